@@ -0,0 +1,7 @@
+"""
+Benchmark scripts for the backend.
+
+Run them from the backend directory, e.g. `python -m benchmarks.bench_catalog`.
+`benchmarks.loadgen` is the whole-API load generator, the bench_* ones
+each look at one thing.
+"""
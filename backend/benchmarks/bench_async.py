@@ -0,0 +1,102 @@
+"""
+Cart + checkout under 1k concurrent clients: sync handlers on the
+threadpool vs the async handlers that run on the event loop.
+
+Starts a real uvicorn server in a subprocess. The "sync" routes are only
+registered here and reproduce the old `def` handlers; "async" is the real
+/cart/add and /checkout. Every client is its own user doing
+add-to-cart + checkout in a loop over one keep-alive connection.
+The client speaks bare HTTP/1.1 over asyncio streams, a full HTTP client
+library eats more CPU than the server and drowns out the difference.
+
+    python -m benchmarks.bench_async --clients 1000 --rounds 5
+"""
+import argparse
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
+from fastapi import HTTPException
+from main import app, store
+from benchmarks.common import bottomless_stock, percentile, print_table, uvicorn_server
+
+main_lifespan = app.router.lifespan_context
+
+@asynccontextmanager
+async def lifespan(app):
+    # the real startup seeds a few dozen of each product, every round here buys one
+    async with main_lifespan(app):
+        bottomless_stock(store)
+        yield
+
+app.router.lifespan_context = lifespan
+
+@app.post("/sync/cart/add")
+def legacy_add_to_cart(item_id: int, quantity: int = 1, user_id: str = "demo_user"):
+    try:
+        store.add_to_cart(user_id, item_id, quantity)
+        return {"message": "Item added to cart", "cart": store.get_cart(user_id)}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/sync/checkout")
+def legacy_checkout(discount_code: Optional[str] = None, user_id: str = "demo_user"):
+    try:
+        return store.checkout(user_id, discount_code)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def post(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, path: str) -> int:
+    writer.write(f"POST {path} HTTP/1.1\r\nHost: bench\r\nContent-Length: 0\r\n\r\n".encode())
+    head = await reader.readuntil(b"\r\n\r\n")
+    status = int(head.split(b" ", 2)[1])
+    length = 0
+    for line in head.split(b"\r\n"):
+        if line.lower().startswith(b"content-length:"):
+            length = int(line.split(b":", 1)[1])
+    await reader.readexactly(length)
+    return status
+
+async def client_loop(port: int, prefix: str, user: str, rounds: int, latencies: list):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        for _ in range(rounds):
+            for path in (f"{prefix}/cart/add?item_id=1&quantity=1&user_id={user}", f"{prefix}/checkout?user_id={user}"):
+                start = time.perf_counter()
+                status = await post(reader, writer, path)
+                latencies.append(time.perf_counter() - start)
+                if status != 200:
+                    raise RuntimeError(f"{path} returned {status}")
+    finally:
+        writer.close()
+
+async def run(port: int, mode: str, clients: int, rounds: int) -> dict:
+    prefix = "/sync" if mode == "sync" else ""
+    latencies: list = []
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        client_loop(port, prefix, f"{mode}_{i}", rounds, latencies) for i in range(clients)
+    ))
+    elapsed = time.perf_counter() - start
+    return {
+        "handlers": mode,
+        "clients": clients,
+        "req/s": f"{len(latencies) / elapsed:,.0f}",
+        "p50 ms": f"{percentile(latencies, 50) * 1000:.1f}",
+        "p99 ms": f"{percentile(latencies, 99) * 1000:.1f}"
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=1000, help="concurrent clients")
+    parser.add_argument("--rounds", type=int, default=5, help="add + checkout rounds per client")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    server_args = ("--backlog", str(args.clients * 2), "--timeout-keep-alive", "300")
+    with uvicorn_server("benchmarks.bench_async:app", args.port, *server_args):
+        rows = [asyncio.run(run(args.port, mode, args.clients, args.rounds)) for mode in ("sync", "async")]
+    print_table(f"cart + checkout, {args.clients} concurrent clients", rows)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Catalog endpoints: FastAPI encoding on every request vs pre-encoded bytes.
+
+"before" routes are registered here only and reproduce the old handlers
+(hand the Pydantic objects to FastAPI and let it encode them).
+"after" is the real /products endpoints, both a full 200 and a 304
+revalidation with If-None-Match.
+
+    python -m benchmarks.bench_catalog --items 5000 --seconds 3
+"""
+import argparse
+from fastapi.testclient import TestClient
+from main import app, store
+from models import ProductPage
+from benchmarks.common import synthetic_items, requests_per_second, print_table
+
+def legacy_products(limit: int = 50):
+    items, next_cursor = store.search_products(limit=limit)
+    return ProductPage(items=items, next_cursor=next_cursor)
+
+def legacy_product(product_id: int):
+    return store.items[product_id]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=5000, help="synthetic catalog size")
+    parser.add_argument("--limit", type=int, default=200, help="page size for /products")
+    parser.add_argument("--seconds", type=float, default=2.0, help="time per scenario")
+    args = parser.parse_args()
+
+    store.reset()
+    store.load_catalog(synthetic_items(args.items))
+    app.add_api_route("/_bench/legacy/products", legacy_products)
+    app.add_api_route("/_bench/legacy/products/{product_id}", legacy_product)
+    client = TestClient(app)
+
+    page_url = f"/products?limit={args.limit}"
+    page_etag = client.get(page_url).headers["etag"]
+    item_etag = client.get("/products/42").headers["etag"]
+
+    scenarios = [
+        ("page, before", lambda: client.get(f"/_bench/legacy/products?limit={args.limit}")),
+        ("page, after (200)", lambda: client.get(page_url)),
+        ("page, after (304)", lambda: client.get(page_url, headers={"If-None-Match": page_etag})),
+        ("product, before", lambda: client.get("/_bench/legacy/products/42")),
+        ("product, after (200)", lambda: client.get("/products/42")),
+        ("product, after (304)", lambda: client.get("/products/42", headers={"If-None-Match": item_etag})),
+    ]
+    rows = []
+    for name, fn in scenarios:
+        rps = requests_per_second(fn, args.seconds)
+        rows.append({"scenario": name, "req/s": f"{rps:,.0f}", "bytes": len(fn().content)})
+    print_table(f"catalog of {args.items} items, page size {args.limit}", rows)
+
+if __name__ == "__main__":
+    main()
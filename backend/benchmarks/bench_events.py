@@ -0,0 +1,104 @@
+"""
+Checkout with the order event work inline vs on the event consumer.
+
+Each run has buyer threads checking out one line at a time with an
+audit trail on:
+- inline: no consumer thread, so the rollups, nth-order codes and the
+  audit write happen inside checkout (what checkout used to do, plus
+  the audit trail)
+- pipeline: checkout only publishes, the consumer thread does the rest
+
+Also a consumer that's deliberately slow (sleeps per event) with a
+small queue, to show backpressure keeping the queue bounded. Every run
+checks that each nth order got its code.
+
+    python -m benchmarks.bench_events --orders 20000 --buyers 8
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from typing import Dict
+from events import AuditTrail
+from store import InMemoryStore
+from sqlite_store import SQLiteStore
+from benchmarks.common import bottomless_stock, percentile, print_table
+
+def run(store, name: str, orders: int, buyers: int, pipeline: bool, audit_path: str,
+        capacity: int = 10_000, consumer_delay: float = 0.0) -> Dict:
+    store.seed_data()
+    bottomless_stock(store)
+    store.audit = AuditTrail(audit_path)
+    store.events.capacity = capacity
+    if consumer_delay:
+        handler = store.events.handler
+        store.events.handler = lambda batch: (time.sleep(consumer_delay * len(batch)), handler(batch))
+    if pipeline:
+        store.events.start()
+
+    per_buyer = orders // buyers
+    latencies = [[] for _ in range(buyers)]
+    start_line = threading.Barrier(buyers)
+
+    def buyer(n: int):
+        start_line.wait()
+        for i in range(per_buyer):
+            user_id = f"b{n}-{i}"
+            store.add_to_cart(user_id, 1 + (n + i) % 10, 1)
+            began = time.perf_counter()
+            store.checkout(user_id)
+            latencies[n].append((time.perf_counter() - began) * 1000)
+
+    threads = [threading.Thread(target=buyer, args=(n,)) for n in range(buyers)]
+    began = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - began
+    store.events.close()
+    drained = time.perf_counter() - began
+    store.audit.close()
+
+    placed = per_buyer * buyers
+    codes = sum(store.validate_discount_code(f"DISCOUNT10-{n}") for n in range(3, placed + 1, 3))
+    samples = [ms for per_thread in latencies for ms in per_thread]
+    stats = store.events.stats()
+    return {
+        "scenario": name,
+        "orders/s": f"{placed / elapsed:,.0f}",
+        "p50 ms": f"{percentile(samples, 50):.3f}",
+        "p99 ms": f"{percentile(samples, 99):.3f}",
+        "drained s": f"{drained:.2f}",
+        "max depth": stats["max_depth"],
+        "waits": stats["backpressure_waits"],
+        "codes": f"{codes}/{placed // 3}",
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=20_000)
+    parser.add_argument("--buyers", type=int, default=8, help="checkout threads")
+    args = parser.parse_args()
+
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        audit = os.path.join(directory, "audit.jsonl")
+        for pipeline in (False, True):
+            label = "pipeline" if pipeline else "inline"
+            rows.append(run(InMemoryStore(), f"memory {label}", args.orders, args.buyers, pipeline, audit))
+            store = SQLiteStore(os.path.join(directory, f"{label}.db"))
+            try:
+                # a database checkout is slower, a tenth of the orders keeps the run short
+                rows.append(run(store, f"sqlite {label}", args.orders // 10, args.buyers, pipeline, audit))
+            finally:
+                store.close()
+        rows.append(run(InMemoryStore(), "memory slow consumer, queue 100", args.orders // 10, args.buyers, True,
+                        audit, capacity=100, consumer_delay=0.0002))
+    print_table(f"{args.buyers} buyer threads, audit trail on", rows)
+    if any(row["codes"].split("/")[0] != row["codes"].split("/")[1] for row in rows):
+        raise SystemExit("a milestone didn't get its code!")
+
+if __name__ == "__main__":
+    main()
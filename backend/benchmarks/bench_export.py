@@ -0,0 +1,119 @@
+"""
+Order export: one big JSON list vs the streamed /admin/orders/export.
+
+For each backend and history size:
+- list: every order as one list, dumped in one go, which is what a
+  "return all orders" endpoint would do
+- ndjson / csv / ndjson gzip: order_export.export_chunks over
+  store.export_orders, a batch at a time, the way the route streams it
+  (each chunk is dropped once it's "sent")
+
+Peak is the most Python memory allocated at once while exporting
+(tracemalloc, a separate pass since tracing slows things down). The list
+grows with the history, the streamed exports stay at one batch.
+
+    python -m benchmarks.bench_export --orders 200000
+"""
+import argparse
+import gc
+import os
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, Iterator
+from fast_json import dumps
+from order_export import BATCH_SIZE, export_chunks
+from order_log import OrderLog
+from store import InMemoryStore
+from sqlite_store import SQLiteStore
+from benchmarks.bench_orders import make_orders
+from benchmarks.common import print_table
+
+def fill_memory(store: InMemoryStore, n: int):
+    store.orders = OrderLog.from_rows(
+        (o.id, o.user_id, [(i.item_id, i.quantity) for i in o.items],
+         o.total_amount, o.discount_code, o.discount_amount, o.final_amount, time.time())
+        for o in make_orders(n)
+    )
+
+def fill_sqlite(store: SQLiteStore, n: int):
+    # straight into the tables, checkout would take minutes at this size
+    with store.pool.connection() as conn:
+        conn.execute("BEGIN")
+        for o in make_orders(n):
+            conn.execute(
+                "INSERT INTO orders (id, user_id, total_amount, discount_code, discount_amount, final_amount, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (o.id, o.user_id, o.total_amount, o.discount_code, o.discount_amount, o.final_amount, time.time())
+            )
+            conn.executemany(
+                "INSERT INTO order_items (order_id, line, item_id, quantity) VALUES (?, ?, ?, ?)",
+                [(o.id, line, item.item_id, item.quantity) for line, item in enumerate(o.items)]
+            )
+        conn.execute("COMMIT")
+
+def one_list(store) -> Iterator[bytes]:
+    _, batches = store.export_orders(0, BATCH_SIZE)
+    yield dumps([order for batch in batches for order in batch])
+
+def streamed(fmt: str, gzip: bool = False) -> Callable:
+    def export(store) -> Iterator[bytes]:
+        _, batches = store.export_orders(0, BATCH_SIZE)
+        return export_chunks(batches, fmt, gzip)
+    return export
+
+MODES = {
+    "list": one_list,
+    "ndjson": streamed("ndjson"),
+    "csv": streamed("csv"),
+    "ndjson gzip": streamed("ndjson", gzip=True),
+}
+
+def drain(chunks: Iterator[bytes]) -> int:
+    return sum(len(chunk) for chunk in chunks)
+
+def measure(store, export: Callable) -> Dict:
+    gc.collect()
+    began = time.perf_counter()
+    size = drain(export(store))
+    seconds = time.perf_counter() - began
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    drain(export(store))
+    peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    return {"seconds": seconds, "size": size, "peak": peak}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=200_000, help="largest history, also runs a quarter of it")
+    args = parser.parse_args()
+
+    rows = []
+    for n in (args.orders // 4, args.orders):
+        for backend in ("memory", "sqlite"):
+            with tempfile.TemporaryDirectory() as directory:
+                if backend == "memory":
+                    store = InMemoryStore()
+                    fill_memory(store, n)
+                else:
+                    store = SQLiteStore(os.path.join(directory, "export.db"))
+                    fill_sqlite(store, n)
+                try:
+                    for mode, export in MODES.items():
+                        result = measure(store, export)
+                        rows.append({
+                            "backend": backend,
+                            "orders": f"{n:,}",
+                            "export": mode,
+                            "orders/s": f"{n / result['seconds']:,.0f}",
+                            "output MB": f"{result['size'] / 2**20:,.1f}",
+                            "peak MB": f"{result['peak'] / 2**20:,.1f}",
+                        })
+                finally:
+                    store.close()
+    print_table(f"exporting every order, {BATCH_SIZE} orders per batch", rows)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Catalog startup from a feed file: memory and time at scale.
+
+Writes a synthetic JSONL (and CSV) feed, then loads it into a fresh
+InMemoryStore in a separate process per mode, so each peak RSS is its own:
+- whole file: read and parse everything, validate the list, then load,
+  which is what loading the feed without catalog_feed.py would look like
+- streamed: load_feed, a record at a time and validated in chunks
+- streamed lazy: load_feed(lazy=True), descriptions/features stay in the file
+
+Then a delta touching 1% of the catalog (half updates, half deletes).
+
+    python -m benchmarks.bench_feed --items 1000000
+"""
+import argparse
+import csv
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict
+from benchmarks.common import BACKEND_DIR, iter_synthetic_items, print_table
+
+MODES = ("whole file", "streamed", "streamed lazy")
+
+def write_feeds(directory: str, count: int) -> Dict[str, str]:
+    paths = {"jsonl": os.path.join(directory, "catalog.jsonl"), "csv": os.path.join(directory, "catalog.csv"),
+             "delta": os.path.join(directory, "delta.jsonl")}
+    columns = ["id", "name", "price", "originalPrice", "image", "category", "rating",
+               "reviewCount", "description", "features", "stock", "sale"]
+    with open(paths["jsonl"], "w") as jsonl, open(paths["csv"], "w", newline="") as f, open(paths["delta"], "w") as delta:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for item in iter_synthetic_items(count):
+            row = item.model_dump()
+            jsonl.write(json.dumps(row) + "\n")
+            writer.writerow(["|".join(row[c]) if c == "features" else "" if row[c] is None else row[c] for c in columns])
+            if item.id % 100 == 0:
+                change = {"op": "delete", "id": item.id} if item.id % 200 == 0 else {**row, "price": 1.0}
+                delta.write(json.dumps(change) + "\n")
+    return paths
+
+def load(mode: str, path: str, delta: str) -> Dict:
+    """
+    Runs in the child process. Peak RSS is whatever it took to get the
+    catalog in, minus what the imports cost on their own.
+    """
+    from catalog_feed import _ITEMS, apply_delta, load_feed
+    from store import InMemoryStore
+    store = InMemoryStore()
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    if mode == "whole file":
+        with open(path) as f:
+            rows = [json.loads(line) for line in f.read().splitlines()]
+        store.load_catalog(_ITEMS.validate_python(rows))
+        del rows
+    else:
+        load_feed(store, path, lazy=mode == "streamed lazy")
+    seconds = time.perf_counter() - started
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    delta_report = apply_delta(store, delta)
+    return {
+        "products": len(store.items),
+        "startup s": round(seconds, 1),
+        "peak MB": round((peak - before) / 1024),
+        "delta s": delta_report["seconds"],
+    }
+
+def run_child(mode: str, path: str, delta: str) -> Dict:
+    child = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_feed", "--child", mode, path, delta],
+        cwd=BACKEND_DIR, capture_output=True, text=True
+    )
+    if child.returncode != 0:
+        # most likely the OOM killer, which is the point of the comparison
+        return {"products": "-", "startup s": "-", "peak MB": f"failed ({child.returncode})", "delta s": "-"}
+    return json.loads(child.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=1_000_000, help="products in the feed")
+    parser.add_argument("--modes", default=",".join(MODES), help="comma separated, from: " + ", ".join(MODES))
+    parser.add_argument("--child", nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(load(*args.child)))
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        started = time.perf_counter()
+        paths = write_feeds(directory, args.items)
+        sizes = {name: os.path.getsize(path) / 2**20 for name, path in paths.items()}
+        print(f"wrote {args.items:,} products in {time.perf_counter() - started:.0f}s: "
+              f"jsonl {sizes['jsonl']:,.0f} MB, csv {sizes['csv']:,.0f} MB, delta {sizes['delta']:,.1f} MB")
+        rows = []
+        for fmt in ("jsonl", "csv"):
+            for mode in args.modes.split(","):
+                if mode == "whole file" and fmt == "csv":
+                    continue
+                rows.append({"format": fmt, "mode": mode, **run_child(mode, paths[fmt], paths["delta"])})
+        print_table(f"loading {args.items:,} products into a fresh process", rows)
+
+if __name__ == "__main__":
+    main()
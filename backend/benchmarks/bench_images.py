@@ -0,0 +1,100 @@
+"""
+Product grid image loads: the old StaticFiles mount vs the image pipeline.
+
+Starts a real uvicorn server in a subprocess and loads every product
+image the way the store page does, 6 at a time like a browser does per
+host. "before" is a StaticFiles mount over the backend directory, only
+registered here, serving the full-size PNGs. "after" is the real
+/images/products/<file>?size=card, following the redirect to the
+hashed variant: once cold (each variant generated on first request)
+and once warm (variants already on disk).
+
+A repeat visit costs nothing after: the redirect is cacheable for an
+hour and the variant forever. Before, the browser had to revalidate
+every image.
+
+    python -m benchmarks.bench_images --rounds 5
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+from typing import List, Tuple
+import httpx
+from fastapi.staticfiles import StaticFiles
+from main import app, store
+from benchmarks.common import percentile, print_table, uvicorn_server
+
+app.mount("/legacy-static", StaticFiles(directory="."), name="legacy-static")
+
+async def fetch(client: httpx.AsyncClient, path: str, limit: asyncio.Semaphore) -> Tuple[int, float, float]:
+    """
+    (bytes, ms to the image's first byte, ms to its last byte), redirect included.
+    """
+    async with limit:
+        start = time.perf_counter()
+        while True:
+            response = await client.send(client.build_request("GET", path), stream=True)
+            if not response.is_redirect:
+                break
+            await response.aclose()
+            path = response.headers["location"]
+        first_byte = time.perf_counter()
+        body = await response.aread()
+        response.raise_for_status()
+        done = time.perf_counter()
+        return len(body), (first_byte - start) * 1000, (done - start) * 1000
+
+async def grid_load(base_url: str, paths: List[str]) -> Tuple[int, List[float], float]:
+    # a fresh client is a visitor with an empty cache
+    limit = asyncio.Semaphore(6)
+    async with httpx.AsyncClient(base_url=base_url, limits=httpx.Limits(max_connections=6)) as client:
+        start = time.perf_counter()
+        results = await asyncio.gather(*(fetch(client, path, limit) for path in paths))
+        elapsed = (time.perf_counter() - start) * 1000
+    return sum(r[0] for r in results), [r[1] for r in results], elapsed
+
+def run(base_url: str, name: str, paths: List[str], rounds: int) -> dict:
+    total_bytes, ttfbs, loads = 0, [], []
+    for _ in range(rounds):
+        total_bytes, round_ttfbs, elapsed = asyncio.run(grid_load(base_url, paths))
+        ttfbs += round_ttfbs
+        loads.append(elapsed)
+    return {
+        "scenario": name,
+        "images": len(paths),
+        "KB per load": f"{total_bytes / 1024:,.0f}",
+        "ttfb p50 ms": f"{percentile(ttfbs, 50):.1f}",
+        "ttfb p95 ms": f"{percentile(ttfbs, 95):.1f}",
+        "full load ms": f"{percentile(loads, 50):.0f}",
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=5, help="grid loads per scenario")
+    parser.add_argument("--size", default="card", help="variant the grid asks for")
+    parser.add_argument("--port", type=int, default=8766)
+    args = parser.parse_args()
+
+    store.seed_data()
+    files = [item.image.rsplit("/", 1)[1] for item in store.items.values()]
+    # a throwaway cache so the cold run really is cold
+    cache_dir = tempfile.mkdtemp(prefix="bench-images-")
+    os.environ["IMAGE_CACHE_DIR"] = cache_dir
+    os.environ["IMAGE_PREWARM"] = "0"
+    try:
+        with uvicorn_server("benchmarks.bench_images:app", args.port) as base_url:
+            after = [f"/images/products/{name}?size={args.size}" for name in files]
+            rows = [
+                run(base_url, "before (full PNG)", [f"/legacy-static/products/{name}" for name in files], args.rounds),
+                run(base_url, f"after, cold ({args.size})", after, 1),
+                run(base_url, f"after, warm ({args.size})", after, args.rounds),
+            ]
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    print_table("store page grid, one visitor with an empty cache", rows)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Flash sale: lots of buyers racing for a little stock.
+
+Every buyer thread puts one unit in its own cart and checks out, over
+and over, against both storage backends. "hot" sends everyone at one
+item, "spread" across 8 items (so per-item locks can keep buyers apart).
+The check is that exactly `stock` units sell per item and the rest are
+turned away: sold + rejected == attempts and on_hand never goes negative.
+
+    python -m benchmarks.bench_inventory --buyers 32 --stock 2000
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from typing import Dict, List
+from store import InMemoryStore
+from sqlite_store import SQLiteStore
+from benchmarks.common import percentile, print_table
+
+def flash_sale(store, name: str, buyers: int, stock: int, items: List[int], reserve: float) -> Dict:
+    store.seed_data()
+    for item_id in items:
+        store.upsert_item(store.items[item_id].model_copy(update={"stock": stock}))
+    store.reservation_seconds = reserve
+
+    sold, rejected, latencies = [0] * buyers, [0] * buyers, [[] for _ in range(buyers)]
+    start_line = threading.Barrier(buyers)
+
+    def buyer(n: int):
+        user_id = f"buyer{n}"
+        item_id = items[n % len(items)]
+        start_line.wait()
+        # keep going until this buyer's item is gone for good
+        while True:
+            began = time.perf_counter()
+            try:
+                store.add_to_cart(user_id, item_id, 1)
+                store.checkout(user_id)
+                sold[n] += 1
+            except ValueError:
+                rejected[n] += 1
+                # start the next attempt from an empty cart
+                if store.get_cart(user_id).items:
+                    store.remove_from_cart(user_id, item_id)
+                if store.stock_level(item_id)["on_hand"] == 0:
+                    break
+            latencies[n].append((time.perf_counter() - began) * 1000)
+
+    threads = [threading.Thread(target=buyer, args=(n,)) for n in range(buyers)]
+    began = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - began
+
+    on_hand = [store.stock_level(item_id)["on_hand"] for item_id in items]
+    total_sold = sum(sold)
+    samples = [ms for per_buyer in latencies for ms in per_buyer]
+    return {
+        "scenario": name,
+        "items": len(items),
+        "stock": stock * len(items),
+        "sold": total_sold,
+        "oversold": max(0, total_sold - stock * len(items)),
+        "min on_hand": min(on_hand),
+        "rejected": sum(rejected),
+        "orders/s": f"{total_sold / elapsed:,.0f}",
+        "p50 ms": f"{percentile(samples, 50):.2f}",
+        "p99 ms": f"{percentile(samples, 99):.2f}",
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--buyers", type=int, default=32, help="threads racing for the stock")
+    parser.add_argument("--stock", type=int, default=2000, help="units per item")
+    args = parser.parse_args()
+
+    rows = []
+    for scenario, items in (("hot", [1]), ("spread", list(range(1, 9)))):
+        for reserve in (0, 60):
+            label = f"{scenario}{', reserved' if reserve else ''}"
+            rows.append(flash_sale(InMemoryStore(), f"memory {label}", args.buyers, args.stock, items, reserve))
+            with tempfile.TemporaryDirectory() as directory:
+                store = SQLiteStore(os.path.join(directory, "bench.db"))
+                try:
+                    # the database is slower per order, a tenth of the stock keeps the run short
+                    rows.append(flash_sale(store, f"sqlite {label}", args.buyers, args.stock // 10, items, reserve))
+                finally:
+                    store.close()
+    print_table(f"{args.buyers} buyers, one unit per order, until sold out", rows)
+    if any(row["oversold"] or row["min on_hand"] < 0 for row in rows):
+        raise SystemExit("oversold!")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Journal throughput and recovery time.
+
+1. throughput: threads doing add-to-cart + checkout against a journaled
+   store, in "group" and "batch" sync modes (plus no journal for reference)
+2. recovery: build up --orders orders, snapshot everything except the last
+   --tail orders, then time recovering a fresh store from disk
+
+    python -m benchmarks.bench_journal --orders 1000000 --tail 100000
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+from persistence import Persistence
+from store import InMemoryStore
+from benchmarks.common import bottomless_stock, print_table
+
+def place_orders(store: InMemoryStore, users: int, orders_per_user: int, prefix: str = "u"):
+    def worker(n: int):
+        user_id = f"{prefix}{n}"
+        for _ in range(orders_per_user):
+            store.add_to_cart(user_id, 1 + n % 10, 1)
+            store.checkout(user_id)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(users)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+def throughput(sync, threads: int, orders_per_thread: int) -> dict:
+    store = InMemoryStore()
+    store.seed_data()
+    bottomless_stock(store)
+    directory = tempfile.mkdtemp(prefix="journal-bench-")
+    persistence = None
+    try:
+        if sync:
+            persistence = Persistence(store, directory, sync=sync, flush_interval=0.005)
+            persistence.recover()
+        start = time.perf_counter()
+        place_orders(store, threads, orders_per_thread)
+        elapsed = time.perf_counter() - start
+        records = threads * orders_per_thread * 2
+        fsyncs = 0
+        if persistence:
+            persistence.journal.close()
+            fsyncs = persistence.journal.fsyncs
+        return {
+            "sync": sync or "no journal",
+            "threads": threads,
+            "records/s": f"{records / elapsed:,.0f}",
+            "checkouts/s": f"{threads * orders_per_thread / elapsed:,.0f}",
+            "fsyncs": fsyncs,
+            "records/fsync": f"{records / fsyncs:,.1f}" if fsyncs else "-"
+        }
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+def recovery(orders: int, tail: int) -> dict:
+    directory = tempfile.mkdtemp(prefix="journal-bench-")
+    try:
+        store = InMemoryStore()
+        store.seed_data()
+        bottomless_stock(store)
+        persistence = Persistence(store, directory, sync="batch", flush_interval=0.05)
+        persistence.recover()
+
+        start = time.perf_counter()
+        place_orders(store, 1, orders - tail, prefix="bulk")
+        build_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        persistence.snapshot()
+        snapshot_seconds = time.perf_counter() - start
+
+        place_orders(store, 1, tail, prefix="tail")
+        persistence.journal.close()
+        store.attach_journal(None)
+        snapshot_mb = os.path.getsize(persistence.snapshot_path) / 1e6
+
+        restored = InMemoryStore()
+        restored.seed_data()
+        bottomless_stock(restored)
+        start = time.perf_counter()
+        report = Persistence(restored, directory, sync="batch").recover()
+        total = time.perf_counter() - start
+        restored.journal.close()
+        assert len(restored.orders) == orders
+
+        return {
+            "orders": f"{orders:,}",
+            "journal tail": f"{report['replayed_records']:,} records",
+            "build": f"{build_seconds:.1f}s",
+            "snapshot write": f"{snapshot_seconds:.2f}s",
+            "snapshot size": f"{snapshot_mb:.0f} MB",
+            "snapshot load": f"{report['snapshot_load_seconds']:.2f}s",
+            "replay": f"{report['replay_seconds']:.2f}s",
+            "recovery total": f"{total:.2f}s"
+        }
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=1_000_000, help="orders to build up for the recovery test")
+    parser.add_argument("--tail", type=int, default=100_000, help="orders placed after the last snapshot")
+    parser.add_argument("--per-thread", type=int, default=500, help="checkouts per thread in the throughput test")
+    args = parser.parse_args()
+
+    rows = []
+    for sync in (None, "batch", "group"):
+        for threads in (1, 8, 32):
+            rows.append(throughput(sync, threads, args.per_thread))
+    print_table("journal throughput (add + checkout = 2 records)", rows)
+    print_table("recovery", [recovery(args.orders, args.tail)])
+
+if __name__ == "__main__":
+    main()
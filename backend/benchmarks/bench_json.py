@@ -0,0 +1,123 @@
+"""
+Response serialization: FastAPI's default path vs FastJSONResponse.
+
+For each endpoint's response, times only the encoding:
+- before: what the routes used to return (Pydantic models, or dicts)
+  through jsonable_encoder + JSONResponse, which is what FastAPI does
+  with a route that has no response_model
+- after: the store's plain data through FastJSONResponse
+
+Then whole requests in-process (httpx over ASGI, no network), with
+FAST_JSON off and on, to show how much of a request that was.
+
+    python -m benchmarks.bench_json --orders 3000
+"""
+import argparse
+import asyncio
+import time
+from typing import Callable, Dict, List, Tuple
+import httpx
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+import fast_json
+from fast_json import FastJSONResponse
+from main import app, settings, store
+from benchmarks.common import bottomless_stock, print_table
+
+def per_call_us(fn: Callable[[], object], seconds: float = 0.5) -> float:
+    fn()
+    calls = 0
+    start = time.perf_counter()
+    deadline = start + seconds
+    while time.perf_counter() < deadline:
+        fn()
+        calls += 1
+    return (time.perf_counter() - start) / calls * 1e6
+
+def payloads() -> List[Tuple[str, object, Callable[[], object]]]:
+    """
+    (endpoint, what the route used to return, what it does now to get its
+    content from what the store gave it).
+    """
+    now = time.time()
+    order = store.checkout("bench_buyer_last")
+    report = store.sales_rollup(now - 86400, now, "hour", "time")
+    return [
+        ("POST /cart/add", {"message": "Item added to cart", "cart": store.get_cart("bench")},
+         lambda cart=store.get_cart_data("bench"): {"message": "Item added to cart", "cart": cart}),
+        ("GET /cart?priced=true", store.get_priced_cart("bench"),
+         lambda cart=store.get_cart_data("bench", priced=True): cart),
+        # the store hands back an Order, the route dumps it
+        ("POST /checkout", order, order.model_dump),
+        ("GET /admin/stats", store.get_stats(), lambda stats=store.get_stats(): stats),
+        ("GET /admin/stats?resolution=hour", {"rows": report}, lambda: {"rows": report}),
+    ]
+
+async def requests_per_second(client: httpx.AsyncClient, method: str, path: str, seconds: float) -> float:
+    calls = 0
+    start = time.perf_counter()
+    deadline = start + seconds
+    while time.perf_counter() < deadline:
+        response = await client.request(method, path)
+        response.raise_for_status()
+        calls += 1
+    return calls / (time.perf_counter() - start)
+
+async def end_to_end(seconds: float) -> Dict[str, Dict[bool, float]]:
+    paths = [("GET", "/cart?user_id=bench"), ("GET", "/cart?user_id=bench&priced=true"), ("GET", "/admin/stats")]
+    results: Dict[str, Dict[bool, float]] = {}
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        for fast in (False, True):
+            settings.FAST_JSON = fast
+            for method, path in paths:
+                await requests_per_second(client, method, path, 0.2)  # warm up
+                results.setdefault(f"{method} {path}", {})[fast] = await requests_per_second(client, method, path, seconds)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=3000, help="orders placed first, the stats list a used code per 3")
+    parser.add_argument("--lines", type=int, default=5, help="lines in the benchmark cart")
+    parser.add_argument("--seconds", type=float, default=2.0, help="per endpoint, end to end")
+    args = parser.parse_args()
+
+    store.seed_data()
+    bottomless_stock(store)
+    code = None
+    for n in range(args.orders):
+        user_id = f"bench_buyer_{n}"
+        store.add_to_cart(user_id, 1 + n % 10, 1)
+        store.checkout(user_id, code)
+        # every code gets used on the next order, so the stats list them all
+        code = store.generate_discount_code()
+    for item_id in range(1, args.lines + 1):
+        store.add_to_cart("bench", item_id, 2)
+        store.add_to_cart("bench_buyer_last", item_id, 1)
+
+    rows = []
+    for endpoint, before, after in payloads():
+        slow = per_call_us(lambda: JSONResponse(jsonable_encoder(before)).body)
+        fast = per_call_us(lambda: FastJSONResponse(after()).body)
+        rows.append({
+            "endpoint": endpoint,
+            "bytes": len(FastJSONResponse(after()).body),
+            "before us": f"{slow:.1f}",
+            "after us": f"{fast:.1f}",
+            "speedup": f"{slow / fast:.1f}x",
+        })
+    encoder = "orjson" if fast_json.orjson is not None else "json (orjson not installed)"
+    print_table(f"encoding one response, {args.orders} orders in the stats, encoder: {encoder}", rows)
+
+    rows = [
+        {
+            "endpoint": endpoint,
+            "FAST_JSON=0 req/s": f"{rates[False]:,.0f}",
+            "FAST_JSON=1 req/s": f"{rates[True]:,.0f}",
+            "change": f"{rates[True] / rates[False] - 1:+.0%}",
+        }
+        for endpoint, rates in asyncio.run(end_to_end(args.seconds)).items()
+    ]
+    print_table("whole requests in-process (httpx + ASGI, one client)", rows)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Order history: a list of Pydantic Orders vs the columnar OrderLog.
+
+Builds the same orders both ways and compares memory per order, the
+stats recomputation behind /admin/stats/verify, and turning the history
+into snapshot rows and back.
+
+Then one page of a user's history (GET /orders) at growing history
+sizes: scanning every order for the user vs OrderLog's per-user index.
+
+    python -m benchmarks.bench_orders --orders 200000
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+from models import CartItem, Order
+from order_log import OrderLog
+from storage import StatsAccumulator
+from benchmarks.common import print_table
+
+def make_orders(n: int, users: int = 5000):
+    for i in range(n):
+        lines = [CartItem(item_id=1 + i % 10, quantity=1)]
+        if i % 3 == 0:
+            lines.append(CartItem(item_id=1 + (i + 3) % 10, quantity=2))
+        total = sum(line.quantity * 10.0 for line in lines)
+        code = f"SAVE10-{i:06X}" if i % 9 == 0 else None
+        discount = round(total * 0.1, 2) if code else 0.0
+        yield Order(
+            id=i + 1, user_id=f"user{i % users}", items=lines,
+            total_amount=total, discount_code=code, discount_amount=discount, final_amount=total - discount
+        )
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    result = build()
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    return result, used
+
+def timed(fn) -> float:
+    start = time.perf_counter()
+    fn()
+    return (time.perf_counter() - start) * 1000
+
+def per_call_us(fn, calls: int = 200) -> float:
+    start = time.perf_counter()
+    for _ in range(calls):
+        fn()
+    return (time.perf_counter() - start) / calls * 1e6
+
+def scan_page(log: OrderLog, user_id: str, limit: int):
+    # what there was before the index: filter everything, newest first
+    rows = [row for row in range(len(log)) if log.users[log.user_index[row]] == user_id]
+    return [log.order_data(row) for row in rows[::-1][:limit]]
+
+def history_lookups(n: int, limit: int = 20):
+    rows = []
+    for size in sorted({n // 100, n // 10, n}):
+        log = OrderLog.from_rows(
+            (o.id, o.user_id, [(i.item_id, i.quantity) for i in o.items],
+             o.total_amount, o.discount_code, o.discount_amount, o.final_amount)
+            # 100 orders per user at every size, only the total grows
+            for o in make_orders(size, users=max(1, size // 100))
+        )
+        user = log.users[0]
+        oldest_id = log.ids[log.user_rows[0][limit]]
+        rows.append({
+            "orders": f"{size:,}",
+            "per user": len(log.user_rows[0]),
+            "scan us": f"{per_call_us(lambda: scan_page(log, user, limit), calls=5):,.0f}",
+            "index us": f"{per_call_us(lambda: [log.order_data(r) for r in log.user_page(user, None, limit)[0]]):,.1f}",
+            "index, last page us": f"{per_call_us(lambda: [log.order_data(r) for r in log.user_page(user, oldest_id, limit)[0]]):,.1f}",
+        })
+    print_table(f"one page of {limit} orders for one user", rows)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=200_000)
+    args = parser.parse_args()
+    n = args.orders
+
+    orders, list_bytes = measure(lambda: list(make_orders(n)))
+    log, log_bytes = measure(lambda: OrderLog.from_rows(
+        (o.id, o.user_id, [(i.item_id, i.quantity) for i in o.items],
+         o.total_amount, o.discount_code, o.discount_amount, o.final_amount)
+        for o in orders
+    ))
+    rows = log.rows()
+
+    print_table(f"{n:,} orders", [
+        {
+            "layout": "list of Order",
+            "bytes/order": f"{list_bytes / n:.0f}",
+            "stats ms": f"{timed(lambda: StatsAccumulator.from_orders(orders)):.0f}",
+            "to rows ms": f"{timed(lambda: [[o.id, o.user_id, [[i.item_id, i.quantity] for i in o.items], o.total_amount, o.discount_code, o.discount_amount, o.final_amount] for o in orders]):.0f}",
+            "from rows ms": f"{timed(lambda: [Order(id=r[0], user_id=r[1], items=[{'item_id': i, 'quantity': q} for i, q in r[2]], total_amount=r[3], discount_code=r[4], discount_amount=r[5], final_amount=r[6]) for r in rows]):.0f}",
+        },
+        {
+            "layout": "OrderLog",
+            "bytes/order": f"{log_bytes / n:.0f}",
+            "stats ms": f"{timed(log.totals):.0f}",
+            "to rows ms": f"{timed(log.rows):.0f}",
+            "from rows ms": f"{timed(lambda: OrderLog.from_rows(rows)):.0f}",
+        },
+    ])
+    history_lookups(n)
+
+if __name__ == "__main__":
+    main()
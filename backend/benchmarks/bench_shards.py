@@ -0,0 +1,114 @@
+"""
+Sharded store: checkout throughput with 1, 2, 4 and 8 shards.
+
+--clients processes (standing in for uvicorn workers) each run a
+ShardedStore router joined to the same cluster (spawn=False) and place
+orders back to back, as their own users so they spread over the shards:
+add one item, check out. Every order goes through the owner for its id
+and stock, so that's the part every shard shares.
+
+Baseline: the same number of clients as threads on one InMemoryStore in
+one process, which is what a single worker gets.
+
+Each shard is a process with its own GIL, so this only scales with cores
+to spread over. With fewer cores than shards the extra processes and the
+socket round trips are pure overhead, which the table shows too.
+
+    python -m benchmarks.bench_shards --clients 8 --seconds 5
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from store import InMemoryStore
+from sharding import ShardedStore
+from benchmarks.common import bottomless_stock, print_table
+
+def place_orders(store, prefix: str, start: float, stop: float) -> int:
+    while time.time() < start:
+        time.sleep(0.001)
+    placed = 0
+    while time.time() < stop:
+        user_id = f"{prefix}-{placed}"
+        store.add_to_cart(user_id, 1 + placed % 10, 1)
+        store.checkout(user_id)
+        placed += 1
+    return placed
+
+def client(directory: str, shards: int, index: int, start: float, stop: float):
+    # one client process: a router of its own, like a uvicorn worker
+    store = ShardedStore(directory, shards, spawn=False)
+    print(place_orders(store, f"c{index}", start, stop))
+    store.close()
+
+def sharded(shards: int, clients: int, seconds: float) -> float:
+    with tempfile.TemporaryDirectory() as directory:
+        store = ShardedStore(directory, shards)
+        try:
+            store.seed_data()
+            bottomless_stock(store)
+            # time for the clients to start up before anyone counts
+            start = time.time() + 2.0
+            stop = start + seconds
+            processes = [
+                subprocess.Popen(
+                    [sys.executable, "-m", "benchmarks.bench_shards", "--client", directory,
+                     "--shards", str(shards), "--index", str(index), "--start", str(start), "--stop", str(stop)],
+                    stdout=subprocess.PIPE, text=True,
+                )
+                for index in range(clients)
+            ]
+            placed = sum(int(process.communicate()[0]) for process in processes)
+        finally:
+            store.close()
+    return placed / seconds
+
+def in_process(clients: int, seconds: float) -> float:
+    store = InMemoryStore()
+    store.seed_data()
+    bottomless_stock(store)
+    start = time.time() + 0.2
+    stop = start + seconds
+    counts = [0] * clients
+
+    def run(index: int):
+        counts[index] = place_orders(store, f"t{index}", start, stop)
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    store.close()
+    return sum(counts) / seconds
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=5.0, help="measured per shard count")
+    parser.add_argument("--shard-counts", default="1,2,4,8")
+    # internal, for the client processes
+    parser.add_argument("--client", help=argparse.SUPPRESS)
+    parser.add_argument("--shards", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--index", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--start", type=float, help=argparse.SUPPRESS)
+    parser.add_argument("--stop", type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.client:
+        client(args.client, args.shards, args.index, args.start, args.stop)
+        return
+
+    baseline = in_process(args.clients, args.seconds)
+    rows = [{"store": "one InMemoryStore (threads)", "orders/s": f"{baseline:,.0f}", "vs baseline": "1.00x"}]
+    for shards in (int(n) for n in args.shard_counts.split(",")):
+        rate = sharded(shards, args.clients, args.seconds)
+        rows.append({"store": f"{shards} shard{'s' if shards > 1 else ''}",
+                     "orders/s": f"{rate:,.0f}", "vs baseline": f"{rate / baseline:.2f}x"})
+    print_table(f"add + checkout, {args.clients} clients, {args.seconds:g}s each, {os.cpu_count()} CPUs", rows)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Checkout throughput per storage backend.
+
+Each thread is its own user doing add-to-cart + checkout in a loop.
+"memory+shared" is the memory backend with the cross-worker registry
+(SHARED_STATE_DIR) for the order counter and discount codes.
+
+    python -m benchmarks.bench_storage --per-thread 500
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from store import InMemoryStore
+from sqlite_store import SQLiteStore
+from shared_state import SharedRegistry
+from benchmarks.bench_journal import place_orders
+from benchmarks.common import bottomless_stock, print_table
+
+def run(backend: str, threads: int, per_thread: int, pool_size: int) -> dict:
+    directory = tempfile.mkdtemp(prefix="storage-bench-")
+    try:
+        if backend == "memory":
+            store = InMemoryStore()
+        elif backend == "memory+shared":
+            store = InMemoryStore(registry=SharedRegistry(os.path.join(directory, "shared")))
+        else:
+            store = SQLiteStore(os.path.join(directory, "bench.db"), pool_size=pool_size)
+        store.seed_data()
+        bottomless_stock(store)
+        start = time.perf_counter()
+        place_orders(store, threads, per_thread)
+        elapsed = time.perf_counter() - start
+        assert store.get_stats()["total_orders"] == threads * per_thread
+        store.close()
+        return {
+            "backend": backend,
+            "threads": threads,
+            "checkouts/s": f"{threads * per_thread / elapsed:,.0f}",
+            "ms/checkout (incl. add)": f"{elapsed * 1000 / (threads * per_thread):.3f}"
+        }
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--per-thread", type=int, default=500, help="checkouts per thread")
+    parser.add_argument("--pool-size", type=int, default=8, help="SQLite connection pool size")
+    args = parser.parse_args()
+
+    rows = []
+    for backend in ("memory", "memory+shared", "sqlite"):
+        for threads in (1, 8, 32):
+            rows.append(run(backend, threads, args.per_thread, args.pool_size))
+    print_table("checkout throughput", rows)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+Live admin dashboards: polling /admin/stats vs /admin/stats/stream.
+
+Starts a real uvicorn server in a subprocess, a buyer places orders at a
+steady rate so the stats keep changing, and N dashboards watch them:
+- idle: no dashboards, just the buyer (the floor)
+- polling: every dashboard GETs /admin/stats once per --interval over a
+  keep-alive connection
+- streaming: every dashboard holds /admin/stats/stream open, the server
+  checks for changes once per --interval (STREAM_INTERVAL_MS)
+
+Same freshness either way. Server CPU is the server process's own
+process_time() (all threads), read through a route only this module adds.
+The dashboards speak bare HTTP/1.1 over asyncio streams, like
+bench_async, so the client side stays cheap.
+
+    python -m benchmarks.bench_streams --dashboards 500 --seconds 20
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+from contextlib import asynccontextmanager
+from main import app, store
+from benchmarks.common import bottomless_stock, print_table, uvicorn_server
+
+main_lifespan = app.router.lifespan_context
+
+@asynccontextmanager
+async def lifespan(app):
+    async with main_lifespan(app):
+        bottomless_stock(store)
+        yield
+
+app.router.lifespan_context = lifespan
+
+@app.get("/bench/cpu")
+def server_cpu():
+    return {"cpu": time.process_time()}
+
+async def request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, method: str, path: str) -> bytes:
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: bench\r\nContent-Length: 0\r\n\r\n".encode())
+    head = await reader.readuntil(b"\r\n\r\n")
+    length = 0
+    for line in head.split(b"\r\n"):
+        if line.lower().startswith(b"content-length:"):
+            length = int(line.split(b":", 1)[1])
+    body = await reader.readexactly(length)
+    if b" 200 " not in head.split(b"\r\n", 1)[0]:
+        raise RuntimeError(f"{method} {path}: {head.split(maxsplit=2)[1].decode()}")
+    return body
+
+async def server_cpu_seconds(port: int) -> float:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        body = await request(reader, writer, "GET", "/bench/cpu")
+    finally:
+        writer.close()
+    return float(body.split(b":")[1].rstrip(b"}"))
+
+async def buyer(port: int, rate: float, stop: asyncio.Event, placed: list):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        n = 0
+        while not stop.is_set():
+            user = f"buyer{n}"
+            await request(reader, writer, "POST", f"/cart/add?item_id={1 + n % 10}&quantity=1&user_id={user}")
+            await request(reader, writer, "POST", f"/checkout?user_id={user}")
+            n += 1
+            placed[0] += 1
+            await asyncio.sleep(1 / rate)
+    finally:
+        writer.close()
+
+async def polling_dashboard(port: int, interval: float, stop: asyncio.Event, counts: dict):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        # spread out, like dashboards opened at different times
+        await asyncio.sleep(random.uniform(0, interval))
+        while not stop.is_set():
+            body = await request(reader, writer, "GET", "/admin/stats")
+            counts["responses"] += 1
+            counts["bytes"] += len(body)
+            await asyncio.sleep(interval)
+    finally:
+        writer.close()
+
+async def streaming_dashboard(port: int, stop: asyncio.Event, counts: dict):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(b"GET /admin/stats/stream HTTP/1.1\r\nHost: bench\r\n\r\n")
+    await reader.readuntil(b"\r\n\r\n")
+    try:
+        while not stop.is_set():
+            # chunked framing and all; only the event count and size matter here
+            chunk = await reader.read(65536)
+            if not chunk:
+                break
+            counts["responses"] += chunk.count(b"\nevent: ") + chunk.startswith(b"event: ")
+            counts["bytes"] += len(chunk)
+    finally:
+        writer.close()
+
+async def run(port: int, mode: str, dashboards: int, seconds: float, interval: float, rate: float) -> dict:
+    stop = asyncio.Event()
+    counts = {"responses": 0, "bytes": 0}
+    placed = [0]
+    if mode == "polling":
+        watchers = [polling_dashboard(port, interval, stop, counts) for _ in range(dashboards)]
+    elif mode == "streaming":
+        watchers = [streaming_dashboard(port, stop, counts) for _ in range(dashboards)]
+    else:
+        watchers = []
+    tasks = [asyncio.ensure_future(watcher) for watcher in watchers]
+    tasks.append(asyncio.ensure_future(buyer(port, rate, stop, placed)))
+    # let everyone connect and settle before measuring
+    await asyncio.sleep(max(2.0, interval * 2))
+    counts.update(responses=0, bytes=0)
+    placed[0] = 0
+    cpu_before, began = await server_cpu_seconds(port), time.perf_counter()
+    await asyncio.sleep(seconds)
+    cpu = await server_cpu_seconds(port) - cpu_before
+    elapsed = time.perf_counter() - began
+    got = dict(counts)
+    stop.set()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return {
+        "dashboards": f"{dashboards if watchers else 0} {mode}",
+        "orders": placed[0],
+        "server cpu s": f"{cpu:.2f}",
+        "cpu %": f"{cpu / elapsed:.0%}",
+        "updates/s": f"{got['responses'] / elapsed:,.0f}",
+        "KB/s out": f"{got['bytes'] / elapsed / 1024:,.0f}",
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dashboards", type=int, default=500)
+    parser.add_argument("--seconds", type=float, default=20, help="measured per mode")
+    parser.add_argument("--interval", type=float, default=1.0, help="poll interval = stream coalescing interval")
+    parser.add_argument("--orders-per-second", type=float, default=20)
+    parser.add_argument("--port", type=int, default=8766)
+    args = parser.parse_args()
+
+    os.environ["STREAM_INTERVAL_MS"] = str(int(args.interval * 1000))
+    os.environ["IMAGE_PREWARM"] = "0"
+    server_args = ("--backlog", str(args.dashboards * 2), "--timeout-keep-alive", "300")
+    rows = []
+    for mode in ("idle", "polling", "streaming"):
+        # a fresh server per mode, so the stats payload starts the same size
+        with uvicorn_server("benchmarks.bench_streams:app", args.port, *server_args):
+            rows.append(asyncio.run(run(args.port, mode, args.dashboards, args.seconds,
+                                        args.interval, args.orders_per_second)))
+    print_table(f"{args.orders_per_second:g} orders/s, dashboards refreshing every {args.interval:g}s, "
+                f"{args.seconds:g}s measured", rows)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+from typing import Callable, Dict, Iterator, List
+from contextlib import contextmanager
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from models import Item
+
+CATEGORIES = ["Electronics", "Furniture", "Clothing", "Accessories", "Beauty", "Footwear", "Outdoors", "Kitchen"]
+WORDS = ["wireless", "smart", "premium", "ergonomic", "organic", "leather", "steel", "ultra",
+         "compact", "pro", "classic", "travel", "sport", "deluxe", "mini", "max"]
+NOUNS = ["headphones", "watch", "chair", "shirt", "bottle", "bag", "monitor", "keyboard",
+         "serum", "shoes", "lamp", "desk", "jacket", "kettle", "speaker", "backpack"]
+
+def synthetic_items(count: int, seed: int = 42) -> List[Item]:
+    """
+    Deterministic fake catalog, shaped like the seeded products.
+    """
+    return list(iter_synthetic_items(count, seed))
+
+def iter_synthetic_items(count: int, seed: int = 42) -> Iterator[Item]:
+    """
+    synthetic_items one at a time, for catalogs too big to hold twice.
+    """
+    rng = random.Random(seed)
+    for i in range(1, count + 1):
+        name = f"{rng.choice(WORDS).title()} {rng.choice(WORDS).title()} {rng.choice(NOUNS).title()} {i}"
+        price = round(rng.uniform(5, 900), 2)
+        sale = rng.random() < 0.15
+        yield Item(
+            id=i,
+            name=name,
+            price=price,
+            originalPrice=round(price * 1.2, 2) if sale else None,
+            image="/images/products/Bag.png",
+            category=rng.choice(CATEGORIES),
+            rating=round(rng.uniform(3, 5), 1),
+            reviewCount=rng.randint(0, 5000),
+            description=f"{name} with everything you'd expect. " * 3,
+            features=[f"Feature {n}" for n in range(5)],
+            stock=rng.randint(0, 500),
+            sale=sale,
+        )
+
+def bottomless_stock(store, quantity: int = 10**9):
+    """
+    Enough stock that throughput benchmarks never sell out. Checkout
+    turns buyers away once an item is gone (see inventory.py), and the
+    seeded stock is only a few dozen per product.
+    """
+    for item in list(store.items.values()):
+        store.upsert_item(item.model_copy(update={"stock": quantity}))
+
+def requests_per_second(fn: Callable[[], object], seconds: float = 2.0) -> float:
+    """
+    Call fn back to back for roughly `seconds` and return calls/sec.
+    """
+    fn()  # warm up
+    calls = 0
+    start = time.perf_counter()
+    deadline = start + seconds
+    while time.perf_counter() < deadline:
+        fn()
+        calls += 1
+    return calls / (time.perf_counter() - start)
+
+def print_table(title: str, rows: List[Dict]):
+    print(f"\n{title}")
+    if not rows:
+        return
+    headers = list(rows[0])
+    widths = [max(len(h), *(len(str(r[h])) for r in rows)) for h in headers]
+    print("  ".join(h.ljust(w) for h, w in zip(headers, widths)))
+    for row in rows:
+        print("  ".join(str(row[h]).ljust(w) for h, w in zip(headers, widths)))
+
+def percentile(samples: List[float], pct: float) -> float:
+    """
+    Nearest-rank percentile, samples don't need to be sorted.
+    """
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@contextmanager
+def uvicorn_server(app: str, port: int, *extra_args: str) -> Iterator[str]:
+    """
+    Run `uvicorn <app>` in a subprocess for the duration of the block,
+    yields its base URL. Started from the backend directory so
+    "main:app" style paths resolve.
+    """
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", app, "--port", str(port), "--log-level", "warning", *extra_args],
+        cwd=BACKEND_DIR
+    )
+    try:
+        for _ in range(100):
+            if server.poll() is not None:
+                raise RuntimeError("server exited during startup")
+            try:
+                socket.create_connection(("127.0.0.1", port)).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+        else:
+            raise RuntimeError("server didn't come up")
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        server.terminate()
+        server.wait()
@@ -0,0 +1,307 @@
+"""
+Load generator for the whole API, with a latency report per endpoint.
+
+Workers loop over a weighted mix of user journeys for --duration seconds.
+Each journey is a few requests. Every request is timed and grouped by its
+route (e.g. "POST /cart/add"), and the report shows requests/sec plus
+p50/p95/p99 per endpoint.
+
+Targets:
+- in-process (default): httpx talking straight to the ASGI app, no sockets
+- --serve: starts `uvicorn main:app` on --port and goes over real HTTP
+- --url: a server that's already running
+
+Mixes (--mix takes a name, or weights like browse=6,cart=3,checkout=1):
+  browse     catalog pages, search, filters, product detail
+  cart       add/remove/batch/get cart churn, no checkouts
+  checkout   fill a cart and check out, in bursts
+  admin      dashboard polling: stats, lock counters, the occasional verify
+  mixed      mostly browsing, with some of everything else
+
+--output writes the results as JSON. --baseline compares the run with an
+earlier --output file and exits 1 if any endpoint's p95 went up, or its
+throughput went down, by more than --tolerance.
+
+    python -m benchmarks.loadgen --mix mixed --duration 10 --output baseline.json
+    python -m benchmarks.loadgen --mix mixed --duration 10 --baseline baseline.json
+"""
+from typing import Callable, Dict, List, Optional
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+import httpx
+from benchmarks.common import bottomless_stock, percentile, print_table, synthetic_items, uvicorn_server
+
+MIXES = {
+    "browse": {"browse": 1},
+    "cart": {"cart": 1},
+    "checkout": {"checkout": 1},
+    "admin": {"admin": 1},
+    "mixed": {"browse": 70, "cart": 20, "checkout": 8, "admin": 2},
+}
+
+class Recorder:
+    """
+    Latencies and error counts per endpoint. Requests that finish before
+    `start` (the warmup) aren't kept.
+    """
+    def __init__(self):
+        self.start = float("inf")
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+
+    def record(self, endpoint: str, finished: float, elapsed: float, ok: bool):
+        if finished < self.start:
+            return
+        self.latencies.setdefault(endpoint, []).append(elapsed)
+        if not ok:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def summary(self, duration: float) -> Dict:
+        def row(samples: List[float], errors: int) -> Dict:
+            return {
+                "requests": len(samples),
+                "errors": errors,
+                "rps": round(len(samples) / duration, 1),
+                "p50_ms": round(percentile(samples, 50) * 1000, 2),
+                "p95_ms": round(percentile(samples, 95) * 1000, 2),
+                "p99_ms": round(percentile(samples, 99) * 1000, 2),
+            }
+        everything = [sample for samples in self.latencies.values() for sample in samples]
+        return {
+            "total": row(everything, sum(self.errors.values())),
+            "endpoints": {
+                endpoint: row(samples, self.errors.get(endpoint, 0))
+                for endpoint, samples in sorted(self.latencies.items())
+            }
+        }
+
+class Session:
+    """
+    One simulated user: its own user_id and cart, sharing the HTTP client.
+    """
+    def __init__(self, http: httpx.AsyncClient, recorder: Recorder, user_id: str, catalog: Dict, rng: random.Random):
+        self.http = http
+        self.recorder = recorder
+        self.user_id = user_id
+        self.catalog = catalog
+        self.rng = rng
+
+    async def call(self, method: str, route: str, url: str, **kwargs) -> Optional[httpx.Response]:
+        start = time.perf_counter()
+        try:
+            response = await self.http.request(method, url, **kwargs)
+            ok = response.status_code < 400
+        except httpx.TransportError:
+            response, ok = None, False
+        finished = time.perf_counter()
+        self.recorder.record(f"{method} {route}", finished, finished - start, ok)
+        return response
+
+    def item_id(self) -> int:
+        return self.rng.choice(self.catalog["ids"])
+
+async def browse(session: Session):
+    rng = session.rng
+    response = await session.call("GET", "/products", "/products?limit=48")
+    if response is not None and response.status_code == 200 and rng.random() < 0.3:
+        cursor = response.json().get("next_cursor")
+        if cursor:
+            await session.call("GET", "/products", "/products", params={"limit": 48, "cursor": cursor})
+    choice = rng.random()
+    if choice < 0.4:
+        await session.call("GET", "/products", "/products", params={"q": rng.choice(session.catalog["words"])})
+    elif choice < 0.7:
+        await session.call("GET", "/products", "/products", params={
+            "category": rng.choice(session.catalog["categories"]),
+            "sort": rng.choice(["price_asc", "price_desc", "rating"])
+        })
+    for _ in range(rng.randint(1, 3)):
+        await session.call("GET", "/products/{id}", f"/products/{session.item_id()}")
+
+async def cart_churn(session: Session):
+    rng = session.rng
+    user = {"user_id": session.user_id}
+    item_id = session.item_id()
+    await session.call("POST", "/cart/add", "/cart/add", params={**user, "item_id": item_id, "quantity": rng.randint(1, 3)})
+    await session.call("GET", "/cart", "/cart", params={**user, "priced": "true"})
+    await session.call("DELETE", "/cart/remove", "/cart/remove", params={**user, "item_id": item_id})
+    if rng.random() < 0.3:
+        # set, not add, so the cart stays small however long this runs
+        operations = [{"op": "set", "item_id": session.item_id(), "quantity": rng.randint(0, 3)} for _ in range(3)]
+        await session.call("POST", "/cart/batch", "/cart/batch", params=user, json={"operations": operations})
+
+async def checkout_burst(session: Session):
+    rng = session.rng
+    user = {"user_id": session.user_id}
+    for _ in range(rng.randint(1, 5)):
+        operations = [{"op": "add", "item_id": session.item_id(), "quantity": 1} for _ in range(rng.randint(1, 3))]
+        await session.call("POST", "/cart/batch", "/cart/batch", params=user, json={"operations": operations})
+        await session.call("POST", "/checkout", "/checkout", params=user)
+
+async def admin_polling(session: Session):
+    await session.call("GET", "/admin/stats", "/admin/stats")
+    await session.call("GET", "/admin/locks", "/admin/locks")
+    if session.rng.random() < 0.05:
+        await session.call("GET", "/admin/stats/verify", "/admin/stats/verify")
+    # a dashboard polls, it doesn't hammer
+    await asyncio.sleep(0.05)
+
+JOURNEYS: Dict[str, Callable] = {
+    "browse": browse,
+    "cart": cart_churn,
+    "checkout": checkout_burst,
+    "admin": admin_polling,
+}
+
+def parse_mix(mix: str) -> Dict[str, int]:
+    if mix in MIXES:
+        return MIXES[mix]
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name not in JOURNEYS:
+            raise SystemExit(f"unknown journey '{name}', pick from {', '.join(JOURNEYS)}")
+        weights[name] = int(weight or 1)
+    return weights
+
+async def discover_catalog(http: httpx.AsyncClient) -> Dict:
+    """
+    Item ids, categories and search words, read from the first page of the API.
+    """
+    items = (await http.get("/products", params={"limit": 200})).json()["items"]
+    if not items:
+        raise SystemExit("catalog is empty, nothing to browse")
+    words = sorted({word.lower() for item in items for word in item["name"].split() if word.isalpha()})
+    return {
+        "ids": [item["id"] for item in items],
+        "categories": sorted({item["category"] for item in items}),
+        "words": words or ["a"],
+    }
+
+async def worker(session: Session, weights: Dict[str, int], deadline: float):
+    names, counts = list(weights), list(weights.values())
+    while time.perf_counter() < deadline:
+        journey = JOURNEYS[session.rng.choices(names, counts)[0]]
+        await journey(session)
+
+async def run(http: httpx.AsyncClient, weights: Dict[str, int], concurrency: int, duration: float, warmup: float, seed: int) -> Dict:
+    catalog = await discover_catalog(http)
+    recorder = Recorder()
+    now = time.perf_counter()
+    recorder.start = now + warmup
+    deadline = recorder.start + duration
+    sessions = [
+        Session(http, recorder, f"loadgen_{n}", catalog, random.Random(seed + n)) for n in range(concurrency)
+    ]
+    await asyncio.gather(*(worker(session, weights, deadline) for session in sessions))
+    # requests still in flight at the deadline finish a little late
+    return recorder.summary(max(time.perf_counter(), deadline) - recorder.start)
+
+def in_process_client(items: int) -> httpx.AsyncClient:
+    # the lifespan doesn't run under ASGITransport, so seed here
+    from main import app, store
+    store.seed_data()
+    if items:
+        store.load_catalog(synthetic_items(items))
+    bottomless_stock(store)
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://loadgen", timeout=60)
+
+def http_client(base_url: str, concurrency: int) -> httpx.AsyncClient:
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    return httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60)
+
+def compare(current: Dict, baseline: Dict, tolerance: float, slack_ms: float = 1.0, min_requests: int = 100) -> List[str]:
+    """
+    Regressions of `current` against `baseline`, as readable lines.
+
+    Endpoints missing from either side are ignored (the mix changed), and
+    so are ones with fewer than `min_requests` samples, whose percentiles
+    are mostly noise. p95 has to be worse by `tolerance` *and* by
+    `slack_ms`, so sub-millisecond jitter on fast routes doesn't trip it.
+    """
+    problems = []
+    for endpoint, base in baseline["endpoints"].items():
+        now = current["endpoints"].get(endpoint)
+        if now is None or min(now["requests"], base["requests"]) < min_requests:
+            continue
+        if now["p95_ms"] > max(base["p95_ms"] * (1 + tolerance), base["p95_ms"] + slack_ms):
+            problems.append(f"{endpoint}: p95 {base['p95_ms']}ms -> {now['p95_ms']}ms")
+        if now["rps"] < base["rps"] * (1 - tolerance):
+            problems.append(f"{endpoint}: throughput {base['rps']} -> {now['rps']} req/s")
+        if now["errors"] > base["errors"]:
+            problems.append(f"{endpoint}: errors {base['errors']} -> {now['errors']}")
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mix", default="mixed", help=f"one of {', '.join(MIXES)}, or journey=weight,...")
+    parser.add_argument("--concurrency", type=int, default=16, help="simulated users running at once")
+    parser.add_argument("--duration", type=float, default=10.0, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=1.0, help="seconds before measuring starts")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--items", type=int, default=0, help="in-process only: add this many synthetic products")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--serve", action="store_true", help="start uvicorn main:app and go over HTTP")
+    target.add_argument("--url", help="base URL of a server that's already running")
+    parser.add_argument("--port", type=int, default=8766, help="port for --serve")
+    parser.add_argument("--output", help="write results JSON here")
+    parser.add_argument("--baseline", help="results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative change before it counts as a regression")
+    parser.add_argument("--slack-ms", type=float, default=1.0, help="p95 also has to grow by at least this much")
+    parser.add_argument("--min-requests", type=int, default=100, help="don't gate endpoints with fewer samples")
+    args = parser.parse_args()
+
+    weights = parse_mix(args.mix)
+
+    async def go(client: httpx.AsyncClient) -> Dict:
+        async with client:
+            return await run(client, weights, args.concurrency, args.duration, args.warmup, args.seed)
+
+    if args.serve:
+        target_name = "uvicorn"
+        with uvicorn_server("main:app", args.port) as base_url:
+            summary = asyncio.run(go(http_client(base_url, args.concurrency)))
+    elif args.url:
+        target_name = args.url
+        summary = asyncio.run(go(http_client(args.url, args.concurrency)))
+    else:
+        target_name = "in-process"
+        summary = asyncio.run(go(in_process_client(args.items)))
+
+    results = {
+        "config": {
+            "target": target_name,
+            "mix": weights,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "seed": args.seed,
+        },
+        **summary
+    }
+    rows = [{"endpoint": endpoint, **row} for endpoint, row in results["endpoints"].items()]
+    rows.append({"endpoint": "total", **results["total"]})
+    print_table(f"{target_name}, mix {args.mix}, {args.concurrency} users, {args.duration:g}s", rows)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["config"] != results["config"]:
+            print(f"\nnote: baseline was run with {baseline['config']}")
+        problems = compare(results, baseline, args.tolerance, args.slack_ms, args.min_requests)
+        if problems:
+            print(f"\nregressions (tolerance {args.tolerance:.0%}):")
+            for problem in problems:
+                print(f"  {problem}")
+            sys.exit(1)
+        print(f"\nno regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+from typing import Dict, Optional
+import threading
+import time
+
+class CartSweeper:
+    """
+    Background thread that evicts abandoned carts every `interval` seconds
+    (see InMemoryStore.evict_carts): anything idle for longer than
+    `idle_seconds`, then least recently used carts over `max_carts`.
+    A sweep that raises (a shard that's down, say) is counted in `errors`
+    and kept in `last_error`/`last_sweep`, and the next one runs as usual.
+    """
+    def __init__(self, store, idle_seconds: float, max_carts: int, interval: float = 60.0):
+        self.store = store
+        self.idle_seconds = idle_seconds
+        self.max_carts = max_carts
+        self.interval = interval
+        self.sweeps: int = 0
+        self.last_sweep: Optional[Dict] = None
+        self.errors: int = 0
+        self.last_error: Optional[str] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def sweep(self) -> Dict:
+        start = time.perf_counter()
+        result = self.store.evict_carts(self.idle_seconds, self.max_carts)
+        result["seconds"] = time.perf_counter() - start
+        self.sweeps += 1
+        self.last_sweep = result
+        return result
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name="cart-sweeper", daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                # an escaping exception would end the thread, and eviction with it
+                self.errors += 1
+                self.last_error = f"{type(e).__name__}: {e}"
+                self.last_sweep = {"error": self.last_error}
+
+    def close(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
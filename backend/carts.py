@@ -0,0 +1,174 @@
+from typing import Dict, Callable, Iterable, Optional
+import sys
+import time
+from models import Cart, CartItem, CartOperation, PricedCart
+
+def to_cents(price: float) -> int:
+    """
+    Money as integer cents, so running totals never drift.
+    """
+    return int(round(price * 100))
+
+def check_cart_ops(
+    quantities: Dict[int, int], operations: Iterable[CartOperation], in_catalog: Callable[[int], bool]
+) -> Dict[int, int]:
+    """
+    Dry run of a batch against the cart's current quantities (item_id -> qty),
+    so a bad op can be rejected before anything is changed.
+    Raises ValueError naming the first op that would fail, otherwise
+    returns the quantities the batch would leave.
+    """
+    quantities = dict(quantities)
+    for n, operation in enumerate(operations):
+        item_id = operation.item_id
+        if operation.op == "remove":
+            if item_id not in quantities:
+                raise ValueError(f"Operation {n}: item {item_id} not in cart")
+            del quantities[item_id]
+            continue
+        if not in_catalog(item_id):
+            raise ValueError(f"Operation {n}: item {item_id} not found")
+        if operation.op == "set":
+            if operation.quantity < 0:
+                raise ValueError(f"Operation {n}: quantity can't be negative")
+            new_quantity = operation.quantity
+        else:
+            new_quantity = quantities.get(item_id, 0) + operation.quantity
+        if new_quantity > 0:
+            quantities[item_id] = new_quantity
+        else:
+            quantities.pop(item_id, None)
+    return quantities
+
+class CartState:
+    """
+    Internal cart representation.
+    
+    Lines are keyed by item_id so add/remove don't have to scan the list,
+    and the subtotal is kept as integer cents and updated as items change,
+    so checkout doesn't need to walk the cart again.
+    dicts keep insertion order, so the public Cart still lists items in the
+    order they were added.
+    
+    Unit prices are remembered per line. If the catalog changes,
+    `catalog_version` won't match anymore and the store calls `reprice`.
+
+    `touched` is the time.monotonic() of the last access, for evicting
+    abandoned carts.
+    """
+    def __init__(self, catalog_version: int = 0):
+        self.lines: Dict[int, CartItem] = {}
+        self.unit_cents: Dict[int, int] = {}
+        self.subtotal_cents: int = 0
+        self.item_count: int = 0
+        self.catalog_version = catalog_version
+        self.touched: float = time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self.lines)
+
+    @property
+    def subtotal(self) -> float:
+        return self.subtotal_cents / 100
+
+    def add(self, item_id: int, quantity: int, unit_cents: int):
+        line = self.lines.get(item_id)
+        if line:
+            # remove it if quantity goes to zero or less
+            if line.quantity + quantity <= 0:
+                self.remove(item_id)
+                return
+            line.quantity += quantity
+        elif quantity > 0:
+            self.lines[item_id] = CartItem(item_id=item_id, quantity=quantity)
+            self.unit_cents[item_id] = unit_cents
+        else:
+            return
+        self.subtotal_cents += self.unit_cents[item_id] * quantity
+        self.item_count += quantity
+
+    def set(self, item_id: int, quantity: int, unit_cents: int):
+        """
+        Make the line exactly `quantity`. 0 or less drops it.
+        """
+        line = self.lines.get(item_id)
+        current = line.quantity if line else 0
+        self.add(item_id, quantity - current, unit_cents)
+
+    def apply(self, operations: Iterable[CartOperation], price_cents: Callable[[int], Optional[int]]):
+        """
+        Run a batch that `check_cart_ops` already passed.
+        """
+        for operation in operations:
+            if operation.op == "remove":
+                self.remove(operation.item_id)
+            elif operation.op == "set":
+                self.set(operation.item_id, operation.quantity, price_cents(operation.item_id))
+            else:
+                self.add(operation.item_id, operation.quantity, price_cents(operation.item_id))
+
+    def quantities(self) -> Dict[int, int]:
+        return {item_id: line.quantity for item_id, line in self.lines.items()}
+
+    def remove(self, item_id: int) -> CartItem:
+        """
+        Drop a line entirely. Raises KeyError if it isn't there.
+        """
+        line = self.lines.pop(item_id)
+        unit = self.unit_cents.pop(item_id)
+        self.subtotal_cents -= unit * line.quantity
+        self.item_count -= line.quantity
+        return line
+
+    def clear(self):
+        self.lines = {}
+        self.unit_cents = {}
+        self.subtotal_cents = 0
+        self.item_count = 0
+
+    def reprice(self, price_cents: Callable[[int], Optional[int]], catalog_version: int):
+        """
+        Full recompute after a catalog change. O(lines), but only runs
+        when the catalog actually moved. Lines for items that no longer
+        exist (price_cents returns None) get dropped.
+        """
+        for item_id in list(self.lines):
+            unit = price_cents(item_id)
+            if unit is None:
+                del self.lines[item_id]
+                del self.unit_cents[item_id]
+            else:
+                self.unit_cents[item_id] = unit
+        self.subtotal_cents = sum(self.unit_cents[i] * line.quantity for i, line in self.lines.items())
+        self.item_count = sum(line.quantity for line in self.lines.values())
+        self.catalog_version = catalog_version
+
+    def approx_bytes(self) -> int:
+        """
+        Rough memory footprint, for the eviction metrics. Only called on
+        carts that are being thrown away.
+        """
+        size = sys.getsizeof(self) + sys.getsizeof(self.__dict__)
+        size += sys.getsizeof(self.lines) + sys.getsizeof(self.unit_cents)
+        for line in self.lines.values():
+            size += sys.getsizeof(line) + sys.getsizeof(line.__dict__)
+        return size
+
+    def to_data(self, priced: bool = False) -> Dict:
+        """
+        Same shape as to_cart/priced, as plain dicts for FastJSONResponse.
+        """
+        data = {"items": [{"item_id": item_id, "quantity": line.quantity} for item_id, line in self.lines.items()]}
+        if priced:
+            data["item_count"] = self.item_count
+            data["subtotal"] = self.subtotal
+        return data
+
+    def to_cart(self) -> Cart:
+        return Cart(items=list(self.lines.values()))
+
+    def priced(self) -> PricedCart:
+        """
+        Cart plus the cached totals, for `GET /cart?priced=true`.
+        """
+        return PricedCart(items=list(self.lines.values()), item_count=self.item_count, subtotal=self.subtotal)
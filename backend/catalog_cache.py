@@ -0,0 +1,105 @@
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+from collections import OrderedDict
+import hashlib
+import json
+from models import Item
+
+def make_etag(body: bytes) -> str:
+    """
+    Strong ETag straight from the bytes, so equal bodies always get equal tags
+    (even across restarts).
+    """
+    return '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+
+class EncodedCatalog:
+    """
+    Pre-encoded JSON for the catalog endpoints.
+    
+    The catalog hardly ever changes, so there's no point running the same
+    Item objects through the JSON encoder on every request.
+    - each product is encoded once and kept as bytes + ETag
+    - /products pages are stitched together from those bytes and kept in
+      a small LRU keyed by the catalog version and the query
+    - with lazily loaded details (catalog_feed.FeedDetails) pages still use
+      the items as they are in memory, without descriptions. Only a single
+      product is completed, and those go in their own LRU of
+      `max_detailed` entries, so paging through the catalog never pulls
+      every description into memory
+    
+    The store invalidates entries whenever an item changes.
+    Not thread-safe on its own, the store holds the catalog lock around it.
+    """
+    def __init__(self, max_pages: int = 256, max_detailed: int = 10_000):
+        self._items: Dict[int, Tuple[str, bytes]] = {}
+        self._pages: "OrderedDict[Hashable, Tuple[str, bytes]]" = OrderedDict()
+        self._max_pages = max_pages
+        # completed products, lazy details only
+        self._detailed: "OrderedDict[int, Tuple[str, bytes]]" = OrderedDict()
+        self._max_detailed = max_detailed
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def item(self, item: Item, complete: Optional[Callable[[Item], Item]] = None) -> Tuple[str, bytes]:
+        """
+        (etag, bytes) for one product. `complete` fills in anything the
+        item was loaded without, only on a miss.
+        """
+        if complete is not None:
+            return self._detailed_item(item, complete)
+        cached = self._items.get(item.id)
+        if cached is None:
+            body = item.model_dump_json().encode()
+            cached = self._items[item.id] = (make_etag(body), body)
+        return cached
+
+    def _detailed_item(self, item: Item, complete: Callable[[Item], Item]) -> Tuple[str, bytes]:
+        cached = self._detailed.get(item.id)
+        if cached is not None:
+            self._detailed.move_to_end(item.id)
+            return cached
+        body = complete(item).model_dump_json().encode()
+        cached = self._detailed[item.id] = (make_etag(body), body)
+        if len(self._detailed) > self._max_detailed:
+            self._detailed.popitem(last=False)
+        return cached
+
+    def page(self, key: Hashable, build: Callable[[], Tuple[List[Item], Optional[str]]]) -> Tuple[str, bytes]:
+        """
+        Cached page for `key`, or run `build` to get (items, next_cursor)
+        and encode it. Same shape as models.ProductPage. Items go in as
+        they are, lazy details aren't read for a listing.
+        """
+        cached = self._pages.get(key)
+        if cached is not None:
+            self._pages.move_to_end(key)
+            self.hits += 1
+            return cached
+        self.misses += 1
+
+        items, next_cursor = build()
+        body = b"".join((
+            b'{"items":[',
+            b",".join(self.item(item)[1] for item in items),
+            b'],"next_cursor":',
+            json.dumps(next_cursor).encode(),
+            b"}",
+        ))
+        cached = self._pages[key] = (make_etag(body), body)
+        if len(self._pages) > self._max_pages:
+            self._pages.popitem(last=False)
+        return cached
+
+    def invalidate(self, item_id: int):
+        self._items.pop(item_id, None)
+        self._detailed.pop(item_id, None)
+        # any page could have had this item (or should have it now)
+        self._pages.clear()
+
+    def stats(self) -> Dict:
+        return {
+            "encoded_items": len(self._items),
+            "detailed_items": len(self._detailed),
+            "cached_pages": len(self._pages),
+            "page_hits": self.hits,
+            "page_misses": self.misses
+        }
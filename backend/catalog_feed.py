@@ -0,0 +1,266 @@
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+import csv
+import io
+import json
+import os
+import threading
+import time
+from pydantic import TypeAdapter, ValidationError
+from models import Item
+
+FORMATS = ("jsonl", "csv")
+# rows validated per batch. big enough that the per-call overhead
+# disappears, small enough that a batch of raw dicts is a few MB at most
+CHUNK_ROWS = 10_000
+# invalid rows are skipped, this many of their messages are kept for the report
+MAX_REPORTED_ERRORS = 20
+
+_ITEMS = TypeAdapter(List[Item])
+
+# one raw record: (byte offset in the file, line number, parsed row)
+Record = Tuple[int, int, Dict]
+
+def feed_format(path: str, fmt: Optional[str] = None) -> str:
+    """
+    jsonl or csv, from `fmt` or the file extension.
+    Raises ValueError if it's neither.
+    """
+    if fmt is None:
+        extension = os.path.splitext(path)[1].lower()
+        fmt = {".jsonl": "jsonl", ".ndjson": "jsonl", ".csv": "csv"}.get(extension)
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown feed format for '{path}', expected one of {', '.join(FORMATS)}")
+    return fmt
+
+def _read_record(f: BinaryIO, fmt: str) -> bytes:
+    # one record from the current position. a csv record can span lines
+    # if a quoted field has newlines in it, an odd quote count means it's still open
+    record = f.readline()
+    if fmt == "csv":
+        while record.count(b'"') % 2 and (more := f.readline()):
+            record += more
+    return record
+
+def _csv_row(header: List[str], record: bytes) -> Dict:
+    values = next(csv.reader(io.StringIO(record.decode("utf-8"))), [])
+    # empty cells mean "not given", so optional fields get their defaults
+    row = {name: value for name, value in zip(header, values) if value != ""}
+    if "features" in row:
+        features = row["features"]
+        row["features"] = json.loads(features) if features.startswith("[") else features.split("|")
+    return row
+
+def read_records(f: BinaryIO, fmt: str) -> Iterator[Record]:
+    """
+    Every record in the feed, one at a time. Only the current record is
+    ever in memory. JSONL is one object per line. CSV needs a header row;
+    `features` is a JSON list or `|` separated.
+    """
+    header = None
+    if fmt == "csv":
+        header = next(csv.reader([_read_record(f, fmt).decode("utf-8-sig")]), None)
+        if not header:
+            return
+    offset, line = f.tell(), 1 if fmt == "jsonl" else 2
+    while True:
+        record = _read_record(f, fmt)
+        if not record:
+            return
+        start, start_line = offset, line
+        offset += len(record)
+        line += record.count(b"\n")
+        if not record.strip():
+            continue
+        try:
+            row = json.loads(record) if fmt == "jsonl" else _csv_row(header, record)
+        except ValueError as e:
+            yield start, start_line, {"__error__": f"not valid {fmt}: {e}"}
+            continue
+        if not isinstance(row, dict):
+            row = {"__error__": "not an object"}
+        yield start, start_line, row
+
+class FeedDetails:
+    """
+    Descriptions and features of a feed loaded with lazy=True.
+
+    Those two are most of a product's size and only the product page
+    shows them, so the items in memory get them blank. This keeps the byte
+    offset of each item's row in the feed and reads the row back when the
+    product's JSON is first built (see EncodedCatalog). After that the
+    encoded product is cached like any other.
+
+    The feed file has to stay where it is, unchanged, while the catalog is
+    loaded from it. A row that no longer matches its item gives blanks.
+    """
+    def __init__(self, path: str, fmt: str, header: Optional[List[str]] = None):
+        self.path = path
+        self.fmt = fmt
+        self.header = header
+        self.offsets: Dict[int, int] = {}
+        self._file = open(path, "rb")
+        self._lock = threading.Lock()
+        self.reads: int = 0
+
+    def complete(self, item: Item) -> Item:
+        """
+        `item` with its description and features filled in from the feed.
+        """
+        offset = self.offsets.get(item.id)
+        if offset is None:
+            return item
+        with self._lock:
+            self._file.seek(offset)
+            record = _read_record(self._file, self.fmt)
+            self.reads += 1
+        try:
+            row = json.loads(record) if self.fmt == "jsonl" else _csv_row(self.header, record)
+            if str(row.get("id")) != str(item.id):
+                return item
+            return item.model_copy(update={
+                "description": str(row.get("description", "")), "features": list(row.get("features", []))
+            })
+        except ValueError:
+            return item
+
+    def forget(self, item_id: int):
+        # the item was replaced or removed, its row in the feed is stale
+        self.offsets.pop(item_id, None)
+
+    def close(self):
+        self._file.close()
+
+def _validate(batch: List[Record], report: Dict) -> List[Tuple[int, Item]]:
+    """
+    (offset, Item) for the valid rows of a batch. Validates the whole
+    batch in one call, and only if that fails sorts out which rows were bad.
+    """
+    rows = [row for _, _, row in batch]
+    try:
+        return list(zip((offset for offset, _, _ in batch), _ITEMS.validate_python(rows)))
+    except ValidationError as e:
+        bad: Dict[int, str] = {}
+        for error in e.errors():
+            position = error["loc"][0]
+            field = ".".join(str(part) for part in error["loc"][1:]) or "row"
+            bad.setdefault(position, f"{field}: {error['msg']}")
+    good = [record for position, record in enumerate(batch) if position not in bad]
+    for position, message in bad.items():
+        _record_error(report, batch[position][1], message)
+    return list(zip((offset for offset, _, _ in good), _ITEMS.validate_python([row for _, _, row in good])))
+
+def _record_error(report: Dict, line: int, message: str):
+    report["invalid"] += 1
+    if len(report["errors"]) < MAX_REPORTED_ERRORS:
+        report["errors"].append(f"line {line}: {message}")
+
+def iter_items(f: BinaryIO, fmt: str, report: Dict, lazy: bool = False,
+               chunk_rows: int = CHUNK_ROWS) -> Iterator[Tuple[int, Item]]:
+    """
+    (offset, Item) for every valid row, validated chunk_rows at a time.
+    With lazy=True description and features are blanked before validation.
+    Counts go into `report` as it goes.
+    """
+    batch: List[Record] = []
+    for record in read_records(f, fmt):
+        report["rows"] += 1
+        row = record[2]
+        if "__error__" in row:
+            _record_error(report, record[1], row["__error__"])
+            continue
+        if lazy:
+            row["description"], row["features"] = "", []
+        batch.append(record)
+        if len(batch) == chunk_rows:
+            yield from _validate(batch, report)
+            batch = []
+    if batch:
+        yield from _validate(batch, report)
+
+def _new_report(path: str, fmt: str) -> Dict:
+    return {"path": path, "format": fmt, "rows": 0, "loaded": 0, "invalid": 0, "errors": []}
+
+def load_feed(store, path: str, fmt: Optional[str] = None, lazy: bool = False) -> Dict:
+    """
+    Replace the store's catalog with the products in a JSONL/CSV feed,
+    streaming it: the file is read a record at a time and validated in
+    chunks, so only the items themselves end up in memory. Rows that
+    don't validate are skipped and reported.
+
+    lazy=True leaves descriptions and features in the file until a
+    product's JSON is built (see FeedDetails).
+    """
+    fmt = feed_format(path, fmt)
+    report = _new_report(path, fmt)
+    started = time.perf_counter()
+    with open(path, "rb") as f:
+        details = None
+        if lazy:
+            header = None
+            if fmt == "csv":
+                header = next(csv.reader([_read_record(f, fmt).decode("utf-8-sig")]), None)
+                f.seek(0)
+            details = FeedDetails(path, fmt, header)
+
+        def items() -> Iterator[Item]:
+            for offset, item in iter_items(f, fmt, report, lazy):
+                report["loaded"] += 1
+                if details is not None:
+                    details.offsets[item.id] = offset
+                yield item
+
+        store.load_catalog(items(), details=details)
+    report["seconds"] = round(time.perf_counter() - started, 3)
+    return report
+
+def apply_delta(store, path: str, fmt: Optional[str] = None) -> Dict:
+    """
+    Apply a delta feed on top of the current catalog. Same formats as
+    load_feed; a row with "op": "delete" removes that id, any other row
+    adds or replaces the product. Applied chunk by chunk, each chunk in
+    one go. Delta items are always kept whole, even on a lazy catalog.
+    """
+    fmt = feed_format(path, fmt)
+    report = _new_report(path, fmt)
+    report["deleted"] = 0
+    started = time.perf_counter()
+
+    upserts: List[Record] = []
+    deletes: List[int] = []
+    # ids in the current chunk. a chunk is applied upserts first, so an id
+    # seen twice starts a new chunk to keep the feed's order
+    pending = set()
+
+    def flush():
+        items = [item for _, item in _validate(upserts, report)] if upserts else []
+        if items or deletes:
+            report["deleted"] += store.apply_catalog_delta(items, deletes)
+            report["loaded"] += len(items)
+        upserts.clear()
+        deletes.clear()
+        pending.clear()
+
+    with open(path, "rb") as f:
+        for offset, line, row in read_records(f, fmt):
+            report["rows"] += 1
+            if "__error__" in row:
+                _record_error(report, line, row["__error__"])
+                continue
+            op = row.pop("op", "upsert")
+            if str(row.get("id")) in pending:
+                flush()
+            pending.add(str(row.get("id")))
+            if op == "delete":
+                try:
+                    deletes.append(int(row["id"]))
+                except (KeyError, TypeError, ValueError):
+                    _record_error(report, line, "delete needs an integer id")
+            elif op == "upsert":
+                upserts.append((offset, line, row))
+            else:
+                _record_error(report, line, f"unknown op '{op}'")
+            if len(upserts) + len(deletes) >= CHUNK_ROWS:
+                flush()
+        flush()
+    report["seconds"] = round(time.perf_counter() - started, 3)
+    return report
@@ -0,0 +1,247 @@
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from bisect import bisect_left, bisect_right, insort
+import base64
+import json
+import re
+from models import Item
+
+# sort name -> how to build the key for an item.
+# every key ends with the item id so keys are unique and pages are stable.
+SORT_KEYS = {
+    "id": lambda item: (item.id,),
+    "price_asc": lambda item: (item.price, item.id),
+    "price_desc": lambda item: (-item.price, item.id),
+    "rating": lambda item: (-item.rating, item.id),
+    "name": lambda item: (item.name.lower(), item.id),
+}
+
+# prefixes longer than this aren't indexed. longer query tokens look up the
+# capped prefix and then get checked against the item's real tokens.
+MAX_PREFIX = 12
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(text.lower())
+
+def item_tokens(item: Item) -> Set[str]:
+    return set(tokenize(item.name)) | set(tokenize(item.category))
+
+def encode_cursor(sort: str, key: Tuple) -> str:
+    raw = json.dumps([sort, *key], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str, sort: str) -> Tuple:
+    """
+    Turns a cursor back into the sort key of the last item on the previous page.
+    Raises ValueError if it's garbage or was made for a different sort.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        decoded = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(decoded, list) or len(decoded) < 2 or decoded[0] != sort:
+        raise ValueError("Cursor doesn't match the requested sort")
+    return tuple(decoded[1:])
+
+class CatalogIndex:
+    """
+    In-memory secondary indexes over the catalog.
+
+    - token/prefix inverted index over name + category for text search
+    - category -> ids, and the set of ids on sale
+    - one pre-sorted key list per sort order. the price one doubles as the
+      price-range index (bisect on it)
+
+    Pages are read with a keyset cursor: the sort key of the last item
+    returned. That way page N costs the same as page 1.
+
+    An item's tokens and sort keys aren't stored per item, they're cheap
+    to work out again from the item when needed. With a million products
+    that's about 1.5 GB less.
+
+    Not thread-safe on its own, the store guards it with the catalog lock.
+    """
+    def __init__(self):
+        self._docs: Dict[int, Item] = {}
+        self._prefixes: Dict[str, Set[int]] = {}
+        self._by_category: Dict[str, Set[int]] = {}
+        self._on_sale: Set[int] = set()
+        self._sorted: Dict[str, List[Tuple]] = {sort: [] for sort in SORT_KEYS}
+
+    @classmethod
+    def build(cls, items: Iterable[Item]) -> "CatalogIndex":
+        """
+        Bulk build. Appends everything and sorts once at the end instead
+        of inserting in order one at a time.
+        """
+        index = cls()
+        for item in items:
+            index._add(item, keep_sorted=False)
+        for keys in index._sorted.values():
+            keys.sort()
+        return index
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def upsert(self, item: Item):
+        if item.id in self._docs:
+            self.remove(item.id)
+        self._add(item, keep_sorted=True)
+
+    def bulk_update(self, upserts: List[Item], removed: Iterable[int]):
+        """
+        Many upserts/removals at once. upsert/remove shift the sorted
+        lists on every call, which adds up over a big delta; this filters
+        them once and sorts once, so it's O(catalog) however many change.
+        """
+        gone = {item_id for item_id in removed if item_id in self._docs}
+        gone.update(item.id for item in upserts if item.id in self._docs)
+        dead = {sort: set() for sort in SORT_KEYS}
+        for item_id in gone:
+            item = self._docs[item_id]
+            for sort, make_key in SORT_KEYS.items():
+                dead[sort].add(make_key(item))
+            self._unlink(item)
+        for sort in SORT_KEYS:
+            if dead[sort]:
+                self._sorted[sort] = [key for key in self._sorted[sort] if key not in dead[sort]]
+        for item in upserts:
+            self._add(item, keep_sorted=False)
+        if upserts:
+            # the new keys are a sorted-ish tail on a sorted list, timsort merges that in one pass
+            for keys in self._sorted.values():
+                keys.sort()
+
+    def remove(self, item_id: int):
+        item = self._docs.get(item_id)
+        if item is None:
+            return
+        self._unlink(item)
+        for sort, make_key in SORT_KEYS.items():
+            keys = self._sorted[sort]
+            del keys[bisect_left(keys, make_key(item))]
+
+    def _unlink(self, item: Item):
+        # everything but the sorted lists
+        item_id = item.id
+        del self._docs[item_id]
+        for token in item_tokens(item):
+            for prefix in self._token_prefixes(token):
+                ids = self._prefixes.get(prefix)
+                if ids is not None:
+                    ids.discard(item_id)
+                    if not ids:
+                        del self._prefixes[prefix]
+        category = item.category.lower()
+        self._by_category[category].discard(item_id)
+        if not self._by_category[category]:
+            del self._by_category[category]
+        self._on_sale.discard(item_id)
+
+    def _add(self, item: Item, keep_sorted: bool):
+        self._docs[item.id] = item
+        for token in item_tokens(item):
+            for prefix in self._token_prefixes(token):
+                self._prefixes.setdefault(prefix, set()).add(item.id)
+        self._by_category.setdefault(item.category.lower(), set()).add(item.id)
+        if item.sale:
+            self._on_sale.add(item.id)
+        for sort, make_key in SORT_KEYS.items():
+            key = make_key(item)
+            if keep_sorted:
+                insort(self._sorted[sort], key)
+            else:
+                self._sorted[sort].append(key)
+
+    @staticmethod
+    def _token_prefixes(token: str) -> Iterable[str]:
+        return (token[:i] for i in range(1, min(len(token), MAX_PREFIX) + 1))
+
+    def _match_token(self, token: str) -> Set[int]:
+        ids = self._prefixes.get(token[:MAX_PREFIX], set())
+        if len(token) > MAX_PREFIX:
+            ids = {i for i in ids if any(t.startswith(token) for t in item_tokens(self._docs[i]))}
+        return ids
+
+    def search(
+        self,
+        query: Optional[str] = None,
+        category: Optional[str] = None,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+        sale: Optional[bool] = None,
+        min_rating: Optional[float] = None,
+        ids: Optional[Iterable[int]] = None,
+        sort: str = "id",
+        cursor: Optional[str] = None,
+        limit: int = 50,
+    ) -> Tuple[List[Item], Optional[str]]:
+        """
+        One page of matching items plus the cursor for the next page
+        (None when this was the last one).
+
+        Every query token has to prefix-match some word in the name or category.
+        Filters that have an index narrow down a candidate set (smallest
+        first), the rest are checked per item while walking the sort order.
+        """
+        if sort not in SORT_KEYS:
+            raise ValueError(f"Unknown sort '{sort}'")
+        after = decode_cursor(cursor, sort) if cursor else None
+
+        candidates: Optional[Set[int]] = None
+        narrowing: List[Set[int]] = []
+        if ids is not None:
+            narrowing.append(set(ids) & self._docs.keys())
+        if query:
+            narrowing.extend(self._match_token(token) for token in tokenize(query))
+        if category:
+            narrowing.append(self._by_category.get(category.lower(), set()))
+        if sale:
+            narrowing.append(self._on_sale)
+        if min_price is not None or max_price is not None:
+            narrowing.append(self._price_range(min_price, max_price))
+        for ids_set in sorted(narrowing, key=len):
+            candidates = set(ids_set) if candidates is None else candidates & ids_set
+            if not candidates:
+                return [], None
+
+        def wanted(item_id: int) -> bool:
+            if candidates is not None and item_id not in candidates:
+                return False
+            doc = self._docs[item_id]
+            if sale is False and doc.sale:
+                return False
+            if min_rating is not None and doc.rating < min_rating:
+                return False
+            return True
+
+        ordered = self._sorted[sort]
+        if candidates is not None and len(candidates) * 8 < len(ordered):
+            # small result set: cheaper to sort it than to walk the whole order
+            make_key = SORT_KEYS[sort]
+            ordered = sorted(make_key(self._docs[i]) for i in candidates)
+        try:
+            start = bisect_right(ordered, after) if after is not None else 0
+        except TypeError:
+            raise ValueError("Invalid cursor")
+
+        page: List[Item] = []
+        last_key = None
+        for pos in range(start, len(ordered)):
+            key = ordered[pos]
+            if not wanted(key[-1]):
+                continue
+            if len(page) == limit:
+                return page, encode_cursor(sort, last_key)
+            page.append(self._docs[key[-1]])
+            last_key = key
+        return page, None
+
+    def _price_range(self, min_price: Optional[float], max_price: Optional[float]) -> Set[int]:
+        keys = self._sorted["price_asc"]
+        lo = bisect_left(keys, (min_price,)) if min_price is not None else 0
+        hi = bisect_right(keys, (max_price, float("inf"))) if max_price is not None else len(keys)
+        return {key[-1] for key in keys[lo:hi]}
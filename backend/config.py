@@ -10,6 +10,89 @@ class Settings:
     # Nth order logic configuration
     NTH_ORDER_FOR_DISCOUNT: int = int(os.getenv("NTH_ORDER_FOR_DISCOUNT", 5))
     
+    # Where carts/orders/discount codes live: "memory", "sqlite" or "sharded".
+    # The catalog is always kept in memory.
+    STORE_BACKEND: str = os.getenv("STORE_BACKEND", "memory")
+    SQLITE_PATH: str = os.getenv("SQLITE_PATH", "store.db")
+    SQLITE_POOL_SIZE: int = int(os.getenv("SQLITE_POOL_SIZE", 8))
+    
+    # Sharded backend (see sharding.py): carts and orders split by user over
+    # SHARDS processes. With SHARD_SPAWN=1 the app starts them itself (one
+    # worker only); with SHARD_SPAWN=0 it joins a cluster already started in
+    # SHARD_DIR with `python -m sharding --dir ... --shards ...`.
+    SHARDS: int = int(os.getenv("SHARDS", 4))
+    SHARD_DIR: str = os.getenv("SHARD_DIR", "")
+    SHARD_SPAWN: bool = os.getenv("SHARD_SPAWN", "1") == "1"
+    
+    # Memory backend with several uvicorn workers: point this at a directory
+    # and the order counter + discount codes are shared by every worker on
+    # the host (see shared_state.py). The sqlite backend shares them already.
+    SHARED_STATE_DIR: str = os.getenv("SHARED_STATE_DIR", "")
+    
+    # Number of lock stripes for carts. Bump this if /admin/locks shows
+    # a lot of contention between unrelated users.
+    LOCK_STRIPES: int = int(os.getenv("LOCK_STRIPES", 64))
+    
+    # Durability for the memory backend. Leave JOURNAL_DIR empty to keep everything in memory only.
+    # JOURNAL_SYNC: "group" = requests wait for their fsync (shared between
+    # concurrent requests), "batch" = fsync in the background every
+    # JOURNAL_FLUSH_MS, so a crash can lose that window.
+    JOURNAL_DIR: str = os.getenv("JOURNAL_DIR", "")
+    JOURNAL_SYNC: str = os.getenv("JOURNAL_SYNC", "group")
+    JOURNAL_FLUSH_MS: int = int(os.getenv("JOURNAL_FLUSH_MS", 10))
+    # write a compacted snapshot after this many journal records
+    SNAPSHOT_EVERY: int = int(os.getenv("SNAPSHOT_EVERY", 100000))
+    
+    # Abandoned cart eviction (memory backend). Every CART_SWEEP_SECONDS,
+    # carts untouched for CART_IDLE_TTL seconds are dropped, then the least
+    # recently used ones until at most MAX_CARTS are left.
+    CART_IDLE_TTL: int = int(os.getenv("CART_IDLE_TTL", 86400))
+    MAX_CARTS: int = int(os.getenv("MAX_CARTS", 1000000))
+    CART_SWEEP_SECONDS: int = int(os.getenv("CART_SWEEP_SECONDS", 60))
+    
+    # Product images. Sources are read from IMAGE_SOURCE_DIR, resized variants
+    # are written to IMAGE_CACHE_DIR (see images.py). IMAGE_PREWARM=1 builds
+    # every variant in the background at startup instead of on first request.
+    IMAGE_SOURCE_DIR: str = os.getenv("IMAGE_SOURCE_DIR", "products")
+    IMAGE_CACHE_DIR: str = os.getenv("IMAGE_CACHE_DIR", "image_cache")
+    IMAGE_PREWARM: bool = os.getenv("IMAGE_PREWARM", "1") == "1"
+    
+    # Catalog feed to load at startup instead of the built-in demo products:
+    # a .jsonl or .csv file, streamed (see catalog_feed.py). CATALOG_DELTAS
+    # is a comma separated list of delta feeds applied on top, in order.
+    # CATALOG_LAZY_DETAILS=1 leaves descriptions/features in the feed file
+    # until a product is asked for.
+    CATALOG_FEED: str = os.getenv("CATALOG_FEED", "")
+    CATALOG_DELTAS: list = [path for path in os.getenv("CATALOG_DELTAS", "").split(",") if path]
+    CATALOG_LAZY_DETAILS: bool = os.getenv("CATALOG_LAZY_DETAILS", "0") == "1"
+    
+    # Stock is always checked at checkout. Set this above 0 and adding to a
+    # cart also reserves the stock for that many seconds (renewed on every
+    # change), so it can't sell out from under someone mid-checkout.
+    CART_RESERVATION_SECONDS: int = int(os.getenv("CART_RESERVATION_SECONDS", 0))
+    
+    # Cart, checkout and admin routes return plain dicts as FastJSONResponse
+    # (orjson if installed) instead of letting FastAPI re-encode them.
+    # FAST_JSON=0 goes back to FastAPI's jsonable_encoder + JSONResponse.
+    FAST_JSON: bool = os.getenv("FAST_JSON", "1") == "1"
+    
+    # Checkout publishes an order-placed event, and a background consumer
+    # issues the nth-order codes and updates the sales rollups. At most
+    # EVENT_QUEUE_SIZE events wait; past that, checkouts wait for the consumer.
+    # AUDIT_LOG is a JSON lines file of everything it did (off if empty).
+    EVENT_QUEUE_SIZE: int = int(os.getenv("EVENT_QUEUE_SIZE", 10000))
+    AUDIT_LOG: str = os.getenv("AUDIT_LOG", "")
+    
+    # /admin/stats/stream and /cart/stream (server-sent events) check for
+    # changes every STREAM_INTERVAL_MS and send at most one update per
+    # interval, computed once for everyone watching the same thing.
+    STREAM_INTERVAL_MS: int = int(os.getenv("STREAM_INTERVAL_MS", 1000))
+    
+    # Checkout results kept for Idempotency-Key replays: at most
+    # IDEMPOTENCY_MAX_KEYS of them, each for IDEMPOTENCY_TTL seconds.
+    IDEMPOTENCY_MAX_KEYS: int = int(os.getenv("IDEMPOTENCY_MAX_KEYS", 10000))
+    IDEMPOTENCY_TTL: int = int(os.getenv("IDEMPOTENCY_TTL", 86400))
+    
     # Simple Admin Credentials (DEMO ONLY)
     ADMIN_USERNAME: str = os.getenv("ADMIN_USERNAME", "admin")
     ADMIN_PASSWORD: str = os.getenv("ADMIN_PASSWORD", "admin")
@@ -0,0 +1,237 @@
+from typing import Callable, Deque, Dict, List, Optional
+from collections import deque
+from itertools import islice
+import json
+import threading
+import time
+from locks import WouldBlock, waiting_allowed
+from sales_rollups import SaleLine
+
+def order_placed(order_id: int, user_id: str, created_at: float, total_amount: float, final_amount: float,
+                 discount_amount: float, discount_code: Optional[str], sales: List[SaleLine]) -> Dict:
+    """
+    The event checkout publishes. Plain data, so it can go in a snapshot
+    or an outbox row as is. `sales` are the lines priced at checkout time.
+    """
+    return {
+        "type": "order_placed",
+        "order_id": order_id,
+        "user_id": user_id,
+        "created_at": created_at,
+        "total_amount": total_amount,
+        "final_amount": final_amount,
+        "discount_amount": discount_amount,
+        "discount_code": discount_code,
+        "sales": [list(line) for line in sales],
+    }
+
+class EventPipeline:
+    """
+    Bounded in-process queue of order events, drained by a background
+    consumer thread.
+
+    Checkout only appends its event and moves on. The consumer hands
+    events to `handler` in batches of up to `batch_size`, in the order
+    they were published. The store's handler does the work that used to
+    sit in checkout or wait for an admin call: nth-order discount codes,
+    the sales rollups and the audit trail.
+
+    Backpressure: once `capacity` events are waiting, `wait_for_room`
+    holds new checkouts (before they take any lock) until the consumer
+    catches up. A slow consumer slows checkout down rather than the queue
+    growing without limit or events being dropped. On the event loop
+    (no_wait) it raises WouldBlock instead, and the checkout waits on a
+    worker thread.
+
+    Failures: if the handler raises, the batch stays at the head of the
+    queue and the consumer tries it again, waiting `retry_delay` and
+    doubling that up to `max_retry_delay` while it keeps failing. Nothing
+    is dropped, so every nth order still gets its code once the cause is
+    gone, and a handler that never recovers holds up checkout through
+    the backpressure instead. The handler has to cope with seeing part of
+    a batch twice (InMemoryStore skips what it already applied, SQLite's
+    is one transaction). `failed` counts events in failed attempts.
+
+    Until start() there's no thread, and publish runs the handler right
+    away in the caller. Tests and scripts get the old synchronous
+    behaviour that way.
+    """
+    def __init__(self, handler: Callable[[List[Dict]], None], capacity: int = 10_000, batch_size: int = 256,
+                 retry_delay: float = 0.05, max_retry_delay: float = 5.0):
+        self.handler = handler
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        # published and not handled yet, oldest first. the batch being
+        # handled stays in here until it's done
+        self._pending: Deque[Dict] = deque()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._closing = False
+        self.published: int = 0
+        self.processed: int = 0
+        self.failed: int = 0
+        self.retries: int = 0
+        self.last_error: Optional[str] = None
+        self.max_depth: int = 0
+        self.backpressure_waits: int = 0
+        self.backpressure_seconds: float = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    @property
+    def depth(self) -> int:
+        return len(self._pending)
+
+    def wait_for_room(self):
+        """
+        Block while the queue is full. Raises WouldBlock inside no_wait().
+        """
+        if len(self._pending) < self.capacity or not self.running:
+            return
+        if not waiting_allowed():
+            raise WouldBlock()
+        start = time.perf_counter()
+        with self._cond:
+            self.backpressure_waits += 1
+            self._cond.wait_for(lambda: len(self._pending) < self.capacity or not self.running)
+            self.backpressure_seconds += time.perf_counter() - start
+
+    def publish(self, event: Dict):
+        """
+        Queue an event. Never blocks, so it's fine under the store's locks
+        (wait_for_room is where checkout waits). Events get a `seq` in
+        publish order.
+        """
+        with self._cond:
+            self.published += 1
+            event["seq"] = self.published
+            if self._thread is None:
+                inline = True
+            else:
+                inline = False
+                self._pending.append(event)
+                if len(self._pending) > self.max_depth:
+                    self.max_depth = len(self._pending)
+                self._cond.notify_all()
+        if inline:
+            self._handle([event])
+
+    def pending(self) -> List[Dict]:
+        """
+        Copy of the events not handled yet (including a batch in progress).
+        """
+        with self._cond:
+            return list(self._pending)
+
+    def wait_idle(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until every published event has been handled. False on timeout.
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending, timeout)
+
+    def _handle(self, batch: List[Dict]) -> bool:
+        # a failing handler mustn't stop the pipeline or fail a checkout
+        # that's already placed, so errors are counted and kept for /admin/events
+        try:
+            self.handler(batch)
+        except Exception as e:
+            with self._cond:
+                self.failed += len(batch)
+                self.last_error = f"{type(e).__name__}: {e}"
+            return False
+        with self._cond:
+            self.processed += len(batch)
+        return True
+
+    def start(self):
+        self._closing = False
+        self._thread = threading.Thread(target=self._consume, name="order-events", daemon=True)
+        self._thread.start()
+
+    def _consume(self):
+        delay = self.retry_delay
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._closing)
+                if not self._pending:
+                    return
+                batch = list(islice(self._pending, self.batch_size))
+            if not self._handle(batch):
+                # leave it at the head and try again. close() takes over what's left
+                with self._cond:
+                    if self._cond.wait_for(lambda: self._closing, delay):
+                        return
+                    self.retries += 1
+                delay = min(delay * 2, self.max_retry_delay)
+                continue
+            delay = self.retry_delay
+            with self._cond:
+                for _ in batch:
+                    self._pending.popleft()
+                self._cond.notify_all()
+
+    def close(self):
+        """
+        Stop the consumer once it has handled everything queued. Anything
+        published after this is handled inline.
+        """
+        thread = self._thread
+        if thread is None:
+            return
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        thread.join()
+        with self._cond:
+            # anything that slipped in after the consumer's last look
+            leftovers = list(self._pending)
+            self._pending.clear()
+            self._thread = None
+            self._cond.notify_all()
+        if leftovers:
+            self._handle(leftovers)
+
+    def stats(self) -> Dict:
+        return {
+            "running": self.running,
+            "depth": len(self._pending),
+            "max_depth": self.max_depth,
+            "capacity": self.capacity,
+            "published": self.published,
+            "processed": self.processed,
+            "failed": self.failed,
+            "retries": self.retries,
+            "last_error": self.last_error,
+            "backpressure_waits": self.backpressure_waits,
+            "backpressure_seconds": self.backpressure_seconds,
+        }
+
+class AuditTrail:
+    """
+    Append-only JSON lines file of what the event pipeline did: a line
+    per order placed and per discount code issued. Written a batch at a
+    time and flushed, not fsynced; the journal is what recovery trusts.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+        self.lines: int = 0
+
+    def write(self, records: List[Dict]):
+        if not records:
+            return
+        text = "".join(json.dumps(record, separators=(",", ":")) + "\n" for record in records)
+        with self._lock:
+            self._file.write(text)
+            self._file.flush()
+            self.lines += len(records)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
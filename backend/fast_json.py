@@ -0,0 +1,32 @@
+from typing import Any
+import json
+from starlette.responses import Response
+
+try:
+    import orjson
+except ImportError:  # the stdlib encoder is slower, the bytes are the same JSON
+    orjson = None
+
+def dumps(content: Any) -> bytes:
+    """
+    Compact JSON for plain dicts/lists/str/int/float/bool/None. Anything
+    else (a Pydantic model, a datetime) is a TypeError, on purpose: this
+    path is only for data that's already primitives.
+    """
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()
+
+class FastJSONResponse(Response):
+    """
+    JSON response for routes that already have primitives in hand.
+
+    Returning a dict or a model from a route makes FastAPI walk it with
+    jsonable_encoder (a recursive copy) and then json.dumps it. Returning
+    one of these skips both: the content goes straight to bytes, with
+    orjson when it's installed.
+    """
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,106 @@
+from typing import Awaitable, Callable, Dict, Hashable, Tuple
+from collections import OrderedDict
+from concurrent.futures import Future
+import asyncio
+import threading
+import time
+
+class IdempotencyConflict(Exception):
+    """
+    The key was already used for a request with different parameters.
+    """
+
+class _Entry:
+    __slots__ = ("fingerprint", "future", "expires")
+
+    def __init__(self, fingerprint: Hashable, expires: float):
+        self.fingerprint = fingerprint
+        # a concurrent.futures.Future, so requests on any loop or thread can wait on it
+        self.future: Future = Future()
+        self.expires = expires
+
+class IdempotencyCache:
+    """
+    Results of requests sent with an Idempotency-Key, so a retry gets the
+    original answer instead of doing the work again.
+
+    - the first request with a key runs; anyone arriving with the same key
+      while it's still going waits for it (coalescing) instead of running
+    - a successful result is kept for `ttl` seconds, up to `max_entries`
+      of them (oldest dropped first). replays don't touch the store at all
+    - a failure isn't kept: nothing changed, so the client can fix the
+      problem and retry with the same key. requests already waiting on it
+      get the same error
+    - reusing a key with different parameters (`fingerprint`) is an
+      IdempotencyConflict
+
+    Per process. Behind several workers a retry only hits the cache if it
+    lands on the same worker.
+    """
+    def __init__(self, max_entries: int = 10000, ttl: float = 86400, clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        # in insertion order, which is also expiry order
+        self._entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self.executed: int = 0
+        self.replayed: int = 0
+        self.coalesced: int = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _expire(self, now: float):
+        # caller holds _lock
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry.expires > now and len(self._entries) <= self.max_entries:
+                break
+            del self._entries[key]
+
+    async def run(self, key: Hashable, fingerprint: Hashable, call: Callable[[], Awaitable]) -> Tuple[object, bool]:
+        """
+        (result, replayed). Runs `call` unless there's already a result or
+        a request in flight for `key`.
+        """
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires <= now:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                entry = self._entries[key] = _Entry(fingerprint, now + self.ttl)
+                self._expire(now)
+                owner = True
+            else:
+                if entry.fingerprint != fingerprint:
+                    raise IdempotencyConflict("Idempotency-Key was already used with different parameters")
+                owner = False
+                if entry.future.done():
+                    self.replayed += 1
+                else:
+                    self.coalesced += 1
+
+        if not owner:
+            return await asyncio.wrap_future(entry.future), True
+
+        self.executed += 1
+        # run as its own task, so the result is still recorded if this
+        # request is cancelled (client gone) while the work finishes
+        task = asyncio.ensure_future(call())
+        task.add_done_callback(lambda done: self._finish(key, entry, done))
+        return await asyncio.shield(task), False
+
+    def _finish(self, key: Hashable, entry: _Entry, task: "asyncio.Future"):
+        if task.cancelled() or task.exception() is not None:
+            with self._lock:
+                if self._entries.get(key) is entry:
+                    del self._entries[key]
+            entry.future.set_exception(asyncio.CancelledError() if task.cancelled() else task.exception())
+        else:
+            entry.future.set_result(task.result())
+
+    def counters(self) -> Dict[str, int]:
+        return {"executed": self.executed, "replayed": self.replayed, "coalesced": self.coalesced}
@@ -0,0 +1,151 @@
+from typing import Dict, List, Tuple
+import hashlib
+import io
+import os
+import threading
+
+try:
+    from PIL import Image
+except ImportError:  # without Pillow every size is the original file, still hashed and cached
+    Image = None
+
+# name -> longest side in pixels. the grid shows cards at ~240px, so card
+# covers 2x screens. nothing is ever scaled up.
+SIZES: Dict[str, int] = {"thumb": 160, "card": 480, "full": 1200}
+DEFAULT_SIZE = "full"
+SOURCE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp")
+WEBP_QUALITY = 80
+
+# a year, the longest anyone honours. hashed names never change content.
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+
+class ImagePipeline:
+    """
+    Resized, compressed product images under content-hashed names.
+
+    Product images are referenced as /images/products/<file>?size=card.
+    That URL redirects to /images/v/<stem>.<digest>.<size>.webp, where the
+    digest covers the source bytes and the variant settings. Same source +
+    same settings = same name, so those files can be cached forever
+    (`immutable`) and a changed source just gets a new name.
+
+    Variants are written to `cache_dir` the first time they're asked for
+    (or all at once by `warm`) and served from disk after that. Only files
+    directly inside `source_dir` with an image extension are reachable.
+    """
+    def __init__(self, source_dir: str, cache_dir: str, quality: int = WEBP_QUALITY):
+        self.source_dir = source_dir
+        self.cache_dir = cache_dir
+        self.quality = quality
+        self._lock = threading.Lock()
+        # source file name -> (mtime_ns, sha256 of its bytes)
+        self._hashes: Dict[str, Tuple[int, str]] = {}
+        # one lock per variant file, so two first requests don't both resize it
+        self._generating: Dict[str, threading.Lock] = {}
+        self.generated: int = 0
+
+    def _source_path(self, name: str) -> str:
+        if os.path.basename(name) != name or name.startswith(".") or not name.lower().endswith(SOURCE_EXTENSIONS):
+            raise FileNotFoundError(name)
+        path = os.path.join(self.source_dir, name)
+        if not os.path.isfile(path):
+            raise FileNotFoundError(name)
+        return path
+
+    def _source_hash(self, name: str) -> str:
+        path = self._source_path(name)
+        mtime = os.stat(path).st_mtime_ns
+        with self._lock:
+            cached = self._hashes.get(name)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        with open(path, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        with self._lock:
+            self._hashes[name] = (mtime, digest)
+        return digest
+
+    def _extension(self) -> str:
+        return ".webp" if Image is not None else ""
+
+    def variant_name(self, name: str, size: str) -> str:
+        """
+        Hashed file name for `name` at `size`. Raises FileNotFoundError for
+        an unknown source, ValueError for an unknown size.
+        """
+        if size not in SIZES:
+            raise ValueError(f"Unknown size '{size}', expected one of {', '.join(SIZES)}")
+        settings = f"{size}:{SIZES[size]}:{self.quality}:{self._extension() or 'original'}"
+        digest = hashlib.sha256(f"{self._source_hash(name)}:{settings}".encode()).hexdigest()[:16]
+        stem, extension = os.path.splitext(name)
+        return f"{stem}.{digest}.{size}{self._extension() or extension}"
+
+    def _split(self, filename: str) -> Tuple[str, str]:
+        # (stem, size) from <stem>.<digest>.<size>.<ext>, anything else is a 404
+        parts = filename.split(".")
+        if os.path.basename(filename) != filename or len(parts) < 4 or parts[-2] not in SIZES:
+            raise FileNotFoundError(filename)
+        return ".".join(parts[:-3]), parts[-2]
+
+    def _parse(self, filename: str) -> Tuple[str, str]:
+        # (source name, size) for a variant file name, if it's current
+        stem, size = self._split(filename)
+        for name in self.sources():
+            if os.path.splitext(name)[0] == stem and self.variant_name(name, size) == filename:
+                return name, size
+        # unknown, or the source has changed since this name was handed out
+        raise FileNotFoundError(filename)
+
+    def variant_path(self, filename: str) -> str:
+        """
+        Path of a variant on disk, generating it if this is the first ask.
+        Raises FileNotFoundError if the name isn't a current variant.
+        """
+        self._split(filename)
+        path = os.path.join(self.cache_dir, filename)
+        if os.path.isfile(path):
+            return path
+        name, size = self._parse(filename)
+        with self._lock:
+            lock = self._generating.setdefault(filename, threading.Lock())
+        with lock:
+            if not os.path.isfile(path):
+                data = self._render(self._source_path(name), SIZES[size])
+                os.makedirs(self.cache_dir, exist_ok=True)
+                # write then rename, so a reader never sees half a file
+                temporary = f"{path}.{threading.get_ident()}.tmp"
+                with open(temporary, "wb") as f:
+                    f.write(data)
+                os.replace(temporary, path)
+                self.generated += 1
+        with self._lock:
+            self._generating.pop(filename, None)
+        return path
+
+    def _render(self, source: str, longest_side: int) -> bytes:
+        if Image is None:
+            with open(source, "rb") as f:
+                return f.read()
+        with Image.open(source) as image:
+            image.load()
+            # thumbnail keeps the aspect ratio and never upscales
+            image.thumbnail((longest_side, longest_side), Image.LANCZOS)
+            if image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+            out = io.BytesIO()
+            image.save(out, "WEBP", quality=self.quality, method=4)
+            return out.getvalue()
+
+    def sources(self) -> List[str]:
+        return sorted(
+            name for name in os.listdir(self.source_dir)
+            if name.lower().endswith(SOURCE_EXTENSIONS) and not name.startswith(".")
+        )
+
+    def warm(self):
+        """
+        Generate every size of every source image ahead of time.
+        """
+        for name in self.sources():
+            for size in SIZES:
+                self.variant_path(self.variant_name(name, size))
@@ -0,0 +1,186 @@
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from collections import OrderedDict
+from contextlib import ExitStack, contextmanager
+import time
+from locks import StripedLock
+
+class Inventory:
+    """
+    Stock levels and cart reservations for the memory backend.
+
+    - `on_hand` is what's left to sell. checkout takes from it, and
+      nothing else does.
+    - a reservation holds some of an item for one user's cart until it
+      expires. Other buyers can only take on_hand minus everyone else's
+      live reservations.
+
+    Every item has its own lock (a stripe of a StripedLock keyed by
+    item_id, and with the default 64 stripes the seed catalog gets one
+    each). Operations on several items take their stripes in index
+    order, so two checkouts can't deadlock, and buyers of different items
+    never wait on each other. A flash sale on one SKU only queues the
+    buyers of that SKU, and only for the check-and-decrement.
+
+    Reservations per item are kept in expiry order (the TTL is the same
+    for all of them), so dropping expired ones only looks at the front.
+    """
+    def __init__(self, stripes: int = 64, clock=time.monotonic):
+        self._locks = StripedLock(stripes)
+        self._clock = clock
+        self.on_hand: Dict[int, int] = {}
+        # item_id -> {user_id: [quantity, expires]}, soonest expiry first
+        self._holds: Dict[int, "OrderedDict[str, List]"] = {}
+        # item_id -> sum of the quantities in _holds
+        self._held: Dict[int, int] = {}
+        self.rejected: int = 0
+
+    @contextmanager
+    def _locked(self, item_ids: Iterable[int]) -> Iterator[None]:
+        stripes = sorted({self._locks.stripe_index(item_id) for item_id in item_ids})
+        all_stripes = self._locks.all_stripes()
+        with ExitStack() as stack:
+            for index in stripes:
+                stack.enter_context(all_stripes[index])
+            yield
+
+    def _expire(self, item_id: int, now: float):
+        # caller holds the item's stripe
+        holds = self._holds.get(item_id)
+        while holds:
+            user_id, (quantity, expires) = next(iter(holds.items()))
+            if expires > now:
+                break
+            del holds[user_id]
+            self._held[item_id] -= quantity
+
+    def _sellable(self, item_id: int, user_id: Optional[str], now: float) -> int:
+        # on hand minus what other carts are holding. caller holds the stripe
+        self._expire(item_id, now)
+        held = self._held.get(item_id, 0)
+        mine = self._holds.get(item_id, {}).get(user_id)
+        if mine:
+            held -= mine[0]
+        return self.on_hand.get(item_id, 0) - held
+
+    def _release(self, user_id: str, item_id: int):
+        # caller holds the stripe
+        hold = self._holds.get(item_id, {}).pop(user_id, None)
+        if hold:
+            self._held[item_id] -= hold[0]
+
+    def load(self, stock: Dict[int, int]):
+        """
+        Replace every stock level (catalog load, snapshot restore).
+        Reservations are dropped, they don't survive a reload.
+        """
+        with ExitStack() as stack:
+            for lock in self._locks.all_stripes():
+                stack.enter_context(lock)
+            self.on_hand = dict(stock)
+            self._holds = {}
+            self._held = {}
+
+    def set_stock(self, item_id: int, quantity: int):
+        with self._locked((item_id,)):
+            self.on_hand[item_id] = quantity
+
+    def remove(self, item_id: int):
+        with self._locked((item_id,)):
+            self.on_hand.pop(item_id, None)
+            self._holds.pop(item_id, None)
+            self._held.pop(item_id, None)
+
+    def available(self, item_id: int, user_id: Optional[str] = None) -> int:
+        """
+        How many `user_id` could buy right now (anyone, if None).
+        """
+        with self._locked((item_id,)):
+            return max(0, self._sellable(item_id, user_id, self._clock()))
+
+    def level(self, item_id: int) -> Tuple[int, int]:
+        """
+        (on hand, available to anyone), read together.
+        """
+        with self._locked((item_id,)):
+            return self.on_hand.get(item_id, 0), max(0, self._sellable(item_id, None, self._clock()))
+
+    def reserve(self, user_id: str, quantities: Dict[int, int], ttl: float):
+        """
+        Set this user's reservations to `quantities` (item_id -> quantity
+        in the cart, 0 releases) and restart their clock. All or nothing:
+        raises ValueError if any item doesn't have enough left.
+        """
+        now = self._clock()
+        with self._locked(quantities):
+            for item_id, quantity in quantities.items():
+                if quantity > 0 and quantity > self._sellable(item_id, user_id, now):
+                    self.rejected += 1
+                    raise ValueError(self._shortage(item_id, user_id, now))
+            for item_id, quantity in quantities.items():
+                self._release(user_id, item_id)
+                if quantity > 0:
+                    self._holds.setdefault(item_id, OrderedDict())[user_id] = [quantity, now + ttl]
+                    self._held[item_id] = self._held.get(item_id, 0) + quantity
+
+    def release(self, user_id: str, item_ids: Iterable[int]):
+        item_ids = list(item_ids)
+        with self._locked(item_ids):
+            for item_id in item_ids:
+                self._release(user_id, item_id)
+
+    def commit(self, user_id: str, quantities: Dict[int, int]):
+        """
+        Take a checkout's items out of stock, all or nothing. The user's
+        own reservations count towards what they can buy and are used up.
+        Raises ValueError if anything is short.
+        """
+        now = self._clock()
+        with self._locked(quantities):
+            for item_id, quantity in quantities.items():
+                if quantity > self._sellable(item_id, user_id, now):
+                    self.rejected += 1
+                    raise ValueError(self._shortage(item_id, user_id, now))
+            for item_id, quantity in quantities.items():
+                self._release(user_id, item_id)
+                self.on_hand[item_id] -= quantity
+
+    def uncommit(self, user_id: str, quantities: Dict[int, int], ttl: float = 0):
+        """
+        Undo a `commit` for a checkout that failed after it: the items go
+        back on hand and, with reservations on (`ttl`), back to being held
+        for this user, so their cart is as safe as it was before.
+        """
+        now = self._clock()
+        with self._locked(quantities):
+            for item_id, quantity in quantities.items():
+                if item_id not in self.on_hand:
+                    continue
+                self.on_hand[item_id] += quantity
+                if ttl:
+                    self._release(user_id, item_id)
+                    self._holds.setdefault(item_id, OrderedDict())[user_id] = [quantity, now + ttl]
+                    self._held[item_id] = self._held.get(item_id, 0) + quantity
+
+    def apply_sale(self, quantities: Dict[int, int]):
+        """
+        Journal replay: the sale already happened, no checks.
+        """
+        for item_id, quantity in quantities.items():
+            if item_id in self.on_hand:
+                self.on_hand[item_id] -= quantity
+
+    def _shortage(self, item_id: int, user_id: str, now: float) -> str:
+        left = max(0, self._sellable(item_id, user_id, now))
+        return f"Only {left} of item {item_id} left" if left else f"Item {item_id} is out of stock"
+
+    def snapshot(self) -> Dict[int, int]:
+        with ExitStack() as stack:
+            for lock in self._locks.all_stripes():
+                stack.enter_context(lock)
+            return dict(self.on_hand)
+
+    def held(self) -> int:
+        """
+        Units currently reserved (expired ones not yet dropped included).
+        """
+        return sum(self._held.values())
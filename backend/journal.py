@@ -0,0 +1,232 @@
+from typing import Dict, Iterator, List, Optional, Tuple
+import asyncio
+import fcntl
+import json
+import os
+import threading
+import time
+
+SEGMENT_PREFIX = "journal-"
+SEGMENT_SUFFIX = ".log"
+LOCK_NAME = "journal.lock"
+
+def _segment_name(first_seq: int) -> str:
+    return f"{SEGMENT_PREFIX}{first_seq:012d}{SEGMENT_SUFFIX}"
+
+def list_segments(directory: str) -> List[Tuple[int, str]]:
+    """
+    (first_seq, path) for every journal segment, oldest first.
+    """
+    segments = []
+    for name in os.listdir(directory):
+        if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX):
+            first_seq = int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+            segments.append((first_seq, os.path.join(directory, name)))
+    return sorted(segments)
+
+def lock_directory(directory: str) -> int:
+    """
+    Claim a journal directory: an exclusive flock on a file in it, held
+    until the returned fd is closed. Two writers (say, uvicorn workers
+    sharing JOURNAL_DIR) would append to and prune the same segments and
+    overwrite each other's snapshots, so the second one gets a RuntimeError.
+    """
+    os.makedirs(directory, exist_ok=True)
+    fd = os.open(os.path.join(directory, LOCK_NAME), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        raise RuntimeError(
+            f"Journal directory {directory} is already in use, every worker needs its own JOURNAL_DIR"
+        ) from None
+    return fd
+
+def read_records(directory: str, after_seq: int = 0) -> Iterator[Dict]:
+    """
+    Every record with seq > after_seq, in order.
+    A torn last line (crash halfway through a write) is skipped.
+    """
+    for _, path in list_segments(directory):
+        with open(path, "rb") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # only ever happens to the tail of a segment that was being
+                    # written when the process died. nothing after it was acked.
+                    break
+                if record["seq"] > after_seq:
+                    yield record
+
+def _resolve(future: asyncio.Future):
+    # runs on the waiter's event loop
+    if not future.done():
+        future.set_result(None)
+
+class Journal:
+    """
+    Append-only log of store mutations, one JSON record per line.
+
+    Appends just go onto an in-memory buffer (cheap, so the store can do it
+    while holding its locks and keep records in apply order). A background
+    thread writes the buffer out and fsyncs it:
+    - "group": callers block in `wait(seq)` until their record is on disk.
+      Everyone who appended while the previous fsync was running shares
+      the next one, so throughput goes up with concurrency.
+    - "batch": nobody waits. The flusher fsyncs every `flush_interval`
+      seconds, so a crash can lose that much.
+
+    The log is split into segments. `rotate` starts a new one (used when a
+    snapshot is taken) so old segments can be deleted with `prune`.
+
+    The directory is locked (see lock_directory) until `close`. Pass
+    `lock_fd` if the caller already holds it.
+    """
+    def __init__(self, directory: str, next_seq: int = 1, sync: str = "group", flush_interval: float = 0.01,
+                 lock_fd: Optional[int] = None):
+        if sync not in ("group", "batch"):
+            raise ValueError(f"Unknown journal sync mode '{sync}'")
+        self._lock_fd = lock_fd if lock_fd is not None else lock_directory(directory)
+        self.directory = directory
+        self.sync = sync
+        self.flush_interval = flush_interval
+
+        # lock order: _io_lock before _cond, never the other way round
+        self._io_lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._buffer: List[bytes] = []
+        # (seq, loop, future) for coroutines waiting in wait_async
+        self._async_waiters: List[Tuple[int, asyncio.AbstractEventLoop, asyncio.Future]] = []
+        self._last_seq = next_seq - 1
+        self._synced_seq = next_seq - 1
+        self._closed = False
+        self._file = open(os.path.join(directory, _segment_name(next_seq)), "ab")
+
+        self.records_written: int = 0
+        self.fsyncs: int = 0
+
+        self._flusher = threading.Thread(target=self._flush_loop, name="journal-flusher", daemon=True)
+        self._flusher.start()
+
+    @property
+    def last_seq(self) -> int:
+        return self._last_seq
+
+    def append(self, record: Dict) -> int:
+        """
+        Queue a record and return its sequence number.
+        Doesn't touch the disk, call `wait` for that.
+        """
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Journal is closed")
+            self._last_seq += 1
+            record["seq"] = self._last_seq
+            self._buffer.append(json.dumps(record, separators=(",", ":")).encode() + b"\n")
+            self._cond.notify_all()
+            return self._last_seq
+
+    def wait(self, seq: int):
+        """
+        Block until `seq` is fsynced. Only does anything in group mode.
+        """
+        if self.sync != "group":
+            return
+        with self._cond:
+            self._cond.wait_for(lambda: self._synced_seq >= seq or self._closed)
+
+    async def wait_async(self, seq: int):
+        """
+        Same as `wait`, but suspends the coroutine instead of blocking the
+        thread. The flusher resolves the future once `seq` is fsynced.
+        """
+        if self.sync != "group":
+            return
+        loop = asyncio.get_running_loop()
+        with self._cond:
+            if self._synced_seq >= seq or self._closed:
+                return
+            future = loop.create_future()
+            self._async_waiters.append((seq, loop, future))
+        await future
+
+    def _wake_async_waiters(self):
+        # caller holds _cond
+        still_waiting = []
+        for seq, loop, future in self._async_waiters:
+            if seq <= self._synced_seq or self._closed:
+                loop.call_soon_threadsafe(_resolve, future)
+            else:
+                still_waiting.append((seq, loop, future))
+        self._async_waiters = still_waiting
+
+    def _write_pending(self):
+        # caller holds _io_lock
+        with self._cond:
+            batch, self._buffer = self._buffer, []
+            upto = self._last_seq
+        if batch:
+            self._file.write(b"".join(batch))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        with self._cond:
+            self.records_written += len(batch)
+            if batch:
+                self.fsyncs += 1
+            self._synced_seq = upto
+            self._cond.notify_all()
+            if self._async_waiters:
+                self._wake_async_waiters()
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._buffer or self._closed)
+                if self._closed and not self._buffer:
+                    return
+            if self.sync == "batch":
+                # let a batch build up before paying for the fsync
+                time.sleep(self.flush_interval)
+            with self._io_lock:
+                self._write_pending()
+
+    def rotate(self) -> int:
+        """
+        Flush everything, then start a new segment.
+        Returns the last seq in the old segments.
+        """
+        with self._io_lock:
+            self._write_pending()
+            self._file.close()
+            self._file = open(os.path.join(self.directory, _segment_name(self._last_seq + 1)), "ab")
+            return self._last_seq
+
+    def prune(self, upto_seq: int):
+        """
+        Delete segments whose records are all <= upto_seq (i.e. covered by a snapshot).
+        """
+        segments = list_segments(self.directory)
+        for (_, path), (next_first, _) in zip(segments, segments[1:]):
+            if next_first - 1 <= upto_seq:
+                os.remove(path)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            self._wake_async_waiters()
+        self._flusher.join()
+        with self._io_lock:
+            self._write_pending()
+            self._file.close()
+        os.close(self._lock_fd)
+
+    def stats(self) -> Dict:
+        return {
+            "sync": self.sync,
+            "last_seq": self._last_seq,
+            "synced_seq": self._synced_seq,
+            "records_written": self.records_written,
+            "fsyncs": self.fsyncs
+        }
@@ -0,0 +1,206 @@
+from typing import AsyncIterator, Callable, Dict, Hashable, List, Optional, Set
+import asyncio
+from fast_json import dumps
+
+def sse(event: str, data: Dict, id: Optional[int] = None) -> bytes:
+    """
+    One server-sent event, ready to write.
+    """
+    head = f"event: {event}\n" + (f"id: {id}\n" if id is not None else "")
+    return head.encode() + b"data: " + dumps(data) + b"\n\n"
+
+KEEPALIVE = b": keepalive\n\n"
+
+class _Topic:
+    """
+    What one topic's subscribers share: the latest payload, its version,
+    and both ways of sending it, encoded once.
+    """
+    def __init__(self):
+        self.payload: Optional[Dict] = None
+        self.version: int = 0
+        self.snapshot: bytes = b""
+        self.delta: bytes = b""
+        self.subscribers: int = 0
+        # replaced on every publish, setting the old one wakes everyone
+        self.changed = asyncio.Event()
+
+class Broadcaster:
+    """
+    Server-sent event streams fed from one shared fetch per interval.
+
+    Subscribers ask for a topic (a user id for carts, one fixed topic for
+    the stats). Nobody fetches for themselves: a single task on the event
+    loop wakes every `interval` seconds, fetches the topics that may have
+    changed (one worker thread call for all of them), and where a payload
+    differs from the last one, encodes it once and wakes that topic's
+    subscribers. 500 dashboards cost one get_stats a second, not 500.
+
+    A topic may have changed if:
+    - someone called touch() on it (the cart routes do)
+    - `version()` returned something new since the last tick (the stats
+      use the order count, which is cheap to read)
+    - it's a resync tick, every `resync_every` intervals, which catches
+      changes made somewhere touch() didn't see (another worker, the
+      cart sweeper, a catalog price change)
+
+    The first message on a stream is a "snapshot" event with the whole
+    payload. After that each update is a "delta" event with only the
+    top-level keys that changed. Event ids are the topic version; a
+    subscriber that fell more than one version behind (a slow client)
+    gets a fresh snapshot instead, so it never has to see every delta.
+    Either way a subscriber gets at most one message per interval.
+    """
+    def __init__(self, fetch: Callable[[List[Hashable]], Dict[Hashable, Dict]], interval: float = 1.0,
+                 version: Optional[Callable[[], object]] = None, resync_every: int = 30, keepalive: float = 15.0):
+        self.fetch = fetch
+        self.interval = interval
+        self.version = version
+        self.resync_every = resync_every
+        self.keepalive = keepalive
+        self._topics: Dict[Hashable, _Topic] = {}
+        self._touched: Set[Hashable] = set()
+        self._last_version: object = None
+        self._task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._closing = False
+        self.ticks: int = 0
+        self.fetches: int = 0
+        self.published: int = 0
+        self.errors: int = 0
+        self.last_error: Optional[str] = None
+
+    @property
+    def subscribers(self) -> int:
+        return sum(topic.subscribers for topic in self._topics.values())
+
+    def touch(self, topic: Hashable):
+        """
+        Note that a topic changed. Free if nobody's subscribed to it.
+        """
+        if topic in self._topics:
+            self._touched.add(topic)
+
+    async def subscribe(self, topic: Hashable) -> AsyncIterator[bytes]:
+        """
+        The stream for one subscriber, as SSE bytes. Runs until the client
+        goes away (the response cancels it) or close().
+        """
+        state = self._topics.get(topic)
+        if state is None:
+            state = self._topics[topic] = _Topic()
+        state.subscribers += 1
+        self._start()
+        sent = 0
+        try:
+            if state.payload is None:
+                # a new topic, get the loop to fetch it now instead of next tick
+                self._touched.add(topic)
+                self._wake.set()
+            while not self._closing:
+                if state.version > sent:
+                    message = state.delta if state.version == sent + 1 and sent else state.snapshot
+                    sent = state.version
+                    yield message
+                    continue
+                try:
+                    await asyncio.wait_for(state.changed.wait(), self.keepalive)
+                except asyncio.TimeoutError:
+                    yield KEEPALIVE
+        finally:
+            state.subscribers -= 1
+            if not state.subscribers and self._topics.get(topic) is state:
+                del self._topics[topic]
+                self._touched.discard(topic)
+
+    def _start(self):
+        if self._task is None or self._task.done():
+            self._closing = False
+            self._wake = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        while self._topics and not self._closing:
+            try:
+                await asyncio.wait_for(self._wake.wait(), max(0.0, next_tick - loop.time()))
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            if loop.time() >= next_tick:
+                next_tick = loop.time() + self.interval
+                await self._tick(new_only=False)
+            else:
+                await self._tick(new_only=True)
+
+    async def _tick(self, new_only: bool):
+        if new_only:
+            due = [topic for topic, state in self._topics.items() if state.payload is None]
+            check_version = False
+        else:
+            self.ticks += 1
+            resync = self.ticks % self.resync_every == 0
+            due = [topic for topic in self._topics if resync or topic in self._touched]
+            check_version = self.version is not None and not resync
+        self._touched.difference_update(due)
+        try:
+            payloads = await asyncio.to_thread(self._collect, due, list(self._topics) if check_version else [])
+        except Exception as e:
+            # streams keep their last payload; the next resync tries again
+            self.errors += 1
+            self.last_error = f"{type(e).__name__}: {e}"
+            return
+        for topic, payload in payloads.items():
+            state = self._topics.get(topic)
+            if state is not None:
+                self._publish(state, payload)
+
+    def _collect(self, due: List[Hashable], everything: List[Hashable]) -> Dict[Hashable, Dict]:
+        # worker thread. `everything` is fetched too if version() moved
+        if everything:
+            version = self.version()
+            if version != self._last_version:
+                self._last_version = version
+                due = everything
+        if not due:
+            return {}
+        self.fetches += 1
+        return self.fetch(due)
+
+    def _publish(self, state: _Topic, payload: Dict):
+        previous = state.payload
+        if payload == previous:
+            return
+        changed = {key: value for key, value in payload.items() if previous is None or previous.get(key) != value}
+        if previous is not None:
+            changed.update({key: None for key in previous if key not in payload})
+        state.payload = payload
+        state.version += 1
+        state.snapshot = sse("snapshot", payload, state.version)
+        state.delta = sse("delta", changed, state.version)
+        self.published += 1
+        woken, state.changed = state.changed, asyncio.Event()
+        woken.set()
+
+    def close(self):
+        """
+        End every stream, e.g. at shutdown so open dashboards don't hold it up.
+        """
+        self._closing = True
+        for state in self._topics.values():
+            state.changed.set()
+        if self._wake is not None:
+            self._wake.set()
+
+    def stats(self) -> Dict:
+        return {
+            "topics": len(self._topics),
+            "subscribers": self.subscribers,
+            "interval": self.interval,
+            "ticks": self.ticks,
+            "fetches": self.fetches,
+            "published": self.published,
+            "errors": self.errors,
+            "last_error": self.last_error,
+        }
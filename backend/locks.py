@@ -0,0 +1,204 @@
+from typing import Callable, Dict, Hashable, List
+from contextlib import contextmanager
+import functools
+import threading
+import time
+
+class WouldBlock(Exception):
+    """
+    Raised by CountedLock instead of waiting, inside a `no_wait()` block.
+    """
+
+_no_wait = threading.local()
+
+@contextmanager
+def no_wait():
+    """
+    Inside this block, contended CountedLocks raise WouldBlock instead of
+    blocking the thread. The event loop uses this to run store operations
+    inline and hand them to a worker thread only when a lock is busy.
+    Store methods take their locks before changing anything, so bailing
+    out at any acquire leaves no half-done work.
+    """
+    previous = getattr(_no_wait, "active", False)
+    _no_wait.active = True
+    try:
+        yield
+    finally:
+        _no_wait.active = previous
+
+@contextmanager
+def blocking():
+    """
+    Undo `no_wait()` for a block that must not bail out halfway, like
+    putting back what a failed operation already took.
+    """
+    previous = getattr(_no_wait, "active", False)
+    _no_wait.active = False
+    try:
+        yield
+    finally:
+        _no_wait.active = previous
+
+def waiting_allowed() -> bool:
+    """
+    False inside `no_wait()`. Anything else that would park the thread
+    (not a lock) checks this and raises WouldBlock instead.
+    """
+    return not getattr(_no_wait, "active", False)
+
+class _Caller(threading.local):
+    # the decorated store method running on this thread
+    method = "other"
+
+_caller = _Caller()
+_now = time.perf_counter
+
+def lock_owner(method: Callable) -> Callable:
+    """
+    Decorator for store methods: locks taken inside get their wait and hold
+    times booked under the method's name (see CountedLock.method_stats).
+    Costs one thread-local write on the way in and out.
+    """
+    name = method.__name__
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        caller = _caller
+        previous = caller.method
+        caller.method = name
+        try:
+            return method(*args, **kwargs)
+        finally:
+            caller.method = previous
+    return wrapper
+
+class CountedLock:
+    """
+    Reentrant lock that keeps track of how often it was fought over, and
+    how long each store method waited for it and held it.
+    
+    Works as a drop-in `with` block just like threading.RLock. The counters
+    are only ever touched while the lock is held, so they don't need
+    their own synchronisation.
+    """
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.acquisitions: int = 0
+        self.contended: int = 0
+        self.wait_seconds: float = 0.0
+        # method -> [acquisitions, wait seconds, hold seconds].
+        # only the outermost acquire of a reentrant hold counts.
+        self.by_method: Dict[str, List] = {}
+        self._depth = 0
+        self._holder = ""
+        self._held_since = 0.0
+
+    def acquire(self):
+        self.__enter__()
+
+    def release(self):
+        self.__exit__(None, None, None)
+
+    # the work is in __enter__/__exit__ since `with` is the hot path,
+    # saves a call per lock
+
+    def __enter__(self):
+        # try the fast path first, only start the clock if someone else has it
+        waited = 0.0
+        if not self._lock.acquire(blocking=False):
+            if getattr(_no_wait, "active", False):
+                raise WouldBlock()
+            start = _now()
+            self._lock.acquire()
+            waited = _now() - start
+            self.contended += 1
+            self.wait_seconds += waited
+        self.acquisitions += 1
+        if self._depth:
+            self._depth += 1
+            return self
+        self._depth = 1
+        holder = self._holder = _caller.method
+        timing = self.by_method.get(holder)
+        if timing is None:
+            timing = self.by_method[holder] = [0, 0.0, 0.0]
+        timing[0] += 1
+        timing[1] += waited
+        self._held_since = _now()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._depth -= 1
+        if not self._depth:
+            self.by_method[self._holder][2] += _now() - self._held_since
+        self._lock.release()
+
+    def stats(self) -> Dict:
+        return {
+            "acquisitions": self.acquisitions,
+            "contended": self.contended,
+            "wait_seconds": self.wait_seconds
+        }
+
+    def method_stats(self) -> Dict[str, Dict]:
+        """
+        Per-method acquisitions, wait and hold seconds. Read without the
+        lock, so it can be a hair behind.
+        """
+        return {
+            method: {"acquisitions": count, "wait_seconds": wait, "hold_seconds": hold}
+            for method, (count, wait, hold) in list(self.by_method.items())
+        }
+
+class StripedLock:
+    """
+    Fixed pool of CountedLocks picked by hashing a key.
+    
+    Used for carts: two users only ever wait on each other if their ids
+    land on the same stripe. More stripes means less collision at the cost
+    of a few more lock objects.
+    """
+    def __init__(self, stripes: int = 64):
+        if stripes < 1:
+            raise ValueError("Need at least one lock stripe")
+        self._stripes: List[CountedLock] = [CountedLock() for _ in range(stripes)]
+
+    @property
+    def stripe_count(self) -> int:
+        return len(self._stripes)
+
+    def stripe_index(self, key: Hashable) -> int:
+        return hash(key) % len(self._stripes)
+
+    def for_key(self, key: Hashable) -> CountedLock:
+        return self._stripes[self.stripe_index(key)]
+
+    def all_stripes(self) -> List[CountedLock]:
+        """
+        Every stripe, always in the same order. Take them in this order
+        if you need all of them at once.
+        """
+        return list(self._stripes)
+
+    def stats(self) -> Dict:
+        per_stripe = [lock.stats() for lock in self._stripes]
+        return {
+            "stripes": len(per_stripe),
+            "acquisitions": sum(s["acquisitions"] for s in per_stripe),
+            "contended": sum(s["contended"] for s in per_stripe),
+            "wait_seconds": sum(s["wait_seconds"] for s in per_stripe),
+            "per_stripe_contended": [s["contended"] for s in per_stripe]
+        }
+
+    def method_stats(self) -> Dict[str, Dict]:
+        """
+        Same as CountedLock.method_stats, summed over every stripe.
+        """
+        totals: Dict[str, Dict] = {}
+        for lock in self._stripes:
+            for method, timing in lock.method_stats().items():
+                total = totals.setdefault(method, {"acquisitions": 0, "wait_seconds": 0.0, "hold_seconds": 0.0})
+                for key, value in timing.items():
+                    total[key] += value
+        return totals
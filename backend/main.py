@@ -1,10 +1,45 @@
-from fastapi import FastAPI, HTTPException, Depends, status
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, HTTPException, Depends, Header, Query, Request, Response, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import FileResponse, JSONResponse, RedirectResponse, StreamingResponse
 from typing import List, Optional
+from datetime import datetime, timezone
+import time
 from fastapi.middleware.cors import CORSMiddleware
-from models import Cart, Order, Stats
-from store import store
+from models import Cart, CartBatch, Item, Order, Stats, ProductPage
 from config import settings
+from storage import create_store
+from persistence import Persistence
+from cart_sweeper import CartSweeper
+from metrics import MetricsMiddleware, RequestMetrics, render_prometheus
+from images import DEFAULT_SIZE, IMMUTABLE_CACHE, ImagePipeline
+from idempotency import IdempotencyCache, IdempotencyConflict
+from fast_json import FastJSONResponse
+from catalog_feed import FORMATS, apply_delta, load_feed
+import order_export
+from events import AuditTrail
+from live_updates import Broadcaster
+import asyncio
+import tempfile
+import threading
+
+# backend is picked by STORE_BACKEND (see config.py)
+store = create_store(settings)
+images = ImagePipeline(settings.IMAGE_SOURCE_DIR, settings.IMAGE_CACHE_DIR)
+# finished checkouts by (user_id, Idempotency-Key), for client retries
+checkouts = IdempotencyCache(settings.IDEMPOTENCY_MAX_KEYS, settings.IDEMPOTENCY_TTL)
+# reports from the catalog feeds loaded since startup, for /admin/catalog
+catalog_loads: List[dict] = []
+# live dashboards and carts (server-sent events): one fetch per interval,
+# shared by everyone subscribed to the same stats/cart
+stats_updates = Broadcaster(
+    lambda topics: {topic: store.get_stats() for topic in topics},
+    interval=settings.STREAM_INTERVAL_MS / 1000,
+    version=lambda: store.stats_version(),
+)
+cart_updates = Broadcaster(
+    lambda user_ids: {user_id: store.get_cart_data(user_id, priced=True) for user_id in user_ids},
+    interval=settings.STREAM_INTERVAL_MS / 1000,
+)
 
 from contextlib import asynccontextmanager
 
@@ -14,16 +49,52 @@ async def lifespan(app: FastAPI):
     Lifespan context manager for the FastAPI app.
     Handles startup and shutdown events.
     """
-    # Startup: Load initial data
-    store.seed_data()
+    # Startup: Load initial data, from the feed if there is one
+    if settings.CATALOG_FEED:
+        catalog_loads.append(load_feed(store, settings.CATALOG_FEED, lazy=settings.CATALOG_LAZY_DETAILS))
+        for path in settings.CATALOG_DELTAS:
+            catalog_loads.append(apply_delta(store, path))
+    else:
+        store.seed_data()
+    persistence = None
+    if settings.JOURNAL_DIR and settings.STORE_BACKEND == "memory":
+        # bring back carts/orders/codes from the last run before serving anything
+        persistence = Persistence(
+            store,
+            settings.JOURNAL_DIR,
+            sync=settings.JOURNAL_SYNC,
+            flush_interval=settings.JOURNAL_FLUSH_MS / 1000,
+            snapshot_every=settings.SNAPSHOT_EVERY,
+        )
+        persistence.recover()
+        persistence.start()
+    if settings.AUDIT_LOG:
+        store.audit = AuditTrail(settings.AUDIT_LOG)
+    # discount codes + rollups from here on happen on the event consumer thread
+    store.events.start()
+    sweeper = None
+    if settings.STORE_BACKEND in ("memory", "sharded"):
+        sweeper = CartSweeper(store, settings.CART_IDLE_TTL, settings.MAX_CARTS, settings.CART_SWEEP_SECONDS)
+        sweeper.start()
+    if settings.IMAGE_PREWARM:
+        # resizing takes a few seconds, requests that get there first generate their own
+        threading.Thread(target=images.warm, name="image-warm", daemon=True).start()
     yield
-    # Shutdown: Clean up resources if needed (none for in-memory)
+    # Shutdown: end the open streams, stop sweeping, final snapshot + flush the journal, close connections
+    stats_updates.close()
+    cart_updates.close()
+    if sweeper:
+        sweeper.close()
+    # apply what's queued before the final snapshot
+    store.events.close()
+    if persistence:
+        persistence.close()
+    store.close()
+    if store.audit:
+        store.audit.close()
 
 app = FastAPI(title=settings.PROJECT_NAME, version=settings.PROJECT_VERSION, lifespan=lifespan)
 
-# Serve product images from the backend
-# Images will be accessible at http://localhost:8000/static/products/Headphones.png
-app.mount("/static", StaticFiles(directory="."), name="static")
 
 # enabling CORS because the frontend is on port 5173 (or 5174 if 5173 is busy) and backend is on 8000.
 # need this for local dev communication.
@@ -35,99 +106,425 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# request latency per route, for /metrics. added last so it's the
+# outermost middleware and the timing covers everything else.
+request_metrics = RequestMetrics()
+app.add_middleware(MetricsMiddleware, metrics=request_metrics)
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    If-None-Match check. Uses weak comparison like the RFC says,
+    so a W/ prefix from a proxy still counts.
+    """
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+def cached_json(request: Request, etag: str, body: bytes) -> Response:
+    """
+    Serve pre-encoded JSON with its ETag, or a bare 304 if the client
+    already has it. no-cache makes browsers revalidate every time, which is
+    cheap since the 304 has no body.
+    """
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+def json_response(content, headers: Optional[dict] = None) -> Response:
+    """
+    Plain dicts/lists from the store straight to bytes, skipping FastAPI's
+    jsonable_encoder pass (see fast_json.py). With FAST_JSON off it's the
+    usual FastAPI encoding of the same content.
+    """
+    if settings.FAST_JSON:
+        return FastJSONResponse(content, headers=headers)
+    return JSONResponse(jsonable_encoder(content), headers=headers)
+
+def event_stream(messages) -> StreamingResponse:
+    """
+    Server-sent events. X-Accel-Buffering stops nginx from holding them back.
+    """
+    return StreamingResponse(messages, media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.get("/")
 def read_root():
     return {"message": "Welcome to the E-commerce Assessment API"}
 
 # Product Endpoints
 
-@app.get("/products")
-def get_products():
+@app.get("/products", response_model=ProductPage)
+def get_products(
+    request: Request,
+    q: Optional[str] = None,
+    category: Optional[str] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    sale: Optional[bool] = None,
+    min_rating: Optional[float] = None,
+    ids: Optional[str] = None,
+    sort: str = "id",
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+):
     """
-    Get all products.
+    Search, filter and page through products.
+    q matches word prefixes in the name or category. ids is a comma separated
+    list (handy for looking up everything in a cart at once).
+    Pass the returned next_cursor back to get the following page.
+    Responses come pre-encoded from the store's cache, with an ETag.
     """
-    return list(store.items.values())
+    try:
+        id_list = tuple(int(i) for i in ids.split(",") if i.strip()) if ids is not None else None
+        etag, body = store.product_page_json(
+            query=q,
+            category=category,
+            min_price=min_price,
+            max_price=max_price,
+            sale=sale,
+            min_rating=min_rating,
+            ids=id_list,
+            sort=sort,
+            cursor=cursor,
+            limit=limit,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return cached_json(request, etag, body)
 
-@app.get("/products/{product_id}")
-def get_product(product_id: int):
+@app.get("/products/{product_id}", response_model=Item)
+def get_product(product_id: int, request: Request):
     """
     Get a single product by ID.
     """
-    if product_id not in store.items:
+    cached = store.product_json(product_id)
+    if cached is None:
         raise HTTPException(status_code=404, detail="Product not found")
-    return store.items[product_id]
+    return cached_json(request, *cached)
+
+@app.get("/products/{product_id}/stock")
+def get_stock(product_id: int):
+    """
+    Live stock for a product. `stock` on the product itself is only what
+    it was loaded with; this is what's left, and how much of it carts are
+    holding (with CART_RESERVATION_SECONDS on).
+    """
+    try:
+        return json_response(store.stock_level(product_id))
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Product not found")
+
+# Product images
+#
+# Item.image is /images/products/<file>. add ?size=thumb|card|full and it
+# redirects to a resized webp under a content-hashed name that's cached
+# forever (see images.py). only the image files are reachable, not the
+# rest of the backend directory.
+
+@app.get("/images/products/{name}")
+def get_product_image(name: str, size: str = DEFAULT_SIZE):
+    """
+    Redirect to the hashed URL for this image at this size. The redirect
+    itself is cacheable for an hour, so a browser only asks again when
+    the image might have changed.
+    """
+    try:
+        variant = images.variant_name(name, size)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Image not found")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return RedirectResponse(f"/images/v/{variant}", status_code=302, headers={"Cache-Control": "public, max-age=3600"})
+
+@app.get("/images/v/{filename}")
+def get_image_variant(filename: str):
+    """
+    A resized variant, generated on first request.
+    """
+    try:
+        path = images.variant_path(filename)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return FileResponse(path, headers={"Cache-Control": IMMUTABLE_CACHE})
+
+@app.get("/static/products/{name}")
+def legacy_product_image(name: str):
+    """
+    Old image URLs from before the image pipeline.
+    """
+    return RedirectResponse(f"/images/products/{name}", status_code=301)
 
 # Cart Endpoints
 
 # I'm using a user_id param here to simulate different users.
 # allows me to test multiple carts without needing a full login system.
 # defaults to "demo_user" so simple calls just work.
+#
+# cart and checkout routes are async and call the store's *_async methods,
+# so they run straight on the event loop instead of hopping to the
+# threadpool for a few microseconds of dict work (see Storage._run_async).
+# they take plain dicts from the store and return them with json_response,
+# so the response isn't run back through the models either.
 
 @app.post("/cart/add")
-def add_to_cart(item_id: int, quantity: int = 1, user_id: str = "demo_user"):
+async def add_to_cart(item_id: int, quantity: int = 1, user_id: str = "demo_user"):
     """
     Add item to cart or update quantity if it's already there.
     """
     try:
-        store.add_to_cart(user_id, item_id, quantity)
-        return {"message": "Item added to cart", "cart": store.get_cart(user_id)}
+        await store.add_to_cart_async(user_id, item_id, quantity)
+        cart_updates.touch(user_id)
+        return json_response({"message": "Item added to cart", "cart": await store.get_cart_data_async(user_id)})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/cart/batch")
+async def apply_cart_batch(batch: CartBatch, user_id: str = "demo_user"):
+    """
+    Apply several add/set/remove operations in one go, in order.
+    All or nothing: if any op is invalid, nothing changes and you get a 400
+    saying which one. Returns the cart once at the end.
+    """
+    try:
+        cart = await store.apply_cart_batch_async(user_id, batch.operations)
+        cart_updates.touch(user_id)
+        return json_response({"message": "Cart updated", "cart": cart.model_dump()})
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.get("/cart")
-def get_cart(user_id: str = "demo_user"):
-    return store.get_cart(user_id)
+async def get_cart(user_id: str = "demo_user", priced: bool = False):
+    """
+    Get the user's cart.
+    Pass priced=true to also get the item count and subtotal.
+    """
+    return json_response(await store.get_cart_data_async(user_id, priced))
+
+@app.get("/cart/stream")
+async def stream_cart(user_id: str = "demo_user"):
+    """
+    The priced cart as server-sent events: a "snapshot" event with the
+    whole cart, then a "delta" with the changed fields whenever it changes
+    (at most one per STREAM_INTERVAL_MS). Every tab of the same user shares
+    one fetch.
+    """
+    return event_stream(cart_updates.subscribe(user_id))
 
 @app.delete("/cart/remove")
-def remove_from_cart(item_id: int, user_id: str = "demo_user"):
+async def remove_from_cart(item_id: int, user_id: str = "demo_user"):
     """
     Remove an item completely from the cart.
     """
     try:
-        store.remove_from_cart(user_id, item_id)
-        return {"message": "Item removed from cart", "cart": store.get_cart(user_id)}
+        await store.remove_from_cart_async(user_id, item_id)
+        cart_updates.touch(user_id)
+        return json_response({"message": "Item removed from cart", "cart": await store.get_cart_data_async(user_id)})
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.get("/discount/validate")
-def validate_discount_code(code: str):
+async def validate_discount_code(code: str):
     """
     Check if a discount code is valid (exists and hasn't been used).
     """
-    is_valid = store.validate_discount_code(code)
-    return {"code": code, "valid": is_valid}
+    is_valid = await store.validate_discount_code_async(code)
+    return json_response({"code": code, "valid": is_valid})
 
 # Checkout
 
 @app.post("/checkout")
-def checkout(discount_code: Optional[str] = None, user_id: str = "demo_user"):
+async def checkout(
+    discount_code: Optional[str] = None,
+    user_id: str = "demo_user",
+    idempotency_key: Optional[str] = Header(None, max_length=255),
+):
     """
     Submits the order.
     Calculates totals, applies discount if the code is valid, and records the order.
     Checks the nth order condition internally to see if a new code should be generated next.
+
+    With an Idempotency-Key header, retries with the same key get the
+    original order back (and an Idempotent-Replayed header) without
+    touching the cart or placing another order.
+    """
+    try:
+        if idempotency_key is None:
+            order, replayed = await store.checkout_async(user_id, discount_code), False
+        else:
+            order, replayed = await checkouts.run(
+                (user_id, idempotency_key), discount_code, lambda: store.checkout_async(user_id, discount_code)
+            )
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # the cart is empty now; the stats stream notices the order by itself
+    cart_updates.touch(user_id)
+    return json_response(order.model_dump(), {"Idempotent-Replayed": "true"} if replayed else None)
+
+# Order history
+
+@app.get("/orders")
+async def list_orders(user_id: str = "demo_user", cursor: Optional[str] = None, limit: int = Query(20, ge=1, le=100)):
+    """
+    The user's past orders, newest first. Pass next_cursor back as
+    `cursor` for the next page; it's null on the last one.
     """
     try:
-        order = store.checkout(user_id, discount_code)
-        return order
+        return json_response(await store.list_orders_async(user_id, cursor, limit))
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@app.get("/orders/{order_id}")
+async def get_order(order_id: int):
+    """
+    One order by id.
+    """
+    try:
+        return json_response(await store.get_order_async(order_id))
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Order not found")
+
 # Admin
 
 @app.post("/admin/generate-discount")
 def generate_discount():
     """
-    Endpoint to manually trigger the discount generation check.
-    If the order count condition is met, it spits out a new code.
+    Did the latest order hit the nth order milestone? If so, this returns
+    its code. The event consumer issues a code for every milestone on its
+    own, so one that nobody asked about here isn't lost any more.
     """
     code = store.generate_discount_code()
     if code:
         return {"message": "Discount code generated", "code": code}
     return {"message": "No discount code generated. Condition not met."}
 
+def _unix_seconds(value: datetime) -> float:
+    # naive datetimes are taken as UTC, same as the day buckets
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
 @app.get("/admin/stats")
-def get_stats():
+def get_stats(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    resolution: Optional[str] = None,
+    group_by: Optional[str] = None,
+):
     """
     Basic sales stats for the admin.
+
+    Pass any of start/end/resolution/group_by to get a sales report from
+    the pre-aggregated rollups instead. start/end are ISO datetimes or
+    unix seconds (default: the last 24 hours), resolution is
+    minute/hour/day (default hour) and group_by is time (one row per
+    bucket, the default), product or category.
+    """
+    if start is None and end is None and resolution is None and group_by is None:
+        return json_response(store.get_stats())
+    end_at = _unix_seconds(end) if end else time.time()
+    start_at = _unix_seconds(start) if start else end_at - 86400
+    resolution = resolution or "hour"
+    group_by = group_by or "time"
+    try:
+        rows = store.sales_rollup(start_at, end_at, resolution, group_by)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return json_response({"start": start_at, "end": end_at, "resolution": resolution, "group_by": group_by, "rows": rows})
+
+@app.get("/admin/stats/stream")
+async def stream_stats():
+    """
+    The /admin/stats numbers as server-sent events, for dashboards that
+    would otherwise poll: a "snapshot" event, then "delta" events with
+    only the fields that changed, at most one per STREAM_INTERVAL_MS.
+    Computed once per interval however many dashboards are open.
+    """
+    return event_stream(stats_updates.subscribe("stats"))
+
+@app.get("/admin/orders/export")
+def export_orders(format: str = "ndjson", since_id: int = Query(0, ge=0), gzip: bool = False):
+    """
+    Every order with an id above since_id, oldest first, as NDJSON (one
+    order per line, same shape as /orders/{id}) or CSV. Streamed a batch
+    at a time, so it doesn't matter how many orders there are. Orders
+    placed while it's streaming aren't included: X-Last-Order-Id is the
+    since_id for the next pull. gzip=true sends it as a .gz file.
+    """
+    if format not in order_export.FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(order_export.FORMATS)}")
+    last_id, batches = store.export_orders(since_id, order_export.BATCH_SIZE)
+    filename = f"orders-since-{since_id}.{format}" + (".gz" if gzip else "")
+    return StreamingResponse(
+        order_export.export_chunks(batches, format, gzip),
+        media_type="application/gzip" if gzip else order_export.MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"', "X-Last-Order-Id": str(last_id)},
+    )
+
+@app.get("/admin/catalog")
+def get_catalog_loads():
+    """
+    Product count, plus what each feed loaded since startup did
+    (rows, loaded, invalid + the first few errors, seconds).
+    """
+    return json_response({"products": len(store.items), "loads": catalog_loads})
+
+@app.post("/admin/catalog/delta")
+async def upload_catalog_delta(request: Request, format: str = "jsonl"):
+    """
+    Apply a delta feed sent as the request body (JSONL or CSV, see
+    catalog_feed.apply_delta). The body is spooled to a temp file as it
+    arrives rather than read into memory.
+    """
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(FORMATS)}")
+    with tempfile.NamedTemporaryFile(suffix=f".{format}") as spool:
+        async for chunk in request.stream():
+            spool.write(chunk)
+        spool.flush()
+        report = await asyncio.to_thread(apply_delta, store, spool.name, format)
+    report["path"] = "(request body)"
+    catalog_loads.append(report)
+    return json_response(report)
+
+@app.get("/admin/stats/verify")
+def verify_stats():
+    """
+    Recomputes the stats from the full order history and diffs them against
+    the running totals. Slow on big histories, meant for occasional checks.
+    """
+    return json_response(store.verify_stats())
+
+@app.get("/admin/events")
+def get_event_stats():
+    """
+    The order event pipeline: queue depth (now and the most it's been),
+    events handled, and how often checkouts had to wait for room.
+    """
+    return json_response(store.events.stats())
+
+@app.get("/admin/locks")
+def get_lock_stats():
+    """
+    Lock contention counters, for tuning LOCK_STRIPES.
+    """
+    return store.lock_stats()
+
+@app.get("/metrics")
+def get_metrics():
+    """
+    Prometheus scrape endpoint: request latency histograms per route,
+    lock wait/hold time per store method, and cart/order/code gauges.
     """
-    return store.get_stats()
+    counters = {f"checkout_idempotency_{name}": value for name, value in checkouts.counters().items()}
+    for stream, updates in (("stats", stats_updates), ("cart", cart_updates)):
+        counters.update({f"{stream}_stream_{name}": updates.stats()[name]
+                         for name in ("fetches", "published", "errors")})
+    body = render_prometheus(request_metrics, store, counters)
+    return Response(body, media_type="text/plain; version=0.0.4")
@@ -0,0 +1,137 @@
+from typing import Dict, List, Optional, Tuple
+from bisect import bisect_left
+import time
+
+# seconds. most routes answer in well under a millisecond in-process,
+# so the low end is fine-grained
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+class Histogram:
+    """
+    Prometheus-style histogram. Counts are per bucket here and made
+    cumulative when rendered, so `observe` is one bisect and two adds.
+    """
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts: List[int] = [0] * (len(buckets) + 1)  # last one is +Inf
+        self.count: int = 0
+        self.sum: float = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        running = 0
+        result = []
+        for bound, count in zip((*self.buckets, "+Inf"), self.counts):
+            running += count
+            result.append((bound if bound == "+Inf" else repr(bound), running))
+        return result
+
+class RequestMetrics:
+    """
+    Latency histogram per (method, route) and a counter per
+    (method, route, status).
+
+    Only ever updated from the event loop thread (by MetricsMiddleware),
+    so there's no locking. With several workers each process has its own,
+    which is what Prometheus expects.
+    """
+    def __init__(self):
+        self.latency: Dict[Tuple[str, str], Histogram] = {}
+        self.responses: Dict[Tuple[str, str, int], int] = {}
+
+    def observe(self, method: str, route: str, status: int, seconds: float):
+        histogram = self.latency.get((method, route))
+        if histogram is None:
+            histogram = self.latency[(method, route)] = Histogram()
+        histogram.observe(seconds)
+        key = (method, route, status)
+        self.responses[key] = self.responses.get(key, 0) + 1
+
+class MetricsMiddleware:
+    """
+    Plain ASGI middleware that times every HTTP request.
+
+    Requests are labelled with the route template ("/products/{product_id}"),
+    not the raw path, so ids don't blow up the number of series. Paths
+    that match no route all count as "unmatched".
+    """
+    def __init__(self, app, metrics: RequestMetrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # the router writes the matched route into the scope
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            self.metrics.observe(scope["method"], route, status, time.perf_counter() - start)
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(**labels) -> str:
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+def render_prometheus(requests: RequestMetrics, store, counters: Optional[Dict[str, int]] = None) -> str:
+    """
+    Everything in the Prometheus text exposition format (version 0.0.4).
+    `counters` are app-level extras, exported as `<name>_total`.
+    """
+    lines: List[str] = []
+
+    lines.append("# HELP http_request_duration_seconds Time from request start to the end of the response.")
+    lines.append("# TYPE http_request_duration_seconds histogram")
+    for (method, route), histogram in sorted(requests.latency.items()):
+        for bound, count in histogram.cumulative():
+            lines.append(f"http_request_duration_seconds_bucket{_labels(method=method, route=route, le=bound)} {count}")
+        lines.append(f"http_request_duration_seconds_sum{_labels(method=method, route=route)} {histogram.sum}")
+        lines.append(f"http_request_duration_seconds_count{_labels(method=method, route=route)} {histogram.count}")
+
+    lines.append("# HELP http_responses_total Responses by route and status code.")
+    lines.append("# TYPE http_responses_total counter")
+    for (method, route, status), count in sorted(requests.responses.items()):
+        lines.append(f"http_responses_total{_labels(method=method, route=route, status=status)} {count}")
+
+    per_method = {name: lock.method_stats() for name, lock in store.instrumented_locks().items()}
+    for metric, field, help_text in (
+        ("store_lock_acquisitions_total", "acquisitions", "Lock acquisitions by store method."),
+        ("store_lock_wait_seconds_total", "wait_seconds", "Time spent waiting for a lock, by store method."),
+        ("store_lock_hold_seconds_total", "hold_seconds", "Time a lock was held, by store method."),
+    ):
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} counter")
+        for lock_name, methods in sorted(per_method.items()):
+            for method, timing in sorted(methods.items()):
+                lines.append(f"{metric}{_labels(lock=lock_name, method=method)} {timing[field]}")
+
+    for name, value in sorted(store.counters().items()):
+        lines.append(f"# TYPE store_{name}_total counter")
+        lines.append(f"store_{name}_total {value}")
+
+    for name, value in sorted((counters or {}).items()):
+        lines.append(f"# TYPE {name}_total counter")
+        lines.append(f"{name}_total {value}")
+
+    for name, value in sorted(store.gauges().items()):
+        lines.append(f"# HELP store_{name} Current number of {name.replace('_', ' ')}.")
+        lines.append(f"# TYPE store_{name} gauge")
+        lines.append(f"store_{name} {value}")
+
+    return "\n".join(lines) + "\n"
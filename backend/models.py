@@ -1,5 +1,5 @@
-from typing import List, Optional
-from pydantic import BaseModel
+from typing import List, Literal, Optional
+from pydantic import BaseModel, Field
 
 # keeping the models simple for this assessment.
 # we don't need full user auth or complex database schemas,
@@ -23,6 +23,14 @@ class Item(BaseModel):
     stock: int
     sale: bool = False
 
+class ProductPage(BaseModel):
+    """
+    One page of /products results.
+    next_cursor is None on the last page.
+    """
+    items: List[Item]
+    next_cursor: Optional[str] = None
+
 class CartItem(BaseModel):
     """
     Simple link between a product and how many of it the user wants.
@@ -37,6 +45,30 @@ class Cart(BaseModel):
     timestamps and other metadata here.
     """
     items: List[CartItem] = []
+
+class PricedCart(Cart):
+    """
+    Cart plus the totals the store already keeps for it.
+    """
+    item_count: int = 0
+    subtotal: float = 0
+
+class CartOperation(BaseModel):
+    """
+    One step of a batch cart update.
+    - add: same as /cart/add, quantity can be negative to take some off
+    - set: make the line exactly `quantity`, 0 removes it
+    - remove: drop the line, it has to be in the cart
+    """
+    op: Literal["add", "set", "remove"]
+    item_id: int
+    quantity: int = 1
+
+class CartBatch(BaseModel):
+    """
+    Body for POST /cart/batch. Applied in order, all or nothing.
+    """
+    operations: List[CartOperation] = Field(default_factory=list, max_length=200)
     
 class Order(BaseModel):
     """
@@ -51,6 +83,8 @@ class Order(BaseModel):
     discount_code: Optional[str] = None
     discount_amount: float = 0
     final_amount: float
+    # unix seconds. 0 for orders placed before orders were timestamped
+    created_at: float = 0
 
 class DiscountCode(BaseModel):
     """
@@ -63,7 +97,10 @@ class Stats(BaseModel):
     """
     What the admin dashboard sees.
     """
+    total_orders: int
     total_items_purchased: int
+    total_gross_amount: float
     total_purchase_amount: float
-    discount_codes: List[str]
+    discount_codes: List[str] # the latest few, oldest first
+    discount_codes_used: int
     total_discount_amount: float
@@ -0,0 +1,55 @@
+from typing import Dict, Iterable, Iterator, List
+import csv
+import io
+import zlib
+from fast_json import dumps
+
+FORMATS = ("ndjson", "csv")
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+# orders fetched per batch, one chunk of output each
+BATCH_SIZE = 1000
+# one row per order; items are item_id:quantity pairs, | separated
+CSV_COLUMNS = ["id", "user_id", "created_at", "total_amount", "discount_code",
+               "discount_amount", "final_amount", "items"]
+
+def _ndjson(orders: List[Dict]) -> bytes:
+    return b"".join(dumps(order) + b"\n" for order in orders)
+
+def _csv(orders: List[Dict]) -> bytes:
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator="\n")
+    for order in orders:
+        writer.writerow([
+            order["id"], order["user_id"], order["created_at"], order["total_amount"],
+            order["discount_code"] or "", order["discount_amount"], order["final_amount"],
+            "|".join(f"{line['item_id']}:{line['quantity']}" for line in order["items"]),
+        ])
+    return out.getvalue().encode()
+
+def export_chunks(batches: Iterable[List[Dict]], fmt: str, gzip: bool = False) -> Iterator[bytes]:
+    """
+    The output of an export, a chunk per batch of orders (from
+    Storage.export_orders). Nothing is kept between batches, so memory
+    stays at one batch however many orders there are. With gzip the
+    chunks are pieces of one gzip stream.
+    Raises ValueError for an unknown format before producing anything.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+    return _chunks(batches, fmt, gzip)
+
+def _chunks(batches: Iterable[List[Dict]], fmt: str, gzip: bool) -> Iterator[bytes]:
+    encode = _ndjson if fmt == "ndjson" else _csv
+    # wbits 31 = gzip header and trailer, so the result is a .gz file
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip else None
+    if fmt == "csv":
+        header = (",".join(CSV_COLUMNS) + "\n").encode()
+        yield compressor.compress(header) if compressor else header
+    for orders in batches:
+        chunk = encode(orders)
+        if compressor:
+            chunk = compressor.compress(chunk)
+        if chunk:
+            yield chunk
+    if compressor:
+        yield compressor.flush()
@@ -0,0 +1,215 @@
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from array import array
+from bisect import bisect_left
+import sys
+from models import CartItem, Order
+
+class OrderLog:
+    """
+    Append-only order history, stored as columns instead of one Pydantic
+    Order per checkout.
+
+    - one typed array per field (ids, totals, ...), 8 bytes a value
+    - user ids and discount codes are stored once and referenced by index
+    - line items are flattened: order i's lines are
+      item_ids/quantities[line_offsets[i]:line_offsets[i + 1]]
+
+    Order objects are only built when something asks for one (`order_at`,
+    `find`, iterating). Totals for the stats are single C-level passes over
+    the arrays (`sum()` on an array doesn't create Python objects per row).
+
+    Two indexes for order lookups, neither needs a scan:
+    - id -> row: ids are handed out in increasing order, so `ids` is
+      sorted and a bisect finds the row
+    - user -> rows: each user's rows in their own array, oldest first
+
+    Not thread-safe on its own. The store appends under its shared lock,
+    and readers only look at rows below a length they read under the lock,
+    which appends never touch.
+    """
+    def __init__(self):
+        self.ids = array("q")
+        self.user_index = array("l")
+        self.total_amounts = array("d")
+        self.discount_amounts = array("d")
+        self.final_amounts = array("d")
+        self.created_at = array("d")
+        self.code_index = array("l")  # -1 = no code
+        self.line_offsets = array("q", [0])
+        self.item_ids = array("q")
+        self.quantities = array("q")
+        self.users: List[str] = []
+        self._user_numbers: Dict[str, int] = {}
+        self.user_rows: List[array] = []
+        self.codes: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def append(
+        self,
+        order_id: int,
+        user_id: str,
+        lines: Iterable[Tuple[int, int]],
+        total_amount: float,
+        discount_code: Optional[str],
+        discount_amount: float,
+        final_amount: float,
+        created_at: float = 0,
+    ) -> int:
+        """
+        Add one order. `lines` is (item_id, quantity) pairs. Returns its row.
+        """
+        user = self._user_numbers.get(user_id)
+        if user is None:
+            user = self._user_numbers[user_id] = len(self.users)
+            self.users.append(user_id)
+            self.user_rows.append(array("q"))
+        for item_id, quantity in lines:
+            self.item_ids.append(item_id)
+            self.quantities.append(quantity)
+        if discount_code:
+            self.codes.append(discount_code)
+        # lines first, ids last: a reader that sees the id sees a complete row
+        self.line_offsets.append(len(self.item_ids))
+        self.code_index.append(len(self.codes) - 1 if discount_code else -1)
+        self.final_amounts.append(final_amount)
+        self.created_at.append(created_at)
+        self.discount_amounts.append(discount_amount)
+        self.total_amounts.append(total_amount)
+        self.user_index.append(user)
+        self.ids.append(order_id)
+        self.user_rows[user].append(len(self.ids) - 1)
+        return len(self.ids) - 1
+
+    def append_order(self, order: Order) -> int:
+        return self.append(
+            order.id, order.user_id, ((line.item_id, line.quantity) for line in order.items),
+            order.total_amount, order.discount_code, order.discount_amount, order.final_amount,
+            order.created_at
+        )
+
+    def lines_at(self, row: int) -> List[Tuple[int, int]]:
+        start, end = self.line_offsets[row], self.line_offsets[row + 1]
+        return list(zip(self.item_ids[start:end], self.quantities[start:end]))
+
+    def order_at(self, row: int) -> Order:
+        code = self.code_index[row]
+        return Order(
+            id=self.ids[row],
+            user_id=self.users[self.user_index[row]],
+            items=[CartItem(item_id=item_id, quantity=quantity) for item_id, quantity in self.lines_at(row)],
+            total_amount=self.total_amounts[row],
+            discount_code=self.codes[code] if code >= 0 else None,
+            discount_amount=self.discount_amounts[row],
+            final_amount=self.final_amounts[row],
+            created_at=self.created_at[row],
+        )
+
+    def order_data(self, row: int) -> Dict:
+        """
+        order_at as plain dicts, for FastJSONResponse.
+        """
+        code = self.code_index[row]
+        return {
+            "id": self.ids[row],
+            "user_id": self.users[self.user_index[row]],
+            "items": [{"item_id": item_id, "quantity": quantity} for item_id, quantity in self.lines_at(row)],
+            "total_amount": self.total_amounts[row],
+            "discount_code": self.codes[code] if code >= 0 else None,
+            "discount_amount": self.discount_amounts[row],
+            "final_amount": self.final_amounts[row],
+            "created_at": self.created_at[row],
+        }
+
+    def __iter__(self) -> Iterator[Order]:
+        return (self.order_at(row) for row in range(len(self)))
+
+    def row_of(self, order_id: int) -> Optional[int]:
+        """
+        Row of an order id. Ids are handed out in increasing order, so it's a bisect.
+        """
+        row = bisect_left(self.ids, order_id)
+        if row < len(self.ids) and self.ids[row] == order_id:
+            return row
+        return None
+
+    def find(self, order_id: int) -> Optional[Order]:
+        row = self.row_of(order_id)
+        return self.order_at(row) if row is not None else None
+
+    def user_page(self, user_id: str, before_id: Optional[int] = None, limit: int = 20) -> Tuple[List[int], bool]:
+        """
+        Rows of a user's orders, newest first, starting below `before_id`
+        (the last id of the previous page), plus whether there are more.
+        Two bisects and a slice, however many orders there are.
+        """
+        user = self._user_numbers.get(user_id)
+        if user is None:
+            return [], False
+        rows = self.user_rows[user]
+        end = len(rows)
+        if before_id is not None:
+            end = bisect_left(rows, bisect_left(self.ids, before_id))
+        start = max(0, end - limit)
+        return rows[start:end][::-1].tolist(), start > 0
+
+    def totals(self, upto: Optional[int] = None) -> Dict:
+        """
+        Everything the stats need, straight from the columns.
+        `upto` limits it to the first rows (a consistent prefix).
+        """
+        n = len(self) if upto is None else upto
+        codes = [self.codes[i] for i in self.code_index[:n] if i >= 0]
+        return {
+            "total_orders": n,
+            "total_items_purchased": sum(self.quantities[:self.line_offsets[n]]),
+            "total_gross_amount": sum(self.total_amounts[:n]),
+            "total_purchase_amount": sum(self.final_amounts[:n]),
+            "total_discount_amount": sum(self.discount_amounts[:n]),
+            "discount_codes": codes,
+            "discount_codes_used": len(codes),
+        }
+
+    def rows(self, upto: Optional[int] = None) -> List[List]:
+        """
+        Plain rows for a snapshot:
+        [id, user_id, [[item_id, quantity], ...], total, code, discount, final, created_at]
+        """
+        n = len(self) if upto is None else upto
+        users, codes, offsets = self.users, self.codes, self.line_offsets
+        item_ids, quantities = self.item_ids, self.quantities
+        return [
+            [
+                self.ids[row],
+                users[self.user_index[row]],
+                [[item_ids[k], quantities[k]] for k in range(offsets[row], offsets[row + 1])],
+                self.total_amounts[row],
+                codes[self.code_index[row]] if self.code_index[row] >= 0 else None,
+                self.discount_amounts[row],
+                self.final_amounts[row],
+                self.created_at[row],
+            ]
+            for row in range(n)
+        ]
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[List]) -> "OrderLog":
+        # rows from older snapshots have no created_at, append's default covers it
+        log = cls()
+        for row in rows:
+            log.append(*row)
+        return log
+
+    def memory_bytes(self) -> int:
+        """
+        Approximate footprint: the array buffers plus the interned strings.
+        """
+        arrays = (self.ids, self.user_index, self.total_amounts, self.discount_amounts, self.final_amounts,
+                  self.created_at, self.code_index, self.line_offsets, self.item_ids, self.quantities)
+        size = sum(sys.getsizeof(a) for a in arrays)
+        size += sys.getsizeof(self.users) + sum(sys.getsizeof(u) for u in self.users)
+        size += sys.getsizeof(self._user_numbers)
+        size += sys.getsizeof(self.user_rows) + sum(sys.getsizeof(rows) for rows in self.user_rows)
+        size += sys.getsizeof(self.codes) + sum(sys.getsizeof(c) for c in self.codes)
+        return size
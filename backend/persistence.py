@@ -0,0 +1,139 @@
+from typing import Dict, Optional
+import json
+import os
+import threading
+import time
+from journal import Journal, lock_directory, read_records
+
+SNAPSHOT_NAME = "snapshot.json"
+
+class Persistence:
+    """
+    Keeps an InMemoryStore durable across restarts.
+
+    - every mutation goes into the journal (see journal.py)
+    - every `snapshot_every` records, a compacted snapshot of the whole store is
+      written and the journal segments it covers are deleted
+    - on startup, `recover` loads the latest snapshot and replays whatever
+      journal came after it
+
+    Snapshots are written to a temp file and renamed into place, so there's
+    always one complete snapshot on disk.
+
+    One process per directory: `recover` locks it for the journal, and a
+    second worker pointed at the same one fails there.
+    """
+    def __init__(
+        self,
+        store,
+        directory: str,
+        sync: str = "group",
+        flush_interval: float = 0.01,
+        snapshot_every: int = 100_000,
+        check_interval: float = 1.0,
+    ):
+        self.store = store
+        self.directory = directory
+        self.sync = sync
+        self.flush_interval = flush_interval
+        self.snapshot_every = snapshot_every
+        self.check_interval = check_interval
+        self.journal: Optional[Journal] = None
+        self.last_snapshot_seq: int = 0
+        self._stop = threading.Event()
+        self._snapshotter: Optional[threading.Thread] = None
+        self._snapshot_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def snapshot_path(self) -> str:
+        return os.path.join(self.directory, SNAPSHOT_NAME)
+
+    def recover(self) -> Dict:
+        """
+        Load snapshot + replay journal tail into the store, then start journaling.
+        Returns some numbers about how long it took.
+        """
+        start = time.perf_counter()
+        # before reading anything, the journal keeps it from here on
+        lock_fd = lock_directory(self.directory)
+        try:
+            snapshot_seq = 0
+            if os.path.exists(self.snapshot_path):
+                with open(self.snapshot_path, "rb") as f:
+                    snapshot = json.load(f)
+                snapshot_seq = snapshot["seq"]
+                self.store.import_state(snapshot["state"])
+            loaded = time.perf_counter()
+
+            last_seq = snapshot_seq
+            replayed = 0
+            for record in read_records(self.directory, after_seq=snapshot_seq):
+                self.store.apply_record(record)
+                last_seq = record["seq"]
+                replayed += 1
+        except BaseException:
+            os.close(lock_fd)
+            raise
+
+        self.last_snapshot_seq = snapshot_seq
+        self.journal = Journal(self.directory, next_seq=last_seq + 1, sync=self.sync,
+                               flush_interval=self.flush_interval, lock_fd=lock_fd)
+        self.store.attach_journal(self.journal)
+        done = time.perf_counter()
+        return {
+            "snapshot_seq": snapshot_seq,
+            "replayed_records": replayed,
+            "snapshot_load_seconds": loaded - start,
+            "replay_seconds": done - loaded
+        }
+
+    def snapshot(self) -> int:
+        """
+        Write a snapshot now and drop the journal segments it covers.
+        Returns the seq the snapshot is current up to.
+        """
+        with self._snapshot_lock:
+            state, seq = self.store.export_state(self.journal)
+            tmp_path = self.snapshot_path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"seq": seq, "state": state}, f, separators=(",", ":"))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.snapshot_path)
+            self.last_snapshot_seq = seq
+            if self.journal:
+                self.journal.prune(seq)
+            return seq
+
+    def start(self):
+        """
+        Kick off the background thread that takes periodic snapshots.
+        """
+        self._snapshotter = threading.Thread(target=self._snapshot_loop, name="store-snapshotter", daemon=True)
+        self._snapshotter.start()
+
+    def _snapshot_loop(self):
+        while not self._stop.wait(self.check_interval):
+            if self.journal and self.journal.last_seq - self.last_snapshot_seq >= self.snapshot_every:
+                self.snapshot()
+
+    def close(self):
+        """
+        Clean shutdown: snapshot so the next startup has nothing to replay,
+        then flush and close the journal.
+        """
+        self._stop.set()
+        if self._snapshotter:
+            self._snapshotter.join()
+        if self.journal:
+            self.snapshot()
+            self.store.attach_journal(None)
+            self.journal.close()
+            self.journal = None
+
+    def stats(self) -> Dict:
+        return {
+            "last_snapshot_seq": self.last_snapshot_seq,
+            "journal": self.journal.stats() if self.journal else None
+        }
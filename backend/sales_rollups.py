@@ -0,0 +1,192 @@
+from typing import Callable, Dict, List, Optional, Tuple
+
+# bucket widths in seconds. buckets are aligned to the unix epoch, so days are UTC days
+RESOLUTIONS = {"minute": 60, "hour": 3600, "day": 86400}
+GROUP_BY = ("time", "product", "category")
+
+# how long buckets are kept, in seconds. None = forever.
+# a day bucket is a handful of dicts, so those stay.
+RETENTION = {"minute": 2 * 86400, "hour": 90 * 86400, "day": None}
+
+# a query walks every bucket in its range, this keeps that bounded
+MAX_QUERY_BUCKETS = 10_000
+
+# (item_id, quantity, unit price in cents, category) for one order line
+SaleLine = Tuple[int, int, int, str]
+
+def bucket_start(timestamp: float, width: int) -> int:
+    return int(timestamp // width) * width
+
+def query_buckets(start: float, end: float, resolution: str) -> range:
+    """
+    Start times of every bucket overlapping [start, end).
+    Raises ValueError for a bad resolution or an oversized range.
+    """
+    width = RESOLUTIONS.get(resolution)
+    if width is None:
+        raise ValueError(f"Unknown resolution '{resolution}', expected one of {', '.join(RESOLUTIONS)}")
+    if end <= start:
+        raise ValueError("end must be after start")
+    # end is exclusive, so a bucket starting exactly at end isn't included
+    buckets = range(bucket_start(start, width), int(-(-end // width)) * width, width)
+    if len(buckets) > MAX_QUERY_BUCKETS:
+        raise ValueError(f"Range covers {len(buckets)} {resolution} buckets, the limit is {MAX_QUERY_BUCKETS}")
+    return buckets
+
+class Bucket:
+    """
+    Sales totals for one time bucket, overall and per product/category.
+    Per-line money is kept in integer cents (quantity, gross_cents).
+    """
+    __slots__ = ("orders", "items", "gross", "final", "discount", "products", "categories")
+
+    def __init__(self):
+        self.orders: int = 0
+        self.items: int = 0
+        self.gross: float = 0.0
+        self.final: float = 0.0
+        self.discount: float = 0.0
+        self.products: Dict[int, List[int]] = {}
+        self.categories: Dict[str, List[int]] = {}
+
+    def add(self, lines: List[SaleLine], gross: float, final: float, discount: float):
+        self.orders += 1
+        self.gross += gross
+        self.final += final
+        self.discount += discount
+        for item_id, quantity, unit_cents, category in lines:
+            self.items += quantity
+            product = self.products.get(item_id)
+            if product is None:
+                product = self.products[item_id] = [0, 0]
+            product[0] += quantity
+            product[1] += quantity * unit_cents
+            per_category = self.categories.get(category)
+            if per_category is None:
+                per_category = self.categories[category] = [0, 0]
+            per_category[0] += quantity
+            per_category[1] += quantity * unit_cents
+
+    def to_state(self) -> List:
+        return [self.orders, self.items, self.gross, self.final, self.discount,
+                [[k, *v] for k, v in self.products.items()], [[k, *v] for k, v in self.categories.items()]]
+
+    @classmethod
+    def from_state(cls, row: List) -> "Bucket":
+        bucket = cls()
+        bucket.orders, bucket.items, bucket.gross, bucket.final, bucket.discount, products, categories = row
+        bucket.products = {item_id: [quantity, cents] for item_id, quantity, cents in products}
+        bucket.categories = {name: [quantity, cents] for name, quantity, cents in categories}
+        return bucket
+
+def time_row(start: int, orders: int, items: int, gross: float, final: float, discount: float) -> Dict:
+    return {
+        "start": start,
+        "orders": orders,
+        "items": items,
+        "gross_amount": gross,
+        "purchase_amount": final,
+        "discount_amount": discount
+    }
+
+def group_rows(key: str, totals: Dict, name_of: Optional[Callable[[int], Optional[str]]] = None) -> List[Dict]:
+    """
+    {key value: [quantity, gross_cents]} as rows, best sellers first.
+    """
+    rows = []
+    for value, (quantity, cents) in totals.items():
+        row = {key: value, "quantity": quantity, "gross_amount": cents / 100}
+        if name_of is not None:
+            row["name"] = name_of(value)
+        rows.append(row)
+    rows.sort(key=lambda row: (-row["gross_amount"], str(row[key])))
+    return rows
+
+class SalesRollups:
+    """
+    Pre-aggregated sales for the admin analytics, in minute, hour and
+    day buckets.
+
+    checkout adds each order to the three buckets its timestamp falls in,
+    so a range query looks up one dict entry per bucket in the range and
+    never touches the orders themselves. Product and category totals are
+    kept per bucket too, so "best sellers this week" is the same walk.
+
+    Old minute/hour buckets are dropped as new ones start (see RETENTION).
+    Not thread-safe, the store calls it under its shared lock.
+    """
+    def __init__(self):
+        # resolution -> {bucket start: Bucket}, in the order buckets were started
+        self.buckets: Dict[str, Dict[int, Bucket]] = {name: {} for name in RESOLUTIONS}
+
+    def record(self, created_at: float, lines: List[SaleLine], gross: float, final: float, discount: float):
+        for resolution, width in RESOLUTIONS.items():
+            buckets = self.buckets[resolution]
+            start = bucket_start(created_at, width)
+            bucket = buckets.get(start)
+            if bucket is None:
+                bucket = buckets[start] = Bucket()
+                self._expire(resolution, start)
+            bucket.add(lines, gross, final, discount)
+
+    def _expire(self, resolution: str, newest: int):
+        keep = RETENTION[resolution]
+        if keep is None:
+            return
+        buckets = self.buckets[resolution]
+        cutoff = newest - keep
+        # buckets are nearly always started in time order, so the old ones are at the front
+        while buckets:
+            oldest = next(iter(buckets))
+            if oldest >= cutoff:
+                break
+            del buckets[oldest]
+
+    def query(self, start: float, end: float, resolution: str, group_by: str,
+              name_of: Optional[Callable[[int], Optional[str]]] = None) -> List[Dict]:
+        """
+        Rows for [start, end). group_by "time" gives one row per bucket
+        (empty ones included), "product"/"category" sums the range.
+        """
+        if group_by not in GROUP_BY:
+            raise ValueError(f"Unknown group_by '{group_by}', expected one of {', '.join(GROUP_BY)}")
+        starts = query_buckets(start, end, resolution)
+        buckets = self.buckets[resolution]
+        if group_by == "time":
+            rows = []
+            for when in starts:
+                bucket = buckets.get(when)
+                if bucket is None:
+                    rows.append(time_row(when, 0, 0, 0.0, 0.0, 0.0))
+                else:
+                    rows.append(time_row(when, bucket.orders, bucket.items,
+                                         bucket.gross, bucket.final, bucket.discount))
+            return rows
+        totals: Dict = {}
+        for when in starts:
+            bucket = buckets.get(when)
+            if bucket is None:
+                continue
+            for key, (quantity, cents) in (bucket.products if group_by == "product" else bucket.categories).items():
+                total = totals.get(key)
+                if total is None:
+                    totals[key] = [quantity, cents]
+                else:
+                    total[0] += quantity
+                    total[1] += cents
+        if group_by == "product":
+            return group_rows("item_id", totals, name_of)
+        return group_rows("category", totals)
+
+    def to_state(self) -> Dict:
+        return {
+            resolution: [[start, *bucket.to_state()] for start, bucket in buckets.items()]
+            for resolution, buckets in self.buckets.items()
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict) -> "SalesRollups":
+        rollups = cls()
+        for resolution, rows in state.items():
+            rollups.buckets[resolution] = {row[0]: Bucket.from_state(row[1:]) for row in rows}
+        return rollups
@@ -0,0 +1,720 @@
+"""
+Hash-sharded memory backend, for using more than one core.
+
+One InMemoryStore tops out at one core (the GIL), and more uvicorn
+workers with SHARED_STATE_DIR only share the order counter and codes,
+each worker still has its own carts. Here the per-user state is split
+instead:
+
+- N shard processes, each an InMemoryStore holding the carts and orders
+  of the users whose id hashes to it (crc32(user_id) % N, the same in
+  every process). Each runs its own event pipeline for its own orders.
+- one owner process holding what has to be global: the order sequence
+  and discount codes (a LocalRegistry) and the stock (an Inventory).
+  Shards reach it through RemoteRegistry / RemoteInventory, which stand
+  in for the local ones.
+- the router, ShardedStore, which is what main.py uses when
+  STORE_BACKEND=sharded. It keeps the catalog itself (reads never leave
+  the process), sends catalog changes to every shard and stock to the
+  owner, forwards each cart/checkout/history call to the user's shard,
+  and merges the admin views (stats, rollups, export) from all of them.
+
+Everything talks over Unix sockets in one directory: a 4-byte length and
+a pickle each way, a connection per calling thread, a thread per
+connection on the serving side. Pickle trusts whoever is on the other
+end, so the directory must only be writable by the app's user.
+
+Not covered: journaling (JOURNAL_DIR is memory backend only) and the
+audit trail, the shards don't write one.
+
+    python -m sharding --dir /tmp/shop-shards --shards 4
+
+starts a cluster on its own, for several uvicorn workers to share
+(SHARD_SPAWN=0). By default the router starts one itself.
+"""
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from collections.abc import Iterator as IteratorABC
+from functools import reduce
+from itertools import chain, count
+from operator import itemgetter
+import argparse
+import heapq
+import os
+import pickle
+import shutil
+import signal
+import socket
+import socketserver
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from models import Item, Order, Cart, CartOperation, PricedCart
+from locks import StripedLock, lock_owner
+from storage import RECENT_DISCOUNT_CODES, Storage
+from shared_state import LocalRegistry
+from inventory import Inventory
+from catalog_feed import FeedDetails
+from sales_rollups import group_rows
+
+_LENGTH = struct.Struct("!I")
+
+class ShardError(RuntimeError):
+    """
+    Something other than a ValueError went wrong on the other side.
+    """
+
+def owner_path(directory: str) -> str:
+    return os.path.join(directory, "owner.sock")
+
+def shard_path(directory: str, index: int) -> str:
+    return os.path.join(directory, f"shard-{index}.sock")
+
+def shard_of(user_id: str, shards: int) -> int:
+    # not hash(), that's salted per process
+    return zlib.crc32(user_id.encode()) % shards
+
+def _send(sock: socket.socket, message):
+    data = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+    sock.sendall(_LENGTH.pack(len(data)) + data)
+
+def _receive(rfile):
+    header = rfile.read(_LENGTH.size)
+    if len(header) < _LENGTH.size:
+        raise EOFError("connection closed")
+    data = rfile.read(_LENGTH.unpack(header)[0])
+    return pickle.loads(data)
+
+class _IteratorRef:
+    # stands in for an iterator in a reply, the caller pulls it item by item
+    def __init__(self, token: int):
+        self.token = token
+
+class _Service:
+    """
+    The serving side: runs `method` (a dotted attribute path, so
+    "events.wait_idle" works) on the target. Iterators in a reply, on
+    their own or in a tuple, stay here and are handed out an item per
+    "rpc.next" (export_orders gives one of those).
+    """
+    def __init__(self, target):
+        self.target = target
+        self._iterators: Dict[int, Iterator] = {}
+        self._tokens = count(1)
+        self._lock = threading.Lock()
+
+    def _resolve(self, path: str):
+        return reduce(getattr, path.split("."), self.target)
+
+    def _wrap(self, value):
+        if isinstance(value, tuple):
+            return tuple(self._wrap(part) for part in value)
+        if isinstance(value, IteratorABC):
+            with self._lock:
+                token = next(self._tokens)
+                self._iterators[token] = value
+            return _IteratorRef(token)
+        return value
+
+    def call(self, method: str, args: tuple):
+        if method == "rpc.next":
+            iterator = self._iterators.get(args[0])
+            if iterator is None:
+                return False, None
+            try:
+                return True, next(iterator)
+            except StopIteration:
+                self._iterators.pop(args[0], None)
+                return False, None
+        if method == "rpc.drop":
+            self._iterators.pop(args[0], None)
+            return None
+        if method == "rpc.get":
+            return self._resolve(args[0])
+        if method == "rpc.set":
+            parent, _, name = args[0].rpartition(".")
+            setattr(self._resolve(parent) if parent else self.target, name, args[1])
+            return None
+        return self._wrap(self._resolve(method)(*args))
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        service = self.server.service
+        while True:
+            try:
+                method, args = _receive(self.rfile)
+            except (EOFError, ConnectionError):
+                return
+            try:
+                reply = (True, service.call(method, args))
+            except Exception as e:
+                reply = (False, (type(e).__name__, str(e)))
+            try:
+                _send(self.request, reply)
+            except OSError:
+                return
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def serve(path: str, target):
+    """
+    Serve `target` on a Unix socket at `path` until SIGTERM or Ctrl-C.
+    """
+    if os.path.exists(path):
+        os.unlink(path)
+    server = _Server(path, _Handler)
+    server.service = _Service(target)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(path):
+            os.unlink(path)
+
+class ShardClient:
+    """
+    Calls into one shard (or the owner). Thread-safe: every thread gets
+    its own connection, so calls from different threads don't queue
+    behind each other here.
+    ValueErrors come back as ValueErrors (bad requests, out of stock),
+    anything else as ShardError.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._connections: List[socket.socket] = []
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(self.path)
+            connection = self._local.connection = (sock, sock.makefile("rb"))
+            with self._lock:
+                self._connections.append(sock)
+        return connection
+
+    def call(self, method: str, *args):
+        sock, rfile = self._connection()
+        try:
+            _send(sock, (method, args))
+            ok, value = _receive(rfile)
+        except (OSError, EOFError) as e:
+            # not retried, the call may have happened. next call reconnects
+            self._local.connection = None
+            sock.close()
+            raise ShardError(f"{self.path}: {e}") from e
+        if not ok:
+            name, message = value
+            if name == "ValueError":
+                raise ValueError(message)
+            raise ShardError(f"{name}: {message}")
+        return self._unwrap(value)
+
+    def _unwrap(self, value):
+        if isinstance(value, tuple):
+            return tuple(self._unwrap(part) for part in value)
+        if isinstance(value, _IteratorRef):
+            return _RemoteIterator(self, value.token)
+        return value
+
+    def close(self):
+        with self._lock:
+            for sock in self._connections:
+                sock.close()
+            self._connections.clear()
+
+class _RemoteIterator:
+    def __init__(self, client: ShardClient, token: int):
+        self.client = client
+        self.token = token
+        self.done = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.done:
+            raise StopIteration
+        more, item = self.client.call("rpc.next", self.token)
+        if not more:
+            self.done = True
+            raise StopIteration
+        return item
+
+    def close(self):
+        # so an abandoned export doesn't stay behind on the shard
+        if not self.done:
+            self.done = True
+            self.client.call("rpc.drop", self.token)
+
+class Owner:
+    """
+    The global pieces, in the owner process. The registry is locked here
+    because LocalRegistry leaves that to its caller, and the shards'
+    locks don't cover each other. The Inventory has its own item locks.
+    """
+    def __init__(self, lock_stripes: int = 64):
+        self._lock = threading.Lock()
+        self.registry = LocalRegistry()
+        self.inventory = Inventory(lock_stripes)
+
+    def registry_call(self, method: str, *args):
+        with self._lock:
+            return getattr(self.registry, method)(*args)
+
+    def reset(self):
+        with self._lock:
+            self.registry = LocalRegistry()
+        self.inventory.load({})
+
+class RemoteRegistry:
+    """
+    A shard's registry: the owner's LocalRegistry, over the socket.
+    `shared` like SharedRegistry, the shard doesn't own the codes.
+    """
+    shared = True
+
+    def __init__(self, owner: ShardClient):
+        self.owner = owner
+
+    def next_order_number(self) -> int:
+        return self.owner.call("registry_call", "next_order_number")
+
+    def current_order_count(self) -> int:
+        return self.owner.call("registry_call", "current_order_count")
+
+    def add_code(self, code: str):
+        self.owner.call("registry_call", "add_code", code)
+
+    def consume_code(self, code: str) -> bool:
+        return self.owner.call("registry_call", "consume_code", code)
+
+    def is_valid_code(self, code: str) -> bool:
+        return self.owner.call("registry_call", "is_valid_code", code)
+
+    def live_codes(self) -> List[str]:
+        return self.owner.call("registry_call", "live_codes")
+
+    def live_code_count(self) -> int:
+        return self.owner.call("registry_call", "live_code_count")
+
+    def restore(self, order_count: int, codes: List[str]):
+        self.owner.call("registry_call", "restore", order_count, codes)
+
+    def close(self):
+        pass
+
+class RemoteInventory:
+    """
+    A shard's inventory: the owner's, over the socket. Stock is global, a
+    user on one shard and a user on another buy from the same on_hand.
+    Catalog-driven changes (load, set_stock, remove) do nothing here, the
+    router sends those to the owner once rather than once per shard.
+    """
+    def __init__(self, owner: ShardClient):
+        self.owner = owner
+        # nothing takes it, the item locks are in the owner. lock_stats wants one
+        self._locks = StripedLock(1)
+
+    def load(self, stock: Dict[int, int]):
+        pass
+
+    def set_stock(self, item_id: int, quantity: int):
+        pass
+
+    def remove(self, item_id: int):
+        pass
+
+    @property
+    def rejected(self) -> int:
+        return self.owner.call("rpc.get", "inventory.rejected")
+
+    def level(self, item_id: int) -> Tuple[int, int]:
+        return self.owner.call("inventory.level", item_id)
+
+    def available(self, item_id: int, user_id: Optional[str] = None) -> int:
+        return self.owner.call("inventory.available", item_id, user_id)
+
+    def reserve(self, user_id: str, quantities: Dict[int, int], ttl: float):
+        self.owner.call("inventory.reserve", user_id, quantities, ttl)
+
+    def release(self, user_id: str, item_ids: Iterable[int]):
+        self.owner.call("inventory.release", user_id, list(item_ids))
+
+    def commit(self, user_id: str, quantities: Dict[int, int]):
+        self.owner.call("inventory.commit", user_id, quantities)
+
+    def uncommit(self, user_id: str, quantities: Dict[int, int], ttl: float = 0):
+        self.owner.call("inventory.uncommit", user_id, quantities, ttl)
+
+def start_cluster(directory: str, shards: int, lock_stripes: int = 64, timeout: float = 30.0) -> List[subprocess.Popen]:
+    """
+    Start the owner and `shards` shard processes serving from `directory`,
+    and wait until they all accept connections. Owner first in the list.
+    """
+    os.makedirs(directory, exist_ok=True)
+    here = os.path.dirname(os.path.abspath(__file__))
+    base = [sys.executable, "-m", "sharding", "--dir", directory, "--lock-stripes", str(lock_stripes)]
+    processes = [subprocess.Popen([*base, "--role", "owner"], cwd=here)]
+    try:
+        _wait_for(owner_path(directory), processes[0], timeout)
+        for index in range(shards):
+            processes.append(subprocess.Popen([*base, "--role", "shard", "--index", str(index)], cwd=here))
+        for index, process in enumerate(processes[1:]):
+            _wait_for(shard_path(directory, index), process, timeout)
+    except BaseException:
+        stop_cluster(processes)
+        raise
+    return processes
+
+def _wait_for(path: str, process: subprocess.Popen, timeout: float):
+    deadline = time.monotonic() + timeout
+    while True:
+        if process.poll() is not None:
+            raise ShardError(f"{path}: process exited with {process.returncode}")
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.connect(path)
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise ShardError(f"{path}: not up after {timeout:g}s")
+            time.sleep(0.05)
+
+def stop_cluster(processes: List[subprocess.Popen]):
+    # shards first, they hand their last events to the owner on the way out
+    for group in (processes[1:], processes[:1]):
+        for process in group:
+            if process.poll() is None:
+                process.terminate()
+        for process in group:
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+class ShardEvents:
+    """
+    store.events for the router. Each shard's pipeline starts with the
+    shard and handles that shard's orders, so start() has nothing to do,
+    close() waits for them to drain and stats() adds them up.
+    """
+    def __init__(self, shards: List[ShardClient]):
+        self.shards = shards
+
+    @property
+    def capacity(self) -> int:
+        return self.shards[0].call("rpc.get", "events.capacity")
+
+    @capacity.setter
+    def capacity(self, capacity: int):
+        for shard in self.shards:
+            shard.call("rpc.set", "events.capacity", capacity)
+
+    @property
+    def depth(self) -> int:
+        return sum(shard.call("rpc.get", "events.depth") for shard in self.shards)
+
+    def start(self):
+        pass
+
+    def wait_idle(self, timeout: Optional[float] = None) -> bool:
+        return all([shard.call("events.wait_idle", timeout) for shard in self.shards])
+
+    def close(self):
+        self.wait_idle()
+
+    def stats(self) -> Dict:
+        parts = [shard.call("events.stats") for shard in self.shards]
+        merged = {key: sum(part[key] for part in parts) for key in parts[0] if key not in ("running", "last_error")}
+        merged["max_depth"] = max(part["max_depth"] for part in parts)
+        merged["running"] = all(part["running"] for part in parts)
+        merged["last_error"] = next((part["last_error"] for part in parts if part["last_error"]), None)
+        merged["shards"] = parts
+        return merged
+
+class ShardedStore(Storage):
+    """
+    The router: a Storage whose carts and orders live in shard processes
+    (see the top of this module). Every call is a socket round trip, so
+    blocking_io is on and the async routes run it on a worker thread.
+
+    With `spawn` it starts the owner and shards itself, in `directory`
+    (a temporary one if None), and stops them on close(). Otherwise it
+    joins a cluster started with `python -m sharding` in that directory,
+    which is how several uvicorn workers share one.
+    """
+    blocking_io = True
+
+    def __init__(self, directory: Optional[str] = None, shards: int = 4, spawn: bool = True, lock_stripes: int = 64):
+        super().__init__()
+        self._temporary = directory is None
+        self.directory = directory or tempfile.mkdtemp(prefix="shards-")
+        self._processes = start_cluster(self.directory, shards, lock_stripes) if spawn else []
+        self.owner = ShardClient(owner_path(self.directory))
+        self.shards = [ShardClient(shard_path(self.directory, index)) for index in range(shards)]
+        self.events = ShardEvents(self.shards)
+        self._reservation_seconds: float = 0
+
+    def _shard(self, user_id: str) -> ShardClient:
+        return self.shards[shard_of(user_id, len(self.shards))]
+
+    def _everywhere(self, method: str, *args) -> List:
+        return [shard.call(method, *args) for shard in self.shards]
+
+    @property
+    def reservation_seconds(self) -> float:
+        return self._reservation_seconds
+
+    @reservation_seconds.setter
+    def reservation_seconds(self, seconds: float):
+        # the shards do the reserving
+        self._reservation_seconds = seconds
+        for shard in self.shards:
+            shard.call("rpc.set", "reservation_seconds", seconds)
+
+    def reset(self):
+        self.reset_catalog()
+        self.owner.call("reset")
+        self._everywhere("reset")
+
+    # the catalog is kept here for reads, and copied to every shard for
+    # cart prices. stock goes to the owner
+
+    @lock_owner
+    def load_catalog(self, items: Iterable[Item], details: Optional[FeedDetails] = None):
+        items = list(items)
+        super().load_catalog(items, details)
+        self._everywhere("load_catalog", items)
+        self.owner.call("inventory.load", {item.id: item.stock for item in items})
+
+    @lock_owner
+    def upsert_item(self, item: Item):
+        super().upsert_item(item)
+        self._everywhere("upsert_item", item)
+        self.owner.call("inventory.set_stock", item.id, item.stock)
+
+    @lock_owner
+    def remove_item(self, item_id: int):
+        super().remove_item(item_id)
+        self._everywhere("remove_item", item_id)
+        self.owner.call("inventory.remove", item_id)
+
+    @lock_owner
+    def apply_catalog_delta(self, upserts: List[Item], deletes: List[int]) -> int:
+        deleted = super().apply_catalog_delta(upserts, deletes)
+        self._everywhere("apply_catalog_delta", upserts, deletes)
+        for item_id in deletes:
+            self.owner.call("inventory.remove", item_id)
+        for item in upserts:
+            self.owner.call("inventory.set_stock", item.id, item.stock)
+        return deleted
+
+    def stock_level(self, item_id: int) -> Dict:
+        if item_id not in self.items:
+            raise ValueError(f"Item {item_id} not found")
+        on_hand, available = self.owner.call("inventory.level", item_id)
+        return {"item_id": item_id, "on_hand": on_hand, "reserved": on_hand - available, "available": available}
+
+    # one user, one shard
+
+    def get_cart(self, user_id: str) -> Cart:
+        return self._shard(user_id).call("get_cart", user_id)
+
+    def get_priced_cart(self, user_id: str) -> PricedCart:
+        return self._shard(user_id).call("get_priced_cart", user_id)
+
+    def get_cart_data(self, user_id: str, priced: bool = False) -> Dict:
+        return self._shard(user_id).call("get_cart_data", user_id, priced)
+
+    def add_to_cart(self, user_id: str, item_id: int, quantity: int):
+        self._shard(user_id).call("add_to_cart", user_id, item_id, quantity)
+
+    def remove_from_cart(self, user_id: str, item_id: int):
+        self._shard(user_id).call("remove_from_cart", user_id, item_id)
+
+    def apply_cart_batch(self, user_id: str, operations: List[CartOperation]) -> Cart:
+        return self._shard(user_id).call("apply_cart_batch", user_id, operations)
+
+    def checkout(self, user_id: str, discount_code: Optional[str] = None) -> Order:
+        return self._shard(user_id).call("checkout", user_id, discount_code)
+
+    def _order_page(self, user_id: str, before_id: Optional[int], limit: int) -> Tuple[List[Dict], bool]:
+        return self._shard(user_id).call("_order_page", user_id, before_id, limit)
+
+    # global, from the owner
+
+    def generate_discount_code(self) -> Optional[str]:
+        # the nth order could be on any shard, and that shard's consumer issues the code
+        for code in self._everywhere("generate_discount_code"):
+            if code:
+                return code
+        return None
+
+    def _apply_events(self, events: List[Dict], applied: List[Tuple[Dict, Optional[str]]]):
+        # never called, nothing is published here. each shard applies its own
+        pass
+
+    def add_discount_code(self, code: str):
+        self.owner.call("registry_call", "add_code", code)
+
+    def validate_discount_code(self, code: str) -> bool:
+        return self.owner.call("registry_call", "is_valid_code", code)
+
+    @property
+    def order_count(self) -> int:
+        return self.owner.call("registry_call", "current_order_count")
+
+    # everything, merged from every shard
+
+    def get_order(self, order_id: int) -> Dict:
+        # the id doesn't say which user (so shard) it belongs to
+        for shard in self.shards:
+            try:
+                return shard.call("get_order", order_id)
+            except ValueError:
+                continue
+        raise ValueError("Order not found")
+
+    def export_orders(self, since_id: int = 0, batch_size: int = 1000) -> Tuple[int, Iterator[List[Dict]]]:
+        # a shard takes an order id and appends the order under one lock, so
+        # every id handed out by now is in the shard's export once it's asked
+        # after this read. later ones are cut off, whichever shard has them
+        upto = self.order_count
+        parts = [shard.call("export_orders", since_id, batch_size)[1] for shard in self.shards]
+        return max(upto, since_id), self._merged_batches(parts, upto, batch_size)
+
+    @staticmethod
+    def _merged_batches(parts: List[_RemoteIterator], upto: int, batch_size: int) -> Iterator[List[Dict]]:
+        try:
+            batch = []
+            # each shard's orders come oldest first, so a merge keeps the id order
+            for order in heapq.merge(*(chain.from_iterable(part) for part in parts), key=itemgetter("id")):
+                if order["id"] > upto:
+                    break
+                batch.append(order)
+                if len(batch) == batch_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+        finally:
+            for part in parts:
+                part.close()
+
+    def get_stats(self) -> Dict:
+        parts = self._everywhere("get_stats")
+        return {
+            key: [code for part in parts for code in part[key]][-RECENT_DISCOUNT_CODES:] if key == "discount_codes"
+            else sum(part[key] for part in parts)
+            for key in parts[0]
+        }
+
+    def stats_version(self) -> int:
+        return sum(self._everywhere("stats_version"))
+
+    def verify_stats(self) -> Dict:
+        mismatches = {}
+        for index, result in enumerate(self._everywhere("verify_stats")):
+            if not result["consistent"]:
+                mismatches[f"shard-{index}"] = result["mismatches"]
+        return {"consistent": not mismatches, "mismatches": mismatches}
+
+    def sales_rollup(self, start: float, end: float, resolution: str, group_by: str) -> List[Dict]:
+        parts = self._everywhere("sales_rollup", start, end, resolution, group_by)
+        if group_by == "time":
+            # same buckets from every shard, in the same order
+            return [
+                {key: row[key] if key == "start" else sum(rows[i][key] for rows in parts) for key in row}
+                for i, row in enumerate(parts[0])
+            ]
+        key = "item_id" if group_by == "product" else "category"
+        totals: Dict = {}
+        for rows in parts:
+            for row in rows:
+                total = totals.setdefault(row[key], [0, 0])
+                total[0] += row["quantity"]
+                total[1] += round(row["gross_amount"] * 100)
+        return group_rows(key, totals, self._product_name if key == "item_id" else None)
+
+    def lock_stats(self) -> Dict:
+        return {
+            "catalog_lock": self._catalog_lock.stats(),
+            "async_fallbacks": self.async_fallbacks,
+            "shards": self._everywhere("lock_stats"),
+        }
+
+    def gauges(self) -> Dict[str, int]:
+        parts = self._everywhere("gauges")
+        merged = {key: sum(part[key] for part in parts) for key in parts[0]}
+        merged["live_discount_codes"] = self.owner.call("registry_call", "live_code_count")
+        return merged
+
+    def counters(self) -> Dict[str, int]:
+        parts = self._everywhere("counters")
+        merged = {key: sum(part[key] for part in parts) for key in parts[0]}
+        merged["async_fallbacks"] = self.async_fallbacks
+        merged["stock_rejections"] = self.owner.call("rpc.get", "inventory.rejected")
+        return merged
+
+    def evict_carts(self, idle_seconds: float, max_carts: int, now: Optional[float] = None) -> Dict:
+        # users are spread evenly, so each shard gets an even share of the cap
+        per_shard = max(1, max_carts // len(self.shards))
+        parts = self._everywhere("evict_carts", idle_seconds, per_shard, now)
+        return {key: sum(part[key] for part in parts) for key in parts[0]}
+
+    def close(self):
+        for client in [self.owner, *self.shards]:
+            client.close()
+        if self._processes:
+            stop_cluster(self._processes)
+            self._processes = []
+            if self._temporary:
+                shutil.rmtree(self.directory, ignore_errors=True)
+        self._set_details(None)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the owner and shard processes for STORE_BACKEND=sharded.")
+    parser.add_argument("--dir", required=True, help="where the sockets go (SHARD_DIR)")
+    parser.add_argument("--shards", type=int, default=4)
+    parser.add_argument("--lock-stripes", type=int, default=64)
+    parser.add_argument("--role", choices=["cluster", "owner", "shard"], default="cluster")
+    parser.add_argument("--index", type=int, default=0, help="which shard, with --role shard")
+    args = parser.parse_args()
+
+    if args.role == "owner":
+        serve(owner_path(args.dir), Owner(args.lock_stripes))
+    elif args.role == "shard":
+        from store import InMemoryStore
+        owner = ShardClient(owner_path(args.dir))
+        store = InMemoryStore(args.lock_stripes, registry=RemoteRegistry(owner), inventory=RemoteInventory(owner))
+        store.events.start()
+        try:
+            serve(shard_path(args.dir, args.index), store)
+        finally:
+            store.events.close()
+    else:
+        processes = start_cluster(args.dir, args.shards, args.lock_stripes)
+        print(f"owner + {args.shards} shards serving in {args.dir}, Ctrl-C to stop", flush=True)
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        try:
+            while all(process.poll() is None for process in processes):
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            stop_cluster(processes)
+
+if __name__ == "__main__":
+    # through the module, so what gets pickled is sharding.X and not __main__.X
+    import sharding
+    sharding.main()
@@ -0,0 +1,183 @@
+from typing import Dict, List
+import fcntl
+import mmap
+import os
+import sqlite3
+import struct
+import threading
+from models import DiscountCode
+
+class LocalRegistry:
+    """
+    Order counter + discount codes for a single process.
+    This is what InMemoryStore always did, just pulled out so it can be
+    swapped for SharedRegistry. Callers hold the store's shared lock.
+    """
+    shared = False
+
+    def __init__(self):
+        self.order_count: int = 0
+        self.discount_codes: Dict[str, DiscountCode] = {}
+
+    def next_order_number(self) -> int:
+        self.order_count += 1
+        return self.order_count
+
+    def current_order_count(self) -> int:
+        return self.order_count
+
+    def add_code(self, code: str):
+        self.discount_codes[code] = DiscountCode(code=code)
+
+    def consume_code(self, code: str) -> bool:
+        """
+        Use up a code. False if it doesn't exist or was already used.
+        """
+        # requirements said code can be used once.
+        # easiest way to enforce that is to just delete it after use.
+        if code in self.discount_codes and self.discount_codes[code].is_valid:
+            del self.discount_codes[code]
+            return True
+        return False
+
+    def is_valid_code(self, code: str) -> bool:
+        return code in self.discount_codes and self.discount_codes[code].is_valid
+
+    def live_codes(self) -> List[str]:
+        return [c.code for c in self.discount_codes.values() if c.is_valid]
+
+    def live_code_count(self) -> int:
+        # used codes are deleted, so everything in here is live
+        return len(self.discount_codes)
+
+    def restore(self, order_count: int, codes: List[str]):
+        self.order_count = order_count
+        self.discount_codes = {code: DiscountCode(code=code) for code in codes}
+
+    def close(self):
+        pass
+
+class _FileLock:
+    # thread lock first, then flock. released in reverse.
+    def __init__(self, fd: int, thread_lock: threading.Lock, op: int):
+        self._fd = fd
+        self._thread_lock = thread_lock
+        self._op = op
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        try:
+            fcntl.flock(self._fd, self._op)
+        except BaseException:
+            self._thread_lock.release()
+            raise
+
+    def __exit__(self, exc_type, exc, tb):
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._thread_lock.release()
+
+class SharedCounter:
+    """
+    64-bit counter in a memory-mapped file, shared by every process on
+    the host that opens the same path.
+
+    flock keeps other processes out, the thread lock keeps other threads of
+    this process out (flock is per open file, so it doesn't do that).
+    An increment is two uncontended syscalls plus a memory write.
+    """
+    def __init__(self, path: str):
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        if os.fstat(self._fd).st_size < 8:
+            os.ftruncate(self._fd, 8)
+        self._map = mmap.mmap(self._fd, 8)
+        self._thread_lock = threading.Lock()
+
+    def _locked(self, op: int):
+        return _FileLock(self._fd, self._thread_lock, op)
+
+    def increment(self) -> int:
+        with self._locked(fcntl.LOCK_EX):
+            value = struct.unpack_from("<q", self._map)[0] + 1
+            struct.pack_into("<q", self._map, 0, value)
+            return value
+
+    def value(self) -> int:
+        with self._locked(fcntl.LOCK_SH):
+            return struct.unpack_from("<q", self._map)[0]
+
+    def set(self, value: int):
+        with self._locked(fcntl.LOCK_EX):
+            struct.pack_into("<q", self._map, 0, value)
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+class SharedRegistry:
+    """
+    Order counter + discount codes shared by every worker process on one host
+    (uvicorn --workers N), so there's one global nth-order sequence and a code
+    can only ever be used once, whichever worker sees it.
+
+    - the counter is a SharedCounter, since every checkout touches it
+    - codes live in a small SQLite table. they're only touched when a code
+      is issued, checked or used, and a DELETE that reports whether it hit
+      a row is an atomic use-once across processes.
+
+    Both files sit in `directory` and survive restarts.
+    """
+    shared = True
+
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self.counter = SharedCounter(os.path.join(directory, "order_counter"))
+        self._conn = sqlite3.connect(
+            os.path.join(directory, "discount_codes.db"), check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS discount_codes (code TEXT PRIMARY KEY) WITHOUT ROWID")
+        self._conn_lock = threading.Lock()
+
+    def next_order_number(self) -> int:
+        return self.counter.increment()
+
+    def current_order_count(self) -> int:
+        return self.counter.value()
+
+    def add_code(self, code: str):
+        with self._conn_lock:
+            self._conn.execute("INSERT OR IGNORE INTO discount_codes (code) VALUES (?)", (code,))
+
+    def consume_code(self, code: str) -> bool:
+        with self._conn_lock:
+            return self._conn.execute("DELETE FROM discount_codes WHERE code = ?", (code,)).rowcount == 1
+
+    def is_valid_code(self, code: str) -> bool:
+        with self._conn_lock:
+            return self._conn.execute("SELECT 1 FROM discount_codes WHERE code = ?", (code,)).fetchone() is not None
+
+    def live_codes(self) -> List[str]:
+        with self._conn_lock:
+            return [row[0] for row in self._conn.execute("SELECT code FROM discount_codes")]
+
+    def live_code_count(self) -> int:
+        with self._conn_lock:
+            return self._conn.execute("SELECT COUNT(*) FROM discount_codes").fetchone()[0]
+
+    def restore(self, order_count: int, codes: List[str]):
+        # the files are the source of truth and already survive restarts,
+        # a per-process snapshot mustn't roll them back
+        pass
+
+    def clear(self):
+        """
+        Reset the counter and drop every code. Only for tests/benchmarks.
+        """
+        self.counter.set(0)
+        with self._conn_lock:
+            self._conn.execute("DELETE FROM discount_codes")
+
+    def close(self):
+        self.counter.close()
+        self._conn.close()
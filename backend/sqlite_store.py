@@ -0,0 +1,786 @@
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from contextlib import contextmanager
+import json
+import queue
+import sqlite3
+import threading
+import time
+from models import Item, Order, Cart, CartItem, CartOperation, PricedCart
+from carts import check_cart_ops
+from storage import RECENT_DISCOUNT_CODES, Storage, StatsAccumulator
+from catalog_feed import FeedDetails
+from events import order_placed
+from sales_rollups import GROUP_BY, RESOLUTIONS, RETENTION, bucket_start, group_rows, query_buckets, time_row
+
+ORDER_COLUMNS = "id, user_id, total_amount, discount_code, discount_amount, final_amount, created_at"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cart_lines (
+    user_id TEXT NOT NULL,
+    item_id INTEGER NOT NULL,
+    quantity INTEGER NOT NULL,
+    UNIQUE (user_id, item_id)
+);
+CREATE TABLE IF NOT EXISTS orders (
+    id INTEGER PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    total_amount REAL NOT NULL,
+    discount_code TEXT,
+    discount_amount REAL NOT NULL,
+    final_amount REAL NOT NULL,
+    created_at REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS orders_user_id ON orders (user_id);
+CREATE INDEX IF NOT EXISTS orders_discount_code ON orders (discount_code) WHERE discount_code IS NOT NULL;
+CREATE TABLE IF NOT EXISTS order_items (
+    order_id INTEGER NOT NULL REFERENCES orders (id),
+    line INTEGER NOT NULL,
+    item_id INTEGER NOT NULL,
+    quantity INTEGER NOT NULL,
+    PRIMARY KEY (order_id, line)
+) WITHOUT ROWID;
+-- order_placed events checkout has committed and the event consumer hasn't
+-- applied yet. written in the checkout transaction, deleted by whoever
+-- applies the event, so each one is applied once even with several workers
+CREATE TABLE IF NOT EXISTS order_events (
+    order_id INTEGER PRIMARY KEY,
+    event TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS discount_codes (
+    code TEXT PRIMARY KEY,
+    is_valid INTEGER NOT NULL DEFAULT 1
+) WITHOUT ROWID;
+-- codes that checkout has used, one row per discounted order, so get_stats
+-- doesn't have to scan orders for them
+CREATE TABLE IF NOT EXISTS used_discount_codes (
+    order_id INTEGER PRIMARY KEY,
+    code TEXT NOT NULL
+);
+-- single row of running totals, same idea as StatsAccumulator
+CREATE TABLE IF NOT EXISTS stats (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    order_count INTEGER NOT NULL DEFAULT 0,
+    total_items_purchased INTEGER NOT NULL DEFAULT 0,
+    total_gross_amount REAL NOT NULL DEFAULT 0,
+    total_purchase_amount REAL NOT NULL DEFAULT 0,
+    total_discount_amount REAL NOT NULL DEFAULT 0,
+    discount_codes_used INTEGER NOT NULL DEFAULT 0,
+    -- users with at least one cart line, for /metrics
+    cart_count INTEGER NOT NULL DEFAULT 0
+);
+INSERT OR IGNORE INTO stats (id) VALUES (1);
+-- pre-aggregated sales per time bucket, same idea as sales_rollups.SalesRollups.
+-- width is the bucket size in seconds (60/3600/86400), money per line is in cents
+CREATE TABLE IF NOT EXISTS sales_buckets (
+    width INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    orders INTEGER NOT NULL,
+    items INTEGER NOT NULL,
+    gross_amount REAL NOT NULL,
+    purchase_amount REAL NOT NULL,
+    discount_amount REAL NOT NULL,
+    PRIMARY KEY (width, bucket)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS sales_by_product (
+    width INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    item_id INTEGER NOT NULL,
+    quantity INTEGER NOT NULL,
+    gross_cents INTEGER NOT NULL,
+    PRIMARY KEY (width, bucket, item_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS sales_by_category (
+    width INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    category TEXT NOT NULL,
+    quantity INTEGER NOT NULL,
+    gross_cents INTEGER NOT NULL,
+    PRIMARY KEY (width, bucket, category)
+) WITHOUT ROWID;
+-- live stock, seeded from Item.stock the first time an item is loaded.
+-- shared by every worker, checkout takes from it in its transaction
+CREATE TABLE IF NOT EXISTS inventory (
+    item_id INTEGER PRIMARY KEY,
+    on_hand INTEGER NOT NULL
+);
+-- stock held for a cart until expires_at (unix seconds), only with
+-- CART_RESERVATION_SECONDS on
+CREATE TABLE IF NOT EXISTS reservations (
+    item_id INTEGER NOT NULL,
+    user_id TEXT NOT NULL,
+    quantity INTEGER NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (item_id, user_id)
+) WITHOUT ROWID;
+"""
+
+# what other carts are holding of one item
+HELD_BY_OTHERS = (
+    "SELECT COALESCE(SUM(quantity), 0) FROM reservations WHERE item_id = ? AND user_id IS NOT ? AND expires_at > ?"
+)
+
+ROLLUP_TABLES = ("sales_buckets", "sales_by_product", "sales_by_category")
+
+class ConnectionPool:
+    """
+    Fixed set of SQLite connections shared between threads.
+
+    Each connection is set up once (WAL, busy timeout) and keeps its own
+    prepared statement cache, so reusing connections means reusing the
+    compiled statements too. A connection is only ever used by one thread
+    at a time.
+    """
+    def __init__(self, path: str, size: int = 8):
+        self.path = path
+        self._pool: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+        self._all: List[sqlite3.Connection] = []
+        for _ in range(size):
+            conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, cached_statements=256)
+            # WAL lets readers carry on while a checkout is writing.
+            # synchronous=NORMAL is safe in WAL mode against app crashes,
+            # only a power cut can lose the last few commits.
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._all.append(conn)
+            self._pool.put(conn)
+        self.checkouts: int = 0
+        self.waits: int = 0
+        self.wait_seconds: float = 0.0
+        self._stats_lock = threading.Lock()
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        try:
+            conn = self._pool.get_nowait()
+            waited = 0.0
+        except queue.Empty:
+            start = time.perf_counter()
+            conn = self._pool.get()
+            waited = time.perf_counter() - start
+        with self._stats_lock:
+            self.checkouts += 1
+            if waited:
+                self.waits += 1
+                self.wait_seconds += waited
+        try:
+            yield conn
+        finally:
+            self._pool.put(conn)
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """
+        BEGIN IMMEDIATE takes the write lock up front, so two checkouts
+        can't both read and then deadlock trying to upgrade.
+        """
+        with self.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def stats(self) -> Dict:
+        return {
+            "size": len(self._all),
+            "checkouts": self.checkouts,
+            "waits": self.waits,
+            "wait_seconds": self.wait_seconds
+        }
+
+    def close(self):
+        for conn in self._all:
+            conn.close()
+
+class SQLiteStore(Storage):
+    """
+    Storage backend on a SQLite file.
+
+    Carts, orders and discount codes live in indexed tables, so order
+    history isn't limited by RAM and several worker processes can share
+    one database. The catalog is still in memory (see Storage).
+
+    Same rules as InMemoryStore:
+    - checkout runs in one transaction (read cart, burn code, write order,
+      bump totals, empty cart)
+    - stats come from a row of running totals updated by checkout
+    - checkout only goes through if every line is in stock, with the
+      check and the decrement in one conditional UPDATE per line
+    - sales rollups and nth-order codes are done by the event consumer.
+      checkout writes its event to an outbox table (order_events) in the
+      same transaction, so an event is never lost, and events a crashed
+      worker left behind are applied on startup
+
+    Every call waits on the database, so the async routes run them on
+    worker threads.
+    """
+    blocking_io = True
+
+    def __init__(self, path: str, pool_size: int = 8):
+        super().__init__()
+        self.nth_order_trigger: int = 3 # generating a code every 3rd order for testing
+        self.pool = ConnectionPool(path, pool_size)
+        with self.pool.connection() as conn:
+            had_used_codes = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'used_discount_codes'"
+            ).fetchone()
+            conn.executescript(SCHEMA)
+            # databases made before used codes had their own table
+            if not had_used_codes:
+                conn.execute(
+                    "INSERT OR IGNORE INTO used_discount_codes (order_id, code) "
+                    "SELECT id, discount_code FROM orders WHERE discount_code IS NOT NULL"
+                )
+            # databases made before orders were timestamped
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(orders)")]
+            if "created_at" not in columns:
+                conn.execute("ALTER TABLE orders ADD COLUMN created_at REAL NOT NULL DEFAULT 0")
+            # and before the stats row counted carts
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(stats)")]
+            if "cart_count" not in columns:
+                conn.execute("ALTER TABLE stats ADD COLUMN cart_count INTEGER NOT NULL DEFAULT 0")
+                conn.execute("UPDATE stats SET cart_count = (SELECT COUNT(DISTINCT user_id) FROM cart_lines)")
+            if "discount_codes_used" not in columns:
+                conn.execute("ALTER TABLE stats ADD COLUMN discount_codes_used INTEGER NOT NULL DEFAULT 0")
+                conn.execute("UPDATE stats SET discount_codes_used = (SELECT COUNT(*) FROM used_discount_codes)")
+        # newest bucket this process has pruned behind, per width
+        self._pruned_upto: Dict[int, int] = {}
+        self.stock_rejections: int = 0
+        # left in the outbox by a worker that stopped before applying them
+        with self.pool.connection() as conn:
+            leftovers = [json.loads(row[0]) for row in conn.execute("SELECT event FROM order_events ORDER BY order_id")]
+        if leftovers:
+            self._handle_events(leftovers)
+
+    def reset(self):
+        self.reset_catalog()
+        with self.pool.transaction() as conn:
+            for table in ("cart_lines", "order_items", "orders", "order_events", "discount_codes",
+                          "used_discount_codes", "stats",
+                          "inventory", "reservations", *ROLLUP_TABLES):
+                conn.execute(f"DELETE FROM {table}")
+            conn.execute("INSERT INTO stats (id) VALUES (1)")
+
+    def close(self):
+        self.events.close()
+        self.pool.close()
+        self._set_details(None)
+
+    def load_catalog(self, items: Iterable[Item], details: Optional[FeedDetails] = None):
+        """
+        Every worker loads the catalog on startup, so only items the
+        database hasn't seen yet get their stock from Item.stock.
+        """
+        items = list(items)
+        super().load_catalog(items, details)
+        with self.pool.transaction() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO inventory (item_id, on_hand) VALUES (?, ?)",
+                [(item.id, item.stock) for item in items]
+            )
+
+    def upsert_item(self, item: Item):
+        super().upsert_item(item)
+        with self.pool.transaction() as conn:
+            conn.execute(
+                "INSERT INTO inventory (item_id, on_hand) VALUES (?, ?) "
+                "ON CONFLICT (item_id) DO UPDATE SET on_hand = excluded.on_hand",
+                (item.id, item.stock)
+            )
+
+    def remove_item(self, item_id: int):
+        super().remove_item(item_id)
+        with self.pool.transaction() as conn:
+            conn.execute("DELETE FROM inventory WHERE item_id = ?", (item_id,))
+            conn.execute("DELETE FROM reservations WHERE item_id = ?", (item_id,))
+
+    def apply_catalog_delta(self, upserts: List[Item], deletes: List[int]) -> int:
+        deleted = super().apply_catalog_delta(upserts, deletes)
+        with self.pool.transaction() as conn:
+            conn.executemany(
+                "INSERT INTO inventory (item_id, on_hand) VALUES (?, ?) "
+                "ON CONFLICT (item_id) DO UPDATE SET on_hand = excluded.on_hand",
+                [(item.id, item.stock) for item in upserts]
+            )
+            conn.executemany("DELETE FROM inventory WHERE item_id = ?", [(item_id,) for item_id in deletes])
+            conn.executemany("DELETE FROM reservations WHERE item_id = ?", [(item_id,) for item_id in deletes])
+        return deleted
+
+    def _sellable(self, conn: sqlite3.Connection, item_id: int, user_id: Optional[str], now: float) -> int:
+        row = conn.execute("SELECT on_hand FROM inventory WHERE item_id = ?", (item_id,)).fetchone()
+        if row is None:
+            return 0
+        return row[0] - conn.execute(HELD_BY_OTHERS, (item_id, user_id, now)).fetchone()[0]
+
+    def _shortage(self, conn: sqlite3.Connection, item_id: int, user_id: str, now: float) -> ValueError:
+        self.stock_rejections += 1
+        left = max(0, self._sellable(conn, item_id, user_id, now))
+        return ValueError(f"Only {left} of item {item_id} left" if left else f"Item {item_id} is out of stock")
+
+    def _reserve(self, conn: sqlite3.Connection, user_id: str, item_ids: Iterable[int]):
+        # hold what the cart now has of these items, or raise (rolling the change back)
+        now = time.time()
+        for item_id in item_ids:
+            conn.execute("DELETE FROM reservations WHERE item_id = ? AND expires_at <= ?", (item_id, now))
+            row = conn.execute(
+                "SELECT quantity FROM cart_lines WHERE user_id = ? AND item_id = ?", (user_id, item_id)
+            ).fetchone()
+            if row is None:
+                conn.execute("DELETE FROM reservations WHERE item_id = ? AND user_id = ?", (item_id, user_id))
+                continue
+            if row[0] > self._sellable(conn, item_id, user_id, now):
+                raise self._shortage(conn, item_id, user_id, now)
+            conn.execute(
+                "INSERT INTO reservations (item_id, user_id, quantity, expires_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (item_id, user_id) DO UPDATE SET quantity = excluded.quantity, "
+                "expires_at = excluded.expires_at",
+                (item_id, user_id, row[0], now + self.reservation_seconds)
+            )
+
+    def stock_level(self, item_id: int) -> Dict:
+        if item_id not in self.items:
+            raise ValueError(f"Item {item_id} not found")
+        with self.pool.connection() as conn:
+            row = conn.execute("SELECT on_hand FROM inventory WHERE item_id = ?", (item_id,)).fetchone()
+            on_hand = row[0] if row else 0
+            available = max(0, self._sellable(conn, item_id, None, time.time()))
+        return {"item_id": item_id, "on_hand": on_hand, "reserved": on_hand - available, "available": available}
+
+    def _cart_lines(self, conn: sqlite3.Connection, user_id: str) -> List[CartItem]:
+        rows = conn.execute(
+            "SELECT item_id, quantity FROM cart_lines WHERE user_id = ? ORDER BY rowid", (user_id,)
+        ).fetchall()
+        return [CartItem(item_id=item_id, quantity=quantity) for item_id, quantity in rows]
+
+    def get_cart(self, user_id: str) -> Cart:
+        with self.pool.connection() as conn:
+            return Cart(items=self._cart_lines(conn, user_id))
+
+    def get_priced_cart(self, user_id: str) -> PricedCart:
+        with self.pool.connection() as conn:
+            lines = self._cart_lines(conn, user_id)
+        # prices live in the in-memory catalog, lines for removed items are dropped
+        lines = [line for line in lines if line.item_id in self.items]
+        subtotal_cents = sum(self._price_cents(line.item_id) * line.quantity for line in lines)
+        return PricedCart(
+            items=lines,
+            item_count=sum(line.quantity for line in lines),
+            subtotal=subtotal_cents / 100
+        )
+
+    def get_cart_data(self, user_id: str, priced: bool = False) -> Dict:
+        with self.pool.connection() as conn:
+            rows = conn.execute(
+                "SELECT item_id, quantity FROM cart_lines WHERE user_id = ? ORDER BY rowid", (user_id,)
+            ).fetchall()
+        if not priced:
+            return {"items": [{"item_id": item_id, "quantity": quantity} for item_id, quantity in rows]}
+        rows = [(item_id, quantity) for item_id, quantity in rows if item_id in self.items]
+        return {
+            "items": [{"item_id": item_id, "quantity": quantity} for item_id, quantity in rows],
+            "item_count": sum(quantity for _, quantity in rows),
+            "subtotal": sum(self._price_cents(item_id) * quantity for item_id, quantity in rows) / 100
+        }
+
+    def add_to_cart(self, user_id: str, item_id: int, quantity: int):
+        """
+        Same semantics as the in-memory store: negative quantities reduce the
+        line, and it's removed once it hits zero.
+        """
+        if item_id not in self.items:
+            raise ValueError(f"Item {item_id} not found")
+        with self.pool.transaction() as conn:
+            had_cart = self._has_cart(conn, user_id)
+            self._add_line(conn, user_id, item_id, quantity)
+            if self.reservation_seconds:
+                self._reserve(conn, user_id, (item_id,))
+            self._count_cart(conn, had_cart, self._has_cart(conn, user_id))
+
+    def _has_cart(self, conn: sqlite3.Connection, user_id: str) -> bool:
+        return conn.execute("SELECT 1 FROM cart_lines WHERE user_id = ? LIMIT 1", (user_id,)).fetchone() is not None
+
+    def _count_cart(self, conn: sqlite3.Connection, had_cart: bool, has_cart: bool):
+        # keeps stats.cart_count in step when a cart appears or empties,
+        # so /metrics doesn't have to count cart_lines
+        if had_cart != has_cart:
+            conn.execute("UPDATE stats SET cart_count = cart_count + ? WHERE id = 1", (1 if has_cart else -1,))
+
+    def _add_line(self, conn: sqlite3.Connection, user_id: str, item_id: int, quantity: int):
+        if quantity > 0:
+            conn.execute(
+                "INSERT INTO cart_lines (user_id, item_id, quantity) VALUES (?, ?, ?) "
+                "ON CONFLICT (user_id, item_id) DO UPDATE SET quantity = quantity + excluded.quantity",
+                (user_id, item_id, quantity)
+            )
+        else:
+            conn.execute(
+                "UPDATE cart_lines SET quantity = quantity + ? WHERE user_id = ? AND item_id = ?",
+                (quantity, user_id, item_id)
+            )
+            conn.execute(
+                "DELETE FROM cart_lines WHERE user_id = ? AND item_id = ? AND quantity <= 0",
+                (user_id, item_id)
+            )
+
+    def remove_from_cart(self, user_id: str, item_id: int):
+        with self.pool.transaction() as conn:
+            cursor = conn.execute("DELETE FROM cart_lines WHERE user_id = ? AND item_id = ?", (user_id, item_id))
+            if cursor.rowcount == 0:
+                raise ValueError(f"Item {item_id} not in cart")
+            conn.execute("DELETE FROM reservations WHERE item_id = ? AND user_id = ?", (item_id, user_id))
+            self._count_cart(conn, True, self._has_cart(conn, user_id))
+
+    def apply_cart_batch(self, user_id: str, operations: List[CartOperation]) -> Cart:
+        """
+        Checked against the current lines first, then applied op by op in
+        one transaction, so the row order matches the in-memory backend.
+        """
+        with self.pool.transaction() as conn:
+            current = {line.item_id: line.quantity for line in self._cart_lines(conn, user_id)}
+            check_cart_ops(current, operations, self.items.__contains__)
+            for operation in operations:
+                if operation.op == "remove":
+                    conn.execute(
+                        "DELETE FROM cart_lines WHERE user_id = ? AND item_id = ?", (user_id, operation.item_id)
+                    )
+                elif operation.op == "set":
+                    if operation.quantity > 0:
+                        conn.execute(
+                            "INSERT INTO cart_lines (user_id, item_id, quantity) VALUES (?, ?, ?) "
+                            "ON CONFLICT (user_id, item_id) DO UPDATE SET quantity = excluded.quantity",
+                            (user_id, operation.item_id, operation.quantity)
+                        )
+                    else:
+                        conn.execute(
+                            "DELETE FROM cart_lines WHERE user_id = ? AND item_id = ?", (user_id, operation.item_id)
+                        )
+                else:
+                    self._add_line(conn, user_id, operation.item_id, operation.quantity)
+            if self.reservation_seconds:
+                self._reserve(conn, user_id, sorted({operation.item_id for operation in operations}))
+            lines = self._cart_lines(conn, user_id)
+            self._count_cart(conn, bool(current), bool(lines))
+            return Cart(items=lines)
+
+    def checkout(self, user_id: str, discount_code: Optional[str] = None) -> Order:
+        # backpressure: a full event queue holds checkouts here, before the write lock
+        self.events.wait_for_room()
+        with self.pool.transaction() as conn:
+            lines = [line for line in self._cart_lines(conn, user_id) if line.item_id in self.items]
+            if not lines:
+                raise ValueError("Cart is empty")
+
+            # check and take in one statement per line, other carts' live
+            # reservations count as gone. a shortfall rolls the lot back
+            now = time.time()
+            for line in lines:
+                cursor = conn.execute(
+                    f"UPDATE inventory SET on_hand = on_hand - ? WHERE item_id = ? AND on_hand - ? >= ({HELD_BY_OTHERS})",
+                    (line.quantity, line.item_id, line.quantity, line.item_id, user_id, now)
+                )
+                if cursor.rowcount == 0:
+                    raise self._shortage(conn, line.item_id, user_id, now)
+            conn.execute("DELETE FROM reservations WHERE user_id = ?", (user_id,))
+
+            # same cents arithmetic as CartState so both backends agree to the penny
+            total_amount = sum(self._price_cents(line.item_id) * line.quantity for line in lines) / 100
+
+            discount_amount = 0.0
+            if discount_code:
+                # one-time use: deleting it is the check
+                cursor = conn.execute("DELETE FROM discount_codes WHERE code = ? AND is_valid = 1", (discount_code,))
+                if cursor.rowcount == 0:
+                    raise ValueError("Invalid discount code")
+                discount_amount = total_amount * 0.10 # 10% off
+            final_amount = total_amount - discount_amount
+
+            created_at = time.time()
+            order_id = conn.execute(
+                "INSERT INTO orders (user_id, total_amount, discount_code, discount_amount, final_amount, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (user_id, total_amount, discount_code, discount_amount, final_amount, created_at)
+            ).lastrowid
+            if discount_code:
+                conn.execute("INSERT INTO used_discount_codes (order_id, code) VALUES (?, ?)", (order_id, discount_code))
+            conn.executemany(
+                "INSERT INTO order_items (order_id, line, item_id, quantity) VALUES (?, ?, ?, ?)",
+                [(order_id, n, line.item_id, line.quantity) for n, line in enumerate(lines)]
+            )
+            conn.execute(
+                "UPDATE stats SET order_count = order_count + 1, "
+                "total_items_purchased = total_items_purchased + ?, "
+                "total_gross_amount = total_gross_amount + ?, "
+                "total_purchase_amount = total_purchase_amount + ?, "
+                "total_discount_amount = total_discount_amount + ?, "
+                "discount_codes_used = discount_codes_used + ?, "
+                "cart_count = cart_count - 1 WHERE id = 1",  # the cart is emptied below
+                (sum(line.quantity for line in lines), total_amount, final_amount, discount_amount, 1 if discount_code else 0)
+            )
+            # rollups and the nth-order code are the event consumer's job
+            event = order_placed(
+                order_id, user_id, created_at, total_amount, final_amount, discount_amount, discount_code,
+                [(line.item_id, line.quantity, self._price_cents(line.item_id), self._category(line.item_id))
+                 for line in lines]
+            )
+            conn.execute("INSERT INTO order_events (order_id, event) VALUES (?, ?)", (order_id, json.dumps(event)))
+            conn.execute("DELETE FROM cart_lines WHERE user_id = ?", (user_id,))
+        self.events.publish(event)
+
+        return Order(
+            id=order_id,
+            user_id=user_id,
+            items=lines,
+            total_amount=total_amount,
+            discount_code=discount_code,
+            discount_amount=discount_amount,
+            final_amount=final_amount,
+            created_at=created_at
+        )
+
+    def _apply_events(self, events: List[Dict], applied: List[Tuple[Dict, Optional[str]]]):
+        done = []
+        with self.pool.transaction() as conn:
+            # claim them first. an event another worker already applied is gone from the outbox
+            claimed = {row[0] for row in conn.execute(
+                f"DELETE FROM order_events WHERE order_id IN ({','.join('?' * len(events))}) RETURNING order_id",
+                [event["order_id"] for event in events]
+            )}
+            for event in events:
+                if event["order_id"] not in claimed:
+                    continue
+                self._record_sales(conn, event)
+                code = self._milestone(event["order_id"])
+                if code:
+                    conn.execute("INSERT OR IGNORE INTO discount_codes (code, is_valid) VALUES (?, 1)", (code,))
+                done.append((event, code))
+        # all or nothing, so only once the transaction is in
+        applied.extend(done)
+
+    def _record_sales(self, conn: sqlite3.Connection, event: Dict):
+        # one executemany per table, it's 3 + 6 * lines upserts otherwise
+        created_at, gross, final, discount = (
+            event["created_at"], event["total_amount"], event["final_amount"], event["discount_amount"]
+        )
+        items = sum(quantity for _, quantity, _, _ in event["sales"])
+        sales = [(item_id, quantity, unit_cents * quantity, category)
+                 for item_id, quantity, unit_cents, category in event["sales"]]
+        buckets = [(width, bucket_start(created_at, width)) for width in RESOLUTIONS.values()]
+        conn.executemany(
+            "INSERT INTO sales_buckets VALUES (?, ?, 1, ?, ?, ?, ?) ON CONFLICT (width, bucket) DO UPDATE SET "
+            "orders = orders + 1, items = items + excluded.items, "
+            "gross_amount = gross_amount + excluded.gross_amount, "
+            "purchase_amount = purchase_amount + excluded.purchase_amount, "
+            "discount_amount = discount_amount + excluded.discount_amount",
+            [(width, bucket, items, gross, final, discount) for width, bucket in buckets]
+        )
+        conn.executemany(
+            "INSERT INTO sales_by_product VALUES (?, ?, ?, ?, ?) ON CONFLICT (width, bucket, item_id) "
+            "DO UPDATE SET quantity = quantity + excluded.quantity, gross_cents = gross_cents + excluded.gross_cents",
+            [(width, bucket, item_id, quantity, cents)
+             for width, bucket in buckets for item_id, quantity, cents, _ in sales]
+        )
+        conn.executemany(
+            "INSERT INTO sales_by_category VALUES (?, ?, ?, ?, ?) ON CONFLICT (width, bucket, category) "
+            "DO UPDATE SET quantity = quantity + excluded.quantity, gross_cents = gross_cents + excluded.gross_cents",
+            [(width, bucket, category, quantity, cents)
+             for width, bucket in buckets for _, quantity, cents, category in sales]
+        )
+        for resolution, (_, bucket) in zip(RESOLUTIONS, buckets):
+            self._prune_sales(conn, resolution, bucket)
+
+    def _prune_sales(self, conn: sqlite3.Connection, resolution: str, bucket: int):
+        # at most once per new bucket per process, not on every checkout
+        width = RESOLUTIONS[resolution]
+        if self._pruned_upto.get(width) == bucket:
+            return
+        self._pruned_upto[width] = bucket
+        keep = RETENTION[resolution]
+        if keep is None:
+            return
+        for table in ROLLUP_TABLES:
+            conn.execute(f"DELETE FROM {table} WHERE width = ? AND bucket < ?", (width, bucket - keep))
+
+    def sales_rollup(self, start: float, end: float, resolution: str, group_by: str) -> List[Dict]:
+        if group_by not in GROUP_BY:
+            raise ValueError(f"Unknown group_by '{group_by}', expected one of {', '.join(GROUP_BY)}")
+        starts = query_buckets(start, end, resolution)
+        # primary key range scans, so the cost follows the number of buckets
+        args = (RESOLUTIONS[resolution], starts[0], starts[-1])
+        with self.pool.connection() as conn:
+            if group_by == "time":
+                found = {
+                    row[0]: row for row in conn.execute(
+                        "SELECT bucket, orders, items, gross_amount, purchase_amount, discount_amount "
+                        "FROM sales_buckets WHERE width = ? AND bucket BETWEEN ? AND ?", args
+                    )
+                }
+                return [time_row(*found[when]) if when in found else time_row(when, 0, 0, 0.0, 0.0, 0.0)
+                        for when in starts]
+            if group_by == "product":
+                totals = {
+                    item_id: [quantity, cents] for item_id, quantity, cents in conn.execute(
+                        "SELECT item_id, SUM(quantity), SUM(gross_cents) FROM sales_by_product "
+                        "WHERE width = ? AND bucket BETWEEN ? AND ? GROUP BY item_id", args
+                    )
+                }
+                return group_rows("item_id", totals, self._product_name)
+            totals = {
+                category: [quantity, cents] for category, quantity, cents in conn.execute(
+                    "SELECT category, SUM(quantity), SUM(gross_cents) FROM sales_by_category "
+                    "WHERE width = ? AND bucket BETWEEN ? AND ? GROUP BY category", args
+                )
+            }
+            return group_rows("category", totals)
+
+    def generate_discount_code(self) -> Optional[str]:
+        self.events.wait_idle(timeout=1.0)
+        with self.pool.connection() as conn:
+            (order_count,) = conn.execute("SELECT order_count FROM stats WHERE id = 1").fetchone()
+            code = self._milestone(order_count)
+            if code and conn.execute(
+                "SELECT 1 FROM discount_codes WHERE code = ? AND is_valid = 1", (code,)
+            ).fetchone():
+                return code
+            return None
+
+    def add_discount_code(self, code: str):
+        with self.pool.transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO discount_codes (code, is_valid) VALUES (?, 1)", (code,))
+
+    def validate_discount_code(self, code: str) -> bool:
+        with self.pool.connection() as conn:
+            row = conn.execute("SELECT 1 FROM discount_codes WHERE code = ? AND is_valid = 1", (code,)).fetchone()
+            return row is not None
+
+    def _orders_data(self, conn: sqlite3.Connection, rows: List[tuple]) -> List[Dict]:
+        # order rows -> plain dicts with their lines, one query for all the lines
+        lines: Dict[int, List[Dict]] = {row[0]: [] for row in rows}
+        if rows:
+            for order_id, item_id, quantity in conn.execute(
+                f"SELECT order_id, item_id, quantity FROM order_items WHERE order_id IN ({','.join('?' * len(rows))}) "
+                "ORDER BY order_id, line", list(lines)
+            ):
+                lines[order_id].append({"item_id": item_id, "quantity": quantity})
+        return [
+            {
+                "id": order_id, "user_id": user_id, "items": lines[order_id], "total_amount": total_amount,
+                "discount_code": discount_code, "discount_amount": discount_amount,
+                "final_amount": final_amount, "created_at": created_at,
+            }
+            for order_id, user_id, total_amount, discount_code, discount_amount, final_amount, created_at in rows
+        ]
+
+    def get_order(self, order_id: int) -> Dict:
+        with self.pool.connection() as conn:
+            rows = conn.execute(f"SELECT {ORDER_COLUMNS} FROM orders WHERE id = ?", (order_id,)).fetchall()
+            if not rows:
+                raise ValueError("Order not found")
+            return self._orders_data(conn, rows)[0]
+
+    def _order_page(self, user_id: str, before_id: Optional[int], limit: int) -> Tuple[List[Dict], bool]:
+        # orders_user_id entries are (user_id, rowid), so this walks the
+        # index backwards from before_id and stops after limit + 1 rows
+        with self.pool.connection() as conn:
+            rows = conn.execute(
+                f"SELECT {ORDER_COLUMNS} FROM orders WHERE user_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                (user_id, before_id if before_id is not None else 2**63 - 1, limit + 1)
+            ).fetchall()
+            return self._orders_data(conn, rows[:limit]), len(rows) > limit
+
+    def export_orders(self, since_id: int = 0, batch_size: int = 1000) -> Tuple[int, Iterator[List[Dict]]]:
+        # writers are serialized, so every id up to the current max is
+        # already committed and nothing below it can show up later
+        with self.pool.connection() as conn:
+            (last_id,) = conn.execute("SELECT COALESCE(MAX(id), 0) FROM orders").fetchone()
+        return max(last_id, since_id), self._export_batches(since_id, last_id, batch_size)
+
+    def _export_batches(self, after_id: int, last_id: int, batch_size: int) -> Iterator[List[Dict]]:
+        # a short read per batch, the connection goes back to the pool before each yield
+        while after_id < last_id:
+            with self.pool.connection() as conn:
+                rows = conn.execute(
+                    f"SELECT {ORDER_COLUMNS} FROM orders WHERE id > ? AND id <= ? ORDER BY id LIMIT ?",
+                    (after_id, last_id, batch_size)
+                ).fetchall()
+                batch = self._orders_data(conn, rows)
+            if not batch:
+                return
+            after_id = batch[-1]["id"]
+            yield batch
+
+    def _stats_row(self, conn: sqlite3.Connection, all_codes: bool = False) -> StatsAccumulator:
+        # just the latest codes unless all_codes, that's all snapshot() shows
+        acc = StatsAccumulator()
+        (acc.total_orders, acc.total_items_purchased, acc.total_gross_amount,
+         acc.total_purchase_amount, acc.total_discount_amount, acc.discount_codes_used) = conn.execute(
+            "SELECT order_count, total_items_purchased, total_gross_amount, "
+            "total_purchase_amount, total_discount_amount, discount_codes_used FROM stats WHERE id = 1"
+        ).fetchone()
+        if all_codes:
+            rows = conn.execute("SELECT code FROM used_discount_codes ORDER BY order_id").fetchall()
+        else:
+            rows = conn.execute(
+                "SELECT code FROM used_discount_codes ORDER BY order_id DESC LIMIT ?", (RECENT_DISCOUNT_CODES,)
+            ).fetchall()[::-1]
+        acc.discount_codes = [row[0] for row in rows]
+        return acc
+
+    def get_stats(self) -> Dict:
+        with self.pool.connection() as conn:
+            conn.execute("BEGIN")  # one read snapshot for the totals and the codes
+            try:
+                return self._stats_row(conn).snapshot()
+            finally:
+                conn.execute("COMMIT")
+
+    def stats_version(self) -> int:
+        with self.pool.connection() as conn:
+            return conn.execute("SELECT order_count FROM stats WHERE id = 1").fetchone()[0]
+
+    def verify_stats(self) -> Dict:
+        with self.pool.connection() as conn:
+            conn.execute("BEGIN")
+            try:
+                accumulated = self._stats_row(conn, all_codes=True)
+                recomputed = StatsAccumulator()
+                (recomputed.total_orders, recomputed.total_gross_amount,
+                 recomputed.total_purchase_amount, recomputed.total_discount_amount) = conn.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(total_amount), 0.0), COALESCE(SUM(final_amount), 0.0), "
+                    "COALESCE(SUM(discount_amount), 0.0) FROM orders"
+                ).fetchone()
+                (recomputed.total_items_purchased,) = conn.execute(
+                    "SELECT COALESCE(SUM(quantity), 0) FROM order_items"
+                ).fetchone()
+                recomputed.discount_codes = [row[0] for row in conn.execute(
+                    "SELECT discount_code FROM orders WHERE discount_code IS NOT NULL ORDER BY id"
+                )]
+                recomputed.discount_codes_used = len(recomputed.discount_codes)
+            finally:
+                conn.execute("COMMIT")
+        mismatches = accumulated.diff(recomputed)
+        return {"consistent": not mismatches, "mismatches": mismatches}
+
+    def gauges(self) -> Dict[str, int]:
+        with self.pool.connection() as conn:
+            # kept up by the cart and checkout transactions, nothing here scans
+            carts, orders = conn.execute("SELECT cart_count, order_count FROM stats WHERE id = 1").fetchone()
+            return {
+                "carts": carts,
+                "orders": orders,
+                "live_discount_codes": conn.execute("SELECT COUNT(*) FROM discount_codes WHERE is_valid = 1").fetchone()[0],
+                "queued_events": self.events.depth
+            }
+
+    def counters(self) -> Dict[str, int]:
+        return {**super().counters(), "stock_rejections": self.stock_rejections}
+
+    def lock_stats(self) -> Dict:
+        return {
+            "connection_pool": self.pool.stats(),
+            "catalog_lock": self._catalog_lock.stats(),
+            "async_fallbacks": self.async_fallbacks
+        }
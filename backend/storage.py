@@ -0,0 +1,704 @@
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+import asyncio
+import math
+from models import Item, Order, Cart, CartOperation, PricedCart
+from locks import CountedLock, WouldBlock, lock_owner, no_wait
+from carts import to_cents
+from catalog_index import CatalogIndex, decode_cursor, encode_cursor
+from catalog_cache import EncodedCatalog
+from catalog_feed import FeedDetails
+from events import AuditTrail, EventPipeline
+
+# how many of the latest used codes /admin/stats lists, the rest is just counted
+RECENT_DISCOUNT_CODES = 20
+
+def milestone_code(order_number: int) -> str:
+    # the code the nth-order rule issues for that order
+    return f"DISCOUNT10-{order_number}"
+
+class StatsAccumulator:
+    """
+    Running totals for the admin dashboard.
+    
+    checkout feeds every new order in here as it's written, so reading
+    the stats is O(1) instead of walking the whole order list. That
+    includes the used codes: `snapshot` has how many and the latest few,
+    the full list is only in `to_state` (persistence, verify_stats).
+    """
+    def __init__(self):
+        self.total_orders: int = 0
+        self.total_items_purchased: int = 0
+        self.total_gross_amount: float = 0.0
+        self.total_purchase_amount: float = 0.0
+        self.total_discount_amount: float = 0.0
+        # every code used, oldest first (SQLite only loads the latest, see _stats_row)
+        self.discount_codes: List[str] = []
+        self.discount_codes_used: int = 0
+
+    @classmethod
+    def from_orders(cls, orders: Iterable[Order]) -> "StatsAccumulator":
+        """
+        Rebuild the totals from scratch, one order at a time. The memory
+        store's OrderLog can do this without building Orders (`totals()`).
+        """
+        acc = cls()
+        for order in orders:
+            acc.record(order)
+        return acc
+
+    def record(self, order: Order):
+        self.add(
+            sum(item.quantity for item in order.items),
+            order.total_amount, order.final_amount, order.discount_amount, order.discount_code
+        )
+
+    def add(self, items: int, gross: float, final: float, discount: float, discount_code: Optional[str]):
+        # same as record, without needing an Order (journal replay)
+        self.total_orders += 1
+        self.total_items_purchased += items
+        self.total_gross_amount += gross
+        self.total_purchase_amount += final
+        self.total_discount_amount += discount
+        if discount_code:
+            self.discount_codes.append(discount_code)
+            self.discount_codes_used += 1
+
+    @classmethod
+    def from_state(cls, data: Dict) -> "StatsAccumulator":
+        """
+        From `to_state` (a store snapshot) or OrderLog.totals.
+        """
+        acc = cls()
+        acc.total_orders = data["total_orders"]
+        acc.total_items_purchased = data["total_items_purchased"]
+        acc.total_gross_amount = data["total_gross_amount"]
+        acc.total_purchase_amount = data["total_purchase_amount"]
+        acc.total_discount_amount = data["total_discount_amount"]
+        acc.discount_codes = list(data["discount_codes"])
+        acc.discount_codes_used = len(acc.discount_codes)
+        return acc
+
+    def to_state(self) -> Dict:
+        # everything, codes included. O(codes used), keep it off the hot path
+        return {**self.snapshot(), "discount_codes": list(self.discount_codes)}
+
+    def snapshot(self) -> Dict:
+        return {
+            "total_orders": self.total_orders,
+            "total_items_purchased": self.total_items_purchased,
+            "total_gross_amount": self.total_gross_amount,
+            "total_purchase_amount": self.total_purchase_amount,
+            "discount_codes": self.discount_codes[-RECENT_DISCOUNT_CODES:],
+            "discount_codes_used": self.discount_codes_used,
+            "total_discount_amount": self.total_discount_amount
+        }
+
+    def diff(self, other: "StatsAccumulator") -> Dict:
+        """
+        Field-by-field comparison against another accumulator.
+        Returns only the fields that disagree, so an empty dict means consistent.
+        """
+        mine, theirs = self.to_state(), other.to_state()
+        mismatches = {}
+        for key, value in mine.items():
+            expected = theirs[key]
+            if isinstance(value, float):
+                same = math.isclose(value, expected, rel_tol=1e-9, abs_tol=1e-6)
+            else:
+                same = value == expected
+            if not same:
+                mismatches[key] = {"accumulated": value, "recomputed": expected}
+        return mismatches
+
+class Storage(ABC):
+    """
+    What the API needs from a storage backend.
+    
+    The catalog lives in memory for every backend (it's seeded at startup
+    and read constantly), so that part is implemented here once: items,
+    search indexes and pre-encoded responses, all behind one catalog lock.
+    Single-item reads are lock-free dict lookups.
+    
+    Carts, orders, discount codes and stats are up to the backend:
+    - store.InMemoryStore keeps them in dicts
+    - sqlite_store.SQLiteStore keeps them in a SQLite file
+    - sharding.ShardedStore spreads them over InMemoryStore processes
+
+    The `*_async` methods are what the async routes call (see `_run_async`).
+    """
+    # True if cart/checkout calls wait on disk, so the async versions
+    # have to run them on a worker thread
+    blocking_io: bool = False
+    # how long adding to the cart holds stock for that user. 0 = no
+    # reservations, stock is only checked at checkout
+    reservation_seconds: float = 0
+
+    def __init__(self):
+        self._catalog_lock = CountedLock()
+        # async calls that found a lock busy and went to a worker thread
+        self.async_fallbacks: int = 0
+        # order-placed events from checkout: discount codes, sales rollups,
+        # audit trail. main.py starts the consumer thread
+        self.events = EventPipeline(self._handle_events)
+        self.audit: Optional[AuditTrail] = None
+        self.reset_catalog()
+
+    def reset_catalog(self):
+        self.items: Dict[int, Item] = {}
+        # search/filter indexes over self.items, built in seed_data
+        self.index = CatalogIndex()
+        # pre-encoded JSON for the catalog endpoints
+        self.encoded = EncodedCatalog()
+        # bumped whenever the catalog changes, so carts know to reprice
+        self.catalog_version: int = 0
+        self._set_details(None)
+
+    def _set_details(self, details: Optional[FeedDetails]):
+        # lazily loaded descriptions/features, see catalog_feed.load_feed
+        old = getattr(self, "details", None)
+        if old is not None and old is not details:
+            old.close()
+        self.details = details
+
+    def _full_item(self, item: Item) -> Item:
+        return self.details.complete(item) if self.details is not None else item
+
+    def seed_data(self):
+        """
+        Loading up default products with full details.
+        Images served from backend at /images/products/ (see images.py).
+        """
+        products = [
+            {
+                "id": 1,
+                "name": "Wireless Noise-Canceling Headphones",
+                "price": 299.99,
+                "originalPrice": 349.99,
+                "image": "/images/products/Headphones.png",
+                "category": "Electronics",
+                "rating": 4.8,
+                "reviewCount": 2847,
+                "description": "Experience immersive sound with our premium wireless headphones featuring advanced noise-canceling technology. Perfect for music lovers, travelers, and remote workers who demand crystal-clear audio.",
+                "features": ["Active Noise Cancellation", "40-hour battery life", "Bluetooth 5.2", "Premium memory foam ear cushions", "Foldable design for travel"],
+                "stock": 45,
+                "sale": True
+            },
+            {
+                "id": 2,
+                "name": "Smart Fitness Watch Pro",
+                "price": 199.50,
+                "image": "/images/products/Smartwatch.png",
+                "category": "Electronics",
+                "rating": 4.5,
+                "reviewCount": 1523,
+                "description": "Track your health and fitness goals with precision. This advanced smartwatch monitors heart rate, sleep patterns, and over 100 workout modes.",
+                "features": ["Heart rate monitoring", "GPS tracking", "Water resistant to 50m", "7-day battery life", "Compatible with iOS and Android"],
+                "stock": 78
+            },
+            {
+                "id": 3,
+                "name": "Ergonomic Office Chair",
+                "price": 450.00,
+                "image": "/images/products/Chair.png",
+                "category": "Furniture",
+                "rating": 4.9,
+                "reviewCount": 892,
+                "description": "Designed for all-day comfort, this ergonomic chair features adjustable lumbar support, breathable mesh back, and customizable armrests.",
+                "features": ["Adjustable lumbar support", "Breathable mesh back", "4D armrests", "Recline up to 135 degrees", "Supports up to 300 lbs"],
+                "stock": 23
+            },
+            {
+                "id": 4,
+                "name": "Premium Cotton T-Shirt",
+                "price": 25.00,
+                "image": "/images/products/Shirt.png",
+                "category": "Clothing",
+                "rating": 4.2,
+                "reviewCount": 3421,
+                "description": "Ultra-soft 100% organic cotton t-shirt with a modern fit. Pre-shrunk and machine washable for easy care.",
+                "features": ["100% organic cotton", "Pre-shrunk fabric", "Reinforced seams", "Available in 12 colors", "Sizes XS-3XL"],
+                "stock": 156
+            },
+            {
+                "id": 5,
+                "name": "Stainless Steel Water Bottle",
+                "price": 35.00,
+                "image": "/images/products/Bottle.png",
+                "category": "Accessories",
+                "rating": 4.7,
+                "reviewCount": 2156,
+                "description": "Double-walled vacuum insulated water bottle keeps drinks cold for 24 hours or hot for 12 hours. BPA-free and eco-friendly.",
+                "features": ["24-hour cold / 12-hour hot", "Double-wall insulation", "BPA-free", "Leak-proof lid", "32 oz capacity"],
+                "stock": 234
+            },
+            {
+                "id": 6,
+                "name": "Leather Weekend Bag",
+                "price": 150.00,
+                "originalPrice": 199.00,
+                "image": "/images/products/Bag.png",
+                "category": "Accessories",
+                "rating": 4.6,
+                "reviewCount": 678,
+                "description": "Handcrafted genuine leather weekend bag with spacious interior and multiple compartments. Perfect for short trips and gym sessions.",
+                "features": ["Genuine full-grain leather", "Padded laptop sleeve", "Multiple pockets", "Detachable shoulder strap", "Brass hardware"],
+                "stock": 34,
+                "sale": True
+            },
+            {
+                "id": 7,
+                "name": "4K Ultra HD Monitor",
+                "price": 399.99,
+                "image": "/images/products/Monitor.png",
+                "category": "Electronics",
+                "rating": 4.4,
+                "reviewCount": 1892,
+                "description": "27-inch 4K UHD monitor with HDR support, perfect for content creators, gamers, and professionals who demand accurate colors.",
+                "features": ["27-inch 4K UHD display", "HDR10 support", "99% sRGB color accuracy", "USB-C with 65W charging", "Height adjustable stand"],
+                "stock": 56
+            },
+            {
+                "id": 8,
+                "name": "Mechanical Gaming Keyboard",
+                "price": 129.99,
+                "image": "/images/products/Keyboard.png",
+                "category": "Electronics",
+                "rating": 4.8,
+                "reviewCount": 3567,
+                "description": "Premium mechanical keyboard with hot-swappable switches, per-key RGB lighting, and aircraft-grade aluminum frame.",
+                "features": ["Hot-swappable switches", "Per-key RGB lighting", "Aluminum frame", "N-key rollover", "Detachable USB-C cable"],
+                "stock": 89
+            },
+            {
+                "id": 9,
+                "name": "Organic Face Serum",
+                "price": 45.00,
+                "image": "/images/products/Serum.png",
+                "category": "Beauty",
+                "rating": 4.9,
+                "reviewCount": 4521,
+                "description": "Luxurious organic face serum with vitamin C and hyaluronic acid. Brightens skin, reduces fine lines, and provides deep hydration.",
+                "features": ["Vitamin C and hyaluronic acid", "100% organic ingredients", "Cruelty-free", "Suitable for all skin types", "1 oz bottle"],
+                "stock": 167
+            },
+            {
+                "id": 10,
+                "name": "Running Shoes Gen 2",
+                "price": 89.95,
+                "image": "/images/products/Shoe.png",
+                "category": "Footwear",
+                "rating": 4.3,
+                "reviewCount": 2789,
+                "description": "Lightweight running shoes with responsive cushioning and breathable mesh upper. Designed for comfort on long runs.",
+                "features": ["Responsive foam cushioning", "Breathable mesh upper", "Rubber outsole for grip", "Reflective details", "Available in 8 colors"],
+                "stock": 145
+            },
+        ]
+        
+        self.load_catalog(Item(**p) for p in products)
+
+    @lock_owner
+    def load_catalog(self, items: Iterable[Item], details: Optional[FeedDetails] = None):
+        """
+        Replace the whole catalog in one go and rebuild the indexes.
+        `details` is for items loaded without descriptions/features
+        (catalog_feed.load_feed with lazy=True).
+        """
+        items = {item.id: item for item in items}
+        with self._catalog_lock:
+            self.items = items
+            self.index = CatalogIndex.build(self.items.values())
+            self.encoded = EncodedCatalog()
+            self._set_details(details)
+            self.catalog_version += 1
+
+    @lock_owner
+    def upsert_item(self, item: Item):
+        """
+        Add or replace a product, keeping the search indexes in step.
+        """
+        with self._catalog_lock:
+            self.items[item.id] = item
+            self.index.upsert(item)
+            self.encoded.invalidate(item.id)
+            if self.details is not None:
+                self.details.forget(item.id)
+            self.catalog_version += 1
+
+    @lock_owner
+    def remove_item(self, item_id: int):
+        """
+        Drop a product from the catalog. Carts holding it lose that line
+        next time they're touched.
+        """
+        with self._catalog_lock:
+            if item_id not in self.items:
+                raise ValueError(f"Item {item_id} not found")
+            del self.items[item_id]
+            self.index.remove(item_id)
+            self.encoded.invalidate(item_id)
+            if self.details is not None:
+                self.details.forget(item_id)
+            self.catalog_version += 1
+
+    @lock_owner
+    def apply_catalog_delta(self, upserts: List[Item], deletes: List[int]) -> int:
+        """
+        Add/replace `upserts` and drop `deletes` (unknown ids are ignored)
+        as one catalog change, for delta feeds. Returns how many were
+        actually deleted.
+        """
+        with self._catalog_lock:
+            deleted = [item_id for item_id in deletes if item_id in self.items]
+            for item_id in deleted:
+                del self.items[item_id]
+            for item in upserts:
+                self.items[item.id] = item
+            self.index.bulk_update(upserts, deleted)
+            for item_id in [*deleted, *(item.id for item in upserts)]:
+                self.encoded.invalidate(item_id)
+                if self.details is not None:
+                    self.details.forget(item_id)
+            self.catalog_version += 1
+        return len(deleted)
+
+    @lock_owner
+    def search_products(self, **filters) -> Tuple[List[Item], Optional[str]]:
+        """
+        One page of products from the catalog index.
+        See CatalogIndex.search for the filters.
+        """
+        with self._catalog_lock:
+            return self.index.search(**filters)
+
+    @lock_owner
+    def product_json(self, item_id: int) -> Optional[Tuple[str, bytes]]:
+        """
+        (etag, encoded bytes) for one product, or None if it doesn't exist.
+        """
+        with self._catalog_lock:
+            item = self.items.get(item_id)
+            if item is None:
+                return None
+            return self.encoded.item(item, self._full_item if self.details is not None else None)
+
+    @lock_owner
+    def product_page_json(self, **filters) -> Tuple[str, bytes]:
+        """
+        (etag, encoded bytes) for a page of search results.
+        Same filters as search_products.
+        """
+        with self._catalog_lock:
+            key = (self.catalog_version, tuple(sorted(filters.items())))
+            return self.encoded.page(key, lambda: self.index.search(**filters))
+
+    def _price_cents(self, item_id: int) -> Optional[int]:
+        item = self.items.get(item_id)
+        return to_cents(item.price) if item else None
+
+    def _category(self, item_id: int) -> str:
+        # for the sales rollups, taken at checkout time
+        item = self.items.get(item_id)
+        return item.category if item else "unknown"
+
+    def _product_name(self, item_id: int) -> Optional[str]:
+        item = self.items.get(item_id)
+        return item.name if item else None
+
+    # Carts, orders and discount codes. Each backend implements these.
+
+    @abstractmethod
+    def reset(self):
+        """
+        Wipe all state back to an empty store. Handy for tests.
+        """
+
+    @abstractmethod
+    def get_cart(self, user_id: str) -> Cart: ...
+
+    @abstractmethod
+    def get_priced_cart(self, user_id: str) -> PricedCart: ...
+
+    def get_cart_data(self, user_id: str, priced: bool = False) -> Dict:
+        """
+        get_cart (or get_priced_cart) as plain dicts, ready for
+        FastJSONResponse. Backends override this to skip the models.
+        """
+        return (self.get_priced_cart if priced else self.get_cart)(user_id).model_dump()
+
+    @abstractmethod
+    def add_to_cart(self, user_id: str, item_id: int, quantity: int): ...
+
+    @abstractmethod
+    def remove_from_cart(self, user_id: str, item_id: int): ...
+
+    @abstractmethod
+    def apply_cart_batch(self, user_id: str, operations: List[CartOperation]) -> Cart:
+        """
+        Apply add/set/remove ops in order, atomically. Returns the new cart.
+        Raises ValueError (and changes nothing) if any op is invalid.
+        """
+
+    @abstractmethod
+    def checkout(self, user_id: str, discount_code: Optional[str] = None) -> Order: ...
+
+    @abstractmethod
+    def generate_discount_code(self) -> Optional[str]:
+        """
+        The code for the latest order, if it was an nth order and the code
+        is still unused. Codes are issued by the event pipeline (see
+        _apply_events), this waits for it to catch up first.
+        """
+
+    def _milestone(self, order_number: int) -> Optional[str]:
+        if order_number > 0 and order_number % self.nth_order_trigger == 0:
+            return milestone_code(order_number)
+        return None
+
+    def _handle_events(self, events: List[Dict]):
+        # the pipeline's consumer: apply, then write down what happened.
+        # only what this attempt applied, so a batch that fails halfway and
+        # is retried gets each event (and its code) audited exactly once
+        applied: List[Tuple[Dict, Optional[str]]] = []
+        try:
+            self._apply_events(events, applied)
+        finally:
+            if self.audit is not None and applied:
+                records = [
+                    {"type": "order_placed", "at": event["created_at"], "order_id": event["order_id"],
+                     "user_id": event["user_id"], "final_amount": event["final_amount"],
+                     "discount_code": event["discount_code"]}
+                    for event, _ in applied
+                ]
+                records.extend({"type": "discount_issued", "order_id": event["order_id"], "code": code}
+                               for event, code in applied if code)
+                self.audit.write(records)
+
+    @abstractmethod
+    def _apply_events(self, events: List[Dict], applied: List[Tuple[Dict, Optional[str]]]):
+        """
+        Handle a batch of order_placed events (events.order_placed): add
+        them to the sales rollups and issue a code for every nth order.
+        Appends (event, code or None) to `applied` for each event once it
+        has stuck, so if this raises partway `applied` is what got done.
+        Events an earlier attempt already applied are skipped.
+        """
+
+    @abstractmethod
+    def add_discount_code(self, code: str):
+        """
+        Register a code directly, bypassing the nth order rule.
+        """
+
+    @abstractmethod
+    def validate_discount_code(self, code: str) -> bool: ...
+
+    @abstractmethod
+    def get_order(self, order_id: int) -> Dict:
+        """
+        One order as plain dicts. Raises ValueError if there's no such order.
+        """
+
+    @abstractmethod
+    def _order_page(self, user_id: str, before_id: Optional[int], limit: int) -> Tuple[List[Dict], bool]:
+        """
+        Up to `limit` of a user's orders with ids below `before_id` (all of
+        them if None), newest first, plus whether there are older ones.
+        """
+
+    def list_orders(self, user_id: str, cursor: Optional[str] = None, limit: int = 20) -> Dict:
+        """
+        One page of a user's order history, newest first. The cursor is the
+        last order id of the previous page, so a page costs the same however
+        far back it is. Raises ValueError for a bad cursor.
+        """
+        before_id = None
+        if cursor:
+            key = decode_cursor(cursor, "orders")
+            if len(key) != 1 or not isinstance(key[0], int):
+                raise ValueError("Invalid cursor")
+            before_id = key[0]
+        orders, more = self._order_page(user_id, before_id, limit)
+        next_cursor = encode_cursor("orders", (orders[-1]["id"],)) if more and orders else None
+        return {"items": orders, "next_cursor": next_cursor}
+
+    @abstractmethod
+    def export_orders(self, since_id: int = 0, batch_size: int = 1000) -> Tuple[int, Iterator[List[Dict]]]:
+        """
+        Every order with an id above `since_id`, oldest first, as batches of
+        plain dicts (same shape as get_order). Which orders are in it is
+        fixed when this is called, orders placed while the batches are read
+        aren't. Returns (last id, batches): pass the last id back as
+        since_id to get only what's new. No lock or connection is held
+        between batches.
+        """
+
+    @abstractmethod
+    def stock_level(self, item_id: int) -> Dict:
+        """
+        Live stock for one item: on_hand, reserved and available.
+        Item.stock in the catalog is only the level it was loaded with.
+        Raises ValueError for an unknown item.
+        """
+
+    @abstractmethod
+    def get_stats(self) -> Dict: ...
+
+    @abstractmethod
+    def stats_version(self) -> int:
+        """
+        Changes whenever get_stats would (it's the order count in the
+        totals). Cheap, so the stats stream can check it every interval.
+        """
+
+    @abstractmethod
+    def verify_stats(self) -> Dict: ...
+
+    @abstractmethod
+    def sales_rollup(self, start: float, end: float, resolution: str, group_by: str) -> List[Dict]:
+        """
+        Pre-aggregated sales for [start, end) (unix seconds), per
+        minute/hour/day bucket or summed per product/category. See
+        sales_rollups. Raises ValueError for a bad resolution, group_by
+        or range.
+        """
+
+    @abstractmethod
+    def lock_stats(self) -> Dict: ...
+
+    @abstractmethod
+    def gauges(self) -> Dict[str, int]:
+        """
+        Current sizes for /metrics: carts, orders, live discount codes.
+        """
+
+    def counters(self) -> Dict[str, int]:
+        """
+        Running totals for /metrics, exported as `store_<name>_total`.
+        """
+        events = self.events
+        return {
+            "async_fallbacks": self.async_fallbacks,
+            "events_published": events.published,
+            "events_processed": events.processed,
+            "events_failed": events.failed,
+            "event_retries": events.retries,
+            "event_backpressure_waits": events.backpressure_waits,
+            "event_backpressure_seconds": events.backpressure_seconds,
+        }
+
+    def evict_carts(self, idle_seconds: float, max_carts: int, now: Optional[float] = None) -> Dict:
+        """
+        Drop abandoned carts. Only does anything for backends that keep
+        carts in memory; a database can hold them, and nothing is evicted.
+        """
+        return {"evicted_idle": 0, "evicted_lru": 0, "bytes_reclaimed": 0}
+
+    def instrumented_locks(self) -> Dict[str, object]:
+        """
+        Locks whose per-method wait/hold times go out on /metrics,
+        by name. Anything with a `method_stats()` counts.
+        """
+        return {"catalog": self._catalog_lock}
+
+    def close(self):
+        """
+        Release any resources (connections etc). No-op by default.
+        """
+
+    # Async versions for the event loop.
+
+    @contextmanager
+    def deferred_durability(self, pending: List[int]):
+        """
+        Inside this block, writes don't wait for their journal fsync on this
+        thread, they put the seq to wait for in `pending` instead.
+        Nothing to wait for by default.
+        """
+        yield
+
+    async def wait_durable_async(self, seq: int):
+        pass
+
+    async def _run_async(self, method, *args):
+        """
+        Run a store method from the event loop.
+
+        Backends that don't do I/O run it right here, no thread hop. Locks
+        are in no_wait mode, so if another thread holds one (a snapshot, a
+        sync admin route) the call bails out before touching anything and
+        is redone on a worker thread instead of stalling the loop.
+        Journal fsyncs are awaited rather than blocked on.
+        """
+        if self.blocking_io:
+            return await asyncio.to_thread(method, *args)
+        pending: List[int] = []
+        try:
+            with no_wait(), self.deferred_durability(pending):
+                result = method(*args)
+        except WouldBlock:
+            self.async_fallbacks += 1
+            return await asyncio.to_thread(method, *args)
+        if pending:
+            await self.wait_durable_async(max(pending))
+        return result
+
+    async def get_cart_async(self, user_id: str) -> Cart:
+        return await self._run_async(self.get_cart, user_id)
+
+    async def get_priced_cart_async(self, user_id: str) -> PricedCart:
+        return await self._run_async(self.get_priced_cart, user_id)
+
+    async def get_cart_data_async(self, user_id: str, priced: bool = False) -> Dict:
+        return await self._run_async(self.get_cart_data, user_id, priced)
+
+    async def add_to_cart_async(self, user_id: str, item_id: int, quantity: int):
+        return await self._run_async(self.add_to_cart, user_id, item_id, quantity)
+
+    async def remove_from_cart_async(self, user_id: str, item_id: int):
+        return await self._run_async(self.remove_from_cart, user_id, item_id)
+
+    async def apply_cart_batch_async(self, user_id: str, operations: List[CartOperation]) -> Cart:
+        return await self._run_async(self.apply_cart_batch, user_id, operations)
+
+    async def checkout_async(self, user_id: str, discount_code: Optional[str] = None) -> Order:
+        return await self._run_async(self.checkout, user_id, discount_code)
+
+    async def validate_discount_code_async(self, code: str) -> bool:
+        return await self._run_async(self.validate_discount_code, code)
+
+    async def get_order_async(self, order_id: int) -> Dict:
+        return await self._run_async(self.get_order, order_id)
+
+    async def list_orders_async(self, user_id: str, cursor: Optional[str] = None, limit: int = 20) -> Dict:
+        return await self._run_async(self.list_orders, user_id, cursor, limit)
+
+def create_store(settings) -> Storage:
+    """
+    Build the backend picked by settings.STORE_BACKEND.
+    Imports are inside so this module doesn't depend on the backends.
+    """
+    if settings.STORE_BACKEND == "memory":
+        from store import InMemoryStore
+        registry = None
+        if settings.SHARED_STATE_DIR:
+            from shared_state import SharedRegistry
+            registry = SharedRegistry(settings.SHARED_STATE_DIR)
+        store = InMemoryStore(lock_stripes=settings.LOCK_STRIPES, registry=registry)
+    elif settings.STORE_BACKEND == "sqlite":
+        from sqlite_store import SQLiteStore
+        store = SQLiteStore(settings.SQLITE_PATH, pool_size=settings.SQLITE_POOL_SIZE)
+    elif settings.STORE_BACKEND == "sharded":
+        # the shard processes apply the events, the router would never write a line
+        if settings.AUDIT_LOG:
+            raise ValueError("AUDIT_LOG isn't supported with STORE_BACKEND 'sharded'")
+        from sharding import ShardedStore
+        store = ShardedStore(settings.SHARD_DIR or None, settings.SHARDS,
+                             spawn=settings.SHARD_SPAWN, lock_stripes=settings.LOCK_STRIPES)
+    else:
+        raise ValueError(f"Unknown STORE_BACKEND '{settings.STORE_BACKEND}'")
+    store.reservation_seconds = settings.CART_RESERVATION_SECONDS
+    store.events.capacity = settings.EVENT_QUEUE_SIZE
+    return store
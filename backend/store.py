@@ -1,8 +1,22 @@
-from typing import List, Dict, Optional
+from typing import Iterable, Iterator, List, Dict, Optional, Tuple
+from bisect import bisect_right
+from collections import OrderedDict
+from contextlib import ExitStack, contextmanager
+import sys
 import threading
-from models import Item, Order, DiscountCode, Cart, CartItem
+import time
+from models import Item, Order, Cart, CartOperation, PricedCart
+from locks import CountedLock, StripedLock, blocking, lock_owner
+from carts import CartState, check_cart_ops, to_cents
+from storage import Storage, StatsAccumulator
+from shared_state import LocalRegistry
+from order_log import OrderLog
+from sales_rollups import SalesRollups
+from inventory import Inventory
+from catalog_feed import FeedDetails
+from events import order_placed
 
-class InMemoryStore:
+class InMemoryStore(Storage):
     """
     In-memory storage for the app state.
     
@@ -11,283 +25,686 @@ class InMemoryStore:
     easier to run locally.
     
     couple things to note:
-    1. if you restart the server, data is gone.
-    2. uses a lock for thread-safety with multiple workers.
+    1. on its own, restarting the server loses everything. set JOURNAL_DIR
+       and persistence.py journals every mutation and snapshots the store,
+       so it can be rebuilt on startup.
+    2. locking is split up for thread-safety:
+       - the catalog and its search indexes have their own lock (see Storage).
+       - carts are guarded by a striped lock keyed on user_id, so
+         users who don't share a stripe never wait on each other.
+       - the shared bits (order counter, discount codes, order log, stats)
+         sit behind one small lock.
+       - stock has a lock per item (see inventory.Inventory).
+       a cart stripe is always taken before either of the others, and an
+       item lock is never held while taking anything else.
+    3. checkout publishes an order_placed event and the sales rollups and
+       nth-order codes are done by the event consumer (see events.py).
+       `_events_applied` is the seq of the last event it applied, so a
+       snapshot knows which queued events it still has to carry.
     """
-    def __init__(self):
-        self._lock = threading.RLock()  # reentrant lock for thread-safety
-        self.items: Dict[int, Item] = {}
+    def __init__(self, lock_stripes: int = 64, registry=None, inventory=None):
+        # order counter + discount codes. None means plain in-process state,
+        # pass a shared_state.SharedRegistry to share them across workers.
+        self._shared_registry = registry
+        self._cart_locks = StripedLock(lock_stripes)
+        self._lock = CountedLock()  # shared state only, keep these sections short
+        # stock. a shard (see sharding.py) passes one that lives in the owner process
+        self.inventory = inventory or Inventory(lock_stripes)
+        # those wait on other processes (flock, SQLite's busy timeout, a
+        # socket), which no_wait can't cut short, so async calls go to a thread
+        self.blocking_io = bool(registry is not None and registry.shared) or inventory is not None
+        super().__init__()
+        # set by persistence.Persistence when journaling is on
+        self.journal = None
+        # per-thread list of journal seqs to hand back instead of waiting on
+        # (see deferred_durability)
+        self._deferred = threading.local()
+        self._events_applied: int = 0
+        self.reset()
+
+    def reset(self):
+        """
+        Wipe all state back to an empty store. Handy for tests.
+        """
+        self.reset_catalog()
+        self.inventory.load({})
         
         # using a simple user_id string as the key here.
         # usually this would be linked to a real user table/auth token.
-        self.carts: Dict[str, Cart] = {}
-        self.orders: List[Order] = []
-        self.discount_codes: Dict[str, DiscountCode] = {}
+        # kept in least-recently-touched order so evict_carts only has to
+        # look at the front.
+        self.carts: "OrderedDict[str, CartState]" = OrderedDict()
+        # columnar, Order objects are only built when one is asked for
+        self.orders = OrderLog()
         
-        # tracking order counts to trigger the nth order discount
-        self.order_count: int = 0
+        # tracking order counts to trigger the nth order discount, plus the
+        # live discount codes. a shared registry is left alone here, it
+        # belongs to every worker.
+        self.registry = self._shared_registry or LocalRegistry()
         self.nth_order_trigger: int = 3 # generating a code every 3rd order for testing
         
-    def seed_data(self):
-        """
-        Loading up default products with full details.
-        Images served from backend at /static/products/.
-        """
-        products = [
-            {
-                "id": 1,
-                "name": "Wireless Noise-Canceling Headphones",
-                "price": 299.99,
-                "originalPrice": 349.99,
-                "image": "/static/products/Headphones.png",
-                "category": "Electronics",
-                "rating": 4.8,
-                "reviewCount": 2847,
-                "description": "Experience immersive sound with our premium wireless headphones featuring advanced noise-canceling technology. Perfect for music lovers, travelers, and remote workers who demand crystal-clear audio.",
-                "features": ["Active Noise Cancellation", "40-hour battery life", "Bluetooth 5.2", "Premium memory foam ear cushions", "Foldable design for travel"],
-                "stock": 45,
-                "sale": True
-            },
-            {
-                "id": 2,
-                "name": "Smart Fitness Watch Pro",
-                "price": 199.50,
-                "image": "/static/products/Smartwatch.png",
-                "category": "Electronics",
-                "rating": 4.5,
-                "reviewCount": 1523,
-                "description": "Track your health and fitness goals with precision. This advanced smartwatch monitors heart rate, sleep patterns, and over 100 workout modes.",
-                "features": ["Heart rate monitoring", "GPS tracking", "Water resistant to 50m", "7-day battery life", "Compatible with iOS and Android"],
-                "stock": 78
-            },
-            {
-                "id": 3,
-                "name": "Ergonomic Office Chair",
-                "price": 450.00,
-                "image": "/static/products/Chair.png",
-                "category": "Furniture",
-                "rating": 4.9,
-                "reviewCount": 892,
-                "description": "Designed for all-day comfort, this ergonomic chair features adjustable lumbar support, breathable mesh back, and customizable armrests.",
-                "features": ["Adjustable lumbar support", "Breathable mesh back", "4D armrests", "Recline up to 135 degrees", "Supports up to 300 lbs"],
-                "stock": 23
-            },
-            {
-                "id": 4,
-                "name": "Premium Cotton T-Shirt",
-                "price": 25.00,
-                "image": "/static/products/Shirt.png",
-                "category": "Clothing",
-                "rating": 4.2,
-                "reviewCount": 3421,
-                "description": "Ultra-soft 100% organic cotton t-shirt with a modern fit. Pre-shrunk and machine washable for easy care.",
-                "features": ["100% organic cotton", "Pre-shrunk fabric", "Reinforced seams", "Available in 12 colors", "Sizes XS-3XL"],
-                "stock": 156
-            },
-            {
-                "id": 5,
-                "name": "Stainless Steel Water Bottle",
-                "price": 35.00,
-                "image": "/static/products/Bottle.png",
-                "category": "Accessories",
-                "rating": 4.7,
-                "reviewCount": 2156,
-                "description": "Double-walled vacuum insulated water bottle keeps drinks cold for 24 hours or hot for 12 hours. BPA-free and eco-friendly.",
-                "features": ["24-hour cold / 12-hour hot", "Double-wall insulation", "BPA-free", "Leak-proof lid", "32 oz capacity"],
-                "stock": 234
-            },
-            {
-                "id": 6,
-                "name": "Leather Weekend Bag",
-                "price": 150.00,
-                "originalPrice": 199.00,
-                "image": "/static/products/Bag.png",
-                "category": "Accessories",
-                "rating": 4.6,
-                "reviewCount": 678,
-                "description": "Handcrafted genuine leather weekend bag with spacious interior and multiple compartments. Perfect for short trips and gym sessions.",
-                "features": ["Genuine full-grain leather", "Padded laptop sleeve", "Multiple pockets", "Detachable shoulder strap", "Brass hardware"],
-                "stock": 34,
-                "sale": True
-            },
-            {
-                "id": 7,
-                "name": "4K Ultra HD Monitor",
-                "price": 399.99,
-                "image": "/static/products/Monitor.png",
-                "category": "Electronics",
-                "rating": 4.4,
-                "reviewCount": 1892,
-                "description": "27-inch 4K UHD monitor with HDR support, perfect for content creators, gamers, and professionals who demand accurate colors.",
-                "features": ["27-inch 4K UHD display", "HDR10 support", "99% sRGB color accuracy", "USB-C with 65W charging", "Height adjustable stand"],
-                "stock": 56
-            },
-            {
-                "id": 8,
-                "name": "Mechanical Gaming Keyboard",
-                "price": 129.99,
-                "image": "/static/products/Keyboard.png",
-                "category": "Electronics",
-                "rating": 4.8,
-                "reviewCount": 3567,
-                "description": "Premium mechanical keyboard with hot-swappable switches, per-key RGB lighting, and aircraft-grade aluminum frame.",
-                "features": ["Hot-swappable switches", "Per-key RGB lighting", "Aluminum frame", "N-key rollover", "Detachable USB-C cable"],
-                "stock": 89
-            },
-            {
-                "id": 9,
-                "name": "Organic Face Serum",
-                "price": 45.00,
-                "image": "/static/products/Serum.png",
-                "category": "Beauty",
-                "rating": 4.9,
-                "reviewCount": 4521,
-                "description": "Luxurious organic face serum with vitamin C and hyaluronic acid. Brightens skin, reduces fine lines, and provides deep hydration.",
-                "features": ["Vitamin C and hyaluronic acid", "100% organic ingredients", "Cruelty-free", "Suitable for all skin types", "1 oz bottle"],
-                "stock": 167
-            },
-            {
-                "id": 10,
-                "name": "Running Shoes Gen 2",
-                "price": 89.95,
-                "image": "/static/products/Shoe.png",
-                "category": "Footwear",
-                "rating": 4.3,
-                "reviewCount": 2789,
-                "description": "Lightweight running shoes with responsive cushioning and breathable mesh upper. Designed for comfort on long runs.",
-                "features": ["Responsive foam cushioning", "Breathable mesh upper", "Rubber outsole for grip", "Reflective details", "Available in 8 colors"],
-                "stock": 145
-            },
-        ]
+        # running totals so /admin/stats doesn't have to scan every order
+        self.stats = StatsAccumulator()
+        # the same per minute/hour/day and per product/category, for range queries
+        self.rollups = SalesRollups()
+
+        # eviction counters, for /metrics
+        self.carts_evicted_idle: int = 0
+        self.carts_evicted_lru: int = 0
+        self.cart_bytes_reclaimed: int = 0
         
-        for p in products:
-            self.items[p["id"]] = Item(**p)
+    # stock levels follow the catalog: loading or replacing an item sets
+    # its stock to Item.stock
+
+    @lock_owner
+    def load_catalog(self, items: Iterable[Item], details: Optional[FeedDetails] = None):
+        items = list(items)
+        super().load_catalog(items, details)
+        self.inventory.load({item.id: item.stock for item in items})
+
+    @lock_owner
+    def upsert_item(self, item: Item):
+        super().upsert_item(item)
+        self.inventory.set_stock(item.id, item.stock)
 
+    @lock_owner
+    def remove_item(self, item_id: int):
+        super().remove_item(item_id)
+        self.inventory.remove(item_id)
+
+    @lock_owner
+    def apply_catalog_delta(self, upserts: List[Item], deletes: List[int]) -> int:
+        deleted = super().apply_catalog_delta(upserts, deletes)
+        for item_id in deletes:
+            self.inventory.remove(item_id)
+        for item in upserts:
+            self.inventory.set_stock(item.id, item.stock)
+        return deleted
+
+    @lock_owner
+    def stock_level(self, item_id: int) -> Dict:
+        if item_id not in self.items:
+            raise ValueError(f"Item {item_id} not found")
+        on_hand, available = self.inventory.level(item_id)
+        return {"item_id": item_id, "on_hand": on_hand, "reserved": on_hand - available, "available": available}
+
+    def _cart_state(self, user_id: str, create: bool = True) -> Optional[CartState]:
+        # creates a new cart if this user id hasn't been seen before (unless
+        # create is False, then it's None). every access counts as a touch
+        # for eviction. callers must hold the user's cart stripe.
+        cart = self.carts.get(user_id)
+        if cart is None:
+            if not create:
+                return None
+            cart = self.carts[user_id] = CartState(self.catalog_version)
+        else:
+            if cart.catalog_version != self.catalog_version:
+                cart.reprice(self._price_cents, self.catalog_version)
+            self.carts.move_to_end(user_id)
+            cart.touched = time.monotonic()
+        return cart
+
+    def _drop_if_empty(self, user_id: str, cart: CartState):
+        # an empty cart reads the same as no cart, so don't keep it around
+        if not cart.lines:
+            self.carts.pop(user_id, None)
+
+    @lock_owner
     def get_cart(self, user_id: str) -> Cart:
-        # creates a new cart if this user id hasn't been seen before
-        with self._lock:
-            if user_id not in self.carts:
-                self.carts[user_id] = Cart(items=[])
-            return self.carts[user_id]
+        # reads never create a cart, otherwise every anonymous visitor
+        # would leave one behind
+        with self._cart_locks.for_key(user_id):
+            cart = self._cart_state(user_id, create=False)
+            return cart.to_cart() if cart else Cart()
+
+    @lock_owner
+    def get_priced_cart(self, user_id: str) -> PricedCart:
+        """
+        Cart with item count and subtotal, straight from the cached totals.
+        """
+        with self._cart_locks.for_key(user_id):
+            cart = self._cart_state(user_id, create=False)
+            return cart.priced() if cart else PricedCart()
         
+    @lock_owner
+    def get_cart_data(self, user_id: str, priced: bool = False) -> Dict:
+        with self._cart_locks.for_key(user_id):
+            cart = self._cart_state(user_id, create=False)
+            if cart:
+                return cart.to_data(priced)
+        return {"items": [], "item_count": 0, "subtotal": 0.0} if priced else {"items": []}
+
+    @lock_owner
     def add_to_cart(self, user_id: str, item_id: int, quantity: int):
         """
         Add item logic.
-        Just checking if the item exists, then updating quantity.
-        Skipping inventory checks for now to keep it simple.
+        Checks the item exists, then updates the quantity. Stock is only
+        checked here when reservations are on, otherwise checkout does it.
         """
-        with self._lock:
-            cart = self.get_cart(user_id)
-            
+        with self._cart_locks.for_key(user_id):
             if item_id not in self.items:
                 raise ValueError(f"Item {item_id} not found")
                 
-            existing_item = next((item for item in cart.items if item.item_id == item_id), None)
-            
-            if existing_item:
-                existing_item.quantity += quantity
-                # remove it if quantity goes to zero or less
-                if existing_item.quantity <= 0:
-                    cart.items.remove(existing_item)
-            else:
-                if quantity > 0:
-                    cart.items.append(CartItem(item_id=item_id, quantity=quantity))
+            cart = self._cart_state(user_id, create=False)
+            if self.reservation_seconds:
+                # before creating or touching the cart, so running out (or a
+                # busy item lock under no_wait) leaves it as it was
+                line = cart.lines.get(item_id) if cart else None
+                wanted = max(0, (line.quantity if line else 0) + quantity)
+                self.inventory.reserve(user_id, {item_id: wanted}, self.reservation_seconds)
+            cart = cart or self._cart_state(user_id)
+            cart.add(item_id, quantity, to_cents(self.items[item_id].price))
+            self._drop_if_empty(user_id, cart)
+            seq = self._journal_append({"op": "cart_add", "user_id": user_id, "item_id": item_id, "quantity": quantity})
+        self._journal_wait(seq)
 
+    @lock_owner
     def remove_from_cart(self, user_id: str, item_id: int):
         """
         Remove an item completely from the cart.
         """
-        with self._lock:
-            cart = self.get_cart(user_id)
-            existing_item = next((item for item in cart.items if item.item_id == item_id), None)
-            
-            if not existing_item:
+        with self._cart_locks.for_key(user_id):
+            cart = self._cart_state(user_id, create=False)
+            if cart is None or item_id not in cart.lines:
                 raise ValueError(f"Item {item_id} not in cart")
             
-            cart.items.remove(existing_item)
+            # hold first: under no_wait it's the call that can bail out,
+            # and then the line has to still be there for the retry
+            if self.reservation_seconds:
+                self.inventory.release(user_id, (item_id,))
+            cart.remove(item_id)
+            self._drop_if_empty(user_id, cart)
+            seq = self._journal_append({"op": "cart_remove", "user_id": user_id, "item_id": item_id})
+        self._journal_wait(seq)
                 
+    @lock_owner
+    def apply_cart_batch(self, user_id: str, operations: List[CartOperation]) -> Cart:
+        """
+        Several cart changes under one stripe acquisition and one journal
+        record. Everything is checked up front, so either all of it
+        applies or none of it does.
+        """
+        with self._cart_locks.for_key(user_id):
+            cart = self._cart_state(user_id, create=False)
+            current = cart.quantities() if cart else {}
+            after = check_cart_ops(current, operations, self.items.__contains__)
+            if self.reservation_seconds:
+                touched = {operation.item_id for operation in operations}
+                self.inventory.reserve(
+                    user_id, {item_id: after.get(item_id, 0) for item_id in touched}, self.reservation_seconds
+                )
+            cart = cart or self._cart_state(user_id)
+            cart.apply(operations, self._price_cents)
+            self._drop_if_empty(user_id, cart)
+            seq = self._journal_append({
+                "op": "cart_batch",
+                "user_id": user_id,
+                "operations": [operation.model_dump() for operation in operations]
+            })
+            result = cart.to_cart()
+        self._journal_wait(seq)
+        return result
+
+    @lock_owner
     def checkout(self, user_id: str, discount_code: Optional[str] = None) -> Order:
         """
         Validation and order creation.
         Calculates the final total, applies any discounts, transfers the 
         items to an Order object, and then wipes the cart.
         """
-        with self._lock:
-            cart = self.get_cart(user_id)
-            if not cart.items:
+        # backpressure: a full event queue holds checkouts here, before any lock
+        self.events.wait_for_room()
+        with self._cart_locks.for_key(user_id):
+            cart = self._cart_state(user_id, create=False)
+            if cart is None or not cart.lines:
                 raise ValueError("Cart is empty")
                 
-            total_amount = 0.0
-            for cart_item in cart.items:
-                item = self.items[cart_item.item_id]
-                total_amount += item.price * cart_item.quantity
+            # all or nothing, per-item locks only. anything that fails
+            # after this has to put the stock back
+            quantities = cart.quantities()
+            self.inventory.commit(user_id, quantities)
+
+            # the cart keeps its own running subtotal, no need to walk it again
+            total_amount = cart.subtotal
+            sale_lines = [
+                (item_id, line.quantity, cart.unit_cents[item_id], self._category(item_id))
+                for item_id, line in cart.lines.items()
+            ]
                 
-            discount_amount = 0.0
-            if discount_code:
-                if discount_code in self.discount_codes and self.discount_codes[discount_code].is_valid:
-                    discount_amount = total_amount * 0.10 # 10% off
-                    
-                    # requirements said code can be used once.
-                    # easiest way to enforce that is to just delete it after use.
-                    del self.discount_codes[discount_code]
-                else:
-                    raise ValueError("Invalid discount code")
-                    
-            final_amount = total_amount - discount_amount
-            
-            order = Order(
-                id=len(self.orders) + 1,
-                user_id=user_id,
-                items=list(cart.items), # copy the list so we have a snapshot
-                total_amount=total_amount,
-                discount_code=discount_code,
-                discount_amount=discount_amount,
-                final_amount=final_amount
-            )
-            
-            self.orders.append(order)
-            self.order_count += 1
+            try:
+                # only the shared bits need the global section
+                with self._lock:
+                    discount_amount = 0.0
+                    if discount_code:
+                        # consume_code does the one-time-use check and burns it in one go
+                        if self.registry.consume_code(discount_code):
+                            discount_amount = total_amount * 0.10 # 10% off
+                        else:
+                            raise ValueError("Invalid discount code")
+                        
+                    final_amount = total_amount - discount_amount
+                
+                    order = Order(
+                        # global order sequence, same numbering on every worker
+                        id=self.registry.next_order_number(),
+                        user_id=user_id,
+                        items=list(cart.lines.values()), # copy the list so we have a snapshot
+                        total_amount=total_amount,
+                        discount_code=discount_code,
+                        discount_amount=discount_amount,
+                        final_amount=final_amount,
+                        created_at=time.time()
+                    )
+                
+                    self.orders.append_order(order)
+                    # the running totals stay here, /admin/stats and verify read them with the order log
+                    self.stats.record(order)
+                    # log the finished order rather than the inputs, so replay
+                    # doesn't depend on catalog prices at replay time
+                    seq = self._journal_append({"op": "checkout", "order": order.model_dump(), "sales": sale_lines})
+                    # rollups and the nth-order code happen off the hot path, in order
+                    self.events.publish(order_placed(
+                        order.id, user_id, order.created_at, total_amount, final_amount,
+                        discount_amount, discount_code, sale_lines
+                    ))
+            except BaseException:
+                # blocking: inside no_wait a busy stripe would raise WouldBlock
+                # here and the stock would never come back
+                with blocking():
+                    self.inventory.uncommit(user_id, quantities, self.reservation_seconds)
+                raise
             
-            # empty the cart now that order is placed
-            cart.items = []
+            # the order is placed, the cart goes away entirely
+            del self.carts[user_id]
             
-            return order
+        self._journal_wait(seq)
+        return order
         
+    @lock_owner
     def generate_discount_code(self) -> Optional[str]:
         """
-        Checks if we hit the nth order milestone.
-        If we did, we generate a new code and store it.
+        Checks if we hit the nth order milestone. The event consumer has
+        already issued the code by then (or will have, once it catches up).
         """
+        self.events.wait_idle(timeout=1.0)
         with self._lock:
-            if self.order_count > 0 and self.order_count % self.nth_order_trigger == 0:
-                code = f"DISCOUNT10-{self.order_count}"
-                self.discount_codes[code] = DiscountCode(code=code)
-                return code
-            return None
+            code = self._milestone(self.order_count)
+            return code if code and self.registry.is_valid_code(code) else None
+
+    def _apply_event(self, event: Dict, issue_code: bool = True) -> Optional[str]:
+        # caller holds self._lock. the code first: a shared registry can fail,
+        # and then nothing of the event is applied yet
+        code = self._milestone(event["order_id"]) if issue_code else None
+        if code:
+            self.registry.add_code(code)
+        # journal records from before rollups have no sales lines
+        if event["sales"]:
+            self.rollups.record(
+                event["created_at"], event["sales"], event["total_amount"], event["final_amount"], event["discount_amount"]
+            )
+        return code
 
+    @lock_owner
+    def _apply_events(self, events: List[Dict], applied: List[Tuple[Dict, Optional[str]]]):
+        with self._lock:
+            for event in events:
+                # a batch the pipeline retries skips what the failed attempt got through
+                if event["seq"] <= self._events_applied:
+                    continue
+                code = self._apply_event(event)
+                self._events_applied = event["seq"]
+                applied.append((event, code))
+
+    @lock_owner
     def validate_discount_code(self, code: str) -> bool:
         """
         Check if a discount code exists and is valid.
         """
         with self._lock:
-            return code in self.discount_codes and self.discount_codes[code].is_valid
+            return self.registry.is_valid_code(code)
         
+    @lock_owner
+    def get_order(self, order_id: int) -> Dict:
+        with self._lock:
+            row = self.orders.row_of(order_id)
+            if row is None:
+                raise ValueError("Order not found")
+            return self.orders.order_data(row)
+
+    @lock_owner
+    def _order_page(self, user_id: str, before_id: Optional[int], limit: int) -> Tuple[List[Dict], bool]:
+        # page-sized work only, see OrderLog.user_page
+        with self._lock:
+            rows, more = self.orders.user_page(user_id, before_id, limit)
+            return [self.orders.order_data(row) for row in rows], more
+
+    @lock_owner
+    def export_orders(self, since_id: int = 0, batch_size: int = 1000) -> Tuple[int, Iterator[List[Dict]]]:
+        # rows below the length read here are never written again (see
+        # OrderLog), so the batches are read without the lock
+        with self._lock:
+            log, end = self.orders, len(self.orders)
+        start = bisect_right(log.ids, since_id, 0, end)
+        last_id = log.ids[end - 1] if end else 0
+        return max(last_id, since_id), self._export_batches(log, start, end, batch_size)
+
+    @staticmethod
+    def _export_batches(log: OrderLog, start: int, end: int, batch_size: int) -> Iterator[List[Dict]]:
+        for row in range(start, end, batch_size):
+            yield [log.order_data(r) for r in range(row, min(row + batch_size, end))]
+
+    @lock_owner
     def get_stats(self) -> Dict:
         """
-        Simple aggregation for the admin view.
+        Admin view, served straight from the running totals.
         """
         with self._lock:
-            total_items = sum(sum(item.quantity for item in order.items) for order in self.orders)
-            total_purchase = sum(order.final_amount for order in self.orders)
-            discount_list = [order.discount_code for order in self.orders if order.discount_code]
-            total_discount = sum(order.discount_amount for order in self.orders)
-            
-            return {
-                "total_orders": len(self.orders),
-                "total_items_purchased": total_items,
-                "total_purchase_amount": total_purchase,
-                "discount_codes": discount_list,
-                "total_discount_amount": total_discount
+            return self.stats.snapshot()
+
+    def stats_version(self) -> int:
+        # a plain int read, no lock needed
+        return self.stats.total_orders
+
+    @lock_owner
+    def verify_stats(self) -> Dict:
+        """
+        Consistency check for the running totals.
+        Recomputes everything from the order columns and reports any fields
+        where the accumulator has drifted.
+        """
+        with self._lock:
+            recomputed = StatsAccumulator.from_state(self.orders.totals())
+            mismatches = self.stats.diff(recomputed)
+            return {"consistent": not mismatches, "mismatches": mismatches}
+
+    @lock_owner
+    def sales_rollup(self, start: float, end: float, resolution: str, group_by: str) -> List[Dict]:
+        with self._lock:
+            return self.rollups.query(start, end, resolution, group_by, self._product_name)
+
+    def lock_stats(self) -> Dict:
+        """
+        Contention counters for tuning the stripe count.
+        Read without locking, so the numbers are approximate under load.
+        """
+        return {
+            "cart_locks": self._cart_locks.stats(),
+            "shared_lock": self._lock.stats(),
+            "catalog_lock": self._catalog_lock.stats(),
+            "inventory_locks": self.inventory._locks.stats(),
+            "async_fallbacks": self.async_fallbacks
+        }
+
+    def gauges(self) -> Dict[str, int]:
+        # len() on a dict is atomic, no need to stop writers for this
+        return {
+            "carts": len(self.carts),
+            "orders": len(self.orders),
+            "live_discount_codes": self.registry.live_code_count(),
+            "queued_events": self.events.depth
+        }
+
+    def counters(self) -> Dict[str, int]:
+        return {
+            **super().counters(),
+            "carts_evicted_idle": self.carts_evicted_idle,
+            "carts_evicted_lru": self.carts_evicted_lru,
+            "cart_bytes_reclaimed": self.cart_bytes_reclaimed,
+            "stock_rejections": self.inventory.rejected
+        }
+
+    def instrumented_locks(self) -> Dict[str, object]:
+        return {
+            **super().instrumented_locks(),
+            "cart": self._cart_locks, "shared": self._lock, "inventory": self.inventory._locks
+        }
+
+    @lock_owner
+    def add_discount_code(self, code: str):
+        with self._lock:
+            self.registry.add_code(code)
+
+    @property
+    def order_count(self) -> int:
+        return self.registry.current_order_count()
+
+    def close(self):
+        self.events.close()
+        self.registry.close()
+        self._set_details(None)
+
+    # Persistence hooks, used by persistence.Persistence.
+
+    def attach_journal(self, journal):
+        self.journal = journal
+
+    def _journal_append(self, record: Dict) -> Optional[int]:
+        # called while holding the locks that ordered the mutation,
+        # so journal order matches apply order
+        return self.journal.append(record) if self.journal else None
+
+    def _journal_wait(self, seq: Optional[int]):
+        # called after the locks are released, so other requests can
+        # join the same fsync
+        if seq is not None and self.journal:
+            pending = getattr(self._deferred, "pending", None)
+            if pending is not None:
+                pending.append(seq)
+            else:
+                self.journal.wait(seq)
+
+    @contextmanager
+    def deferred_durability(self, pending: List[int]):
+        self._deferred.pending = pending
+        try:
+            yield
+        finally:
+            self._deferred.pending = None
+
+    async def wait_durable_async(self, seq: int):
+        journal = self.journal
+        if journal:
+            await journal.wait_async(seq)
+
+    @contextmanager
+    def _all_carts_locked(self):
+        """
+        Hold every cart stripe, i.e. nobody else can touch self.carts.
+        """
+        with ExitStack() as stack:
+            for lock in self._cart_locks.all_stripes():
+                stack.enter_context(lock)
+            yield
+
+    @contextmanager
+    def _frozen(self):
+        """
+        Hold every cart stripe and the shared lock, i.e. stop all writes.
+        Same order as checkout (stripes first), so it can't deadlock with it.
+        """
+        with self._all_carts_locked(), self._lock:
+            yield
+
+    @lock_owner
+    def evict_carts(self, idle_seconds: float, max_carts: int, now: Optional[float] = None, batch: int = 1000) -> Dict:
+        """
+        Drop carts nobody has touched for `idle_seconds`, then the least
+        recently touched ones until at most `max_carts` are left.
+
+        self.carts is in touch order, so this only looks at the carts it
+        evicts (plus one), never the whole dict. It works in batches with
+        every cart stripe held, so cart requests stall for one batch at a
+        time at most.
+        """
+        now = time.monotonic() if now is None else now
+        result = {"evicted_idle": 0, "evicted_lru": 0, "bytes_reclaimed": 0}
+        while True:
+            with self._all_carts_locked():
+                victims = []
+                remaining = len(self.carts)
+                for user_id, cart in self.carts.items():
+                    if len(victims) == batch:
+                        break
+                    idle = now - cart.touched > idle_seconds
+                    if not idle and remaining <= max_carts:
+                        # everything after this was touched more recently
+                        break
+                    victims.append((user_id, idle))
+                    remaining -= 1
+                for user_id, idle in victims:
+                    cart = self.carts.pop(user_id)
+                    if self.reservation_seconds:
+                        self.inventory.release(user_id, list(cart.lines))
+                    result["bytes_reclaimed"] += cart.approx_bytes() + sys.getsizeof(user_id)
+                    result["evicted_idle" if idle else "evicted_lru"] += 1
+                if victims:
+                    # not waited on, losing an eviction in a crash just brings a cart back
+                    self._journal_append({"op": "cart_evict", "user_ids": [user_id for user_id, _ in victims]})
+            if len(victims) < batch:
+                break
+        self.carts_evicted_idle += result["evicted_idle"]
+        self.carts_evicted_lru += result["evicted_lru"]
+        self.cart_bytes_reclaimed += result["bytes_reclaimed"]
+        return result
+
+    @lock_owner
+    def export_state(self, journal=None) -> Tuple[Dict, int]:
+        """
+        Consistent copy of carts, orders and discount codes for a snapshot,
+        plus the journal seq it's current up to. Writes are only paused
+        long enough to copy references, the encoding happens after.
+        """
+        with self._frozen():
+            seq = journal.rotate() if journal else 0
+            # rows below this are never touched by later appends
+            order_rows_upto = len(self.orders)
+            carts = {
+                user_id: [[line.item_id, line.quantity] for line in cart.lines.values()]
+                for user_id, cart in self.carts.items() if cart.lines
             }
+            codes = self.registry.live_codes()
+            order_count = self.order_count
+            stats = self.stats.to_state()
+            # buckets are updated in place, so these get copied now
+            rollups = self.rollups.to_state()
+            stock = self.inventory.snapshot()
+            # published but not applied yet: their rollups and codes aren't
+            # in the copies above, so the snapshot carries the events
+            events = [event for event in self.events.pending() if event["seq"] > self._events_applied]
+
+        # orders are stored as plain rows, much smaller than a list of dicts
+        order_rows = self.orders.rows(order_rows_upto)
+        state = {
+            "order_count": order_count,
+            "discount_codes": codes,
+            "carts": carts,
+            "orders": order_rows,
+            "stats": stats,
+            "rollups": rollups,
+            "events": events,
+            # pairs, json would turn int keys into strings
+            "stock": [[item_id, quantity] for item_id, quantity in stock.items()]
+        }
+        return state, seq
+
+    @lock_owner
+    def import_state(self, state: Dict):
+        """
+        Load a snapshot made by export_state. Replaces carts, orders, codes
+        and stock levels, leaves the catalog alone.
+        """
+        with self._frozen():
+            self.orders = OrderLog.from_rows(state["orders"])
+            self.registry.restore(state["order_count"], state["discount_codes"])
+            self.stats = StatsAccumulator.from_state(state["stats"])
+            # older snapshots have none, their orders have no timestamps to bucket anyway
+            self.rollups = SalesRollups.from_state(state.get("rollups", {}))
+            for event in state.get("events", []):
+                self._apply_event(event, issue_code=not self.registry.shared)
+            if "stock" in state:
+                # only items still in the catalog, the rest keep their loaded level
+                stock = self.inventory.snapshot()
+                stock.update((item_id, quantity) for item_id, quantity in state["stock"] if item_id in stock)
+                self.inventory.load(stock)
+            self.carts = OrderedDict()
+            for user_id, lines in state["carts"].items():
+                cart = self._cart_state(user_id)
+                for item_id, quantity in lines:
+                    unit = self._price_cents(item_id)
+                    if unit is not None:
+                        cart.add(item_id, quantity, unit)
+                self._drop_if_empty(user_id, cart)
 
-store = InMemoryStore()
+    def apply_record(self, record: Dict):
+        """
+        Replay one journal record. Only used during recovery,
+        before the app starts serving.
+        """
+        op = record["op"]
+        if op == "cart_add":
+            unit = self._price_cents(record["item_id"])
+            if unit is not None:
+                cart = self._cart_state(record["user_id"])
+                cart.add(record["item_id"], record["quantity"], unit)
+                self._drop_if_empty(record["user_id"], cart)
+        elif op == "cart_remove":
+            cart = self._cart_state(record["user_id"], create=False)
+            if cart and record["item_id"] in cart.lines:
+                cart.remove(record["item_id"])
+                self._drop_if_empty(record["user_id"], cart)
+        elif op == "cart_batch":
+            # the catalog may have changed since, so skip what no longer fits
+            # instead of failing the whole replay
+            cart = self._cart_state(record["user_id"])
+            for operation in record["operations"]:
+                item_id = operation["item_id"]
+                if operation["op"] == "remove":
+                    if item_id in cart.lines:
+                        cart.remove(item_id)
+                    continue
+                unit = self._price_cents(item_id)
+                if unit is None:
+                    continue
+                if operation["op"] == "set":
+                    cart.set(item_id, operation["quantity"], unit)
+                else:
+                    cart.add(item_id, operation["quantity"], unit)
+            self._drop_if_empty(record["user_id"], cart)
+        elif op == "cart_evict":
+            for user_id in record["user_ids"]:
+                self.carts.pop(user_id, None)
+        elif op == "checkout":
+            # straight from the dict into the columns, no Order needed
+            order = record["order"]
+            code = order["discount_code"]
+            # a shared registry is on disk already, replaying into it would count twice
+            if not self.registry.shared:
+                if code:
+                    self.registry.consume_code(code)
+                self.registry.next_order_number()
+            lines = [(line["item_id"], line["quantity"]) for line in order["items"]]
+            created_at = order.get("created_at", 0)
+            self.orders.append(
+                order["id"], order["user_id"], lines,
+                order["total_amount"], code, order["discount_amount"], order["final_amount"], created_at
+            )
+            self.stats.add(
+                sum(quantity for _, quantity in lines),
+                order["total_amount"], order["final_amount"], order["discount_amount"], code
+            )
+            # what the event consumer did for it. older records have no
+            # sales lines, and a shared registry already has the code
+            self._apply_event(
+                order_placed(
+                    order["id"], order["user_id"], created_at, order["total_amount"], order["final_amount"],
+                    order["discount_amount"], code, record.get("sales", [])
+                ),
+                issue_code=not self.registry.shared
+            )
+            self.inventory.apply_sale(dict(lines))
+            self.carts.pop(order["user_id"], None)
+        elif op == "discount_created":
+            if not self.registry.shared:
+                self.registry.add_code(record["code"])
+        else:
+            raise ValueError(f"Unknown journal op '{op}'")
@@ -1,32 +1,53 @@
 from fastapi.testclient import TestClient
+import main
 from main import app
-from store import store
+from store import InMemoryStore
+from sqlite_store import SQLiteStore
 import pytest
+import time
+import images as images_module
+import asyncio
+import json
+from idempotency import IdempotencyCache
 
 # using TestClient which comes with FastAPI (via Starlette).
 # it lets us make requests against the app without actually running the server.
 # super fast for these kinds of unit tests.
 client = TestClient(app)
+store = main.store
 
 # FIXTURE EXPLANATION:
-# since we are using an in-memory store (just a global python object),
-# the state persists between tests. this means if test A adds an item,
+# the store is a global python object (main.store), so state would
+# persist between tests. this means if test A adds an item,
 # test B will see it, which causes flaky tests.
 #
-# this fixture runs automatically before every single test function to
-# wipe the slate clean. gives us a fresh store every time.
-@pytest.fixture(autouse=True)
-def run_around_tests():
-    # Setup: Reset everything to default
-    store.carts = {}
-    store.orders = []
-    store.discount_codes = {}
-    store.order_count = 0
-    store.items = {}
+# this fixture runs automatically before every single test function and
+# swaps in a brand new store. it's parametrized over the storage
+# backends, so every test runs once against each of them.
+@pytest.fixture(autouse=True, params=["memory", "sqlite"])
+def run_around_tests(request, tmp_path, monkeypatch):
+    global store
+    # Setup: fresh store for this backend
+    if request.param == "memory":
+        store = InMemoryStore()
+    else:
+        store = SQLiteStore(str(tmp_path / "store.db"))
+    monkeypatch.setattr(main, "store", store)
+    # idempotency keys belong to the old store's orders
+    monkeypatch.setattr(main, "checkouts", IdempotencyCache())
     # re-seed the items so we have products to buy
     store.seed_data()
     yield
-    # Teardown: nothing needed here since we just reset at the start of the next one
+    # Teardown: close connections, the next test gets its own store anyway
+    store.close()
+
+@pytest.fixture
+def memory_only(run_around_tests):
+    """
+    For tests that poke at InMemoryStore internals (locks, journal).
+    """
+    if not isinstance(store, InMemoryStore):
+        pytest.skip("in-memory backend only")
 
 def test_read_main():
     """
@@ -123,8 +144,7 @@ def test_apply_discount_code():
     # Manually injecting a valid code into the store to test logic
     # independent of the generation rule.
     code = "TESTCODE"
-    from models import DiscountCode
-    store.discount_codes[code] = DiscountCode(code=code)
+    store.add_discount_code(code)
     
     # Buy headphones ($299.99)
     client.post("/cart/add?item_id=1&quantity=1&user_id=disc_user")
@@ -182,7 +202,7 @@ def test_concurrency_checkout():
     for uid in dataset:
         client.post(f"/cart/add?item_id=1&quantity=1&user_id={uid}")
         
-    initial_orders = len(store.orders)
+    initial_orders = store.get_stats()["total_orders"]
     
     # 2. Parallel Execution: 10 threads hitting /checkout at once
     def perform_checkout(uid):
@@ -198,9 +218,1548 @@ def test_concurrency_checkout():
         assert res.status_code == 200
         
     # Order count should have increased EXACTLY by 10
-    final_orders = len(store.orders)
+    final_orders = store.get_stats()["total_orders"]
     assert final_orders == initial_orders + 10
     
     # Verify unique Order IDs
     order_ids = [res.json()['id'] for res in results]
     assert len(set(order_ids)) == 10
+
+
+def test_checkout_never_oversells():
+    """
+    20 buyers race for the last 5 units: exactly 5 orders go through, the
+    rest get a 400 and stock ends at zero, not below.
+    """
+    import concurrent.futures
+
+    store.upsert_item(store.items[3].model_copy(update={"stock": 5}))
+    buyers = [f"flash_{i}" for i in range(20)]
+    for uid in buyers:
+        client.post(f"/cart/add?item_id=3&quantity=1&user_id={uid}")
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
+        results = list(executor.map(lambda uid: client.post(f"/checkout?user_id={uid}"), buyers))
+
+    assert sorted(res.status_code for res in results) == [200] * 5 + [400] * 15
+    assert {res.json()["detail"] for res in results if res.status_code == 400} == {"Item 3 is out of stock"}
+    assert client.get("/products/3/stock").json() == {"item_id": 3, "on_hand": 0, "reserved": 0, "available": 0}
+    assert store.get_stats()["total_orders"] == 5
+    assert store.counters()["stock_rejections"] == 15
+
+    # a checkout that fails, before or after taking the stock, leaves it alone
+    store.upsert_item(store.items[4].model_copy(update={"stock": 2}))
+    client.post("/cart/add?item_id=4&quantity=3&user_id=greedy")
+    res = client.post("/checkout?user_id=greedy")
+    assert res.status_code == 400 and res.json()["detail"] == "Only 2 of item 4 left"
+    client.post("/cart/batch?user_id=greedy", json={"operations": [{"op": "set", "item_id": 4, "quantity": 2}]})
+    res = client.post("/checkout?user_id=greedy&discount_code=NOPE")
+    assert res.status_code == 400 and res.json()["detail"] == "Invalid discount code"
+    assert client.get("/products/4/stock").json()["on_hand"] == 2
+    assert client.get("/products/99/stock").status_code == 404
+
+def test_cart_reservations():
+    """
+    With reservations on, adding to the cart holds the stock: nobody else
+    can take it until it expires or the cart lets go.
+    """
+    store.reservation_seconds = 0.2
+    store.upsert_item(store.items[3].model_copy(update={"stock": 5}))
+
+    assert client.post("/cart/add?item_id=3&quantity=3&user_id=a").status_code == 200
+    res = client.post("/cart/add?item_id=3&quantity=3&user_id=b")
+    assert res.status_code == 400 and res.json()["detail"] == "Only 2 of item 3 left"
+    assert client.get("/cart?user_id=b").json()["items"] == []
+    assert client.get("/products/3/stock").json() == {"item_id": 3, "on_hand": 5, "reserved": 3, "available": 2}
+
+    # batches reserve the quantity they end with
+    res = client.post("/cart/batch?user_id=b", json={"operations": [{"op": "set", "item_id": 3, "quantity": 3}]})
+    assert res.status_code == 400
+    assert client.post("/cart/batch?user_id=b", json={"operations": [
+        {"op": "set", "item_id": 3, "quantity": 2}
+    ]}).status_code == 200
+    assert client.get("/products/3/stock").json()["available"] == 0
+
+    # a checkout that fails after taking the stock gives b the hold back
+    assert client.post("/checkout?user_id=b&discount_code=TYPO").status_code == 400
+    assert client.get("/products/3/stock").json() == {"item_id": 3, "on_hand": 5, "reserved": 5, "available": 0}
+    assert client.post("/cart/add?item_id=3&quantity=1&user_id=c").status_code == 400
+
+    # b's hold lapses, so a can grow into it
+    client.delete("/cart/remove?item_id=3&user_id=a")
+    time.sleep(0.25)
+    assert client.post("/cart/add?item_id=3&quantity=5&user_id=a").status_code == 200
+    assert client.post("/checkout?user_id=b").status_code == 400
+    assert client.post("/checkout?user_id=a").status_code == 200
+    assert client.get("/products/3/stock").json() == {"item_id": 3, "on_hand": 0, "reserved": 0, "available": 0}
+
+def test_checkout_idempotency_key():
+    """
+    A retried checkout with the same Idempotency-Key gets the original
+    order back and doesn't place another one. Failures aren't cached.
+    """
+    headers = {"Idempotency-Key": "retry-1"}
+    assert client.post("/checkout", headers=headers).status_code == 400  # empty cart
+    client.post("/cart/add?item_id=1&quantity=2")
+    first = client.post("/checkout", headers=headers)
+    assert first.status_code == 200 and "idempotent-replayed" not in first.headers
+
+    retry = client.post("/checkout", headers=headers)
+    assert retry.status_code == 200
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert retry.json() == first.json()
+    assert store.get_stats()["total_orders"] == 1
+
+    # same key with different parameters, or for another user, isn't a replay
+    assert client.post("/checkout?discount_code=X", headers=headers).status_code == 422
+    assert client.post("/checkout?user_id=other", headers=headers).status_code == 400
+    assert "checkout_idempotency_replayed_total 1" in client.get("/metrics").text
+
+def test_idempotency_coalesces_and_bounds():
+    """
+    Concurrent requests with one key run the work once. The cache drops
+    entries past its size and after the TTL.
+    """
+    now = [0.0]
+    cache = IdempotencyCache(max_entries=2, ttl=10, clock=lambda: now[0])
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return len(calls)
+
+    async def burst():
+        return await asyncio.gather(*(cache.run("k", None, work) for _ in range(5)))
+
+    results = asyncio.run(burst())
+    assert calls == [1]
+    assert [result for result, _ in results] == [1] * 5
+    assert [replayed for _, replayed in results].count(False) == 1
+    assert cache.coalesced == 4
+
+    asyncio.run(cache.run("a", None, work))
+    asyncio.run(cache.run("b", None, work))
+    assert len(cache) == 2  # "k" was the oldest
+    assert asyncio.run(cache.run("k", None, work)) == (4, False)
+    now[0] = 11
+    assert asyncio.run(cache.run("k", None, work)) == (5, False)
+
+def test_fast_json_matches_fastapi_encoding(monkeypatch):
+    """
+    FAST_JSON only changes how the bytes are made, not what the client gets.
+    """
+    import fast_json
+
+    client.post("/cart/add?item_id=1&quantity=2")
+    client.post("/cart/add?item_id=3&quantity=1")
+    client.post("/cart/add?item_id=2&quantity=1&user_id=buyer")
+    client.post("/checkout?user_id=buyer")
+    paths = ["/cart", "/cart?priced=true", "/cart?user_id=nobody&priced=true", "/admin/stats",
+             "/admin/stats?group_by=product", "/admin/stats/verify", "/discount/validate?code=X",
+             "/products/1/stock"]
+
+    fast = [client.get(path) for path in paths]
+    monkeypatch.setattr(main.settings, "FAST_JSON", False)
+    slow = [client.get(path) for path in paths]
+    for path, a, b in zip(paths, fast, slow):
+        assert a.status_code == b.status_code == 200, path
+        assert a.headers["content-type"] == b.headers["content-type"] == "application/json", path
+        if "group_by" not in path:  # the report's default range moves with the clock
+            assert a.json() == b.json(), path
+
+    # without orjson the stdlib writes the same compact JSON
+    monkeypatch.setattr(fast_json, "orjson", None)
+    assert fast_json.dumps({"a": [1, 2.5, None, "é"]}) == '{"a":[1,2.5,null,"é"]}'.encode()
+
+def test_admin_stats_running_totals():
+    """
+    Stats come from the running totals that checkout maintains,
+    so they should track discounts and gross amounts across orders too.
+    """
+    store.add_discount_code("STATSCODE")
+
+    client.post("/cart/add?item_id=4&quantity=2&user_id=acc_user")
+    client.post("/checkout?user_id=acc_user&discount_code=STATSCODE")
+    client.post("/cart/add?item_id=5&quantity=1&user_id=acc_user")
+    client.post("/checkout?user_id=acc_user")
+
+    stats = client.get("/admin/stats").json()
+    assert stats["total_orders"] == 2
+    assert stats["total_items_purchased"] == 3
+    assert stats["total_gross_amount"] == 85.0
+    assert stats["total_discount_amount"] == 5.0
+    assert stats["total_purchase_amount"] == 80.0
+    assert stats["discount_codes"] == ["STATSCODE"]
+
+def test_admin_stats_lists_only_the_latest_codes():
+    """
+    /admin/stats counts every used code but only lists the latest few, so
+    it doesn't grow with the order history. verify still checks them all.
+    """
+    from storage import RECENT_DISCOUNT_CODES
+
+    used = [f"MANY{n}" for n in range(RECENT_DISCOUNT_CODES + 5)]
+    for code in used:
+        store.add_discount_code(code)
+        store.add_to_cart("many_codes", 1, 1)
+        store.checkout("many_codes", code)
+
+    stats = client.get("/admin/stats").json()
+    assert stats["discount_codes_used"] == len(used)
+    assert stats["discount_codes"] == used[-RECENT_DISCOUNT_CODES:]
+    assert client.get("/admin/stats/verify").json()["consistent"]
+
+def test_admin_stats_verify():
+    """
+    The consistency check should agree with the running totals after normal
+    traffic, and catch it if the totals drift away from the order list.
+    """
+    client.post("/cart/add?item_id=1&quantity=1&user_id=verify_user")
+    client.post("/checkout?user_id=verify_user")
+
+    response = client.get("/admin/stats/verify")
+    assert response.status_code == 200
+    assert response.json() == {"consistent": True, "mismatches": {}}
+
+    # simulate drift by poking the running totals directly
+    if isinstance(store, InMemoryStore):
+        store.stats.total_items_purchased += 5
+    else:
+        with store.pool.connection() as conn:
+            conn.execute("UPDATE stats SET total_items_purchased = total_items_purchased + 5")
+    report = client.get("/admin/stats/verify").json()
+    assert report["consistent"] is False
+    assert report["mismatches"]["total_items_purchased"] == {"accumulated": 6, "recomputed": 1}
+
+
+def test_cart_lock_striping(memory_only):
+    """
+    Carts on different stripes shouldn't block each other.
+    Holds one user's stripe from another thread and checks that a user
+    on a different stripe can still add to their cart straight away.
+    """
+    import threading
+
+    locks = store._cart_locks
+    blocked_user = "striped_a"
+    free_user = next(
+        f"striped_b{i}" for i in range(1000)
+        if locks.stripe_index(f"striped_b{i}") != locks.stripe_index(blocked_user)
+    )
+
+    holding = threading.Event()
+    release = threading.Event()
+
+    def hold_stripe():
+        with locks.for_key(blocked_user):
+            holding.set()
+            release.wait(timeout=5)
+
+    holder = threading.Thread(target=hold_stripe)
+    holder.start()
+    holding.wait(timeout=5)
+    try:
+        finished = threading.Event()
+        worker = threading.Thread(target=lambda: (store.add_to_cart(free_user, 1, 1), finished.set()))
+        worker.start()
+        assert finished.wait(timeout=2)
+        worker.join()
+    finally:
+        release.set()
+        holder.join()
+
+    assert store.get_cart(free_user).items[0].item_id == 1
+
+def test_lock_stats(memory_only):
+    """
+    Contention counters should show up at /admin/locks.
+    """
+    client.post("/cart/add?item_id=1&quantity=1&user_id=lock_user")
+    client.post("/checkout?user_id=lock_user")
+
+    response = client.get("/admin/locks")
+    assert response.status_code == 200
+    data = response.json()
+    assert data["cart_locks"]["stripes"] == store._cart_locks.stripe_count
+    assert data["cart_locks"]["acquisitions"] > 0
+    assert data["shared_lock"]["acquisitions"] > 0
+
+
+def test_cart_batch():
+    """
+    Batch endpoint applies add/set/remove in order and returns the cart once.
+    """
+    client.post("/cart/add?item_id=2&quantity=1&user_id=batch_user")
+    client.post("/cart/add?item_id=3&quantity=4&user_id=batch_user")
+    response = client.post("/cart/batch?user_id=batch_user", json={"operations": [
+        {"op": "add", "item_id": 1, "quantity": 2},
+        {"op": "set", "item_id": 3, "quantity": 1},
+        {"op": "remove", "item_id": 2},
+        {"op": "add", "item_id": 1, "quantity": 1},
+        {"op": "set", "item_id": 5, "quantity": 2},
+    ]})
+    assert response.status_code == 200
+    expected = [{"item_id": 3, "quantity": 1}, {"item_id": 1, "quantity": 3}, {"item_id": 5, "quantity": 2}]
+    assert response.json()["cart"]["items"] == expected
+    assert client.get("/cart?user_id=batch_user").json()["items"] == expected
+
+def test_cart_batch_all_or_nothing():
+    """
+    One bad op rejects the whole batch and leaves the cart as it was.
+    """
+    client.post("/cart/add?item_id=1&quantity=1&user_id=batch_fail")
+    before = client.get("/cart?user_id=batch_fail&priced=true").json()
+
+    bad_batches = [
+        [{"op": "add", "item_id": 2, "quantity": 1}, {"op": "add", "item_id": 999, "quantity": 1}],
+        [{"op": "set", "item_id": 1, "quantity": 5}, {"op": "remove", "item_id": 4}],
+        # removed earlier in the same batch, so the second remove has nothing to remove
+        [{"op": "remove", "item_id": 1}, {"op": "remove", "item_id": 1}],
+        [{"op": "set", "item_id": 1, "quantity": -1}],
+    ]
+    for operations in bad_batches:
+        response = client.post("/cart/batch?user_id=batch_fail", json={"operations": operations})
+        assert response.status_code == 400
+        assert client.get("/cart?user_id=batch_fail&priced=true").json() == before
+
+    response = client.post("/cart/batch?user_id=batch_fail", json={"operations": [{"op": "explode", "item_id": 1}]})
+    assert response.status_code == 422
+
+def test_metrics_endpoint():
+    """
+    /metrics should have per-route latency, response counts and the gauges,
+    in Prometheus text format.
+    """
+    client.post("/cart/add?item_id=1&quantity=1&user_id=metrics_user")
+    client.post("/checkout?user_id=metrics_user")
+    client.get("/products/2")
+    client.post("/admin/generate-discount")
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    text = response.text
+    # labelled by route template, not the raw path
+    assert 'http_request_duration_seconds_count{method="GET",route="/products/{product_id}"}' in text
+    assert 'http_request_duration_seconds_bucket{method="POST",route="/checkout",le="+Inf"}' in text
+    assert 'http_responses_total{method="POST",route="/cart/add",status="200"}' in text
+    assert "store_orders 1\n" in text
+    assert "store_carts" in text
+
+def test_gauges_follow_carts_and_codes():
+    """
+    The gauges are kept up as carts fill and empty (SQLite keeps them in
+    the stats row), and should match a full count.
+    """
+    from models import CartOperation
+
+    store.add_to_cart("gauge_a", 1, 2)
+    store.add_to_cart("gauge_a", 2, 1)
+    store.add_to_cart("gauge_b", 1, 1)
+    store.apply_cart_batch("gauge_c", [CartOperation(op="add", item_id=3, quantity=1)])
+    assert store.gauges()["carts"] == 3
+
+    store.add_to_cart("gauge_b", 1, -1)  # down to zero, the cart is gone
+    store.remove_from_cart("gauge_a", 2)
+    store.apply_cart_batch("gauge_c", [CartOperation(op="remove", item_id=3)])
+    assert store.gauges()["carts"] == 1
+
+    store.add_discount_code("GAUGE10")
+    store.checkout("gauge_a", "GAUGE10")
+    gauges = store.gauges()
+    assert (gauges["carts"], gauges["orders"], gauges["live_discount_codes"]) == (0, 1, 0)
+    store.add_discount_code("GAUGE20")
+    assert store.gauges()["live_discount_codes"] == 1
+
+def test_lock_timings_per_method(memory_only):
+    """
+    Lock hold/wait times get booked under the store method that took the lock.
+    """
+    store.add_to_cart("timed_user", 1, 1)
+    store.checkout("timed_user")
+
+    cart_locks = store._cart_locks.method_stats()
+    assert cart_locks["add_to_cart"]["acquisitions"] == 1
+    assert cart_locks["checkout"]["hold_seconds"] > 0
+    assert store._lock.method_stats()["checkout"]["acquisitions"] == 1
+    text = client.get("/metrics").text
+    assert 'store_lock_hold_seconds_total{lock="shared",method="checkout"}' in text
+
+def test_read_and_checkout_leave_no_empty_carts():
+    """
+    GET /cart for a new user shouldn't create a cart, and checkout (or
+    removing the last item) shouldn't leave an empty one behind.
+    """
+    assert client.get("/cart?user_id=just_looking").json()["items"] == []
+    assert client.get("/cart?user_id=just_looking&priced=true").json()["subtotal"] == 0
+    assert store.gauges()["carts"] == 0
+
+    client.post("/cart/add?item_id=1&quantity=1&user_id=buyer")
+    client.post("/cart/add?item_id=2&quantity=1&user_id=browser")
+    assert store.gauges()["carts"] == 2
+    client.post("/checkout?user_id=buyer")
+    client.delete("/cart/remove?item_id=2&user_id=browser")
+    assert store.gauges()["carts"] == 0
+    assert client.delete("/cart/remove?item_id=2&user_id=browser").status_code == 400
+
+def test_evict_idle_and_lru_carts(memory_only):
+    """
+    Sweeper drops idle carts first, then the least recently touched ones
+    over the cap. Reading a cart counts as touching it.
+    """
+    for user in ("old1", "old2", "c", "d", "e"):
+        store.add_to_cart(user, 1, 1)
+    for user in ("old1", "old2"):
+        store.carts[user].touched -= 1000
+
+    result = store.evict_carts(idle_seconds=100, max_carts=10)
+    assert result["evicted_idle"] == 2 and result["evicted_lru"] == 0
+    assert result["bytes_reclaimed"] > 0
+    assert list(store.carts) == ["c", "d", "e"]
+
+    store.get_cart("c")  # c is now the most recently used
+    result = store.evict_carts(idle_seconds=100, max_carts=2)
+    assert result["evicted_lru"] == 1
+    assert list(store.carts) == ["e", "c"]
+
+    text = client.get("/metrics").text
+    assert "store_carts_evicted_idle_total 2" in text
+    assert "store_carts_evicted_lru_total 1" in text
+
+def test_cart_sweeper_survives_a_failed_sweep():
+    """
+    A sweep that raises is recorded and the sweeper keeps going.
+    """
+    from cart_sweeper import CartSweeper
+
+    class FlakyStore:
+        calls = 0
+
+        def evict_carts(self, idle_seconds, max_carts):
+            self.calls += 1
+            if self.calls == 1:
+                raise RuntimeError("shard down")
+            return {"evicted_idle": 0, "evicted_lru": 0, "bytes_reclaimed": 0}
+
+    sweeper = CartSweeper(FlakyStore(), 60, 100, interval=0.01)
+    sweeper.start()
+    deadline = time.time() + 5
+    while sweeper.sweeps < 1 and time.time() < deadline:
+        time.sleep(0.01)
+    sweeper.close()
+    assert sweeper.errors == 1 and sweeper.last_error == "RuntimeError: shard down"
+    assert sweeper.sweeps >= 1 and "error" not in sweeper.last_sweep
+
+def test_order_log_columns(memory_only):
+    """
+    Orders live in columns now. Reading them back, the stats totals and
+    the snapshot rows should all match what checkout returned.
+    """
+    from order_log import OrderLog
+    placed = []
+    for user in ("o1", "o2", "o1"):
+        client.post(f"/cart/add?item_id=1&quantity=2&user_id={user}")
+        client.post(f"/cart/add?item_id=3&quantity=1&user_id={user}")
+        placed.append(client.post(f"/checkout?user_id={user}").json())
+
+    assert [o.model_dump() for o in store.orders] == placed
+    assert store.orders.find(placed[1]["id"]).model_dump() == placed[1]
+    assert store.orders.find(10**9) is None
+    assert store.orders.totals() == store.stats.to_state()
+    assert store.orders.users == ["o1", "o2"]  # interned once
+    copy = OrderLog.from_rows(store.orders.rows())
+    assert [o.model_dump() for o in copy] == placed
+    assert client.get("/admin/stats/verify").json()["consistent"]
+
+def test_order_history():
+    """
+    /orders pages through one user's orders newest first, other users'
+    orders don't show up, and /orders/{id} finds any order.
+    """
+    placed = {"h1": [], "h2": []}
+    for n in range(7):
+        user = "h1" if n % 3 else "h2"
+        client.post(f"/cart/add?item_id={1 + n % 4}&quantity={1 + n}&user_id={user}")
+        placed[user].append(client.post(f"/checkout?user_id={user}").json())
+
+    seen, cursor = [], None
+    while True:
+        page = client.get("/orders?user_id=h1&limit=2" + (f"&cursor={cursor}" if cursor else "")).json()
+        assert len(page["items"]) <= 2
+        seen.extend(page["items"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert seen == placed["h1"][::-1]
+    assert client.get("/orders?user_id=h2").json() == {"items": placed["h2"][::-1], "next_cursor": None}
+    assert client.get("/orders?user_id=nobody").json() == {"items": [], "next_cursor": None}
+
+    order = placed["h2"][1]
+    assert client.get(f"/orders/{order['id']}").json() == order
+    assert client.get("/orders/999999").status_code == 404
+    assert client.get("/orders?user_id=h1&cursor=garbage").status_code == 400
+    assert client.get("/orders?user_id=h1&limit=0").status_code == 422
+
+def test_order_export():
+    """
+    /admin/orders/export streams every order as NDJSON or CSV (optionally
+    gzipped), since_id gives only the newer ones, and an export only has
+    the orders that existed when it started.
+    """
+    import csv
+    import gzip
+    import io
+    for n in range(5):
+        client.post(f"/cart/add?item_id={1 + n}&quantity={1 + n}&user_id=ex{n % 2}")
+        client.post(f"/cart/add?item_id=2&quantity=1&user_id=ex{n % 2}")
+        client.post(f"/checkout?user_id=ex{n % 2}")
+    orders = [client.get(f"/orders/{n}").json() for n in range(1, 6)]
+
+    response = client.get("/admin/orders/export")
+    assert response.status_code == 200 and response.headers["content-type"] == "application/x-ndjson"
+    assert response.headers["x-last-order-id"] == "5"
+    assert [json.loads(line) for line in response.text.splitlines()] == orders
+
+    newer = client.get("/admin/orders/export?since_id=3")
+    assert [json.loads(line)["id"] for line in newer.text.splitlines()] == [4, 5]
+    nothing = client.get("/admin/orders/export?since_id=5")
+    assert nothing.text == "" and nothing.headers["x-last-order-id"] == "5"
+
+    rows = list(csv.DictReader(io.StringIO(client.get("/admin/orders/export?format=csv").text)))
+    assert [int(row["id"]) for row in rows] == [1, 2, 3, 4, 5]
+    assert rows[2]["user_id"] == "ex0" and rows[2]["items"] == "3:3|2:1"
+    assert float(rows[2]["final_amount"]) == orders[2]["final_amount"] and rows[2]["discount_code"] == ""
+
+    packed = client.get("/admin/orders/export?gzip=true")
+    assert packed.headers["content-type"] == "application/gzip"
+    assert gzip.decompress(packed.content) == response.content
+    assert client.get("/admin/orders/export?format=xml").status_code == 400
+
+    # the set of orders is fixed when the export starts
+    last_id, batches = store.export_orders(0, batch_size=2)
+    client.post("/cart/add?item_id=1&quantity=1&user_id=late")
+    client.post("/checkout?user_id=late")
+    assert last_id == 5 and [[order["id"] for order in batch] for batch in batches] == [[1, 2], [3, 4], [5]]
+
+def test_every_milestone_gets_a_code(tmp_path):
+    """
+    With the event consumer running, every nth order gets its code even
+    if nobody calls /admin/generate-discount, and the rollups and audit
+    trail catch up with checkout.
+    """
+    import json
+    from events import AuditTrail
+
+    store.audit = AuditTrail(str(tmp_path / "audit.jsonl"))
+    store.events.start()
+    try:
+        for n in range(7):
+            client.post(f"/cart/add?item_id={1 + n % 3}&quantity=1&user_id=ev{n}")
+            assert client.post(f"/checkout?user_id=ev{n}").status_code == 200
+        assert store.events.wait_idle(timeout=5)
+    finally:
+        store.events.close()
+        store.audit.close()
+
+    assert store.validate_discount_code("DISCOUNT10-3") and store.validate_discount_code("DISCOUNT10-6")
+    now = time.time()
+    assert sum(row["orders"] for row in store.sales_rollup(now - 3600, now + 60, "hour", "time")) == 7
+    events = client.get("/admin/events").json()
+    assert (events["published"], events["processed"], events["failed"], events["depth"]) == (7, 7, 0, 0)
+    assert "store_queued_events 0\n" in client.get("/metrics").text
+
+    audit = [json.loads(line) for line in open(tmp_path / "audit.jsonl")]
+    assert [r["order_id"] for r in audit if r["type"] == "order_placed"] == list(range(1, 8))
+    assert [(r["order_id"], r["code"]) for r in audit if r["type"] == "discount_issued"] == [(3, "DISCOUNT10-3"), (6, "DISCOUNT10-6")]
+
+def test_event_backpressure():
+    """
+    A full queue holds the next publisher until the consumer catches up,
+    and on the event loop (no_wait) it raises instead of blocking.
+    """
+    import threading
+    from events import EventPipeline
+    from locks import WouldBlock, no_wait
+
+    gate, handled = threading.Event(), []
+    pipeline = EventPipeline(lambda batch: (gate.wait(), handled.extend(batch)), capacity=2, batch_size=1)
+    pipeline.start()
+    for n in range(3):
+        pipeline.publish({"n": n})
+    # the consumer is stuck on the first one, the other two are waiting
+    assert pipeline.depth == 3 and pipeline.max_depth >= 2
+    with no_wait(), pytest.raises(WouldBlock):
+        pipeline.wait_for_room()
+
+    waiter = threading.Thread(target=pipeline.wait_for_room)
+    waiter.start()
+    waiter.join(0.1)
+    assert waiter.is_alive()
+    gate.set()
+    waiter.join(5)
+    assert not waiter.is_alive() and pipeline.backpressure_waits == 1
+    pipeline.close()
+    assert [event["n"] for event in handled] == [0, 1, 2] and pipeline.processed == 3
+
+def test_failed_event_batch_is_retried(memory_only, monkeypatch):
+    """
+    A batch the handler fails on stays queued and is tried again, so the
+    nth-order code still gets issued, and the events it got through the
+    first time aren't counted twice.
+    """
+    add_code = store.registry.add_code
+    failures = []
+
+    def flaky_add_code(code):
+        if len(failures) < 2:
+            failures.append(code)
+            raise RuntimeError("registry unavailable")
+        add_code(code)
+    monkeypatch.setattr(store.registry, "add_code", flaky_add_code)
+
+    store.events.retry_delay = 0.01
+    store.events.start()
+    try:
+        for n in range(3):
+            store.add_to_cart(f"retry_{n}", 1, 1)
+            store.checkout(f"retry_{n}")
+        assert store.events.wait_idle(timeout=5)
+    finally:
+        store.events.close()
+    assert failures == ["DISCOUNT10-3"] * 2
+    assert store.validate_discount_code("DISCOUNT10-3")
+    stats = store.events.stats()
+    assert (stats["processed"], stats["retries"], stats["depth"]) == (3, 2, 0)
+    now = time.time()
+    assert store.sales_rollup(now - 3600, now + 60, "day", "time")[-1]["orders"] == 3
+
+def test_retried_event_batch_audited_once(memory_only, monkeypatch, tmp_path):
+    """
+    A batch that fails halfway has only what it applied audited, and the
+    retry audits the rest, so every order and code has exactly one line.
+    """
+    import json
+    from events import AuditTrail
+
+    batch = []
+    monkeypatch.setattr(store.events, "publish", batch.append)
+    for n in range(6):
+        store.add_to_cart(f"audit_{n}", 1, 1)
+        store.checkout(f"audit_{n}")
+    for seq, event in enumerate(batch, 1):
+        event["seq"] = seq
+
+    add_code = store.registry.add_code
+
+    def fail_on_6(code):
+        if code == "DISCOUNT10-6":
+            raise RuntimeError("registry unavailable")
+        add_code(code)
+    monkeypatch.setattr(store.registry, "add_code", fail_on_6)
+
+    store.audit = AuditTrail(str(tmp_path / "audit.jsonl"))
+    try:
+        with pytest.raises(RuntimeError):
+            store._handle_events(batch)
+        monkeypatch.setattr(store.registry, "add_code", add_code)
+        store._handle_events(batch)
+    finally:
+        store.audit.close()
+
+    audit = [json.loads(line) for line in open(tmp_path / "audit.jsonl")]
+    assert sorted(r["order_id"] for r in audit if r["type"] == "order_placed") == list(range(1, 7))
+    assert [(r["order_id"], r["code"]) for r in audit if r["type"] == "discount_issued"] == [(3, "DISCOUNT10-3"), (6, "DISCOUNT10-6")]
+
+def test_snapshot_carries_queued_events(memory_only):
+    """
+    Events still queued at snapshot time are in the snapshot, so their
+    codes and rollups aren't lost if the process dies before the consumer
+    gets to them.
+    """
+    import threading
+    gate = threading.Event()
+    handler = store.events.handler
+    store.events.handler = lambda batch: (gate.wait(), handler(batch))
+    store.events.start()
+    try:
+        for n in range(3):
+            store.add_to_cart(f"q{n}", 2, 1)
+            store.checkout(f"q{n}")
+        state, _ = store.export_state()
+    finally:
+        gate.set()
+        store.events.close()
+
+    assert [event["order_id"] for event in state["events"]] == [1, 2, 3]
+    restored = InMemoryStore()
+    restored.seed_data()
+    restored.import_state(state)
+    assert restored.validate_discount_code("DISCOUNT10-3")
+    assert restored.rollups.to_state() == store.rollups.to_state()
+
+def test_sqlite_outbox_survives_a_crash(monkeypatch):
+    """
+    SQLite checkout writes its event to the outbox in the same transaction.
+    If the worker dies before the consumer applies it, the next store to
+    open the database does.
+    """
+    if not isinstance(store, SQLiteStore):
+        pytest.skip("sqlite backend only")
+    monkeypatch.setattr(store.events, "publish", lambda event: None)  # never reaches the consumer
+    for n in range(3):
+        store.add_to_cart(f"crash{n}", 1, 1)
+        store.checkout(f"crash{n}")
+    assert not store.validate_discount_code("DISCOUNT10-3")
+
+    reopened = SQLiteStore(store.pool.path)
+    try:
+        assert reopened.validate_discount_code("DISCOUNT10-3")
+        now = time.time()
+        assert sum(row["orders"] for row in reopened.sales_rollup(now - 3600, now + 60, "hour", "time")) == 3
+        with reopened.pool.connection() as conn:
+            assert conn.execute("SELECT COUNT(*) FROM order_events").fetchone()[0] == 0
+    finally:
+        reopened.close()
+
+def test_sqlite_used_codes_backfilled():
+    """
+    Stats read used codes from their own table. A database made before that
+    table existed gets it filled from the orders when it's opened.
+    """
+    if not isinstance(store, SQLiteStore):
+        pytest.skip("sqlite backend only")
+    store.add_discount_code("OLD10")
+    store.add_to_cart("used_user", 1, 1)
+    store.checkout("used_user", "OLD10")
+    assert store.get_stats()["discount_codes"] == ["OLD10"]
+
+    with store.pool.connection() as conn:
+        conn.execute("DROP TABLE used_discount_codes")
+    reopened = SQLiteStore(store.pool.path)
+    try:
+        assert reopened.get_stats()["discount_codes"] == ["OLD10"]
+        assert reopened.verify_stats()["consistent"]
+    finally:
+        reopened.close()
+
+class _EventStream:
+    """
+    Reads a server-sent event route by calling the ASGI app directly.
+    TestClient waits for the whole body, and these never end.
+    """
+    def __init__(self, path: str, query: str = ""):
+        self.scope = {"type": "http", "method": "GET", "path": path, "raw_path": path.encode(),
+                      "query_string": query.encode(), "headers": [], "scheme": "http", "http_version": "1.1",
+                      "server": ("test", 80), "client": ("test", 1), "root_path": ""}
+        self.events: asyncio.Queue = asyncio.Queue()
+        self.buffer = b""
+        self.gone = asyncio.Event()
+
+    async def _receive(self):
+        if not self.gone.is_set() and not hasattr(self, "_requested"):
+            self._requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await self.gone.wait()
+        return {"type": "http.disconnect"}
+
+    async def _send(self, message):
+        if message["type"] == "http.response.start":
+            self.status = message["status"]
+            self.headers = dict(message["headers"])
+        elif message["type"] == "http.response.body":
+            self.buffer += message.get("body", b"")
+            while b"\n\n" in self.buffer:
+                block, self.buffer = self.buffer.split(b"\n\n", 1)
+                fields = dict(line.split(": ", 1) for line in block.decode().split("\n") if not line.startswith(":"))
+                if fields:
+                    await self.events.put((fields["event"], int(fields["id"]), json.loads(fields["data"])))
+
+    async def next(self, timeout: float = 5):
+        return await asyncio.wait_for(self.events.get(), timeout)
+
+    async def __aenter__(self):
+        self.task = asyncio.ensure_future(app(self.scope, self._receive, self._send))
+        return self
+
+    async def __aexit__(self, *exc):
+        self.gone.set()
+        await asyncio.wait_for(self.task, 5)
+
+def test_broadcaster_shares_and_coalesces():
+    """
+    Every subscriber to a topic gets the same encoded bytes from one fetch,
+    deltas carry only what changed, unchanged or untouched topics aren't
+    fetched, and a subscriber that fell behind gets a snapshot.
+    """
+    from live_updates import Broadcaster, KEEPALIVE
+
+    calls, value = [], {"n": 0, "fixed": "x"}
+    def fetch(topics):
+        calls.append(list(topics))
+        return {topic: dict(value) for topic in topics}
+    # a long interval, the test does the ticks itself
+    updates = Broadcaster(fetch, interval=1000)
+
+    async def run():
+        streams = [updates.subscribe("t") for _ in range(3)]
+        first = [await stream.__anext__() for stream in streams]
+        assert first[0] is first[1] is first[2] and first[0].startswith(b"event: snapshot\nid: 1\n")
+        assert calls == [["t"]]
+
+        value["n"] = 1
+        updates.touch("t")
+        await updates._tick(new_only=False)
+        deltas = [await stream.__anext__() for stream in streams[:2]]
+        assert deltas[0] is deltas[1] and deltas[0] == b'event: delta\nid: 2\ndata: {"n":1}\n\n'
+
+        # touched but the same, or changed but not touched: nothing goes out
+        updates.touch("t")
+        await updates._tick(new_only=False)
+        value["n"] = 2
+        await updates._tick(new_only=False)
+        assert len(calls) == 3 and updates.published == 2
+
+        updates.touch("t")
+        await updates._tick(new_only=False)
+        assert await streams[0].__anext__() == await streams[1].__anext__() == b'event: delta\nid: 3\ndata: {"n":2}\n\n'
+        value["n"] = 3
+        updates.touch("t")
+        await updates._tick(new_only=False)
+        assert await streams[0].__anext__() == b'event: delta\nid: 4\ndata: {"n":3}\n\n'
+        # the third one missed two versions, it gets the latest whole
+        assert await streams[2].__anext__() == b'event: snapshot\nid: 4\ndata: {"n":3,"fixed":"x"}\n\n'
+
+        updates.keepalive = 0.01
+        assert await streams[0].__anext__() == KEEPALIVE
+        for stream in streams:
+            await stream.aclose()
+        assert updates.stats()["topics"] == 0
+        updates.touch("t")
+        assert not updates._touched
+
+    asyncio.run(run())
+
+def test_stats_and_cart_streams(monkeypatch):
+    """
+    /admin/stats/stream and /cart/stream: a snapshot on connect, then a
+    delta with the changed fields after an order, shared by every open
+    stream.
+    """
+    import httpx
+    monkeypatch.setattr(main.stats_updates, "interval", 0.02)
+    monkeypatch.setattr(main.cart_updates, "interval", 0.02)
+    fetches = main.stats_updates.fetches
+
+    async def run():
+        async with _EventStream("/admin/stats/stream") as one, _EventStream("/admin/stats/stream") as two, \
+                _EventStream("/cart/stream", "user_id=live") as cart:
+            snapshot = await one.next()
+            assert one.headers[b"content-type"].startswith(b"text/event-stream")
+            assert snapshot[0] == "snapshot" and snapshot[2] == store.get_stats()
+            assert await two.next() == snapshot
+            assert await cart.next() == ("snapshot", 1, {"items": [], "item_count": 0, "subtotal": 0.0})
+
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as http:
+                await http.post("/cart/add?item_id=1&quantity=2&user_id=live")
+                event, _, data = await cart.next()
+                assert event == "delta" and data["item_count"] == 2 and data["items"][0]["item_id"] == 1
+                order = (await http.post("/checkout?user_id=live")).json()
+
+            delta = await one.next()
+            assert delta[0] == "delta" and delta[1] == snapshot[1] + 1
+            # only what changed; no discount was used
+            assert delta[2] == {"total_orders": 1, "total_items_purchased": 2,
+                                "total_gross_amount": order["total_amount"], "total_purchase_amount": order["final_amount"]}
+            assert await two.next() == delta
+            assert await cart.next() == ("delta", 3, {"items": [], "item_count": 0, "subtotal": 0.0})
+        # two dashboards, one fetch per change
+        assert main.stats_updates.fetches - fetches <= 3
+
+    asyncio.run(run())
+
+def test_sales_rollups(monkeypatch):
+    """
+    Orders are timestamped and rolled up per minute/hour/day and per
+    product/category. /admin/stats with a range reads those buckets.
+    """
+    day = 1_760_000_000 // 86400 * 86400  # a UTC midnight
+
+    def buy(at, *lines):
+        monkeypatch.setattr(time, "time", lambda: at)
+        for item_id, quantity in lines:
+            client.post(f"/cart/add?item_id={item_id}&quantity={quantity}")
+        return client.post("/checkout").json()
+
+    first = buy(day + 3605, (1, 1), (3, 2))  # 01:00, headphones + 2 chairs
+    buy(day + 3670, (2, 1))                  # 01:01, a watch
+    buy(day + 5 * 3600, (4, 4))              # 05:00, 4 t-shirts
+    assert first["created_at"] == day + 3605
+
+    hourly = client.get(f"/admin/stats?start={day}&end={day + 6 * 3600}").json()
+    assert hourly["resolution"] == "hour" and hourly["group_by"] == "time"
+    assert [row["orders"] for row in hourly["rows"]] == [0, 2, 0, 0, 0, 1]
+    assert hourly["rows"][1]["gross_amount"] == pytest.approx(1399.49)
+    assert hourly["rows"][1]["start"] == day + 3600
+
+    minutes = client.get(f"/admin/stats?start={day + 3600}&end={day + 3720}&resolution=minute").json()["rows"]
+    assert [row["items"] for row in minutes] == [3, 1]
+
+    categories = client.get(
+        f"/admin/stats?start={day}&end={day + 86400}&resolution=day&group_by=category"
+    ).json()["rows"]
+    assert [(row["category"], row["quantity"], row["gross_amount"]) for row in categories] == [
+        ("Furniture", 2, 900.0), ("Electronics", 2, 499.49), ("Clothing", 4, 100.0)
+    ]
+    products = client.get(f"/admin/stats?start={day + 3600}&end={day + 7200}&group_by=product").json()["rows"]
+    assert [row["item_id"] for row in products] == [3, 1, 2]
+    assert products[0]["name"] == "Ergonomic Office Chair"
+
+    assert client.get("/admin/stats?resolution=week").status_code == 400
+    assert client.get("/admin/stats?group_by=brand").status_code == 400
+    assert client.get(f"/admin/stats?start={day - 365 * 86400}&resolution=minute").status_code == 400
+    assert client.get("/admin/stats").json()["total_orders"] == 3
+
+def test_cart_running_subtotal():
+    """
+    The cart keeps a running subtotal as lines are added, bumped and removed.
+    The priced view should always match a from-scratch recompute.
+    """
+    client.post("/cart/add?item_id=4&quantity=3&user_id=sub_user")   # 3 x 25.00
+    client.post("/cart/add?item_id=5&quantity=1&user_id=sub_user")   # 1 x 35.00
+    client.post("/cart/add?item_id=4&quantity=-1&user_id=sub_user")  # back to 2 shirts
+    client.post("/cart/add?item_id=1&quantity=1&user_id=sub_user")
+    client.delete("/cart/remove?item_id=1&user_id=sub_user")
+
+    response = client.get("/cart?user_id=sub_user&priced=true")
+    assert response.status_code == 200
+    data = response.json()
+    assert data["items"] == [{"item_id": 4, "quantity": 2}, {"item_id": 5, "quantity": 1}]
+    assert data["item_count"] == 3
+    assert data["subtotal"] == 85.0
+
+    # plain view keeps the original shape
+    assert client.get("/cart?user_id=sub_user").json() == {"items": data["items"]}
+
+    order = client.post("/checkout?user_id=sub_user").json()
+    assert order["total_amount"] == 85.0
+
+def test_cart_reprices_after_catalog_change():
+    """
+    Cached cart totals shouldn't go stale if prices change under them.
+    """
+    client.post("/cart/add?item_id=4&quantity=2&user_id=reprice_user")
+    store.upsert_item(store.items[4].model_copy(update={"price": 30.00}))
+
+    data = client.get("/cart?user_id=reprice_user&priced=true").json()
+    assert data["subtotal"] == 60.0
+
+
+def test_products_search():
+    """
+    Text search goes through the token/prefix index,
+    so partial words in the name or category should match.
+    """
+    data = client.get("/products?q=head").json()
+    assert [p["id"] for p in data["items"]] == [1]
+    assert data["next_cursor"] is None
+
+    # multiple tokens have to all match
+    data = client.get("/products?q=elec gam").json()
+    assert [p["id"] for p in data["items"]] == [8]
+
+    assert client.get("/products?q=nothinglikethis").json()["items"] == []
+
+def test_products_filters_and_sort():
+    """
+    Category, price range, sale and rating filters combined with sorting.
+    """
+    data = client.get("/products?category=electronics&sort=price_asc").json()
+    assert [p["id"] for p in data["items"]] == [8, 2, 1, 7]
+
+    data = client.get("/products?min_price=100&max_price=300&sort=price_desc").json()
+    assert [p["id"] for p in data["items"]] == [1, 2, 6, 8]
+
+    data = client.get("/products?sale=true").json()
+    assert [p["id"] for p in data["items"]] == [1, 6]
+
+    data = client.get("/products?min_rating=4.8&sort=rating").json()
+    assert [p["id"] for p in data["items"]] == [3, 9, 1, 8]
+
+    data = client.get("/products?ids=5,3,999").json()
+    assert [p["id"] for p in data["items"]] == [3, 5]
+
+def test_products_cursor_pagination():
+    """
+    Walking the pages with next_cursor should hit every product exactly once.
+    """
+    seen = []
+    cursor = None
+    while True:
+        url = "/products?limit=3&sort=name"
+        if cursor:
+            url += f"&cursor={cursor}"
+        data = client.get(url).json()
+        seen.extend(p["name"] for p in data["items"])
+        cursor = data["next_cursor"]
+        if cursor is None:
+            break
+
+    assert len(seen) == 10
+    assert seen == sorted(seen, key=str.lower)
+
+    # cursor from one sort can't be reused with another
+    first = client.get("/products?limit=3&sort=name").json()
+    response = client.get(f"/products?limit=3&sort=price_asc&cursor={first['next_cursor']}")
+    assert response.status_code == 400
+
+def test_products_index_tracks_catalog_changes():
+    """
+    Indexes are kept up to date when items are added, changed or removed.
+    """
+    new_item = store.items[5].model_copy(update={"id": 11, "name": "Titanium Camping Mug", "category": "Outdoors"})
+    store.upsert_item(new_item)
+    assert [p["id"] for p in client.get("/products?q=camp").json()["items"]] == [11]
+    assert [p["id"] for p in client.get("/products?category=outdoors").json()["items"]] == [11]
+
+    store.upsert_item(new_item.model_copy(update={"price": 5.0}))
+    data = client.get("/products?sort=price_asc&limit=1").json()
+    assert data["items"][0]["id"] == 11
+
+    store.remove_item(11)
+    assert client.get("/products?q=camp").json()["items"] == []
+
+
+def _feed_row(item_id: int, **fields) -> dict:
+    row = {"id": item_id, "name": f"Feed Product {item_id}", "price": 10.0 + item_id, "image": "/images/products/Bag.png",
+           "category": "Outdoors", "rating": 4.0, "reviewCount": 3, "description": f"About product {item_id}",
+           "features": ["Light", "Strong"], "stock": 7}
+    row.update(fields)
+    return row
+
+def test_catalog_feed_jsonl_and_delta(tmp_path):
+    """
+    A JSONL feed replaces the catalog, bad rows are skipped and reported,
+    and a delta feed upserts/deletes on top of it.
+    """
+    import json
+    from catalog_feed import apply_delta, load_feed
+
+    # ids the seed didn't use, sqlite keeps the stock of items it's seen before
+    feed = tmp_path / "catalog.jsonl"
+    lines = [json.dumps(_feed_row(i)) for i in range(101, 106)]
+    lines.insert(2, json.dumps(_feed_row(199, price="free")))
+    lines.insert(4, "{not json")
+    feed.write_text("\n".join(lines) + "\n")
+
+    report = load_feed(store, str(feed))
+    assert (report["rows"], report["loaded"], report["invalid"]) == (7, 5, 2)
+    assert sorted(error.split(":")[0] for error in report["errors"]) == ["line 3", "line 5"]
+    assert any(error.startswith("line 3: price") for error in report["errors"])
+    assert sorted(store.items) == [101, 102, 103, 104, 105]
+    assert client.get("/products/104").json()["description"] == "About product 104"
+    assert client.get("/products/104/stock").json()["on_hand"] == 7
+
+    delta = tmp_path / "delta.jsonl"
+    delta.write_text("\n".join(json.dumps(row) for row in [
+        {"op": "delete", "id": 102},
+        _feed_row(103, name="Renamed Lantern", price=1.5, stock=2),
+        _feed_row(106),
+        {"op": "delete", "id": 106},
+        _feed_row(106, name="Back Again"),
+    ]) + "\n")
+    report = apply_delta(store, str(delta))
+    assert (report["loaded"], report["deleted"], report["invalid"]) == (3, 2, 0)
+    assert sorted(store.items) == [101, 103, 104, 105, 106]
+    assert store.items[106].name == "Back Again"
+    page = client.get("/products?q=lantern").json()["items"]
+    assert [(p["id"], p["price"]) for p in page] == [(103, 1.5)]
+    assert [p["id"] for p in client.get("/products?sort=price_asc").json()["items"]][:2] == [103, 101]
+    assert client.get("/products/102").status_code == 404
+    assert client.get("/products/103/stock").json()["on_hand"] == 2
+
+    # same thing over HTTP, body streamed to disk
+    res = client.post("/admin/catalog/delta?format=jsonl", content=json.dumps({"op": "delete", "id": 101}))
+    assert res.status_code == 200 and res.json()["deleted"] == 1
+    assert client.get("/admin/catalog").json()["products"] == 4
+
+def test_catalog_feed_csv_lazy_details(tmp_path):
+    """
+    Lazy mode keeps descriptions/features out of memory and reads them
+    back from the feed when a product's JSON is built. Quoted newlines
+    in a CSV cell don't break the row.
+    """
+    import csv
+    from catalog_feed import load_feed
+
+    feed = tmp_path / "catalog.csv"
+    with open(feed, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["id", "name", "price", "originalPrice", "image", "category", "rating",
+                         "reviewCount", "description", "features", "stock", "sale"])
+        writer.writerow([1, "Trail Tent", 199.5, "", "/images/products/Bag.png", "Outdoors", 4.5, 10,
+                         'Two person tent.\nSleeps "two", packs small.', "Waterproof|Light", 4, "false"])
+        writer.writerow([2, "Camp Stove", 49, 59, "/images/products/Bag.png", "Outdoors", 4.1, 3,
+                         "Boils fast.", '["Compact"]', 9, "true"])
+
+    report = load_feed(store, str(feed), lazy=True)
+    assert (report["rows"], report["loaded"], report["invalid"]) == (2, 2, 0)
+    assert store.items[1].description == "" and store.items[1].features == []
+    assert store.items[2].originalPrice == 59 and store.items[2].sale is True
+
+    product = client.get("/products/1").json()
+    assert product["description"] == 'Two person tent.\nSleeps "two", packs small.'
+    assert product["features"] == ["Waterproof", "Light"]
+    assert client.get("/products/2").json()["features"] == ["Compact"]
+    assert store.details.reads == 2
+    client.get("/products/1")
+    assert store.details.reads == 2  # encoded once, cached after that
+    # listings use what's in memory and never read the feed
+    listed = client.get("/products").json()["items"]
+    assert [(item["description"], item["features"]) for item in listed] == [("", [])] * 2
+    assert store.details.reads == 2
+
+    # a replaced item is whole in memory, its feed row isn't used any more
+    store.upsert_item(store.items[2].model_copy(update={"description": "New text"}))
+    assert client.get("/products/2").json()["description"] == "New text"
+
+def test_product_etag_and_304():
+    """
+    Product responses carry a strong ETag, and sending it back
+    gets a 304 with no body.
+    """
+    response = client.get("/products/1")
+    assert response.status_code == 200
+    assert response.json()["name"] == "Wireless Noise-Canceling Headphones"
+    etag = response.headers["etag"]
+    assert etag.startswith('"') and not etag.startswith("W/")
+
+    response = client.get("/products/1", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+
+    # a changed product gets a new tag
+    store.upsert_item(store.items[1].model_copy(update={"price": 279.99}))
+    response = client.get("/products/1", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["price"] == 279.99
+    assert response.headers["etag"] != etag
+
+def test_product_list_etag():
+    """
+    Same for search pages, and the cached bytes should decode to
+    exactly what the normal encoder would have produced.
+    """
+    response = client.get("/products?category=electronics")
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+    expected = [store.items[i].model_dump() for i in (1, 2, 7, 8)]
+    assert response.json() == {"items": expected, "next_cursor": None}
+
+    response = client.get("/products?category=electronics", headers={"If-None-Match": f'W/{etag}, "other"'})
+    assert response.status_code == 304
+
+    store.remove_item(7)
+    response = client.get("/products?category=electronics", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert [p["id"] for p in response.json()["items"]] == [1, 2, 8]
+
+def test_product_images(tmp_path, monkeypatch, memory_only):
+    """
+    Images go through the pipeline: a sized URL redirects to a hashed
+    variant that's smaller than the source and cached forever. Nothing
+    outside the image folder is served.
+    """
+    import shutil
+    from images import ImagePipeline
+    source = tmp_path / "products"
+    source.mkdir()
+    shutil.copy("products/Shoe.png", source / "Shoe.png")
+    pipeline = ImagePipeline(str(source), str(tmp_path / "cache"))
+    monkeypatch.setattr(main, "images", pipeline)
+
+    assert client.get("/products/10").json()["image"] == "/images/products/Shoe.png"
+    redirect = client.get("/images/products/Shoe.png?size=thumb", follow_redirects=False)
+    assert redirect.status_code == 302
+    variant_url = redirect.headers["location"]
+    assert variant_url.startswith("/images/v/Shoe.") and ".thumb." in variant_url
+
+    variant = client.get(variant_url)
+    assert variant.status_code == 200
+    assert "immutable" in variant.headers["cache-control"]
+    if images_module.Image is not None:
+        assert variant.headers["content-type"] == "image/webp"
+        assert len(variant.content) < (source / "Shoe.png").stat().st_size / 10
+    assert pipeline.generated == 1
+    client.get(variant_url)
+    assert pipeline.generated == 1  # second hit comes off disk
+
+    # a changed source gets a new name
+    (source / "Shoe.png").write_bytes((source / "Shoe.png").read_bytes() + b"\0")
+    assert client.get("/images/products/Shoe.png?size=thumb", follow_redirects=False).headers["location"] != variant_url
+
+    assert client.get("/images/products/Shoe.png?size=huge").status_code == 400
+    assert client.get("/images/products/main.py").status_code == 404
+    assert client.get("/images/v/..%2Fmain.py").status_code == 404
+    assert client.get("/static/main.py").status_code == 404
+    assert client.get("/static/products/Shoe.png", follow_redirects=False).headers["location"] == "/images/products/Shoe.png"
+
+
+def test_journal_recovery(tmp_path, memory_only):
+    """
+    Durability: mutations go to the journal, and a fresh store
+    recovered from snapshot + journal tail ends up in the same state.
+    """
+    from persistence import Persistence
+
+    persistence = Persistence(store, str(tmp_path), sync="group")
+    persistence.recover()
+    try:
+        client.post("/cart/add?item_id=1&quantity=1&user_id=j1")
+        client.post("/checkout?user_id=j1")
+        client.post("/cart/add?item_id=4&quantity=2&user_id=j2")
+        client.post("/checkout?user_id=j2")
+        # snapshot in the middle, the rest has to come from the journal tail
+        persistence.snapshot()
+        client.post("/cart/add?item_id=5&quantity=1&user_id=j3")
+        client.post("/checkout?user_id=j3")
+        code = client.post("/admin/generate-discount").json()["code"]
+        client.post("/cart/add?item_id=2&quantity=3&user_id=j4")
+        client.post("/cart/add?item_id=9&quantity=1&user_id=j4")
+        client.delete("/cart/remove?item_id=9&user_id=j4")
+        client.post("/cart/batch?user_id=j4", json={"operations": [
+            {"op": "set", "item_id": 2, "quantity": 1}, {"op": "add", "item_id": 6, "quantity": 2}
+        ]})
+    finally:
+        store.attach_journal(None)
+        persistence.journal.close()
+
+    restored = InMemoryStore()
+    restored.seed_data()
+    report = Persistence(restored, str(tmp_path)).recover()
+    restored.journal.close()
+
+    assert report["snapshot_seq"] > 0
+    # the discount code isn't a record of its own, replaying the 3rd checkout issues it
+    assert report["replayed_records"] == 6
+    assert [o.model_dump() for o in restored.orders] == [o.model_dump() for o in store.orders]
+    assert restored.order_count == 3
+    assert restored.validate_discount_code(code)
+    assert restored.get_priced_cart("j4") == store.get_priced_cart("j4")
+    assert restored.get_stats() == store.get_stats()
+    assert restored.rollups.to_state() == store.rollups.to_state()
+    # stock from the snapshot, then the sale after it from the journal
+    assert restored.inventory.snapshot() == store.inventory.snapshot()
+    assert restored.stock_level(5)["on_hand"] == store.items[5].stock - 1
+
+def test_journal_ignores_torn_tail(tmp_path, memory_only):
+    """
+    A half-written last line (crash mid-write) shouldn't stop recovery.
+    """
+    from journal import Journal, read_records
+
+    journal = Journal(str(tmp_path), sync="batch", flush_interval=0)
+    journal.append({"op": "cart_add", "user_id": "t", "item_id": 1, "quantity": 1})
+    journal.close()
+    segment = next(tmp_path.glob("journal-*.log"))
+    with open(segment, "ab") as f:
+        f.write(b'{"op":"cart_add","user_id":"t","ite')
+
+    assert [r["seq"] for r in read_records(str(tmp_path))] == [1]
+
+
+def test_journal_dir_is_one_process_only(tmp_path, memory_only):
+    """
+    Two workers on one JOURNAL_DIR would write over each other's journal
+    and snapshots, so the second one to recover fails until the first closes.
+    """
+    from persistence import Persistence
+
+    first = Persistence(store, str(tmp_path))
+    first.recover()
+    other = InMemoryStore()
+    other.seed_data()
+    second = Persistence(other, str(tmp_path))
+    try:
+        with pytest.raises(RuntimeError, match="already in use"):
+            second.recover()
+    finally:
+        first.close()
+    second.recover()
+    second.close()
+
+
+def _shared_increments(directory, count):
+    # runs in a child process, has to be top level so it can be pickled
+    from shared_state import SharedRegistry
+    registry = SharedRegistry(directory)
+    numbers = [registry.next_order_number() for _ in range(count)]
+    registry.close()
+    return numbers
+
+def _shared_consume(directory, code):
+    from shared_state import SharedRegistry
+    registry = SharedRegistry(directory)
+    used = registry.consume_code(code)
+    registry.close()
+    return used
+
+def test_shared_registry_across_processes(tmp_path, memory_only):
+    """
+    Several processes bumping the shared counter should get one gap-free
+    global sequence, and a code can only be used by one of them.
+    """
+    import multiprocessing
+    from shared_state import SharedRegistry
+
+    directory = str(tmp_path / "shared")
+    registry = SharedRegistry(directory)
+    registry.add_code("ONCE")
+
+    with multiprocessing.get_context("fork").Pool(4) as pool:
+        batches = pool.starmap(_shared_increments, [(directory, 250)] * 4)
+        used = pool.starmap(_shared_consume, [(directory, "ONCE")] * 8)
+
+    numbers = sorted(n for batch in batches for n in batch)
+    assert numbers == list(range(1, 1001))
+    assert registry.current_order_count() == 1000
+    assert used.count(True) == 1
+    assert not registry.is_valid_code("ONCE")
+    registry.close()
+
+def test_shared_registry_between_workers(tmp_path, memory_only):
+    """
+    Two stores sharing a registry stand in for two uvicorn workers.
+    They should share the order numbering and the nth-order rule, and a code
+    issued by one can be used exactly once on either.
+    """
+    from shared_state import SharedRegistry
+
+    directory = str(tmp_path / "shared")
+    workers = [InMemoryStore(registry=SharedRegistry(directory)) for _ in range(2)]
+    for worker in workers:
+        worker.seed_data()
+        # the registry can block on the other worker, so not on the event loop
+        assert worker.blocking_io
+
+    order_ids = []
+    for n in range(3):
+        worker = workers[n % 2]
+        worker.add_to_cart(f"w{n}", 1, 1)
+        order_ids.append(worker.checkout(f"w{n}").id)
+    assert order_ids == [1, 2, 3]
+
+    # 3rd order overall, even though worker 0 only saw two of them
+    code = workers[0].generate_discount_code()
+    assert code == "DISCOUNT10-3"
+    assert workers[1].validate_discount_code(code)
+
+    workers[1].add_to_cart("w_code", 1, 1)
+    order = workers[1].checkout("w_code", code)
+    assert order.discount_code == code
+    workers[0].add_to_cart("w_again", 1, 1)
+    with pytest.raises(ValueError):
+        workers[0].checkout("w_again", code)
+
+    for worker in workers:
+        worker.close()
+
+def test_sharded_store(memory_only, monkeypatch):
+    """
+    Two shard processes behind the router. Users land on different shards,
+    but order ids, discount codes and stock are global, and the admin
+    views add up every shard.
+    """
+    from sharding import ShardedStore, shard_of
+
+    sharded = ShardedStore(shards=2)
+    try:
+        sharded.seed_data()
+        sharded.upsert_item(sharded.items[2].model_copy(update={"stock": 3}))
+        monkeypatch.setattr(main, "store", sharded)
+        users = ["alice", "bob", "carol", "dave"]
+        assert {shard_of(user, 2) for user in users} == {0, 1}
+
+        for user in users:
+            assert client.post(f"/cart/add?item_id=1&quantity=1&user_id={user}").status_code == 200
+        ids = [client.post(f"/checkout?user_id={user}").json()["id"] for user in users[:3]]
+        assert ids == [1, 2, 3]
+        # the 3rd order's code is good on either shard, once
+        code = sharded.generate_discount_code()
+        assert code == "DISCOUNT10-3"
+        response = client.post(f"/checkout?user_id=dave&discount_code={code}")
+        assert response.json()["discount_code"] == code
+        client.post("/cart/add?item_id=1&quantity=1&user_id=alice")
+        assert client.post(f"/checkout?user_id=alice&discount_code={code}").status_code == 400
+
+        # 3 in stock, two buyers on different shards want 2 each
+        buyers = ["erin", "frank"]
+        assert shard_of("erin", 2) != shard_of("frank", 2)
+        for user in buyers:
+            client.post(f"/cart/add?item_id=2&quantity=2&user_id={user}")
+        assert client.post(f"/checkout?user_id={buyers[0]}").status_code == 200
+        assert client.post(f"/checkout?user_id={buyers[1]}").status_code == 400
+        assert client.get("/products/2/stock").json()["on_hand"] == 1
+
+        stats = client.get("/admin/stats").json()
+        assert stats["total_orders"] == 5
+        assert stats["discount_codes"] == [code]
+        assert sharded.verify_stats()["consistent"]
+        assert client.get("/orders/4").json()["user_id"] == "dave"
+        assert [order["id"] for order in client.get("/orders?user_id=alice").json()["items"]] == [1]
+        assert client.get("/cart?user_id=alice").json()["items"][0]["item_id"] == 1
+        last_id, batches = sharded.export_orders(1, batch_size=2)
+        assert last_id == 5
+        assert [[order["id"] for order in batch] for batch in batches] == [[2, 3], [4, 5]]
+    finally:
+        sharded.close()
+
+def test_sharded_store_rejects_audit_log(memory_only):
+    """
+    The shards apply the events, so an audit trail on the router would
+    stay empty. Better to refuse to start than to look like it's on.
+    """
+    from types import SimpleNamespace
+    from storage import create_store
+
+    settings = SimpleNamespace(STORE_BACKEND="sharded", AUDIT_LOG="audit.jsonl")
+    with pytest.raises(ValueError, match="AUDIT_LOG"):
+        create_store(settings)
+
+def test_async_store_falls_back_when_lock_busy(memory_only):
+    """
+    Async calls run inline on the event loop. If another thread holds the
+    cart stripe, the call goes to a worker thread instead of blocking the loop.
+    """
+    import asyncio
+    import threading
+
+    holding = threading.Event()
+    release = threading.Event()
+
+    def hold_stripe():
+        with store._cart_locks.for_key("async_user"):
+            holding.set()
+            release.wait(timeout=5)
+
+    async def run():
+        # uncontended: runs inline, no fallback
+        await store.add_to_cart_async("async_user", 1, 1)
+        assert store.async_fallbacks == 0
+
+        holder = threading.Thread(target=hold_stripe)
+        holder.start()
+        holding.wait(timeout=5)
+        add = asyncio.ensure_future(store.add_to_cart_async("async_user", 1, 2))
+        # the loop is still free while the add waits for the stripe
+        await asyncio.sleep(0.05)
+        assert not add.done()
+        release.set()
+        await add
+        holder.join()
+
+    asyncio.run(run())
+    assert store.async_fallbacks == 1
+    assert store.get_cart("async_user").items[0].quantity == 3
+
+def test_async_checkout_bails_out_with_stock_busy(memory_only, monkeypatch):
+    """
+    An async checkout that bails out (WouldBlock) after taking the stock
+    puts it back even when the item's lock is busy right then, so the
+    retry on a worker thread doesn't take it twice.
+    """
+    import asyncio
+    import threading
+
+    store.upsert_item(store.items[3].model_copy(update={"stock": 10}))
+    store.add_to_cart("async_buyer", 3, 2)
+    stripe = store.inventory._locks.for_key(3)
+    committed, grabbed = threading.Event(), threading.Event()
+    commit = store.inventory.commit
+
+    def commit_then_wait(user_id, quantities):
+        commit(user_id, quantities)
+        if not committed.is_set():
+            committed.set()
+            grabbed.wait()
+    monkeypatch.setattr(store.inventory, "commit", commit_then_wait)
+
+    def busy():
+        # the shared lock makes the checkout bail out, the stripe is busy as it does
+        with store._lock:
+            committed.wait()
+            with stripe:
+                grabbed.set()
+                time.sleep(0.1)
+
+    holder = threading.Thread(target=busy)
+    holder.start()
+    order = asyncio.run(store.checkout_async("async_buyer"))
+    holder.join()
+    assert order.items[0].quantity == 2
+    assert store.async_fallbacks == 1
+    assert store.stock_level(3)["on_hand"] == 8
+
+def test_async_cart_changes_with_stock_busy(memory_only):
+    """
+    With reservations on, cart changes take the item's lock too. If it's
+    busy, an async remove or add has to bail out before touching the cart,
+    so the retry on a worker thread finds it as it was.
+    """
+    import asyncio
+    import threading
+    from locks import WouldBlock, no_wait
+
+    store.reservation_seconds = 60
+    store.add_to_cart("busy_stock", 3, 2)
+    holding, release = threading.Event(), threading.Event()
+
+    def hold_stripe():
+        with store.inventory._locks.for_key(3):
+            holding.set()
+            release.wait(timeout=5)
+
+    holder = threading.Thread(target=hold_stripe)
+    holder.start()
+    holding.wait(timeout=5)
+    try:
+        # a new cart isn't left behind when the hold can't be taken
+        with no_wait(), pytest.raises(WouldBlock):
+            store.add_to_cart("busy_new", 3, 1)
+        assert "busy_new" not in store.carts
+
+        async def run():
+            remove = asyncio.ensure_future(store.remove_from_cart_async("busy_stock", 3))
+            await asyncio.sleep(0.05)
+            assert not remove.done()
+            release.set()
+            await remove
+        asyncio.run(run())
+    finally:
+        release.set()
+        holder.join()
+
+    assert store.async_fallbacks == 1
+    assert store.get_cart("busy_stock").items == []
+    assert store.stock_level(3)["reserved"] == 0
+
+def test_async_checkout_waits_for_journal(tmp_path, memory_only):
+    """
+    Async checkout with group commit only returns once its record is fsynced,
+    awaiting the flusher rather than blocking on it.
+    """
+    import asyncio
+    from journal import Journal
+
+    journal = Journal(str(tmp_path), sync="group")
+    store.attach_journal(journal)
+    try:
+        async def run():
+            await store.add_to_cart_async("async_j", 1, 1)
+            return await store.checkout_async("async_j")
+        order = asyncio.run(run())
+        assert order.id == 1
+        assert journal.stats()["synced_seq"] == journal.last_seq == 2
+    finally:
+        store.attach_journal(None)
+        journal.close()
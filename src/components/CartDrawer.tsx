@@ -3,14 +3,14 @@ import { Button } from "@/components/ui/button"
 import { Input } from "@/components/ui/input"
 import { useCart } from "@/context/CartContext"
 import { api, type Product, getImageUrl } from "@/lib/api"
-import { useState, useEffect } from "react"
+import { useState, useEffect, useRef } from "react"
 import { Loader2, ShoppingBag, Tag, Sparkles, Gift, X, Trash2, Check } from "lucide-react"
 import { toast } from "sonner"
 
 /**
  * Slide-out cart drawer component.
  * Displays cart items, handles discount code validation, and processes checkout.
- * Products are fetched from the backend and cached locally for cart item display.
+ * Products in the cart are fetched from the backend by id and cached locally for display.
  */
 export function CartDrawer() {
     const { cart, isCartOpen, setIsCartOpen, checkout, removeFromCart } = useCart()
@@ -18,6 +18,9 @@ export function CartDrawer() {
     // Product cache - fetched when drawer opens
     const [products, setProducts] = useState<Product[]>([])
     const [isLoadingProducts, setIsLoadingProducts] = useState(false)
+    // ids already asked for (or in flight), so an id the backend doesn't
+    // return (removed from the catalog) isn't asked for again and again
+    const requestedIds = useRef(new Set<number>())
 
     // Discount code state
     const [discountCode, setDiscountCode] = useState("")
@@ -34,16 +37,31 @@ export function CartDrawer() {
     const [isCheckingEligibility, setIsCheckingEligibility] = useState(false)
     const [removingItemId, setRemovingItemId] = useState<number | null>(null)
 
-    // Fetch products when cart opens (for displaying item details)
+    // Fetch details for any cart items we haven't loaded yet (when the cart is open)
     useEffect(() => {
-        if (isCartOpen && products.length === 0) {
-            setIsLoadingProducts(true)
-            api.getProducts()
-                .then(setProducts)
-                .catch(err => console.error("Failed to load products:", err))
-                .finally(() => setIsLoadingProducts(false))
-        }
-    }, [isCartOpen, products.length])
+        if (!isCartOpen || !cart) return
+        const missing = cart.items
+            .map(item => item.item_id)
+            .filter(id => !requestedIds.current.has(id) && !products.some(p => p.id === id))
+        if (missing.length === 0) return
+
+        missing.forEach(id => requestedIds.current.add(id))
+        setIsLoadingProducts(true)
+        api.getProducts({ ids: missing, limit: Math.min(missing.length, 200) })
+            .then(page => {
+                if (page.items.length === 0) return
+                setProducts(prev => {
+                    const known = new Set(prev.map(p => p.id))
+                    return [...prev, ...page.items.filter(p => !known.has(p.id))]
+                })
+            })
+            .catch(err => {
+                // let the next cart change try these again
+                missing.forEach(id => requestedIds.current.delete(id))
+                console.error("Failed to load products:", err)
+            })
+            .finally(() => setIsLoadingProducts(false))
+    }, [isCartOpen, cart, products])
 
     // Reset order success state when drawer closes
     useEffect(() => {
@@ -287,7 +305,7 @@ export function CartDrawer() {
                                 return (
                                     <div key={item.item_id} className={`flex gap-4 p-4 bg-gray-50 rounded-xl ${isRemoving ? 'opacity-50' : ''}`}>
                                         <div className="h-20 w-20 bg-white rounded-lg overflow-hidden flex-shrink-0 border">
-                                            <img src={getImageUrl(product.image)} alt={product.name} className="h-full w-full object-cover" />
+                                            <img src={getImageUrl(product.image, "thumb")} alt={product.name} className="h-full w-full object-cover" />
                                         </div>
                                         <div className="flex-1 min-w-0">
                                             <h4 className="font-medium text-sm line-clamp-2 mb-2">{product.name}</h4>
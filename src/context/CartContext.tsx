@@ -1,5 +1,24 @@
 import { createContext, useContext, useState, useEffect, type ReactNode } from "react"
-import { api, type Cart, type Order } from "@/lib/api"
+import { api, type Cart, type CartItem, type CartOperation, type Order } from "@/lib/api"
+
+// Operations that turn `current` into `target` (item_id -> quantity).
+// Only lines that actually change get an operation.
+export function diffCart(current: CartItem[], target: CartItem[]): CartOperation[] {
+    const wanted = new Map(target.map(item => [item.item_id, item.quantity]))
+    const operations: CartOperation[] = []
+    for (const item of current) {
+        if (!wanted.has(item.item_id) || wanted.get(item.item_id)! <= 0) {
+            operations.push({ op: "remove", item_id: item.item_id })
+        }
+    }
+    const have = new Map(current.map(item => [item.item_id, item.quantity]))
+    for (const [itemId, quantity] of wanted) {
+        if (quantity > 0 && have.get(itemId) !== quantity) {
+            operations.push({ op: "set", item_id: itemId, quantity })
+        }
+    }
+    return operations
+}
 
 interface CartContextType {
     cart: Cart | null
@@ -8,6 +27,8 @@ interface CartContextType {
     setIsCartOpen: (open: boolean) => void
     addToCart: (itemId: number, quantity?: number) => Promise<void>
     removeFromCart: (itemId: number) => Promise<void>
+    addManyToCart: (items: CartItem[]) => Promise<void>
+    setCartItems: (items: CartItem[]) => Promise<void>
     refreshCart: () => Promise<void>
     checkout: (discountCode?: string) => Promise<Order>
 }
@@ -50,6 +71,25 @@ export function CartProvider({ children }: { children: ReactNode }) {
         }
     }
 
+    const applyOperations = async (operations: CartOperation[]) => {
+        if (operations.length === 0) return
+        try {
+            const result = await api.applyCartBatch(operations)
+            setCart(result.cart)
+        } catch (err) {
+            console.error("Failed to update cart:", err)
+            throw err
+        }
+    }
+
+    // e.g. "add bundle" or "reorder": one request instead of one per item
+    const addManyToCart = (items: CartItem[]) =>
+        applyOperations(items.map(item => ({ op: "add", item_id: item.item_id, quantity: item.quantity })))
+
+    // Make the cart match `items` exactly, sending only what changed
+    const setCartItems = (items: CartItem[]) =>
+        applyOperations(diffCart(cart?.items ?? [], items))
+
     const checkout = async (discountCode?: string): Promise<Order> => {
         const order = await api.checkout(discountCode)
         // Clear cart after successful checkout
@@ -70,6 +110,8 @@ export function CartProvider({ children }: { children: ReactNode }) {
             setIsCartOpen,
             addToCart,
             removeFromCart,
+            addManyToCart,
+            setCartItems,
             refreshCart,
             checkout
         }}>
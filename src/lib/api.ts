@@ -3,9 +3,12 @@
 export const BASE_URL = "http://localhost:8000"
 const USER_ID = "demo_user" // Simplified - no auth per assessment
 
-// Helper to get full image URL from backend
-export function getImageUrl(path: string): string {
-    return `${BASE_URL}${path}`
+type ImageSize = "thumb" | "card" | "full"
+
+// Helper to get full image URL from backend.
+// The backend redirects to a resized copy that the browser can cache forever.
+export function getImageUrl(path: string, size: ImageSize = "full"): string {
+    return `${BASE_URL}${path}?size=${size}`
 }
 
 interface CartItem {
@@ -18,6 +21,20 @@ interface Cart {
     items: CartItem[]
 }
 
+// GET /cart?priced=true and /cart/stream
+interface PricedCart {
+    items: CartItem[]
+    item_count: number
+    subtotal: number
+}
+
+// One step of a POST /cart/batch update
+interface CartOperation {
+    op: "add" | "set" | "remove"
+    item_id: number
+    quantity?: number
+}
+
 interface Order {
     id: number
     user_id: string
@@ -26,6 +43,35 @@ interface Order {
     discount_amount: number
     final_amount: number
     discount_code_used: string | null
+    created_at: number
+}
+
+interface SalesQuery {
+    start?: string
+    end?: string
+    resolution?: "minute" | "hour" | "day"
+    group_by?: "time" | "product" | "category"
+}
+
+interface SalesRow {
+    start?: number
+    orders?: number
+    items?: number
+    item_id?: number
+    name?: string | null
+    category?: string
+    quantity?: number
+    gross_amount: number
+    purchase_amount?: number
+    discount_amount?: number
+}
+
+interface SalesReport {
+    start: number
+    end: number
+    resolution: string
+    group_by: string
+    rows: SalesRow[]
 }
 
 interface Product {
@@ -43,6 +89,24 @@ interface Product {
     sale?: boolean
 }
 
+interface ProductPage {
+    items: Product[]
+    next_cursor: string | null
+}
+
+interface ProductQuery {
+    q?: string
+    category?: string
+    minPrice?: number
+    maxPrice?: number
+    sale?: boolean
+    minRating?: number
+    ids?: number[]
+    sort?: "id" | "price_asc" | "price_desc" | "rating" | "name"
+    cursor?: string | null
+    limit?: number
+}
+
 async function handleResponse<T>(response: Response): Promise<T> {
     if (!response.ok) {
         const error = await response.json().catch(() => ({ detail: "Request failed" }))
@@ -51,11 +115,40 @@ async function handleResponse<T>(response: Response): Promise<T> {
     return response.json()
 }
 
+// Server-sent "snapshot" / "delta" events (see backend/live_updates.py):
+// a snapshot replaces what we have, a delta only carries the changed fields.
+// Returns a function that closes the stream.
+function subscribe<T extends object>(path: string, onUpdate: (value: T) => void): () => void {
+    const source = new EventSource(`${BASE_URL}${path}`)
+    let current: T | null = null
+    source.addEventListener("snapshot", (event) => {
+        current = JSON.parse((event as MessageEvent).data) as T
+        onUpdate(current)
+    })
+    source.addEventListener("delta", (event) => {
+        if (!current) return
+        current = { ...current, ...JSON.parse((event as MessageEvent).data) }
+        onUpdate(current)
+    })
+    return () => source.close()
+}
+
 export const api = {
-    // Get all products
-    async getProducts(): Promise<Product[]> {
-        const response = await fetch(`${BASE_URL}/products`)
-        return handleResponse<Product[]>(response)
+    // Search/filter products, one page at a time (pass next_cursor back for more)
+    async getProducts(query: ProductQuery = {}): Promise<ProductPage> {
+        const params = new URLSearchParams()
+        if (query.q) params.append("q", query.q)
+        if (query.category) params.append("category", query.category)
+        if (query.minPrice !== undefined) params.append("min_price", String(query.minPrice))
+        if (query.maxPrice !== undefined) params.append("max_price", String(query.maxPrice))
+        if (query.sale !== undefined) params.append("sale", String(query.sale))
+        if (query.minRating !== undefined) params.append("min_rating", String(query.minRating))
+        if (query.ids) params.append("ids", query.ids.join(","))
+        if (query.sort) params.append("sort", query.sort)
+        if (query.cursor) params.append("cursor", query.cursor)
+        if (query.limit) params.append("limit", String(query.limit))
+        const response = await fetch(`${BASE_URL}/products?${params}`)
+        return handleResponse<ProductPage>(response)
     },
 
     // Get single product by ID
@@ -79,13 +172,28 @@ export const api = {
         return handleResponse(response)
     },
 
+    // Apply several cart changes in one request. All or nothing.
+    async applyCartBatch(operations: CartOperation[]): Promise<{ message: string; cart: Cart }> {
+        const response = await fetch(`${BASE_URL}/cart/batch?user_id=${USER_ID}`, {
+            method: "POST",
+            headers: { "Content-Type": "application/json" },
+            body: JSON.stringify({ operations })
+        })
+        return handleResponse(response)
+    },
+
     // Checkout with optional discount code
-    async checkout(discountCode?: string): Promise<Order> {
+    // Pass the same idempotencyKey when retrying, the backend then returns
+    // the original order instead of placing a second one
+    async checkout(discountCode?: string, idempotencyKey: string = crypto.randomUUID()): Promise<Order> {
         const params = new URLSearchParams({ user_id: USER_ID })
         if (discountCode) {
             params.append("discount_code", discountCode)
         }
-        const response = await fetch(`${BASE_URL}/checkout?${params}`, { method: "POST" })
+        const response = await fetch(`${BASE_URL}/checkout?${params}`, {
+            method: "POST",
+            headers: { "Idempotency-Key": idempotencyKey },
+        })
         return handleResponse<Order>(response)
     },
 
@@ -116,7 +224,27 @@ export const api = {
     async getStats() {
         const response = await fetch(`${BASE_URL}/admin/stats`)
         return handleResponse(response)
+    },
+
+    // Live admin stats, pushed when they change instead of polled
+    streamStats<T extends object>(onUpdate: (stats: T) => void): () => void {
+        return subscribe<T>("/admin/stats/stream", onUpdate)
+    },
+
+    // Live priced cart, e.g. to keep other tabs in sync
+    streamCart(onUpdate: (cart: PricedCart) => void): () => void {
+        return subscribe<PricedCart>(`/cart/stream?user_id=${USER_ID}`, onUpdate)
+    },
+
+    // Sales per time bucket, or per product/category over a range
+    async getSalesReport(query: SalesQuery = {}): Promise<SalesReport> {
+        const params = new URLSearchParams()
+        for (const [key, value] of Object.entries(query)) {
+            if (value !== undefined) params.append(key, value)
+        }
+        const response = await fetch(`${BASE_URL}/admin/stats?${params}`)
+        return handleResponse<SalesReport>(response)
     }
 }
 
-export type { Cart, CartItem, Order, Product }
+export type { ImageSize, Cart, CartItem, PricedCart, CartOperation, Order, Product, ProductPage, ProductQuery, SalesQuery, SalesReport, SalesRow }
@@ -21,6 +21,7 @@ interface Stats {
     total_items_purchased: number
     total_purchase_amount: number
     discount_codes: string[]
+    discount_codes_used: number
     total_discount_amount: number
 }
 
@@ -47,6 +48,8 @@ export default function AdminPage() {
 
     useEffect(() => {
         fetchStats()
+        // then keep up with new orders as they come in
+        return api.streamStats<Stats>(setStats)
     }, [])
 
     // Calculate average order value
@@ -172,7 +175,8 @@ export default function AdminPage() {
                                     <div>
                                         <h2 className="font-semibold">Discount Codes Used</h2>
                                         <p className="text-xs text-muted-foreground">
-                                            {stats.discount_codes.length} code{stats.discount_codes.length !== 1 ? 's' : ''} redeemed
+                                            {stats.discount_codes_used} code{stats.discount_codes_used !== 1 ? 's' : ''} redeemed
+                                            {stats.discount_codes_used > stats.discount_codes.length ? `, latest ${stats.discount_codes.length} shown` : ''}
                                         </p>
                                     </div>
                                 </div>
@@ -8,27 +8,54 @@ import Footer from "@/components/Footer"
 import { useCart } from "@/context/CartContext"
 import { toast } from "sonner"
 
+const PAGE_SIZE = 48
+
 export default function StorePage() {
     const [searchQuery, setSearchQuery] = useState("")
     const [products, setProducts] = useState<Product[]>([])
+    const [nextCursor, setNextCursor] = useState<string | null>(null)
     const [isLoading, setIsLoading] = useState(true)
+    const [isLoadingMore, setIsLoadingMore] = useState(false)
     const { cart, addToCart } = useCart()
 
-    // Fetch products from backend on mount
+    // Search runs on the backend now. Debounced so we don't fire on every keystroke.
     useEffect(() => {
-        const fetchProducts = async () => {
+        let cancelled = false
+        const timer = setTimeout(async () => {
+            setIsLoading(true)
             try {
-                const data = await api.getProducts()
-                setProducts(data)
+                const page = await api.getProducts({ q: searchQuery.trim() || undefined, limit: PAGE_SIZE })
+                if (!cancelled) {
+                    setProducts(page.items)
+                    setNextCursor(page.next_cursor)
+                }
             } catch (err) {
                 console.error("Failed to fetch products:", err)
                 toast.error("Failed to load products")
             } finally {
-                setIsLoading(false)
+                if (!cancelled) setIsLoading(false)
             }
+        }, searchQuery ? 250 : 0)
+        return () => {
+            cancelled = true
+            clearTimeout(timer)
         }
-        fetchProducts()
-    }, [])
+    }, [searchQuery])
+
+    const loadMore = async () => {
+        if (!nextCursor) return
+        setIsLoadingMore(true)
+        try {
+            const page = await api.getProducts({ q: searchQuery.trim() || undefined, cursor: nextCursor, limit: PAGE_SIZE })
+            setProducts(prev => [...prev, ...page.items])
+            setNextCursor(page.next_cursor)
+        } catch (err) {
+            console.error("Failed to fetch products:", err)
+            toast.error("Failed to load more products")
+        } finally {
+            setIsLoadingMore(false)
+        }
+    }
 
     const handleAddToCart = async (productId: number) => {
         try {
@@ -54,10 +81,8 @@ export default function StorePage() {
 
     const isFavorite = (_productId: number) => false
 
-    const filteredProducts = products.filter(product =>
-        product.name.toLowerCase().includes(searchQuery.toLowerCase()) ||
-        product.category.toLowerCase().includes(searchQuery.toLowerCase())
-    )
+    // already filtered server-side
+    const filteredProducts = products
 
     return (
         <div className="min-h-screen w-full bg-zinc-50 dark:bg-zinc-900 flex flex-col">
@@ -107,7 +132,7 @@ export default function StorePage() {
                                                 </div>
                                             )}
                                             <img
-                                                src={getImageUrl(product.image)}
+                                                src={getImageUrl(product.image, "card")}
                                                 alt={product.name}
                                                 className="h-full w-full object-cover transition-transform duration-300 group-hover:scale-105"
                                             />
@@ -177,6 +202,19 @@ export default function StorePage() {
                             })}
                         </div>
 
+                        {nextCursor && (
+                            <div className="flex justify-center pt-8">
+                                <button
+                                    onClick={loadMore}
+                                    disabled={isLoadingMore}
+                                    className="flex items-center gap-2 text-sm h-9 px-6 rounded-full border border-gray-300 dark:border-gray-600 hover:border-primary hover:text-primary transition-colors bg-white dark:bg-zinc-800"
+                                >
+                                    {isLoadingMore && <Loader2 className="h-4 w-4 animate-spin" />}
+                                    Load more
+                                </button>
+                            </div>
+                        )}
+
                         {filteredProducts.length === 0 && (
                             <div className="text-center py-12">
                                 <p className="text-muted-foreground">No products found matching "{searchQuery}"</p>
@@ -189,4 +227,4 @@ export default function StorePage() {
             <Footer />
         </div>
     )
-}
\ No newline at end of file
+}
\ No newline at end of file